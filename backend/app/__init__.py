@@ -1,9 +1,15 @@
+import time
+_import_started = time.perf_counter() # Measures how long importing the app package takes
+
 import os # Import the os module
+import json
+import logging
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
 from flask_cors import CORS
 from flask_jwt_extended import JWTManager
-from flask_migrate import Migrate # Import Migrate
+# Flask-Migrate is not imported here: it pulls in Alembic, which is only needed
+# by 'flask db ...' commands (see app/services/startup.py)
 
 from dotenv import load_dotenv # Import load_dotenv
 
@@ -14,10 +20,15 @@ load_dotenv()
 db = SQLAlchemy()
 cors = CORS() # Initialize CORS instance
 jwt = JWTManager() # Initialize JWTManager instance
-migrate = Migrate() # Initialize Migrate instance
+
+# Time spent importing this module and its dependencies (Flask, SQLAlchemy, ...)
+IMPORT_TIME_MS = round((time.perf_counter() - _import_started) * 1000, 2)
 
 # Define an application factory function
 def create_app():
+    from app.services.startup import StartupTimer
+    timer = StartupTimer()
+
     # Create the Flask application instance
     app = Flask(__name__)
 
@@ -36,35 +47,299 @@ def create_app():
     # Configure the general secret key from environment variable
     app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'fallback-secret-key') # Read from SECRET_KEY env var
 
+    # Nodemap execution: how many agents may run at the same time in one run
+    app.config['NODEMAP_MAX_CONCURRENCY'] = int(os.environ.get('NODEMAP_MAX_CONCURRENCY', '8'))
+    # Simulated response time (seconds) of the offline 'local' model provider
+    app.config['LOCAL_MODEL_LATENCY'] = float(os.environ.get('LOCAL_MODEL_LATENCY', '0'))
+    # ...and the delay between its streamed tokens
+    app.config['LOCAL_MODEL_TOKEN_LATENCY'] = float(os.environ.get('LOCAL_MODEL_TOKEN_LATENCY', '0'))
+
+    # HTTP model provider (see app/services/http_provider.py): an OpenAI-compatible
+    # API, e.g. 'https://api.openai.com/v1' or the offline stand-in started with
+    # 'python -m benchmarks provider-server' ('http://127.0.0.1:8089/v1').
+    # When MODEL_PROVIDER_URL is set it serves the models matching MODEL_PROVIDER_MODELS
+    # (comma separated, exact names or prefixes ending with '*'); other models stay local.
+    app.config['MODEL_PROVIDER_URL'] = os.environ.get('MODEL_PROVIDER_URL')
+    app.config['MODEL_PROVIDER_API_KEY'] = os.environ.get('MODEL_PROVIDER_API_KEY')
+    app.config['MODEL_PROVIDER_MODELS'] = os.environ.get('MODEL_PROVIDER_MODELS', '*')
+    # Timeouts (seconds): opening a connection, and waiting for response data
+    app.config['MODEL_PROVIDER_CONNECT_TIMEOUT'] = float(os.environ.get('MODEL_PROVIDER_CONNECT_TIMEOUT', '5'))
+    app.config['MODEL_PROVIDER_READ_TIMEOUT'] = float(os.environ.get('MODEL_PROVIDER_READ_TIMEOUT', '120'))
+    # Connection errors, timeouts, 429 and 5xx are retried, waiting RETRY_BACKOFF * 2^n seconds
+    app.config['MODEL_PROVIDER_MAX_RETRIES'] = int(os.environ.get('MODEL_PROVIDER_MAX_RETRIES', '2'))
+    app.config['MODEL_PROVIDER_RETRY_BACKOFF'] = float(os.environ.get('MODEL_PROVIDER_RETRY_BACKOFF', '0.5'))
+    # Kept-alive connections (at most POOL_SIZE calls at once), closed after IDLE_TIMEOUT idle seconds
+    app.config['MODEL_PROVIDER_POOL_SIZE'] = int(os.environ.get('MODEL_PROVIDER_POOL_SIZE', '32'))
+    app.config['MODEL_PROVIDER_IDLE_TIMEOUT'] = float(os.environ.get('MODEL_PROVIDER_IDLE_TIMEOUT', '30'))
+    # Identical requests in progress at the same time share one upstream call
+    app.config['MODEL_PROVIDER_SINGLE_FLIGHT'] = os.environ.get('MODEL_PROVIDER_SINGLE_FLIGHT', 'true').lower() == 'true'
+
+    # Model rate limits (see app/services/model_scheduler.py), per minute and per process:
+    # 'model=requests/tokens' entries, comma separated, e.g. 'gpt-4o=500/150000,gemini-*=300/'.
+    # Calls beyond them wait in a queue; interactive calls (streamagent, runnodemap) go
+    # before background runs, and users take turns. Empty = no limits.
+    app.config['MODEL_RATE_LIMITS'] = os.environ.get('MODEL_RATE_LIMITS', '')
+    # Share of each limit that background runs leave for interactive calls
+    app.config['MODEL_SCHEDULER_INTERACTIVE_RESERVE'] = float(os.environ.get('MODEL_SCHEDULER_INTERACTIVE_RESERVE', '0.2'))
+    # Output tokens a call is charged for up front (settled with the real count afterwards)
+    app.config['MODEL_SCHEDULER_OUTPUT_TOKENS'] = int(os.environ.get('MODEL_SCHEDULER_OUTPUT_TOKENS', '256'))
+    # Seconds a call may wait for a slot before its node (or stream) fails
+    app.config['MODEL_SCHEDULER_MAX_WAIT_INTERACTIVE'] = float(os.environ.get('MODEL_SCHEDULER_MAX_WAIT_INTERACTIVE', '30'))
+    app.config['MODEL_SCHEDULER_MAX_WAIT_BATCH'] = float(os.environ.get('MODEL_SCHEDULER_MAX_WAIT_BATCH', '600'))
+
+    # Streaming (Server-Sent Events): seconds of silence before a heartbeat is sent,
+    # and how many events may wait for a slow client before the model is paused
+    app.config['SSE_HEARTBEAT_INTERVAL'] = float(os.environ.get('SSE_HEARTBEAT_INTERVAL', '15'))
+    app.config['SSE_MAX_BUFFERED_EVENTS'] = int(os.environ.get('SSE_MAX_BUFFERED_EVENTS', '64'))
+
+    # Agent response cache: in-memory LRU limits, TTL (seconds, 0 = never expire)
+    # and an optional SQLite file that keeps cached responses across restarts
+    app.config['RESPONSE_CACHE_ENABLED'] = os.environ.get('RESPONSE_CACHE_ENABLED', 'true').lower() == 'true'
+    app.config['RESPONSE_CACHE_MAX_ENTRIES'] = int(os.environ.get('RESPONSE_CACHE_MAX_ENTRIES', '10000'))
+    app.config['RESPONSE_CACHE_MAX_BYTES'] = int(os.environ.get('RESPONSE_CACHE_MAX_BYTES', str(64 * 1024 * 1024)))
+    app.config['RESPONSE_CACHE_TTL'] = int(os.environ.get('RESPONSE_CACHE_TTL', str(24 * 3600)))
+    app.config['RESPONSE_CACHE_PATH'] = os.environ.get('RESPONSE_CACHE_PATH') # e.g. 'response_cache.db'
+    app.config['RESPONSE_CACHE_MAX_DISK_BYTES'] = int(os.environ.get('RESPONSE_CACHE_MAX_DISK_BYTES', str(512 * 1024 * 1024)))
+
+    # Bulk creation (/creation/bulkcreate): maximum agents + nodemaps in one request
+    app.config['BULK_CREATE_MAX_ITEMS'] = int(os.environ.get('BULK_CREATE_MAX_ITEMS', '1000'))
+
+    # Workspace export/import (/creation/exportworkspace, /creation/importworkspace):
+    # rows read per query when exporting, lines imported per transaction, longest
+    # accepted line (bytes), and the minimum time between progress lines (seconds)
+    app.config['EXPORT_BATCH_SIZE'] = int(os.environ.get('EXPORT_BATCH_SIZE', '1000'))
+    app.config['IMPORT_BATCH_SIZE'] = int(os.environ.get('IMPORT_BATCH_SIZE', '1000'))
+    app.config['IMPORT_MAX_LINE_BYTES'] = int(os.environ.get('IMPORT_MAX_LINE_BYTES', str(16 * 1024 * 1024)))
+    app.config['IMPORT_PROGRESS_INTERVAL'] = float(os.environ.get('IMPORT_PROGRESS_INTERVAL', '1'))
+
+    # Nodemap graph storage: compression of the stored node/edge JSON ('zlib', 'zstd'
+    # or 'none'), its level, and the size (bytes) below which values are stored raw
+    app.config['NODEMAP_COMPRESSION'] = os.environ.get('NODEMAP_COMPRESSION', 'zlib').lower()
+    app.config['NODEMAP_COMPRESSION_LEVEL'] = int(os.environ.get('NODEMAP_COMPRESSION_LEVEL', '6'))
+    app.config['NODEMAP_COMPRESSION_MIN_SIZE'] = int(os.environ.get('NODEMAP_COMPRESSION_MIN_SIZE', '64'))
+
+    # Background runs (/execution/enqueuerun), executed by 'flask run-workers':
+    # worker processes, attempts per job and retry backoff (seconds, doubled per attempt),
+    # how long a worker's claim on a job lasts without a heartbeat, how often workers
+    # look for work, and per-user limits on running and unfinished (queued + running) jobs
+    app.config['JOB_WORKER_PROCESSES'] = int(os.environ.get('JOB_WORKER_PROCESSES', '2'))
+    app.config['JOB_MAX_ATTEMPTS'] = int(os.environ.get('JOB_MAX_ATTEMPTS', '3'))
+    app.config['JOB_RETRY_BACKOFF'] = float(os.environ.get('JOB_RETRY_BACKOFF', '5'))
+    app.config['JOB_RETRY_BACKOFF_MAX'] = float(os.environ.get('JOB_RETRY_BACKOFF_MAX', '300'))
+    app.config['JOB_LEASE_SECONDS'] = float(os.environ.get('JOB_LEASE_SECONDS', '60'))
+    app.config['JOB_HEARTBEAT_INTERVAL'] = float(os.environ.get('JOB_HEARTBEAT_INTERVAL', '5'))
+    app.config['JOB_POLL_INTERVAL'] = float(os.environ.get('JOB_POLL_INTERVAL', '1'))
+    app.config['JOB_MAX_RUNNING_PER_USER'] = int(os.environ.get('JOB_MAX_RUNNING_PER_USER', '2'))
+    app.config['JOB_MAX_PENDING_PER_USER'] = int(os.environ.get('JOB_MAX_PENDING_PER_USER', '50'))
+
+    # Run history: every run's per-node inputs, outputs, timings and token counts.
+    # Runs are compacted into summaries after RUN_HISTORY_COMPACT_AFTER_DAYS and deleted
+    # after RUN_HISTORY_RETENTION_DAYS; the job workers do this every
+    # RUN_HISTORY_MAINTENANCE_INTERVAL seconds (or run 'flask run-history-maintenance')
+    app.config['RUN_HISTORY_ENABLED'] = os.environ.get('RUN_HISTORY_ENABLED', 'true').lower() == 'true'
+    app.config['RUN_HISTORY_COMPACT_AFTER_DAYS'] = float(os.environ.get('RUN_HISTORY_COMPACT_AFTER_DAYS', '7'))
+    app.config['RUN_HISTORY_RETENTION_DAYS'] = float(os.environ.get('RUN_HISTORY_RETENTION_DAYS', '90'))
+    app.config['RUN_HISTORY_MAINTENANCE_INTERVAL'] = float(os.environ.get('RUN_HISTORY_MAINTENANCE_INTERVAL', '3600'))
+
+    # Nodemap version history (see app/services/nodemap_history.py): every save is kept
+    # as a version that can be listed, compared and restored; only the last
+    # NODEMAP_HISTORY_MAX_VERSIONS versions of each map are kept. The job workers delete
+    # unused stored elements with the run history maintenance ('flask nodemap-history-maintenance')
+    app.config['NODEMAP_HISTORY_ENABLED'] = os.environ.get('NODEMAP_HISTORY_ENABLED', 'true').lower() == 'true'
+    app.config['NODEMAP_HISTORY_MAX_VERSIONS'] = int(os.environ.get('NODEMAP_HISTORY_MAX_VERSIONS', '1000'))
+
+    # Collaborative editing (WebSocket /collab/nodemap/<id>, needs the optional flask-sock
+    # package): how long edits are collected before they are written (seconds), editors
+    # per map, ops per message, largest message (bytes), messages queued for a slow
+    # editor before it is disconnected, the keepalive ping interval (seconds), and how
+    # long a new editor has to send its 'auth' message (seconds)
+    app.config['COLLAB_PERSIST_INTERVAL'] = float(os.environ.get('COLLAB_PERSIST_INTERVAL', '2'))
+    app.config['COLLAB_MAX_EDITORS'] = int(os.environ.get('COLLAB_MAX_EDITORS', '20'))
+    app.config['COLLAB_MAX_OPS_PER_MESSAGE'] = int(os.environ.get('COLLAB_MAX_OPS_PER_MESSAGE', '500'))
+    app.config['COLLAB_MAX_MESSAGE_BYTES'] = int(os.environ.get('COLLAB_MAX_MESSAGE_BYTES', str(1024 * 1024)))
+    app.config['COLLAB_CLIENT_QUEUE'] = int(os.environ.get('COLLAB_CLIENT_QUEUE', '256'))
+    app.config['COLLAB_PING_INTERVAL'] = float(os.environ.get('COLLAB_PING_INTERVAL', '25'))
+    app.config['COLLAB_AUTH_TIMEOUT'] = float(os.environ.get('COLLAB_AUTH_TIMEOUT', '10'))
+
+    # Token counting and context budgets (see app/services/tokens.py): the tokenizer
+    # ('auto' = tiktoken when installed, else 'heuristic'), extra/overridden context
+    # windows as JSON ('{"model": tokens}'), the window of unknown models, tokens kept
+    # free for the answer, and what to do with an input that does not fit
+    # ('truncate' keeps its beginning and end, 'reject' fails the call)
+    app.config['TOKENIZER'] = os.environ.get('TOKENIZER', 'auto').lower()
+    app.config['MODEL_CONTEXT_WINDOWS'] = json.loads(os.environ.get('MODEL_CONTEXT_WINDOWS', '{}'))
+    app.config['DEFAULT_CONTEXT_WINDOW'] = int(os.environ.get('DEFAULT_CONTEXT_WINDOW', '8192'))
+    app.config['MODEL_OUTPUT_RESERVE'] = int(os.environ.get('MODEL_OUTPUT_RESERVE', '1024'))
+    app.config['CONTEXT_OVERFLOW_POLICY'] = os.environ.get('CONTEXT_OVERFLOW_POLICY', 'truncate').lower()
+    app.config['TOKEN_COUNT_CACHE_SIZE'] = int(os.environ.get('TOKEN_COUNT_CACHE_SIZE', '10000'))
+
+    # Full-text search (/creation/search): 'auto' uses SQLite FTS5 when available,
+    # otherwise the portable search_term table; 'fts5' or 'table' force one
+    app.config['SEARCH_BACKEND'] = os.environ.get('SEARCH_BACKEND', 'auto').lower()
+
+    # JSON responses: 'auto' serializes with orjson when it is installed,
+    # 'orjson' requires it, 'default' keeps Flask's json-module provider
+    app.config['JSON_PROVIDER'] = os.environ.get('JSON_PROVIDER', 'auto').lower()
+
+    # Logging: level and output format ('json' for structured lines, 'text' for humans)
+    app.config['LOG_LEVEL'] = os.environ.get('LOG_LEVEL', 'INFO').upper()
+    app.config['LOG_FORMAT'] = os.environ.get('LOG_FORMAT', 'json').lower()
+    # Metrics: GET /metrics in the Prometheus text format. Scrapers send METRICS_TOKEN as a
+    # bearer token; without one the endpoint is closed, unless METRICS_PUBLIC is true
+    # (only where the network already keeps it private)
+    app.config['METRICS_ENABLED'] = os.environ.get('METRICS_ENABLED', 'true').lower() == 'true'
+    app.config['METRICS_TOKEN'] = os.environ.get('METRICS_TOKEN')
+    app.config['METRICS_PUBLIC'] = os.environ.get('METRICS_PUBLIC', 'false').lower() == 'true'
+    # Administrators: comma-separated usernames that may read process-wide statistics
+    # (/execution/cachestats, /execution/schedulerstats); nobody by default
+    app.config['ADMIN_USERNAMES'] = frozenset(
+        name.strip() for name in os.environ.get('ADMIN_USERNAMES', '').split(',') if name.strip()
+    )
+
+    # Startup: what to do about the database schema when the app starts
+    # ('create_all', 'check' or 'skip'; see app/services/startup.py)
+    app.config['SCHEMA_STARTUP_MODE'] = os.environ.get('SCHEMA_STARTUP_MODE', 'create_all').lower()
+    app.config['MIGRATIONS_DIRECTORY'] = os.environ.get(
+        'MIGRATIONS_DIRECTORY', os.path.join(os.path.dirname(app.root_path), 'migrations'))
+
+    # Database engine profile ('auto' tunes SQLite or the server pool, 'none' keeps
+    # Flask-SQLAlchemy's defaults; see app/services/db_engine.py)
+    app.config['DB_ENGINE_PROFILE'] = os.environ.get('DB_ENGINE_PROFILE', 'auto').lower()
+    app.config['DB_POOL_SIZE'] = int(os.environ.get('DB_POOL_SIZE', '10'))
+    app.config['DB_MAX_OVERFLOW'] = int(os.environ.get('DB_MAX_OVERFLOW', '20'))
+    app.config['DB_POOL_TIMEOUT'] = float(os.environ.get('DB_POOL_TIMEOUT', '30')) # Seconds to wait for a connection
+    app.config['DB_POOL_RECYCLE'] = int(os.environ.get('DB_POOL_RECYCLE', '1800')) # Seconds before a connection is replaced
+    app.config['DB_POOL_PRE_PING'] = os.environ.get('DB_POOL_PRE_PING', 'true').lower() == 'true'
+    app.config['SQLITE_JOURNAL_MODE'] = os.environ.get('SQLITE_JOURNAL_MODE', 'WAL')
+    app.config['SQLITE_SYNCHRONOUS'] = os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL')
+    app.config['SQLITE_MMAP_SIZE'] = int(os.environ.get('SQLITE_MMAP_SIZE', str(256 * 1024 * 1024)))
+    app.config['SQLITE_BUSY_TIMEOUT_MS'] = int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS', '5000'))
+    from app.services.db_engine import engine_options
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(app.config)
+
     # --- End Configuration ---
+    timer.record('config')
 
     # --- Initialize Extensions with the app instance ---
     # This connects the pre-initialized extensions to the Flask app instance
     db.init_app(app)
+    from app.services.db_engine import install_engine_profile
+    install_engine_profile(app, db) # Per-connection settings (e.g. SQLite WAL)
     cors.init_app(app)
     jwt.init_app(app)
-    migrate.init_app(app, db) # Initialize Migrate with the app and db
+    from app.services.json_provider import install_json_provider
+    install_json_provider(app, app.config['JSON_PROVIDER']) # Faster jsonify (see app/services/json_provider.py)
+    # 'flask db ...' commands; Flask-Migrate is set up only when one of them runs
+    from app.services.startup import register_lazy_migrate_commands
+    register_lazy_migrate_commands(app, db)
     # --- End Extension Initialization ---
+    timer.record('extensions')
+
+    # --- Logging and Metrics ---
+    # Structured logs are written by a background thread (see app/services/logging_setup.py);
+    # request latency, status codes, SQL counts and response sizes are exposed at /metrics
+    from app.services.logging_setup import configure_logging
+    configure_logging(app)
+    if app.config['METRICS_ENABLED']:
+        from app.services.metrics import init_metrics
+        init_metrics(app)
+    # --- End Logging and Metrics ---
+    timer.record('logging_and_metrics')
+
+    # --- Model Providers ---
+    # Models without a registered provider use the deterministic offline stand-in
+    from app.services.model_providers import LocalModelProvider, set_default_provider
+    set_default_provider(LocalModelProvider(
+        latency=app.config['LOCAL_MODEL_LATENCY'],
+        token_latency=app.config['LOCAL_MODEL_TOKEN_LATENCY'],
+    ))
+    from app.services.http_provider import configure_http_provider
+    configure_http_provider(app) # Only when MODEL_PROVIDER_URL is set
+    from app.services.model_scheduler import init_model_scheduler
+    init_model_scheduler(app) # Only when MODEL_RATE_LIMITS is set
+    # --- End Model Providers ---
+
+    # --- Response Cache ---
+    from app.services.response_cache import ResponseCache, configure_response_cache
+    if app.config['RESPONSE_CACHE_ENABLED']:
+        configure_response_cache(ResponseCache(
+            max_entries=app.config['RESPONSE_CACHE_MAX_ENTRIES'],
+            max_bytes=app.config['RESPONSE_CACHE_MAX_BYTES'],
+            ttl=app.config['RESPONSE_CACHE_TTL'],
+            disk_path=app.config['RESPONSE_CACHE_PATH'],
+            max_disk_bytes=app.config['RESPONSE_CACHE_MAX_DISK_BYTES'],
+        ))
+    else:
+        configure_response_cache(None)
+    # --- End Response Cache ---
+
+    # --- Graph Storage ---
+    # Nodes and edges are stored compressed (see app/services/graph_codec.py);
+    # 'flask graph-storage-stats' reports the space used and the compression ratio
+    from app.services.graph_codec import configure_graph_codec, register_graph_codec_commands
+    configure_graph_codec(
+        algorithm=app.config['NODEMAP_COMPRESSION'],
+        level=app.config['NODEMAP_COMPRESSION_LEVEL'],
+        min_size=app.config['NODEMAP_COMPRESSION_MIN_SIZE'],
+    )
+    register_graph_codec_commands(app, db)
+    from app.services.graph_index import init_graph_index
+    init_graph_index(db) # Saves tell structure changes from text-only ones, even after an autoflush
+    # --- End Graph Storage ---
+
+    # --- Token Counting ---
+    from app.services.tokens import init_tokens
+    init_tokens(app, db) # Tokenizer, context windows; agents' system prompts are counted on flush
+    # --- End Token Counting ---
+
+    # --- Search ---
+    from app.services.search import init_search
+    init_search(app, db) # Index kept in sync on every flush; 'flask search-reindex' rebuilds it
+    # --- End Search ---
+
+    # --- Background Jobs ---
+    from app.services.job_queue import init_job_queue
+    init_job_queue(app) # 'flask run-workers' runs queued nodemap runs (see app/services/job_queue.py)
+    from app.services.run_history import init_run_history
+    init_run_history(app) # Run history settings and 'flask run-history-maintenance'
+    from app.services.nodemap_history import init_nodemap_history
+    init_nodemap_history(app) # Version history settings and 'flask nodemap-history-maintenance'
+    # --- End Background Jobs ---
+
+    # --- Collaborative Editing ---
+    from app.services.collab import init_collab
+    init_collab(app) # Edits are saved by a background thread started by the first editor
+    # --- End Collaborative Editing ---
+    timer.record('providers_and_cache')
 
     # --- Import and Register Blueprints ---
     # Blueprints organize your routes into modular components.
     # We import them *after* app is created to avoid circular imports.
     from app.routes.auth_routes import auth_bp
     from app.routes.creation_routes import creation_bp
+    from app.routes.execution_routes import execution_bp
+    from app.routes.collab_routes import collab_bp
 
     # Register blueprints WITH URL prefixes
     # /auth prefix for authentication routes
     app.register_blueprint(auth_bp, url_prefix='/auth') # Added url_prefix
     # /creation prefix for nodemap and agent creation/management routes
     app.register_blueprint(creation_bp, url_prefix='/creation') # Added url_prefix
+    # /execution prefix for running nodemaps and agents
+    app.register_blueprint(execution_bp, url_prefix='/execution')
+    # /collab prefix for real-time collaborative editing (WebSockets)
+    app.register_blueprint(collab_bp, url_prefix='/collab')
     # --- End Blueprint Registration ---
+    timer.record('blueprints')
 
-    # --- Database Table Creation ---
-    # This block ensures that database tables are created when the app context is pushed.
-    # In production, you'd typically use Flask-Migrate for database migrations.
-    with app.app_context():
-        db.create_all() # Create database tables for our models if they don't exist
-    # --- End Database Table Creation ---
+    # --- Database Schema ---
+    # By default missing tables are created (convenient in development).
+    # Production workers should use SCHEMA_STARTUP_MODE=check (or skip) and run
+    # 'flask db upgrade' once per deploy, so a worker start does not reflect the schema.
+    from app.services.startup import prepare_schema
+    prepare_schema(app, db)
+    # --- End Database Schema ---
+    timer.record('schema')
 
     # --- Define basic routes (optional, could be in a blueprint) ---
     # These routes do NOT have the blueprint prefixes
@@ -81,9 +356,20 @@ def create_app():
         This function returns a JSON response indicating the API status.
         """
         from flask import jsonify
-        return jsonify(status='OK', message='API is running')
+        return jsonify(status='OK', message='API is running', startup_ms=app.extensions['startup_timings'])
     # --- End basic routes ---
 
+    # --- Startup report ---
+    startup_timings = timer.finish()
+    startup_timings['imports'] = IMPORT_TIME_MS
+    app.extensions['startup_timings'] = startup_timings
+    logging.getLogger(__name__).info(
+        f"App created in {startup_timings['total']}ms (package import {IMPORT_TIME_MS}ms, "
+        f"schema mode '{app.config['SCHEMA_STARTUP_MODE']}')",
+        extra={'startup_ms': startup_timings},
+    )
+    # --- End Startup report ---
+
 
     # Return the created app instance
     return app
@@ -4,6 +4,8 @@ from datetime import datetime
 # from sqlalchemy.dialects.postgresql import JSON
 # Otherwise, you might store as Text and handle JSON serialization/deserialization in Python
 from sqlalchemy import Text # Use Text type for broader database compatibility
+from sqlalchemy import event
+from app.services.graph_codec import CompressedJSONText # Compressed storage for node/edge JSON
 
 # Example User model (adjust based on your actual User model)
 class User(db.Model):
@@ -13,6 +15,10 @@ class User(db.Model):
     password = db.Column(db.String(256)) # Store hashed passwords, not plain text
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
+    # Incremented whenever one of the user's nodemap or agent summaries changes
+    # (see _bump_user_data_version below); used as the ETag of /auth/user_data
+    data_version = db.Column(db.Integer, default=0, nullable=False)
+
     # Define the relationship to Nodemap
     # 'backref' creates a 'user' attribute on the Nodemap model
     # cascade="all, delete-orphan" ensures associated nodemaps are deleted when a user is deleted
@@ -33,28 +39,104 @@ class Nodemap(db.Model):
     name = db.Column(db.String(100), nullable=False)
     goal = db.Column(db.Text, nullable=False)
     description = db.Column(db.Text)
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
 
     # Define the foreign key relationship to the User model
     # ondelete="CASCADE" ensures that if the referenced user is deleted,
     # this nodemap will also be deleted by the database.
     user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), nullable=False)
 
-    # --- Fields to store Node Map data ---
-    # Store nodes and edges data as JSON strings
-    # Using Text type for compatibility, will store JSON string
-    nodes_data = db.Column(Text, default='[]') # Default to empty JSON array string
-    edges_data = db.Column(Text, default='[]') # Default to empty JSON array string
-    # --- End fields ---
+    # --- Legacy fields for Node Map data ---
+    # Nodes and edges used to be stored here as JSON strings.
+    # They now live in the NodemapNode / NodemapEdge tables below; these columns
+    # are only non-NULL for maps that have not been backfilled yet
+    # (see app/services/nodemap_graph.py and the backfill migration).
+    # Deferred so that loading a Nodemap never pulls in these (possibly huge) strings
+    # unless they are accessed; both are then loaded together in one query.
+    nodes_data = db.deferred(db.Column(Text, nullable=True), group='legacy_graph')
+    edges_data = db.deferred(db.Column(Text, nullable=True), group='legacy_graph')
+    # --- End legacy fields ---
 
     # --- New field for favorite status ---
     is_favorite = db.Column(db.Boolean, default=False, nullable=False) # Boolean field with default False
     # --- End new field ---
 
+    # --- Version counter for nodes/edges data ---
+    # Incremented on every successful save so clients can send patches
+    # against the version they last loaded (see /creation/savenodemap)
+    version = db.Column(db.Integer, default=0, nullable=False)
+    # --- End version counter ---
+
+    # --- Precomputed graph index ---
+    # Adjacency, topological order, cycles, entry/exit nodes and components as JSON,
+    # rebuilt on every save (see app/services/graph_index.py). It is only valid while
+    # graph_index_version equals version. Deferred like the legacy graph columns.
+    graph_index = db.deferred(db.Column(Text, nullable=True), group='graph_index')
+    graph_index_version = db.deferred(db.Column(db.Integer, nullable=True), group='graph_index')
+    # --- End graph index ---
+
+    # --- Relationships to the normalized graph tables ---
+    # lazy='dynamic' so that callers can filter (e.g. a single node) instead of loading the whole map
+    # passive_deletes=True lets the database ON DELETE CASCADE remove the rows
+    graph_nodes = db.relationship('NodemapNode', backref='nodemap', lazy='dynamic',
+                                  cascade="all, delete-orphan", passive_deletes=True)
+    graph_edges = db.relationship('NodemapEdge', backref='nodemap', lazy='dynamic',
+                                  cascade="all, delete-orphan", passive_deletes=True)
+    # --- End relationships ---
+
+    # Index used by the paginated /creation/getnodemaps (keyset on created_at, id)
+    __table_args__ = (
+        db.Index('ix_nodemap_user_created_id', 'user_id', 'created_at', 'id'),
+    )
+
 
     def __repr__(self):
         return f'<Nodemap {self.name}>'
 
+# --- Normalized Node Map graph models ---
+# One row per React Flow node / edge. The full element is kept as a JSON string
+# in 'data' (so the client gets back exactly what it saved), while the fields we
+# query on are copied into indexed columns.
+class NodemapNode(db.Model):
+    __tablename__ = 'nodemap_node'
+
+    id = db.Column(db.Integer, primary_key=True)
+    nodemap_id = db.Column(db.Integer, db.ForeignKey('nodemap.id', ondelete='CASCADE'), nullable=False)
+    node_id = db.Column(db.String(255), nullable=False) # The React Flow node id (e.g. 'dndnode_0')
+    # Agent referenced by node.data.agentId; no foreign key because the value comes from the client
+    agent_id = db.Column(db.Integer, nullable=True)
+    sort_index = db.Column(db.Integer, nullable=False, default=0) # Keeps the original list order
+    data = db.Column(CompressedJSONText, nullable=False) # The full node as a JSON string (stored compressed)
+
+    __table_args__ = (
+        db.UniqueConstraint('nodemap_id', 'node_id', name='_nodemap_node_id_uc'),
+        db.Index('ix_nodemap_node_agent_id', 'agent_id'),
+    )
+
+    def __repr__(self):
+        return f'<NodemapNode {self.node_id} of Nodemap {self.nodemap_id}>'
+
+class NodemapEdge(db.Model):
+    __tablename__ = 'nodemap_edge'
+
+    id = db.Column(db.Integer, primary_key=True)
+    nodemap_id = db.Column(db.Integer, db.ForeignKey('nodemap.id', ondelete='CASCADE'), nullable=False)
+    edge_id = db.Column(db.String(255), nullable=False) # The React Flow edge id
+    source = db.Column(db.String(255), nullable=True) # node_id of the source node
+    target = db.Column(db.String(255), nullable=True) # node_id of the target node
+    sort_index = db.Column(db.Integer, nullable=False, default=0)
+    data = db.Column(CompressedJSONText, nullable=False) # The full edge as a JSON string (stored compressed)
+
+    __table_args__ = (
+        db.UniqueConstraint('nodemap_id', 'edge_id', name='_nodemap_edge_id_uc'),
+        db.Index('ix_nodemap_edge_source', 'nodemap_id', 'source'),
+        db.Index('ix_nodemap_edge_target', 'nodemap_id', 'target'),
+    )
+
+    def __repr__(self):
+        return f'<NodemapEdge {self.edge_id} of Nodemap {self.nodemap_id}>'
+# --- End Normalized Node Map graph models ---
+
 # --- Agent model ---
 class Agent(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -63,6 +145,13 @@ class Agent(db.Model):
     model = db.Column(db.String(100), nullable=False) # e.g., 'gpt-4o', 'gemini-pro'
     system_prompt = db.Column(db.Text, nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    # Whether identical invocations may be answered from the response cache.
+    # Set to False for agents whose output should differ between runs.
+    cache_responses = db.Column(db.Boolean, default=True, nullable=False)
+    # Token count of system_prompt and the encoding it was counted with (set on
+    # flush by app/services/tokens.py; recounted when the tokenizer changes)
+    system_prompt_tokens = db.Column(db.Integer, nullable=True)
+    system_prompt_token_encoding = db.Column(db.String(64), nullable=True)
 
     # Define the foreign key relationship to the User model
     user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), nullable=False)
@@ -73,3 +162,257 @@ class Agent(db.Model):
     def __repr__(self):
         return f'<Agent {self.name}>'
 # --- End Agent model ---
+
+# --- Search index (portable backend) ---
+# Inverted index used by /creation/search when SQLite FTS5 is not available:
+# one row per (user, term, document) with the term's weight in that document.
+# The primary key doubles as the lookup index (prefix range scans on 'term').
+# Maintained by app/services/search.py; never edited directly.
+class SearchTerm(db.Model):
+    __tablename__ = 'search_term'
+
+    user_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    term = db.Column(db.String(64), primary_key=True)
+    kind = db.Column(db.String(16), primary_key=True) # 'nodemap' or 'agent'
+    doc_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    weight = db.Column(db.Integer, nullable=False)
+
+    # Used to remove a document's terms when it changes or is deleted
+    __table_args__ = (
+        db.Index('ix_search_term_document', 'kind', 'doc_id'),
+    )
+
+    def __repr__(self):
+        return f'<SearchTerm {self.term!r} in {self.kind} {self.doc_id}>'
+# --- End Search index ---
+
+# --- Background run jobs ---
+# A queued or running execution of a Nodemap, picked up by the worker processes
+# ('flask run-workers', see app/services/job_queue.py). The row is the job's
+# durable state: a worker holds it through a lease it renews while running,
+# and a job whose lease expired (the worker crashed) is queued again.
+class RunJob(db.Model):
+    __tablename__ = 'run_job'
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), nullable=False)
+    nodemap_id = db.Column(db.Integer, db.ForeignKey('nodemap.id', ondelete='CASCADE'), nullable=False)
+    status = db.Column(db.String(16), nullable=False, default='queued') # queued, running, completed, failed, cancelled
+    input = db.Column(db.Text, nullable=False, default='') # The text given to the entry nodes
+    max_concurrency = db.Column(db.Integer, nullable=False)
+
+    # --- Retries ---
+    attempts = db.Column(db.Integer, nullable=False, default=0) # Incremented each time a worker picks it up
+    max_attempts = db.Column(db.Integer, nullable=False, default=3)
+    run_after = db.Column(db.DateTime, nullable=False, default=datetime.utcnow) # Not picked up before (retry backoff)
+    # --- End Retries ---
+
+    # --- Lease held by the worker running it ---
+    worker_id = db.Column(db.String(100), nullable=True)
+    lease_expires_at = db.Column(db.DateTime, nullable=True)
+    cancel_requested = db.Column(db.Boolean, nullable=False, default=False)
+    # --- End Lease ---
+
+    progress = db.Column(db.Text, nullable=True) # JSON {node_id: status}, updated while it runs
+    result = db.Column(db.Text, nullable=True) # JSON result of the run (see execute_nodemap_graph)
+    error = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime, nullable=True)
+    finished_at = db.Column(db.DateTime, nullable=True)
+
+    __table_args__ = (
+        db.Index('ix_run_job_status_run_after', 'status', 'run_after'), # Workers looking for work
+        db.Index('ix_run_job_user_status', 'user_id', 'status'), # Per-user limits
+        db.Index('ix_run_job_nodemap_id', 'nodemap_id', 'id'), # A map's runs, newest first
+    )
+
+    def __repr__(self):
+        return f'<RunJob {self.id} of Nodemap {self.nodemap_id} ({self.status})>'
+# --- End Background run jobs ---
+
+# --- Run history ---
+# Every execution of a nodemap (see app/services/run_history.py):
+# - RunRecord: one row per run with its totals, listed per map newest first,
+# - RunEvent: the run's append-only event log (run start, one event per node, run end),
+# - RunPayload: node inputs and outputs, stored once per distinct content
+#   (keyed by its SHA-256) and compressed, so repeated prompts and cached
+#   outputs cost nothing extra.
+# Old runs are compacted into RunRecord.summary (their events are deleted), and
+# runs past the retention period are deleted entirely.
+class RunRecord(db.Model):
+    __tablename__ = 'run_record'
+
+    id = db.Column(db.Integer, primary_key=True) # The run id
+    nodemap_id = db.Column(db.Integer, db.ForeignKey('nodemap.id', ondelete='CASCADE'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), nullable=False)
+    job_id = db.Column(db.Integer, nullable=True) # The RunJob, for background runs
+    status = db.Column(db.String(16), nullable=False) # completed or failed
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    wall_time = db.Column(db.Float, nullable=True) # Seconds
+    node_count = db.Column(db.Integer, nullable=False, default=0)
+    failed_count = db.Column(db.Integer, nullable=False, default=0)
+    input_tokens = db.Column(db.Integer, nullable=False, default=0)
+    output_tokens = db.Column(db.Integer, nullable=False, default=0)
+    event_count = db.Column(db.Integer, nullable=False, default=0)
+    # Set by compaction: per-node results without payloads, as JSON
+    compacted = db.Column(db.Boolean, nullable=False, default=False)
+    summary = db.deferred(db.Column(db.Text, nullable=True))
+
+    __table_args__ = (
+        db.Index('ix_run_record_nodemap_id', 'nodemap_id', 'id'), # A map's runs, newest first
+        db.Index('ix_run_record_created_at', 'created_at'), # Compaction and retention
+    )
+
+    def __repr__(self):
+        return f'<RunRecord {self.id} of Nodemap {self.nodemap_id} ({self.status})>'
+
+class RunEvent(db.Model):
+    __tablename__ = 'run_event'
+
+    id = db.Column(db.Integer, primary_key=True)
+    nodemap_id = db.Column(db.Integer, nullable=False)
+    run_id = db.Column(db.Integer, db.ForeignKey('run_record.id', ondelete='CASCADE'), nullable=False)
+    sequence = db.Column(db.Integer, nullable=False) # Order of the event within its run
+    kind = db.Column(db.String(16), nullable=False) # run_started, node, run_finished
+    node_id = db.Column(db.String(255), nullable=True)
+    status = db.Column(db.String(16), nullable=True)
+    agent_id = db.Column(db.Integer, nullable=True)
+    model = db.Column(db.String(100), nullable=True)
+    cached = db.Column(db.Boolean, nullable=True)
+    started_at = db.Column(db.Float, nullable=True) # Seconds since the start of the run
+    finished_at = db.Column(db.Float, nullable=True)
+    wall_time = db.Column(db.Float, nullable=True)
+    input_tokens = db.Column(db.Integer, nullable=True)
+    output_tokens = db.Column(db.Integer, nullable=True)
+    input_hash = db.Column(db.String(64), nullable=True) # RunPayload of the input
+    output_hash = db.Column(db.String(64), nullable=True) # RunPayload of the output
+    error = db.Column(db.Text, nullable=True)
+    details = db.Column(db.Text, nullable=True) # Small JSON extras (e.g. the critical path)
+
+    __table_args__ = (
+        db.UniqueConstraint('nodemap_id', 'run_id', 'sequence', name='_run_event_sequence_uc'),
+        db.Index('ix_run_event_run_id', 'run_id', 'sequence'),
+        # Used to find payloads that no event references any more
+        db.Index('ix_run_event_input_hash', 'input_hash'),
+        db.Index('ix_run_event_output_hash', 'output_hash'),
+    )
+
+    def __repr__(self):
+        return f'<RunEvent {self.sequence} of run {self.run_id} ({self.kind})>'
+
+class RunPayload(db.Model):
+    __tablename__ = 'run_payload'
+
+    hash = db.Column(db.String(64), primary_key=True) # SHA-256 of the UTF-8 text
+    size = db.Column(db.Integer, nullable=False) # Uncompressed bytes
+    data = db.Column(db.LargeBinary, nullable=False) # Header byte + (compressed) text, see run_history.py
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+    def __repr__(self):
+        return f'<RunPayload {self.hash[:12]} ({self.size} bytes)>'
+# --- End Run history ---
+
+# --- Nodemap version history ---
+# Every saved version of a nodemap's graph (see app/services/nodemap_history.py):
+# - NodemapRevision: one row per saved version, with its counts and what saved it,
+# - NodemapHistoryElement: the content a node or edge had from one version to
+#   another; a save only closes and opens rows for the elements it changed, so
+#   unchanged elements cost nothing per version,
+# - NodemapBlob: node/edge JSON, stored once per distinct content (keyed by its
+#   SHA-256) and shared by every version and map that contains it.
+class NodemapRevision(db.Model):
+    __tablename__ = 'nodemap_revision'
+
+    id = db.Column(db.Integer, primary_key=True)
+    nodemap_id = db.Column(db.Integer, db.ForeignKey('nodemap.id', ondelete='CASCADE'), nullable=False)
+    version = db.Column(db.Integer, nullable=False) # Nodemap.version after the save
+    source = db.Column(db.String(16), nullable=False) # save, patch, collab, import or restore
+    restored_from = db.Column(db.Integer, nullable=True) # The version a restore brought back
+    node_count = db.Column(db.Integer, nullable=False, default=0)
+    edge_count = db.Column(db.Integer, nullable=False, default=0)
+    changed_count = db.Column(db.Integer, nullable=False, default=0) # Elements added, changed or removed
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+    # Also the index for listing a map's versions, newest first
+    __table_args__ = (
+        db.UniqueConstraint('nodemap_id', 'version', name='_nodemap_revision_version_uc'),
+    )
+
+    def __repr__(self):
+        return f'<NodemapRevision {self.version} of Nodemap {self.nodemap_id} ({self.source})>'
+
+class NodemapHistoryElement(db.Model):
+    __tablename__ = 'nodemap_history_element'
+
+    id = db.Column(db.Integer, primary_key=True)
+    nodemap_id = db.Column(db.Integer, db.ForeignKey('nodemap.id', ondelete='CASCADE'), nullable=False)
+    collection = db.Column(db.String(8), nullable=False) # 'nodes' or 'edges'
+    element_id = db.Column(db.String(255), nullable=False) # The React Flow node/edge id
+    sort_index = db.Column(db.Integer, nullable=False)
+    hash = db.Column(db.String(64), nullable=False) # NodemapBlob of the element's JSON
+    # The element had this content in versions from_version <= v < to_version
+    from_version = db.Column(db.Integer, nullable=False)
+    to_version = db.Column(db.Integer, nullable=True) # NULL while it is the current content
+
+    __table_args__ = (
+        db.Index('ix_nodemap_history_element_from', 'nodemap_id', 'from_version'), # A version's elements
+        db.Index('ix_nodemap_history_element_to', 'nodemap_id', 'to_version'), # Current elements, pruning
+        db.Index('ix_nodemap_history_element_id', 'nodemap_id', 'collection', 'element_id'), # Closing on save
+        db.Index('ix_nodemap_history_element_hash', 'hash'), # Finding unreferenced blobs
+    )
+
+    def __repr__(self):
+        return f'<NodemapHistoryElement {self.element_id} of Nodemap {self.nodemap_id} ({self.from_version}-{self.to_version})>'
+
+class NodemapBlob(db.Model):
+    __tablename__ = 'nodemap_blob'
+
+    hash = db.Column(db.String(64), primary_key=True) # SHA-256 of the serialized element
+    data = db.Column(CompressedJSONText, nullable=False) # The element as a JSON string (stored compressed)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+    def __repr__(self):
+        return f'<NodemapBlob {self.hash[:12]}>'
+# --- End Nodemap version history ---
+
+# --- Keep User.data_version up to date ---
+# Nodemap columns that appear in the user's summary lists; saving a map's
+# nodes/edges changes none of them and so does not invalidate /auth/user_data.
+_NODEMAP_SUMMARY_ATTRIBUTES = ('name', 'goal', 'description', 'is_favorite', 'created_at')
+
+@event.listens_for(db.session, 'before_flush')
+def _bump_user_data_version(session, flush_context, instances):
+    """
+    Before every flush, increments data_version for each user whose nodemaps or
+    agents are being created, deleted or changed in a way visible in their summaries.
+    """
+    user_ids = set()
+    for obj in list(session.new) + list(session.deleted):
+        if isinstance(obj, (Nodemap, Agent)) and obj.user_id is not None:
+            user_ids.add(obj.user_id)
+    for obj in session.dirty:
+        if isinstance(obj, Agent) and session.is_modified(obj):
+            user_ids.add(obj.user_id)
+        elif isinstance(obj, Nodemap):
+            state = db.inspect(obj)
+            if any(state.attrs[name].history.has_changes() for name in _NODEMAP_SUMMARY_ATTRIBUTES):
+                user_ids.add(obj.user_id)
+
+    if user_ids:
+        bump_user_data_version(session, user_ids)
+
+
+def bump_user_data_version(session, user_ids):
+    """
+    Increments data_version for the given users.
+    Called by the listener above, and directly by code that writes agents or
+    nodemaps with bulk statements (which do not go through a flush).
+    """
+    # A Core statement on the session's connection, so no nested ORM flush is triggered
+    user_table = User.__table__
+    session.connection().execute(
+        user_table.update()
+        .where(user_table.c.id.in_(user_ids))
+        .values(data_version=user_table.c.data_version + 1)
+    )
+# --- End Keep User.data_version up to date ---
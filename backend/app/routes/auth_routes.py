@@ -1,3 +1,4 @@
+import logging
 # Import necessary modules from Flask
 from flask import Blueprint, jsonify, request
 # Import the regular expression module for email validation
@@ -10,6 +11,8 @@ from app import db
 from app.models import User, Nodemap, Agent # Import the Nodemap and Agent models
 # Import JWT functions
 from flask_jwt_extended import create_access_token, jwt_required, get_jwt_identity
+from sqlalchemy import func
+from app.services.http_caching import make_etag, is_not_modified, not_modified_response, with_etag
 
 # Create a Blueprint named 'auth'.
 # Blueprints help organize routes and other components into reusable modules.
@@ -17,6 +20,62 @@ from flask_jwt_extended import create_access_token, jwt_required, get_jwt_identi
 # The second argument is the blueprint's import name, typically __name__.
 auth_bp = Blueprint('auth', __name__)
 
+# Module logger; records go through the app's structured, queued logging (app/services/logging_setup.py)
+logger = logging.getLogger(__name__)
+
+# Number of characters of an agent's system prompt included in the summary lists
+SYSTEM_PROMPT_PREVIEW_LENGTH = 200
+
+
+# --- Helper to fetch the nodemap and agent summaries for a user ---
+def get_user_summaries(user_id):
+    """
+    Returns (nodemaps_list, agents_list) for a user using exactly two queries.
+    Only the summary columns are selected, so the nodemaps' graph data and the
+    full agent system prompts are never loaded from the database.
+    Shared by /login and /user_data.
+    """
+    # --- Fetch the user's nodemaps ---
+    nodemap_rows = db.session.query(
+        Nodemap.id, Nodemap.name, Nodemap.goal, Nodemap.description, Nodemap.created_at, Nodemap.is_favorite
+    ).filter(Nodemap.user_id == user_id).order_by(Nodemap.created_at, Nodemap.id)
+
+    nodemaps_list = []
+    for nodemap in nodemap_rows:
+        nodemaps_list.append({
+            "id": nodemap.id,
+            "name": nodemap.name,
+            "goal": nodemap.goal,
+            "description": nodemap.description,
+            "created_at": nodemap.created_at.isoformat() if nodemap.created_at else None, # Convert datetime to string
+            "is_favorite": nodemap.is_favorite # Include the is_favorite status here
+        })
+    # --- End Fetch and Prepare Nodemap List ---
+
+    # --- Fetch the user's agents ---
+    # The system prompt is truncated by the database; the full text is only needed when running the agent
+    agent_rows = db.session.query(
+        Agent.id, Agent.name, Agent.type, Agent.model, Agent.cache_responses, Agent.system_prompt_tokens, Agent.created_at,
+        func.substr(Agent.system_prompt, 1, SYSTEM_PROMPT_PREVIEW_LENGTH).label('system_prompt_preview'),
+    ).filter(Agent.user_id == user_id).order_by(Agent.created_at, Agent.id)
+
+    agents_list = []
+    for agent in agent_rows:
+        agents_list.append({
+            "id": agent.id,
+            "name": agent.name,
+            "type": agent.type,
+            "model": agent.model,
+            "system_prompt_preview": agent.system_prompt_preview, # First characters of the system prompt
+            "cache_responses": agent.cache_responses,
+            "system_prompt_tokens": agent.system_prompt_tokens, # Counted when the agent was saved
+            "created_at": agent.created_at.isoformat() if agent.created_at else None # Convert datetime to string
+        })
+    # --- End Fetch and Prepare Agent List ---
+
+    return nodemaps_list, agents_list
+# --- End Helper ---
+
 # Define the route for user registration within the blueprint
 # This route will accept POST requests
 @auth_bp.route('/register', methods=['POST'])
@@ -92,11 +151,11 @@ def register_user():
     except Exception as e:
         # If an error occurs during the database operation, rollback the session
         db.session.rollback()
-        print(f"Database error during user registration: {e}")
+        logger.exception(f"Database error during user registration: {e}")
         return jsonify({"error": "An error occurred while saving the user"}), 500 # Internal Server Error
     # --- End Save the userData to the database ---
 
-    print(f"Successfully registered user: {username}")
+    logger.info(f"Successfully registered user: {username}")
 
     # Return a success message
     # In a real app, you might return user info (excluding password) or a token
@@ -149,48 +208,15 @@ def login_user():
     # Check if a user was found and if the provided password matches the stored hash
     if user and check_password_hash(user.password, password):
         # Password matches, user is authenticated
-        print(f"User logged in successfully: {user.username}")
+        logger.info(f"User logged in successfully: {user.username}")
 
         # Create the access token with the user's ID as the identity
         # Ensure the identity is a string!
         access_token = create_access_token(identity=str(user.id))
 
-        # --- Fetch the user's nodemaps ---
-        # Access the 'nodemaps' relationship on the user object
-        user_nodemaps = user.nodemaps
-
-        # Prepare a list of nodemap data to include in the response
-        nodemaps_list = []
-        for nodemap in user_nodemaps:
-            nodemaps_list.append({
-                "id": nodemap.id,
-                "name": nodemap.name,
-                "goal": nodemap.goal,
-                "description": nodemap.description,
-                "created_at": nodemap.created_at.isoformat(), # Convert datetime to string
-                "is_favorite": nodemap.is_favorite # Include the is_favorite status here
-                # Add other nodemap fields you want to return
-            })
-        # --- End Fetch and Prepare Nodemap List ---
-
-        # --- Fetch the user's agents ---
-        # Access the 'agents' relationship on the user object
-        user_agents = user.agents
-
-        # Prepare a list of agent data to include in the response
-        agents_list = []
-        for agent in user_agents:
-             agents_list.append({
-                "id": agent.id,
-                "name": agent.name,
-                "type": agent.type,
-                "model": agent.model,
-                "system_prompt": agent.system_prompt, # Include system prompt if needed on frontend
-                "created_at": agent.created_at.isoformat() # Convert datetime to string
-                # Add other agent fields you want to return
-            })
-        # --- End Fetch and Prepare Agent List ---
-
+        # --- Fetch the user's nodemaps and agents (summary columns only) ---
+        nodemaps_list, agents_list = get_user_summaries(user.id)
+        # --- End Fetch ---
 
         # Return the access token, user info, and the lists of nodemaps and agents
         return jsonify({
@@ -206,7 +232,7 @@ def login_user():
         }), 200 # OK
     else:
         # No user found or password does not match
-        print(f"Login failed for: {email_or_username}")
+        logger.warning(f"Login failed for: {email_or_username}")
         return jsonify({"error": "Invalid email/username or password"}), 401 # Unauthorized
 
 # --- Protected Route to Get User Data and Nodemaps/Agents ---
@@ -218,6 +244,8 @@ def get_user_data():
     Protected route to get the logged-in user's details and their nodemaps and agents.
     Requires a valid JWT access token in the Authorization header.
     Includes the is_favorite status for nodemaps.
+    Supports conditional requests: the ETag is derived from the user's data_version,
+    so a request with a matching If-None-Match gets a 304 after a single lookup.
     """
     # Get the identity of the current user from the JWT
     current_user_id = get_jwt_identity()
@@ -226,39 +254,19 @@ def get_user_data():
     user = User.query.get(current_user_id)
 
     if user:
-        # --- Fetch the user's nodemaps (same logic as in login) ---
-        user_nodemaps = user.nodemaps
-        nodemaps_list = []
-        for nodemap in user_nodemaps:
-            nodemaps_list.append({
-                "id": nodemap.id,
-                "name": nodemap.name,
-                "goal": nodemap.goal,
-                "description": nodemap.description,
-                "created_at": nodemap.created_at.isoformat(), # Convert datetime to string
-                 "is_favorite": nodemap.is_favorite # Include the is_favorite status here
-                # Add other nodemap fields you want to return
-            })
-        # --- End Fetch and Prepare Nodemap List ---
-
-        # --- Fetch the user's agents (same logic as in login) ---
-        user_agents = user.agents
-        agents_list = []
-        for agent in user_agents:
-             agents_list.append({
-                "id": agent.id,
-                "name": agent.name,
-                "type": agent.type,
-                "model": agent.model,
-                "system_prompt": agent.system_prompt, # Include system prompt if needed on frontend
-                "created_at": agent.created_at.isoformat() # Convert datetime to string
-                # Add other agent fields you want to return
-            })
-        # --- End Fetch and Prepare Agent List ---
+        # --- Conditional request check ---
+        # Nothing the response contains can change without bumping data_version
+        etag = make_etag('user_data', user.id, user.data_version, user.username, user.email)
+        if is_not_modified(etag):
+            return not_modified_response(etag)
+        # --- End Conditional request check ---
 
+        # --- Fetch the user's nodemaps and agents (same logic as in login) ---
+        nodemaps_list, agents_list = get_user_summaries(user.id)
+        # --- End Fetch ---
 
         # Return the user info and the lists of nodemaps and agents
-        return jsonify({
+        return with_etag(jsonify({
             "user": {
                 "id": user.id,
                 "username": user.username,
@@ -266,7 +274,7 @@ def get_user_data():
             },
             "nodemaps": nodemaps_list, # Include the list of nodemaps here
             "agents": agents_list # Include the list of agents here
-        }), 200 # OK
+        }), etag), 200 # OK
     else:
         # This case should ideally not happen if the token identity is valid
         # and the user exists, but handle it just in case.
@@ -292,7 +300,7 @@ def logout():
 
     # Get the identity of the current user (optional, for logging)
     current_user_id = get_jwt_identity()
-    print(f"User {current_user_id} attempting logout.")
+    logger.info(f"User {current_user_id} attempting logout.", extra={'user_id': current_user_id})
 
     # You might add logic here to add the token to a revocation list
     # if you are implementing token blacklisting.
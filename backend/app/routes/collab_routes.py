@@ -0,0 +1,148 @@
+import json
+import logging
+import socket
+import threading
+from flask import Blueprint, jsonify, current_app
+from flask_jwt_extended import decode_token
+
+from app import db
+from app.models import Nodemap # Import the Nodemap model
+from app.services.collab import collab_hub
+from app.services.nodemap_patch import NodemapPatchError
+
+try:
+    from flask_sock import Sock
+except ImportError: # Optional dependency; without it collaborative editing is unavailable
+    Sock = None
+
+# Create a Blueprint for real-time collaboration routes
+collab_bp = Blueprint('collab', __name__)
+
+# Module logger; records go through the app's structured, queued logging (app/services/logging_setup.py)
+logger = logging.getLogger(__name__)
+
+# WebSocket close codes (RFC 6455)
+CLOSE_POLICY_VIOLATION = 1008
+CLOSE_TRY_AGAIN_LATER = 1013
+
+
+def _send_error(client, error, client_seq=None):
+    client.post(json.dumps({'type': 'error', 'error': error, 'client_seq': client_seq}))
+
+
+def _handle_message(room, client, raw):
+    """
+    Handles one message from an editor:
+        {"type": "ops", "ops": [...patch ops...], "client_seq": n}  edits (see app/services/nodemap_patch.py)
+        {"type": "sync"}                                            asks for a fresh snapshot
+        {"type": "ping"}                                            answered with {"type": "pong"}
+    """
+    try:
+        message = json.loads(raw)
+    except (TypeError, ValueError):
+        return _send_error(client, "Messages must be JSON objects")
+    if not isinstance(message, dict):
+        return _send_error(client, "Messages must be JSON objects")
+
+    message_type = message.get('type')
+    if message_type == 'ops':
+        ops = message.get('ops')
+        client_seq = message.get('client_seq')
+        if not isinstance(ops, list) or not ops:
+            return _send_error(client, "'ops' must be a non-empty list", client_seq)
+        if len(ops) > current_app.config['COLLAB_MAX_OPS_PER_MESSAGE']:
+            return _send_error(client, f"At most {current_app.config['COLLAB_MAX_OPS_PER_MESSAGE']} ops per message", client_seq)
+        try:
+            room.apply(client, ops, client_seq)
+        except NodemapPatchError as e:
+            # Nothing was applied; the editor should ask for a snapshot ('sync') and redo its change
+            _send_error(client, f"Invalid ops: {e}", client_seq)
+    elif message_type == 'sync':
+        with room.lock:
+            client.post(room.snapshot_message())
+    elif message_type == 'ping':
+        client.post('{"type":"pong"}')
+    else:
+        _send_error(client, f"Unknown message type: {message_type!r}")
+
+
+def _authenticate(ws):
+    """
+    Reads the editor's first message, {"type": "auth", "token": "<JWT access token>"},
+    and returns the user id, or None if it is missing, late or invalid.
+    """
+    try:
+        raw = ws.receive(timeout=current_app.config['COLLAB_AUTH_TIMEOUT'])
+        message = json.loads(raw) if raw is not None else None
+        if not isinstance(message, dict) or message.get('type') != 'auth':
+            return None
+        claims = decode_token(message.get('token') or '')
+    except Exception:
+        return None
+    if claims.get('type') != 'access':
+        return None
+    return claims['sub']
+
+
+# --- Define the WebSocket for editing a Node Map together ---
+def nodemap_socket(ws, nodemap_id):
+    """
+    Real-time collaborative editing of a nodemap (see app/services/collab.py).
+    Browsers cannot set headers on a WebSocket, and a token in the URL would end up
+    in access logs, so the first message must be {"type": "auth", "token": "<JWT
+    access token>"}, sent within COLLAB_AUTH_TIMEOUT seconds. Only the nodemap's owner can connect.
+    The server first sends a 'snapshot' of the map, then:
+    - 'ops' with every editor's changes (the sender's own included), in 'seq' order,
+    - 'saved' when the changes were written to the database (with the new version),
+    - 'presence' when editors join or leave, 'error' for rejected messages.
+    """
+    current_user_id = _authenticate(ws)
+    if current_user_id is None:
+        ws.close(reason=CLOSE_POLICY_VIOLATION, message="Invalid or missing token")
+        return
+
+    # --- Find the Nodemap and verify ownership ---
+    nodemap = Nodemap.query.filter_by(id=nodemap_id, user_id=current_user_id).first()
+    if not nodemap:
+        db.session.rollback()
+        logger.warning(f"Attempted to edit non-existent or unauthorized nodemap ID: {nodemap_id} by user ID: {current_user_id}", extra={'user_id': current_user_id})
+        ws.close(reason=CLOSE_POLICY_VIOLATION, message="Nodemap not found or you do not have permission to edit it")
+        return
+    # --- End Find and Verify ---
+
+    # Small messages go out at once instead of waiting to be merged with the next ones (Nagle)
+    try:
+        ws.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    except (AttributeError, OSError):
+        pass
+    try:
+        room, client = collab_hub.join(nodemap, ws.send)
+    except ValueError as e:
+        db.session.rollback()
+        ws.close(reason=CLOSE_TRY_AGAIN_LATER, message=str(e))
+        return
+    finally:
+        db.session.close() # No connection is held for the lifetime of the socket
+    logger.info(f"Editor {client.client_id} joined nodemap ID: {nodemap_id} for user ID: {current_user_id}", extra={'user_id': current_user_id})
+
+    sender = threading.Thread(target=client.run_sender, name=f'collab-send-{client.client_id}', daemon=True)
+    sender.start()
+    try:
+        while not client.closed.is_set():
+            raw = ws.receive(timeout=1)
+            if raw is not None:
+                _handle_message(room, client, raw)
+    finally:
+        collab_hub.leave(room, client)
+        sender.join(timeout=2)
+        logger.info(f"Editor {client.client_id} left nodemap ID: {nodemap_id}", extra={'user_id': current_user_id})
+# --- End Nodemap WebSocket ---
+
+
+if Sock is not None:
+    sock = Sock()
+    sock.route('/nodemap/<int:nodemap_id>', bp=collab_bp)(nodemap_socket)
+else:
+    @collab_bp.route('/nodemap/<int:nodemap_id>')
+    def nodemap_socket_unavailable(nodemap_id):
+        return jsonify({"error": "Collaborative editing is not available: the flask-sock package is not installed"}), 501 # Not Implemented
@@ -1,14 +1,102 @@
-from flask import Blueprint, request, jsonify
+import logging
+import gzip # Compressed workspace uploads
+import time
+from flask import Blueprint, request, jsonify, current_app, Response, stream_with_context
 # Import jwt_required and get_jwt_identity for route protection
 from flask_jwt_extended import jwt_required, get_jwt_identity
 import json # Import the json module for serialization
+import base64 # Used to encode pagination cursors
+import binascii
+from datetime import datetime
+from sqlalchemy import and_, or_, insert
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import undefer_group
 
 from app import db # Import the SQLAlchemy db instance
-from app.models import Nodemap, User, Agent # Import the Nodemap and Agent models
+from app.models import Nodemap, User, Agent, bump_user_data_version # Import the Nodemap and Agent models
+from app.services.nodemap_patch import NodemapPatchError # Patch-based saves
+from app.services.nodemap_graph import load_nodemap_graph_json, save_nodemap_graph, patch_nodemap_graph, claim_next_version, NodemapGraphError
+from app.services.http_caching import make_etag, is_not_modified, not_modified_response, with_etag
+from app.services.json_provider import spliced_json_response
+from app.services.graph_index import get_graph_index, refresh_graph_index
+from app.services.search import search_documents, index_documents, active_search_backend, nodemap_document, agent_document
+from app.services.tokens import check_system_prompt, encoding_for, context_window, ContextBudgetExceeded
+from app.services.nodemap_history import (record_revision, list_revisions, revision_to_dict, get_revision,
+                                          revision_graph_json, diff_revisions, restore_revision, NodemapHistoryError)
+from app.services.workspace_transfer import export_workspace, gzip_lines, read_lines, parse_header, WorkspaceImporter, WorkspaceImportError
 
 # Create a Blueprint for creation-related routes
 creation_bp = Blueprint('creation', __name__)
 
+# Module logger; records go through the app's structured, queued logging (app/services/logging_setup.py)
+logger = logging.getLogger(__name__)
+
+
+# --- Validation helpers shared by the single and bulk creation routes ---
+def validate_nodemap_fields(data):
+    """
+    Checks the fields of a nodemap to create.
+    Returns (fields, None) when valid, or (None, error message).
+    """
+    if not isinstance(data, dict):
+        return None, "Invalid input: No data provided or invalid JSON"
+
+    name = data.get('name')
+    goal = data.get('goal')
+    description = data.get('description')
+
+    if not name:
+        return None, "Nodemap name is required"
+    if not goal:
+        return None, "Nodemap goal is required"
+    if not description:
+        return None, "Nodemap description is required"
+
+    return {'name': name, 'goal': goal, 'description': description}, None
+
+
+def validate_agent_fields(data):
+    """
+    Checks the fields of an agent to create.
+    Returns (fields, None) when valid, or (None, error message).
+    """
+    if not isinstance(data, dict):
+        return None, "Invalid input: No data provided or invalid JSON"
+
+    name = data.get('name')
+    agent_type = data.get('type') # Use a different variable name to avoid conflict with Python's built-in type()
+    model = data.get('model')
+    system_prompt = data.get('system_prompt')
+    cache_responses = data.get('cache_responses', True)
+
+    if not name:
+        return None, "Agent name is required"
+    if not agent_type:
+        return None, "Agent type is required"
+    if not model:
+        return None, "Agent model is required"
+    if not system_prompt:
+        return None, "System prompt is required"
+    if not isinstance(cache_responses, bool):
+        return None, "'cache_responses' must be true or false"
+    # Count the system prompt now (stored on the agent) and reject prompts that
+    # leave no room for an input in the model's context window
+    try:
+        system_prompt_tokens = check_system_prompt(model, system_prompt)
+    except ContextBudgetExceeded as e:
+        return None, str(e)
+
+    return {
+        'name': name,
+        'type': agent_type,
+        'model': model,
+        'system_prompt': system_prompt,
+        'cache_responses': cache_responses,
+        'system_prompt_tokens': system_prompt_tokens,
+        'system_prompt_token_encoding': encoding_for(model).name,
+    }, None
+# --- End Validation helpers ---
+
 
 # Define a route to create a new Nodemap
 # This route requires a valid JWT access token
@@ -29,33 +117,27 @@ def create_nodemap():
     data = request.get_json(silent=True)
 
     # --- Data Validation ---
-    if not data:
-        return jsonify({"error": "Invalid input: No data provided or invalid JSON"}), 400
+    fields, error = validate_nodemap_fields(data)
+    if error:
+        return jsonify({"error": error}), 400
 
-    name = data.get('name')
-    goal = data.get('goal')
-    description = data.get('description')
-
-    if not name:
-        return jsonify({"error": "Nodemap name is required"}), 400
-    if not goal:
-        return jsonify({"error": "Nodemap goal is required"}), 400
-    if not description:
-        return jsonify({"error": "Nodemap description is required"}), 400
+    name = fields['name']
+    goal = fields['goal']
+    description = fields['description']
     # --- End Data Validation ---
 
     # --- Check for existing Nodemap with the same name for this user ---
     existing_nodemap = Nodemap.query.filter_by(user_id=current_user_id, name=name).first()
 
     if existing_nodemap:
-        print(f"Attempted to create duplicate nodemap name '{name}' for user ID: {current_user_id}")
+        logger.warning(f"Attempted to create duplicate nodemap name '{name}' for user ID: {current_user_id}", extra={'user_id': current_user_id})
         return jsonify({"error": f"You already have a nodemap named '{name}'"}), 409 # Conflict
     # --- End Check ---
 
 
     # --- Create and Save Nodemap ---
     # Create a new Nodemap instance
-    # nodes_data and edges_data will use their default values ('[]')
+    # The map starts with no rows in the nodemap_node / nodemap_edge tables
     # is_favorite will use its default value (False)
     new_nodemap = Nodemap(
         name=name,
@@ -67,7 +149,7 @@ def create_nodemap():
     try:
         db.session.add(new_nodemap)
         db.session.commit()
-        print(f"Successfully created nodemap: {name} (ID: {new_nodemap.id}) for user ID: {current_user_id}")
+        logger.info(f"Successfully created nodemap: {name} (ID: {new_nodemap.id}) for user ID: {current_user_id}", extra={'user_id': current_user_id})
         return jsonify({
             "message": "Nodemap created successfully",
             "nodemap_id": new_nodemap.id,
@@ -75,13 +157,14 @@ def create_nodemap():
             "goal": new_nodemap.goal,
             "description": new_nodemap.description,
             "created_at": new_nodemap.created_at.isoformat() if new_nodemap.created_at else None,
-            "nodes_data": new_nodemap.nodes_data, # Should be '[]'
-            "edges_data": new_nodemap.edges_data,  # Should be '[]'
-            "is_favorite": new_nodemap.is_favorite # Include the new field
+            "nodes_data": '[]', # A new map has no nodes yet
+            "edges_data": '[]',  # ...and no edges
+            "is_favorite": new_nodemap.is_favorite, # Include the new field
+            "version": new_nodemap.version
         }), 201 # Created
     except Exception as e:
         db.session.rollback()
-        print(f"Database error during nodemap creation: {e}")
+        logger.exception(f"Database error during nodemap creation: {e}")
         return jsonify({"error": "An error occurred while creating the nodemap"}), 500 # Internal Server Error
 
     # --- End Create and Save ---
@@ -96,7 +179,10 @@ def create_agent():
     Handles the creation of a new AI Agent.
     Requires a valid JWT access token.
     Expects JSON data with 'name', 'type', 'model', and 'system_prompt'.
+    Optional 'cache_responses' (default true) allows identical invocations to be
+    answered from the response cache; set it to false for nondeterministic agents.
     Includes a check to prevent duplicate agent names for the same user.
+    The system prompt's token count is stored with the agent and returned.
     """
     # Get the identity of the current user from the JWT
     current_user_id = get_jwt_identity()
@@ -105,23 +191,15 @@ def create_agent():
     data = request.get_json(silent=True)
 
     # --- Data Validation ---
-    if not data:
-        return jsonify({"error": "Invalid input: No data provided or invalid JSON"}), 400
-
-    name = data.get('name')
-    agent_type = data.get('type') # Use a different variable name to avoid conflict with Python's built-in type()
-    model = data.get('model')
-    system_prompt = data.get('system_prompt')
+    fields, error = validate_agent_fields(data)
+    if error:
+        return jsonify({"error": error}), 400
 
-
-    if not name:
-        return jsonify({"error": "Agent name is required"}), 400
-    if not agent_type:
-        return jsonify({"error": "Agent type is required"}), 400
-    if not model:
-        return jsonify({"error": "Agent model is required"}), 400
-    if not system_prompt:
-        return jsonify({"error": "System prompt is required"}), 400
+    name = fields['name']
+    agent_type = fields['type']
+    model = fields['model']
+    system_prompt = fields['system_prompt']
+    cache_responses = fields['cache_responses']
     # --- End Data Validation ---
 
     # --- Check for existing Agent with the same name for this user ---
@@ -129,7 +207,7 @@ def create_agent():
     existing_agent = Agent.query.filter_by(user_id=current_user_id, name=name).first()
 
     if existing_agent:
-        print(f"Attempted to create duplicate agent name '{name}' for user ID: {current_user_id}")
+        logger.warning(f"Attempted to create duplicate agent name '{name}' for user ID: {current_user_id}", extra={'user_id': current_user_id})
         return jsonify({"error": f"You already have an agent named '{name}'"}), 409 # Conflict
     # --- End Check ---
 
@@ -141,13 +219,16 @@ def create_agent():
         type=agent_type,
         model=model,
         system_prompt=system_prompt,
+        cache_responses=cache_responses,
+        system_prompt_tokens=fields['system_prompt_tokens'],
+        system_prompt_token_encoding=fields['system_prompt_token_encoding'],
         user_id=current_user_id # Link the agent to the current user
     )
 
     try:
         db.session.add(new_agent)
         db.session.commit()
-        print(f"Successfully created agent: {name} (ID: {new_agent.id}) for user ID: {current_user_id}")
+        logger.info(f"Successfully created agent: {name} (ID: {new_agent.id}) for user ID: {current_user_id}", extra={'user_id': current_user_id})
         return jsonify({
             "message": "Agent created successfully",
             "agent_id": new_agent.id,
@@ -155,16 +236,300 @@ def create_agent():
             "type": new_agent.type,
             "model": new_agent.model,
             "system_prompt": new_agent.system_prompt,
+            "cache_responses": new_agent.cache_responses,
+            "system_prompt_tokens": new_agent.system_prompt_tokens,
+            "context_window": context_window(new_agent.model),
             "created_at": new_agent.created_at.isoformat() if new_agent.created_at else None
         }), 201 # Created
     except Exception as e:
         db.session.rollback()
-        print(f"Database error during agent creation: {e}")
+        logger.exception(f"Database error during agent creation: {e}")
         return jsonify({"error": "An error occurred while creating the agent"}), 500 # Internal Server Error
 
     # --- End Create and Save ---
 
 
+# --- Define a route to create many Agents and Nodemaps at once ---
+@creation_bp.route('/bulkcreate', methods=['POST'])
+@jwt_required() # Protect this route with JWT authentication
+def bulk_create():
+    """
+    Creates many agents and nodemaps for the current user in one request.
+    Expects JSON data like:
+        {"agents": [{...same fields as /createagent...}, ...],
+         "nodemaps": [{...same fields as /createmap...}, ...],
+         "all_or_nothing": false}
+    Every item is validated and checked for duplicate names (against the user's
+    existing agents/nodemaps and against the other items) with one query per
+    kind, and all valid items are inserted in a single transaction.
+    Invalid items are reported per item (by their index) instead of failing the
+    whole request, unless 'all_or_nothing' is true.
+    Returns 201 when every item was created, 207 when only some were, and
+    400 when none were.
+    """
+    current_user_id = get_jwt_identity()
+    data = request.get_json(silent=True)
+
+    # --- Data Validation ---
+    if not isinstance(data, dict):
+        return jsonify({"error": "Invalid input: No data provided or invalid JSON"}), 400
+
+    agent_items = data.get('agents', [])
+    nodemap_items = data.get('nodemaps', [])
+    all_or_nothing = data.get('all_or_nothing', False)
+
+    if not isinstance(agent_items, list) or not isinstance(nodemap_items, list):
+        return jsonify({"error": "'agents' and 'nodemaps' must be lists"}), 400
+    if not isinstance(all_or_nothing, bool):
+        return jsonify({"error": "'all_or_nothing' must be true or false"}), 400
+    if not agent_items and not nodemap_items:
+        return jsonify({"error": "Nothing to create: 'agents' and 'nodemaps' are both empty"}), 400
+
+    max_items = current_app.config['BULK_CREATE_MAX_ITEMS']
+    if len(agent_items) + len(nodemap_items) > max_items:
+        return jsonify({"error": f"At most {max_items} items can be created in one request"}), 413 # Payload Too Large
+    # --- End Data Validation ---
+
+    # --- Validate every item and check names ---
+    kinds = {
+        'agents': (agent_items, validate_agent_fields, Agent, 'agent'),
+        'nodemaps': (nodemap_items, validate_nodemap_fields, Nodemap, 'nodemap'),
+    }
+    valid = {'agents': [], 'nodemaps': []} # (index, fields) of the items to insert
+    errors = {'agents': [], 'nodemaps': []}
+
+    for kind, (items, validate, model_class, label) in kinds.items():
+        checked = []
+        for index, item in enumerate(items):
+            fields, error = validate(item)
+            if error:
+                errors[kind].append({"index": index, "error": error})
+            else:
+                checked.append((index, fields))
+
+        # One set-based query for the names that already exist for this user
+        names = {fields['name'] for _, fields in checked}
+        existing_names = set()
+        if names:
+            existing_names = {
+                name for (name,) in db.session.query(model_class.name).filter(
+                    model_class.user_id == current_user_id, model_class.name.in_(names)
+                )
+            }
+
+        seen_names = set()
+        for index, fields in checked:
+            name = fields['name']
+            if name in existing_names:
+                errors[kind].append({"index": index, "error": f"You already have {'an' if label == 'agent' else 'a'} {label} named '{name}'"})
+            elif name in seen_names:
+                errors[kind].append({"index": index, "error": f"Duplicate {label} name '{name}' in this request"})
+            else:
+                seen_names.add(name)
+                valid[kind].append((index, fields))
+        errors[kind].sort(key=lambda entry: entry['index'])
+    # --- End Validate ---
+
+    error_count = len(errors['agents']) + len(errors['nodemaps'])
+    if error_count and all_or_nothing:
+        return jsonify({
+            "error": "Some items are invalid; nothing was created",
+            "agents": {"created": [], "errors": errors['agents']},
+            "nodemaps": {"created": [], "errors": errors['nodemaps']},
+            "created_count": 0,
+            "error_count": error_count
+        }), 400 # Bad Request
+
+    # --- Insert everything in one transaction ---
+    # Bulk INSERT statements (one executemany per table) instead of one ORM object
+    # per item; the generated ids are then read back with one query per table.
+    created = {'agents': [], 'nodemaps': []}
+    try:
+        for kind, model_class, id_key in (('agents', Agent, 'agent_id'), ('nodemaps', Nodemap, 'nodemap_id')):
+            if not valid[kind]:
+                continue
+            db.session.execute(
+                insert(model_class),
+                [dict(fields, user_id=current_user_id) for _, fields in valid[kind]],
+            )
+            names = [fields['name'] for _, fields in valid[kind]]
+            # Ordered by id so that, for names that are not unique in the database
+            # (nodemaps), the rows inserted just now win
+            ids_by_name = {
+                name: row_id for row_id, name in db.session.query(model_class.id, model_class.name).filter(
+                    model_class.user_id == current_user_id, model_class.name.in_(names)
+                ).order_by(model_class.id)
+            }
+            created[kind] = [
+                {"index": index, id_key: ids_by_name.get(fields['name']), "name": fields['name']}
+                for index, fields in valid[kind]
+            ]
+
+        if valid['agents'] or valid['nodemaps']:
+            # Bulk statements bypass the flush listeners that keep /auth/user_data's ETag
+            # and the search index fresh
+            bump_user_data_version(db.session, {current_user_id})
+            index_documents(db.session.connection(), active_search_backend(), [
+                agent_document(item['agent_id'], current_user_id, fields['name'], fields['system_prompt'])
+                for item, (_, fields) in zip(created['agents'], valid['agents'])
+            ] + [
+                nodemap_document(item['nodemap_id'], current_user_id, fields['name'], fields['goal'], fields['description'])
+                for item, (_, fields) in zip(created['nodemaps'], valid['nodemaps'])
+            ])
+        db.session.commit()
+    except IntegrityError as e:
+        # Another request created one of these names since the check above
+        db.session.rollback()
+        logger.warning(f"Integrity error during bulk creation for user ID {current_user_id}: {e}", extra={'user_id': current_user_id})
+        return jsonify({"error": "A name was taken by another request; nothing was created, please retry"}), 409 # Conflict
+    except Exception as e:
+        db.session.rollback()
+        logger.exception(f"Database error during bulk creation: {e}")
+        return jsonify({"error": "An error occurred while creating the items"}), 500 # Internal Server Error
+    # --- End Insert ---
+
+    created_count = len(created['agents']) + len(created['nodemaps'])
+    logger.info(f"Bulk created {len(created['agents'])} agents and {len(created['nodemaps'])} nodemaps for user ID: {current_user_id} ({error_count} errors)", extra={'user_id': current_user_id})
+
+    if not error_count:
+        status_code = 201 # Created
+    elif created_count:
+        status_code = 207 # Multi-Status: some items were created, some were not
+    else:
+        status_code = 400 # Bad Request
+
+    return jsonify({
+        "message": f"Created {created_count} items",
+        "agents": {"created": created['agents'], "errors": errors['agents']},
+        "nodemaps": {"created": created['nodemaps'], "errors": errors['nodemaps']},
+        "created_count": created_count,
+        "error_count": error_count
+    }), status_code
+# --- End Define a route to create many Agents and Nodemaps ---
+
+
+# --- Define a route to export the user's workspace ---
+@creation_bp.route('/exportworkspace', methods=['GET'])
+@jwt_required() # Protect this route
+def export_workspace_route():
+    """
+    Downloads all of the user's agents and nodemaps (with their nodes and edges)
+    as newline-delimited JSON (see app/services/workspace_transfer.py).
+    The file is streamed while it is read from the database, so memory use does
+    not grow with the size of the workspace.
+    Query parameter: 'compress=gzip' for a gzip-compressed download.
+    Requires a valid JWT access token.
+    """
+    current_user_id = get_jwt_identity()
+    compress = request.args.get('compress')
+    if compress not in (None, 'gzip'):
+        return jsonify({"error": "'compress' must be 'gzip'"}), 400 # Bad Request
+
+    lines = export_workspace(current_user_id, current_app.config['EXPORT_BATCH_SIZE'])
+    filename = f"workspace-{datetime.utcnow():%Y%m%d-%H%M%S}.ndjson"
+    mimetype = 'application/x-ndjson'
+    if compress == 'gzip':
+        lines = gzip_lines(lines)
+        filename += '.gz'
+        mimetype = 'application/gzip'
+    logger.info(f"Exporting workspace for user ID: {current_user_id}", extra={'user_id': current_user_id})
+
+    # stream_with_context keeps the request (and its database session) open while the file is sent
+    return Response(stream_with_context(lines), mimetype=mimetype, headers={
+        'Content-Disposition': f'attachment; filename="{filename}"',
+        'Cache-Control': 'no-store',
+        'X-Accel-Buffering': 'no', # Ask proxies such as nginx not to buffer the download
+    })
+# --- End Define a route to export the user's workspace ---
+
+
+def _ndjson_line(record):
+    return json.dumps(record, separators=(',', ':')) + '\n'
+
+
+# --- Define a route to import a workspace file ---
+@creation_bp.route('/importworkspace', methods=['POST'])
+@jwt_required() # Protect this route with JWT authentication
+def import_workspace_route():
+    """
+    Imports a file made by /exportworkspace into the user's workspace.
+    The request body is the NDJSON file itself (send 'Content-Encoding: gzip' for
+    a compressed one). It is read line by line and committed every
+    IMPORT_BATCH_SIZE lines; imported agents and nodemaps get new ids, and names
+    that are already taken get a " (2)" suffix.
+    The response is NDJSON too: a {"type": "progress", ...} line at most every
+    IMPORT_PROGRESS_INTERVAL seconds, then {"type": "done", ...} with the counts and
+    the old -> new id maps, or {"type": "error", "line": n, ...} when a line could not
+    be imported (the batches committed before it are kept).
+    Requires a valid JWT access token.
+    """
+    current_user_id = get_jwt_identity()
+    config = current_app.config
+
+    content_encoding = request.headers.get('Content-Encoding', 'identity').lower()
+    if content_encoding == 'gzip':
+        stream = gzip.GzipFile(fileobj=request.stream, mode='rb')
+    elif content_encoding == 'identity':
+        stream = request.stream
+    else:
+        return jsonify({"error": f"Unsupported Content-Encoding: {content_encoding}"}), 415 # Unsupported Media Type
+
+    # --- Data Validation (the header line, before anything is imported) ---
+    lines = read_lines(stream, config['IMPORT_MAX_LINE_BYTES'])
+    try:
+        _, raw = next(lines, (0, b''))
+        parse_header(raw)
+    except (WorkspaceImportError, OSError, EOFError) as e: # OSError/EOFError: invalid gzip data
+        return jsonify({"error": str(e) or "Invalid workspace file"}), 400 # Bad Request
+    # --- End Data Validation ---
+
+    def import_progress():
+        importer = WorkspaceImporter(current_user_id, validate_agent_fields, validate_nodemap_fields,
+                                     config['IMPORT_BATCH_SIZE'])
+        line_number = 1
+        last_progress = time.monotonic()
+        try:
+            for line_number, raw in lines:
+                if not raw.strip():
+                    continue
+                try:
+                    record = json.loads(raw)
+                except ValueError:
+                    raise WorkspaceImportError("Invalid JSON")
+                committed = importer.feed(record)
+                # Progress is throttled: a client that uploads the whole file before reading
+                # the response never fills the socket buffers with unread progress lines
+                if committed and not importer.finished and time.monotonic() - last_progress >= config['IMPORT_PROGRESS_INTERVAL']:
+                    last_progress = time.monotonic()
+                    yield _ndjson_line(dict(importer.counts, type='progress', line=line_number))
+            if not importer.finished:
+                raise WorkspaceImportError("The file ended before its 'end' line (truncated upload?)")
+        except (WorkspaceImportError, OSError, EOFError) as e:
+            importer.abort()
+            logger.warning(f"Workspace import for user ID: {current_user_id} stopped at line {line_number}: {e}", extra={'user_id': current_user_id})
+            yield _ndjson_line(dict(importer.summary(), type='error', line=line_number, error=str(e) or "Invalid workspace file"))
+            return
+        except GeneratorExit: # The client went away
+            importer.abort()
+            raise
+        except Exception as e:
+            importer.abort()
+            logger.exception(f"Database error during workspace import for user ID {current_user_id} at line {line_number}: {e}")
+            yield _ndjson_line(dict(importer.summary(), type='error', line=line_number, error="An error occurred while importing the workspace"))
+            return
+
+        summary = importer.summary()
+        logger.info(f"Imported workspace for user ID: {current_user_id}: {summary['agents']} agents, "
+                    f"{summary['nodemaps']} nodemaps, {summary['nodes']} nodes, {summary['edges']} edges", extra={'user_id': current_user_id})
+        yield _ndjson_line(dict(summary, type='done'))
+
+    return Response(stream_with_context(import_progress()), mimetype='application/x-ndjson', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no', # Ask proxies such as nginx not to buffer the progress lines
+    })
+# --- End Define a route to import a workspace file ---
+
+
 # --- Define a route to save Node Map data ---
 @creation_bp.route('/savenodemap', methods=['POST'])
 @jwt_required() # Protect this route with JWT authentication
@@ -172,8 +537,15 @@ def save_nodemap_data():
     """
     Handles saving the nodes and edges data for a specific Nodemap.
     Requires a valid JWT access token.
-    Expects JSON data with 'nodemap_id', 'nodes', and 'edges'.
+    Supports two modes:
+    - Full save: JSON data with 'nodemap_id', 'nodes', and 'edges'.
+    - Patch save: JSON data with 'nodemap_id', 'base_version' and 'ops'
+      (JSON-Patch-style operations, see app/services/nodemap_patch.py).
+      If 'base_version' is stale the patch is rejected with 409, unless the
+      request also carries full 'nodes' and 'edges', in which case those are
+      saved instead.
     Ensures the nodemap belongs to the current user.
+    Returns the new version of the nodemap data.
     """
     current_user_id = get_jwt_identity()
     data = request.get_json(silent=True)
@@ -185,72 +557,406 @@ def save_nodemap_data():
     nodemap_id = data.get('nodemap_id')
     nodes = data.get('nodes')
     edges = data.get('edges')
+    ops = data.get('ops')
+    base_version = data.get('base_version')
 
     if nodemap_id is None:
         return jsonify({"error": "Nodemap ID is required"}), 400
-    if nodes is None or not isinstance(nodes, list):
-        return jsonify({"error": "'nodes' must be a list"}), 400
-    if edges is None or not isinstance(edges, list):
-        return jsonify({"error": "'edges' must be a list"}), 400
+    if ops is not None:
+        if not isinstance(ops, list):
+            return jsonify({"error": "'ops' must be a list"}), 400
+        if not isinstance(base_version, int) or isinstance(base_version, bool):
+            return jsonify({"error": "'base_version' is required when sending 'ops'"}), 400
+    has_full_data = isinstance(nodes, list) and isinstance(edges, list)
+    if ops is None:
+        if nodes is None or not isinstance(nodes, list):
+            return jsonify({"error": "'nodes' must be a list"}), 400
+        if edges is None or not isinstance(edges, list):
+            return jsonify({"error": "'edges' must be a list"}), 400
     # --- End Data Validation ---
 
     # --- Find the Nodemap and verify ownership ---
-    nodemap = Nodemap.query.filter_by(id=nodemap_id, user_id=current_user_id).first()
+    # The legacy JSON columns are read right away (to detect maps not yet moved to rows),
+    # so load them in the same query; they are NULL for every backfilled map
+    # The stored graph index is checked after the save, so it is loaded in the same query too
+    nodemap = Nodemap.query.options(
+        undefer_group('legacy_graph'), undefer_group('graph_index')
+    ).filter_by(id=nodemap_id, user_id=current_user_id).first()
 
     if not nodemap:
-        print(f"Attempted to save data for non-existent or unauthorized nodemap ID: {nodemap_id} by user ID: {current_user_id}")
+        logger.warning(f"Attempted to save data for non-existent or unauthorized nodemap ID: {nodemap_id} by user ID: {current_user_id}", extra={'user_id': current_user_id})
         return jsonify({"error": "Nodemap not found or you do not have permission to edit it"}), 404 # Not Found or Forbidden
     # --- End Find and Verify ---
 
     # --- Save the nodes and edges data ---
     try:
-        # Serialize the nodes and edges lists to JSON strings
-        nodemap.nodes_data = json.dumps(nodes)
-        nodemap.edges_data = json.dumps(edges)
+        # Claim the next version first (an atomic compare-and-set): a concurrent
+        # save of the same map waits for this one, then gets a 409 below
+        loaded_version = nodemap.version
+        if not claim_next_version(nodemap, loaded_version):
+            db.session.rollback()
+            current_version = db.session.query(Nodemap.version).filter_by(id=nodemap_id).scalar()
+            db.session.rollback()
+            logger.warning(f"Concurrent save of nodemap ID: {nodemap_id} (loaded {loaded_version}, current {current_version})")
+            return jsonify({
+                "error": "Nodemap was saved by another request at the same time; reload it and try again",
+                "version": current_version,
+                "full_save_required": ops is not None
+            }), 409 # Conflict
+
+        save_mode = 'full'
+        changes = {} # Elements written, for the version history
+        if ops is not None and base_version == loaded_version:
+            # Only the rows touched by the ops are read and written
+            rows_written = patch_nodemap_graph(nodemap, ops, changes)
+            save_mode = 'patch'
+        elif ops is not None and not has_full_data:
+            # The client's copy is out of date; it has to re-send the whole map
+            db.session.rollback() # Gives the claimed version back
+            logger.warning(f"Stale patch for nodemap ID: {nodemap_id} (base {base_version}, current {loaded_version})")
+            return jsonify({
+                "error": "Nodemap has changed since base_version; a full save is required",
+                "version": loaded_version,
+                "full_save_required": True
+            }), 409 # Conflict
+        else:
+            # Diffed against the stored rows, so unchanged nodes/edges are not rewritten
+            rows_written = save_nodemap_graph(nodemap, nodes, edges, changes)
+
+        # Adjacency, order, cycles etc. are computed once here instead of by every reader
+        refresh_graph_index(nodemap)
+        # Keep this version in the map's history (only the written elements are stored)
+        record_revision(nodemap, changes, 'patch' if save_mode == 'patch' else 'save')
 
         db.session.commit()
-        print(f"Successfully saved data for nodemap ID: {nodemap.id} for user ID: {current_user_id}")
-        return jsonify({"message": "Nodemap data saved successfully", "nodemap_id": nodemap.id}), 200 # OK
+        logger.info(f"Successfully saved data ({save_mode}, {rows_written} rows written) for nodemap ID: {nodemap.id} for user ID: {current_user_id}", extra={'user_id': current_user_id})
+        return jsonify({
+            "message": "Nodemap data saved successfully",
+            "nodemap_id": nodemap.id,
+            "version": nodemap.version,
+            "save_mode": save_mode
+        }), 200 # OK
+    except (NodemapPatchError, NodemapGraphError) as e:
+        db.session.rollback()
+        return jsonify({"error": f"Invalid nodemap data: {e}", "version": loaded_version}), 400 # Bad Request
+    except IntegrityError as e:
+        # A concurrent save got this version's history rows in first
+        db.session.rollback()
+        logger.warning(f"Integrity error during nodemap data save for ID {nodemap_id}: {e}", extra={'user_id': current_user_id})
+        return jsonify({
+            "error": "Nodemap was saved by another request at the same time; reload it and try again",
+            "full_save_required": True
+        }), 409 # Conflict
+    except json.JSONDecodeError:
+        db.session.rollback()
+        logger.error(f"JSON Decode Error for nodemap ID {nodemap_id}. Data might be corrupted.")
+        return jsonify({"error": "Invalid data format for this nodemap"}), 500 # Internal Server Error
     except Exception as e:
         db.session.rollback()
-        print(f"Database error during nodemap data save for ID {nodemap_id}: {e}")
+        logger.exception(f"Database error during nodemap data save for ID {nodemap_id}: {e}")
         return jsonify({"error": "An error occurred while saving nodemap data"}), 500 # Internal Server Error
     # --- End Save ---
 
+
+# --- Define a route to list a Node Map's saved versions ---
+@creation_bp.route('/getnodemaphistory/<int:nodemap_id>', methods=['GET'])
+@jwt_required() # Protect this route
+def get_nodemap_history(nodemap_id):
+    """
+    Returns the saved versions of a nodemap, newest first (see app/services/nodemap_history.py).
+    Optional query parameters: 'limit' (1-200, default 50) and 'before' (a version;
+    pass the last version of a page to get the next one).
+    Requires a valid JWT access token.
+    """
+    current_user_id = get_jwt_identity()
+    limit = request.args.get('limit', 50, type=int)
+    before = request.args.get('before', type=int)
+    if limit is None or not 1 <= limit <= 200:
+        return jsonify({"error": "'limit' must be an integer between 1 and 200"}), 400
+
+    nodemap = Nodemap.query.filter_by(id=nodemap_id, user_id=current_user_id).first()
+    if not nodemap:
+        return jsonify({"error": "Nodemap not found or you do not have permission to view it"}), 404 # Not Found or Forbidden
+
+    revisions = list_revisions(nodemap.id, limit=limit, before=before)
+    return jsonify({
+        "nodemap_id": nodemap.id,
+        "current_version": nodemap.version,
+        "versions": [revision_to_dict(revision) for revision in revisions],
+        "next_before": revisions[-1].version if len(revisions) == limit else None,
+    }), 200 # OK
+# --- End Get Nodemap History ---
+
+
+# --- Define a route to read a saved version of a Node Map ---
+@creation_bp.route('/getnodemapversion/<int:nodemap_id>/<int:version>', methods=['GET'])
+@jwt_required() # Protect this route
+def get_nodemap_version(nodemap_id, version):
+    """
+    Returns the nodes and edges of a saved version of a nodemap, in the same
+    shape as /getnodemapdata. A version never changes, so the response can be cached.
+    Requires a valid JWT access token.
+    """
+    current_user_id = get_jwt_identity()
+    nodemap = Nodemap.query.filter_by(id=nodemap_id, user_id=current_user_id).first()
+    if not nodemap:
+        return jsonify({"error": "Nodemap not found or you do not have permission to view it"}), 404 # Not Found or Forbidden
+
+    etag = make_etag('nodemap-version', nodemap.id, version)
+    if is_not_modified(etag):
+        return not_modified_response(etag)
+    try:
+        revision = get_revision(nodemap.id, version)
+        nodes_data, edges_data = revision_graph_json(nodemap.id, version)
+    except NodemapHistoryError as e:
+        return jsonify({"error": str(e)}), 404 # Not Found
+
+    return with_etag(spliced_json_response(current_app, dict(revision_to_dict(revision), id=nodemap.id), {
+        "nodes_data": nodes_data,
+        "edges_data": edges_data
+    }), etag), 200 # OK
+# --- End Get Nodemap Version ---
+
+
+# --- Define a route to compare two saved versions of a Node Map ---
+@creation_bp.route('/diffnodemapversions/<int:nodemap_id>', methods=['GET'])
+@jwt_required() # Protect this route
+def diff_nodemap_versions(nodemap_id):
+    """
+    Returns what changed between two saved versions of a nodemap: the nodes and
+    edges added, removed, changed (before and after) and moved.
+    Query parameters: 'from' (a version) and optionally 'to' (default: the current version).
+    Requires a valid JWT access token.
+    """
+    current_user_id = get_jwt_identity()
+    from_version = request.args.get('from', type=int)
+    to_version = request.args.get('to', type=int)
+    if from_version is None:
+        return jsonify({"error": "'from' must be a version number"}), 400
+
+    nodemap = Nodemap.query.filter_by(id=nodemap_id, user_id=current_user_id).first()
+    if not nodemap:
+        return jsonify({"error": "Nodemap not found or you do not have permission to view it"}), 404 # Not Found or Forbidden
+
+    try:
+        diff = diff_revisions(nodemap.id, from_version, nodemap.version if to_version is None else to_version)
+    except NodemapHistoryError as e:
+        return jsonify({"error": str(e)}), 404 # Not Found
+    return jsonify(dict(diff, nodemap_id=nodemap.id)), 200 # OK
+# --- End Diff Nodemap Versions ---
+
+
+# --- Define a route to restore a saved version of a Node Map ---
+@creation_bp.route('/restorenodemapversion', methods=['POST'])
+@jwt_required() # Protect this route with JWT authentication
+def restore_nodemap_version():
+    """
+    Brings back the nodes and edges of a saved version of a nodemap. Only the
+    elements that differ from the current map are written, and the restore is
+    saved as a new version (so it can be undone like any other save).
+    Expects JSON data with 'nodemap_id' and 'version'.
+    Requires a valid JWT access token.
+    """
+    current_user_id = get_jwt_identity()
+    data = request.get_json(silent=True)
+
+    # --- Data Validation ---
+    if not data:
+        return jsonify({"error": "Invalid input: No data provided or invalid JSON"}), 400
+
+    nodemap_id = data.get('nodemap_id')
+    version = data.get('version')
+
+    if nodemap_id is None:
+        return jsonify({"error": "Nodemap ID is required"}), 400
+    if not isinstance(version, int) or isinstance(version, bool):
+        return jsonify({"error": "'version' must be a version number"}), 400
+    # --- End Data Validation ---
+
+    # --- Find the Nodemap and verify ownership ---
+    nodemap = Nodemap.query.options(
+        undefer_group('legacy_graph'), undefer_group('graph_index')
+    ).filter_by(id=nodemap_id, user_id=current_user_id).first()
+
+    if not nodemap:
+        logger.warning(f"Attempted to restore non-existent or unauthorized nodemap ID: {nodemap_id} by user ID: {current_user_id}", extra={'user_id': current_user_id})
+        return jsonify({"error": "Nodemap not found or you do not have permission to edit it"}), 404 # Not Found or Forbidden
+    # --- End Find and Verify ---
+
+    try:
+        loaded_version = nodemap.version
+        if not claim_next_version(nodemap, loaded_version):
+            db.session.rollback()
+            return jsonify({"error": "Nodemap was saved by another request at the same time; try again"}), 409 # Conflict
+        changes = {}
+        rows_written = restore_revision(nodemap, version, changes, current_version=loaded_version)
+        refresh_graph_index(nodemap)
+        record_revision(nodemap, changes, 'restore', restored_from=version)
+        db.session.commit()
+        logger.info(f"Restored version {version} of nodemap ID: {nodemap.id} ({rows_written} rows written) for user ID: {current_user_id}", extra={'user_id': current_user_id})
+        return jsonify({
+            "message": f"Version {version} restored",
+            "nodemap_id": nodemap.id,
+            "version": nodemap.version,
+            "restored_from": version,
+            "rows_written": rows_written
+        }), 200 # OK
+    except NodemapHistoryError as e:
+        db.session.rollback()
+        return jsonify({"error": str(e)}), 404 # Not Found
+    except IntegrityError as e:
+        db.session.rollback()
+        logger.warning(f"Integrity error during restore of nodemap ID {nodemap_id}: {e}", extra={'user_id': current_user_id})
+        return jsonify({"error": "Nodemap was saved by another request at the same time; try again"}), 409 # Conflict
+    except Exception as e:
+        db.session.rollback()
+        logger.exception(f"Database error while restoring version {version} of nodemap ID {nodemap_id}: {e}")
+        return jsonify({"error": "An error occurred while restoring the nodemap version"}), 500 # Internal Server Error
+# --- End Restore Nodemap Version ---
+
+# --- Helpers for paginating the Node Map list ---
+# Fields that can be requested with ?fields= (nodes/edges are never part of the list)
+NODEMAP_LIST_FIELDS = ('id', 'name', 'goal', 'description', 'created_at', 'is_favorite', 'version')
+# Largest page a client may request with ?limit=
+NODEMAP_PAGE_MAX_LIMIT = 200
+
+# created_at given to maps that had none (migration a3d5e8f1c920)
+NODEMAP_UNKNOWN_CREATED_AT = datetime(1970, 1, 1)
+
+
+def _encode_nodemap_cursor(created_at, nodemap_id):
+    """
+    Encodes the position after a row as an opaque, URL-safe cursor string.
+    """
+    raw = json.dumps([created_at.isoformat(), nodemap_id])
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii')
+
+
+def _decode_nodemap_cursor(cursor):
+    """
+    Decodes a cursor created by _encode_nodemap_cursor(). Raises ValueError if it is invalid.
+    """
+    try:
+        created_at, nodemap_id = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        # Cursors issued before created_at was NOT NULL may hold null; those rows now have the epoch
+        created_at = NODEMAP_UNKNOWN_CREATED_AT if created_at is None else datetime.fromisoformat(created_at)
+        return created_at, int(nodemap_id)
+    except (TypeError, ValueError, binascii.Error) as e:
+        raise ValueError("Invalid cursor") from e
+# --- End Helpers ---
+
+
 # --- Define a route to get all Node Maps for the current user ---
 @creation_bp.route('/getnodemaps', methods=['GET'])
 @jwt_required() # Protect this route
 def get_nodemaps():
     """
-    Fetches all nodemaps for the current user.
+    Fetches the nodemaps for the current user, ordered by created_at then id.
     Requires a valid JWT access token.
     Includes the is_favorite status in the response.
+    Optional query parameters:
+    - limit:       page size (1-200). Without it, all nodemaps are returned as before.
+    - cursor:      the 'next_cursor' of the previous page (keyset pagination, so
+                   every page costs the same index range scan however deep it is).
+    - order:       'asc' (default, oldest first) or 'desc'.
+    - is_favorite: 'true' or 'false' to filter by favorite status.
+    - fields:      comma-separated subset of the returned fields, e.g. 'id,name'.
     """
     current_user_id = get_jwt_identity()
 
+    # --- Query Parameter Validation ---
+    limit = request.args.get('limit', type=int)
+    cursor = request.args.get('cursor')
+    order = request.args.get('order', 'asc')
+    is_favorite = request.args.get('is_favorite')
+    fields = request.args.get('fields')
+
+    if limit is None and 'limit' in request.args:
+        return jsonify({"error": "'limit' must be an integer"}), 400
+    if limit is not None and not 1 <= limit <= NODEMAP_PAGE_MAX_LIMIT:
+        return jsonify({"error": f"'limit' must be between 1 and {NODEMAP_PAGE_MAX_LIMIT}"}), 400
+    if order not in ('asc', 'desc'):
+        return jsonify({"error": "'order' must be 'asc' or 'desc'"}), 400
+    if is_favorite is not None and is_favorite not in ('true', 'false'):
+        return jsonify({"error": "'is_favorite' must be 'true' or 'false'"}), 400
+
+    if fields:
+        requested_fields = [field.strip() for field in fields.split(',') if field.strip()]
+        unknown_fields = [field for field in requested_fields if field not in NODEMAP_LIST_FIELDS]
+        if unknown_fields:
+            return jsonify({"error": f"Unknown fields: {', '.join(unknown_fields)}"}), 400
+    else:
+        requested_fields = ['id', 'name', 'goal', 'description', 'created_at', 'is_favorite']
+
+    cursor_position = None
+    if cursor:
+        try:
+            cursor_position = _decode_nodemap_cursor(cursor)
+        except ValueError:
+            return jsonify({"error": "Invalid cursor"}), 400
+    # --- End Query Parameter Validation ---
+
     try:
-        # Query all nodemaps belonging to the current user
-        user_nodemaps = Nodemap.query.filter_by(user_id=current_user_id).all()
+        # Only the requested columns are selected, plus the (created_at, id) sort key;
+        # the nodes/edges data is never loaded for the list.
+        selected_fields = list(dict.fromkeys(requested_fields + ['created_at', 'id']))
+        query = db.session.query(*[getattr(Nodemap, field) for field in selected_fields]).filter(
+            Nodemap.user_id == current_user_id
+        )
+        if is_favorite is not None:
+            query = query.filter(Nodemap.is_favorite == (is_favorite == 'true'))
+
+        # --- Keyset pagination on the (user_id, created_at, id) index ---
+        if cursor_position is not None:
+            cursor_created_at, cursor_id = cursor_position
+            if order == 'asc':
+                query = query.filter(or_(
+                    Nodemap.created_at > cursor_created_at,
+                    and_(Nodemap.created_at == cursor_created_at, Nodemap.id > cursor_id),
+                ))
+            else:
+                query = query.filter(or_(
+                    Nodemap.created_at < cursor_created_at,
+                    and_(Nodemap.created_at == cursor_created_at, Nodemap.id < cursor_id),
+                ))
+
+        if order == 'asc':
+            query = query.order_by(Nodemap.created_at.asc(), Nodemap.id.asc())
+        else:
+            query = query.order_by(Nodemap.created_at.desc(), Nodemap.id.desc())
+
+        if limit is not None:
+            query = query.limit(limit + 1) # One extra row tells us whether there is another page
+        rows = query.all()
+
+        has_more = limit is not None and len(rows) > limit
+        if has_more:
+            rows = rows[:limit]
+        # --- End Keyset pagination ---
 
         # Prepare a list of nodemap data to return
         nodemaps_list = []
-        for nodemap in user_nodemaps:
-            nodemaps_list.append({
-                "id": nodemap.id,
-                "name": nodemap.name,
-                "goal": nodemap.goal,
-                "description": nodemap.description,
-                "created_at": nodemap.created_at.isoformat() if nodemap.created_at else None,
-                "is_favorite": nodemap.is_favorite # Include the new field
-                # We are NOT including nodes_data and edges_data in this list endpoint
-                # to keep the response size small. Fetch individual map data separately.
-            })
-
-        print(f"Successfully fetched {len(nodemaps_list)} nodemaps for user ID: {current_user_id}")
-        return jsonify({"nodemaps": nodemaps_list}), 200 # OK
+        for row in rows:
+            nodemap_data = {}
+            for field in requested_fields:
+                value = getattr(row, field)
+                if field == 'created_at':
+                    value = value.isoformat() if value else None
+                nodemap_data[field] = value
+            nodemaps_list.append(nodemap_data)
+            # We are NOT including nodes_data and edges_data in this list endpoint
+            # to keep the response size small. Fetch individual map data separately.
+
+        response = {"nodemaps": nodemaps_list}
+        if limit is not None:
+            response["has_more"] = has_more
+            response["next_cursor"] = _encode_nodemap_cursor(rows[-1].created_at, rows[-1].id) if has_more else None
+
+        logger.info(f"Successfully fetched {len(nodemaps_list)} nodemaps for user ID: {current_user_id}", extra={'user_id': current_user_id})
+        return jsonify(response), 200 # OK
 
     except Exception as e:
-        print(f"Database error during nodemap fetch for user ID {current_user_id}: {e}")
+        logger.exception(f"Database error during nodemap fetch for user ID {current_user_id}: {e}", extra={'user_id': current_user_id})
         return jsonify({"error": "An error occurred while fetching nodemaps"}), 500 # Internal Server Error
 # --- End Define a route to get all Node Maps ---
 
@@ -286,24 +992,100 @@ def toggle_nodemap_favorite():
         nodemap = Nodemap.query.filter_by(id=nodemap_id, user_id=current_user_id).first()
 
         if not nodemap:
-            print(f"Attempted to toggle favorite for non-existent or unauthorized nodemap ID: {nodemap_id} by user ID: {current_user_id}")
+            logger.warning(f"Attempted to toggle favorite for non-existent or unauthorized nodemap ID: {nodemap_id} by user ID: {current_user_id}", extra={'user_id': current_user_id})
             return jsonify({"error": "Nodemap not found or you do not have permission to edit it"}), 404 # Not Found or Forbidden
 
         # Toggle the is_favorite status
         nodemap.is_favorite = not nodemap.is_favorite
 
         db.session.commit()
-        print(f"Successfully toggled favorite status for nodemap ID: {nodemap.id} to {nodemap.is_favorite} for user ID: {current_user_id}")
+        logger.info(f"Successfully toggled favorite status for nodemap ID: {nodemap.id} to {nodemap.is_favorite} for user ID: {current_user_id}", extra={'user_id': current_user_id})
 
         # Return the updated status and the nodemap ID
         return jsonify({"message": "Favorite status updated", "is_favorite": nodemap.is_favorite, "nodemap_id": nodemap.id}), 200 # OK
 
     except Exception as e:
         db.session.rollback()
-        print(f"Database error during favorite toggle for ID {nodemap_id}: {e}")
+        logger.exception(f"Database error during favorite toggle for ID {nodemap_id}: {e}")
         return jsonify({"error": "An error occurred while toggling favorite status"}), 500 # Internal Server Error
 # --- End Updated endpoint ---
 
+# --- Helper to build a single Node Map's data response ---
+def nodemap_etag(nodemap):
+    """
+    ETag of the /getnodemapdata response. 'version' changes with every nodes/edges
+    save, and the other parts cover the fields that can change without a save.
+    """
+    return make_etag('nodemap', nodemap.id, nodemap.version, nodemap.is_favorite,
+                     nodemap.name, nodemap.goal, nodemap.description)
+
+
+def nodemap_data_response(nodemap_id, current_user_id):
+    """
+    Returns the full data (including nodes and edges) for a single nodemap,
+    or a 304 (412 for the POST form) if the client's If-None-Match matches the current ETag.
+    Shared by the GET and POST forms of /getnodemapdata.
+    """
+    try:
+        # Find the nodemap by ID and user ID
+        # The legacy JSON columns are read right away (to detect maps not yet moved to rows),
+        # so load them in the same query; they are NULL for every backfilled map
+        nodemap = Nodemap.query.options(undefer_group('legacy_graph')).filter_by(id=nodemap_id, user_id=current_user_id).first()
+
+        if not nodemap:
+            logger.warning(f"Attempted to fetch data for non-existent or unauthorized nodemap ID: {nodemap_id} by user ID: {current_user_id}", extra={'user_id': current_user_id})
+            return jsonify({"error": "Nodemap not found or you do not have permission to view it"}), 404 # Not Found or Forbidden
+
+        # --- Conditional request check (before the graph is loaded or decoded) ---
+        etag = nodemap_etag(nodemap)
+        if is_not_modified(etag):
+            return not_modified_response(etag)
+        # --- End Conditional request check ---
+
+        # Return the nodemap data, including nodes_data and edges_data
+        # Rebuilt from the nodemap_node / nodemap_edge rows (or legacy JSON columns).
+        # The rows already hold each element as JSON, so they are copied into the
+        # response body as-is instead of being parsed and serialized again.
+        nodes_data, edges_data = load_nodemap_graph_json(nodemap)
+
+        return with_etag(spliced_json_response(current_app, {
+            "id": nodemap.id,
+            "name": nodemap.name,
+            "goal": nodemap.goal,
+            "description": nodemap.description,
+            "created_at": nodemap.created_at.isoformat() if nodemap.created_at else None,
+            "is_favorite": nodemap.is_favorite,
+            "version": nodemap.version, # Base version for patch-based saves
+        }, {
+            "nodes_data": nodes_data,
+            "edges_data": edges_data
+        }), etag), 200 # OK
+
+    except json.JSONDecodeError:
+        logger.error(f"JSON Decode Error for nodemap ID {nodemap_id}. Data might be corrupted.")
+        return jsonify({"error": "Invalid data format for this nodemap"}), 500 # Internal Server Error
+    except Exception as e:
+        db.session.rollback() # Rollback in case of database error during fetch (less likely but good practice)
+        logger.exception(f"Database error during single nodemap fetch for ID {nodemap_id}: {e}")
+        return jsonify({"error": "An error occurred while fetching nodemap data"}), 500 # Internal Server Error
+# --- End Helper ---
+
+
+# --- Endpoint to get a single Node Map's data by ID (cacheable GET form) ---
+@creation_bp.route('/getnodemapdata/<int:nodemap_id>', methods=['GET'])
+@jwt_required() # Protect this route
+def get_nodemap_data_by_id(nodemap_id):
+    """
+    Fetches the full data (including nodes and edges) for a single nodemap by ID.
+    Requires a valid JWT access token.
+    Ensures the nodemap belongs to the current user.
+    Responses carry a strong ETag; send it back in If-None-Match to get a
+    304 Not Modified when the map has not changed.
+    """
+    return nodemap_data_response(nodemap_id, get_jwt_identity())
+# --- End GET endpoint ---
+
+
 # --- New endpoint to get a single Node Map's data by ID (expects ID in body) ---
 @creation_bp.route('/getnodemapdata', methods=['POST']) # Changed to POST and removed URL parameter
 @jwt_required() # Protect this route
@@ -313,6 +1095,8 @@ def get_nodemap_data(): # Removed nodemap_id parameter from function signature
     Requires a valid JWT access token.
     Expects JSON data with 'id' for the nodemap ID in the request body.
     Ensures the nodemap belongs to the current user.
+    Kept for existing clients; prefer GET /getnodemapdata/<id>, which HTTP caches can revalidate.
+    A matching If-None-Match is answered with 412 Precondition Failed (304 is GET-only).
     """
     current_user_id = get_jwt_identity()
     data = request.get_json(silent=True) # Get JSON data from the request body
@@ -328,35 +1112,123 @@ def get_nodemap_data(): # Removed nodemap_id parameter from function signature
         return jsonify({"error": "Nodemap ID ('id') is required in the request body"}), 400
     # --- End Data Validation ---
 
-    try:
-        # Find the nodemap by ID and user ID using the ID from the request body
-        nodemap = Nodemap.query.filter_by(id=nodemap_id, user_id=current_user_id).first()
+    return nodemap_data_response(nodemap_id, current_user_id)
+# --- End New endpoint to get a single Node Map's data ---
+
+
+# --- Endpoint to get a Node Map's precomputed graph index ---
+# Fields of the index that are small enough to return for a single node
+NODE_INDEX_FIELDS = ('successors', 'predecessors')
+
 
+@creation_bp.route('/getnodemapindex/<int:nodemap_id>', methods=['GET'])
+@jwt_required() # Protect this route
+def get_nodemap_index(nodemap_id):
+    """
+    Returns the precomputed graph index of a nodemap: adjacency and reverse
+    adjacency, topological order and levels, cycle detection, entry/exit nodes,
+    connected components and whether the map is runnable.
+    With ?node=<node id>, only that node's successors and predecessors are returned.
+    The index is built when the map is saved, so no nodes or edges are loaded here.
+    Responses carry an ETag tied to the map's version.
+    """
+    current_user_id = get_jwt_identity()
+    node_id = request.args.get('node')
+
+    try:
+        # The legacy graph columns are NULL for every backfilled map, so loading them costs nothing
+        nodemap = Nodemap.query.options(
+            undefer_group('graph_index'), undefer_group('legacy_graph')
+        ).filter_by(id=nodemap_id, user_id=current_user_id).first()
         if not nodemap:
-            print(f"Attempted to fetch data for non-existent or unauthorized nodemap ID: {nodemap_id} by user ID: {current_user_id}")
             return jsonify({"error": "Nodemap not found or you do not have permission to view it"}), 404 # Not Found or Forbidden
 
-        # Return the nodemap data, including nodes_data and edges_data
-        # Parse JSON strings back to Python objects
-        nodes_data = json.loads(nodemap.nodes_data) if nodemap.nodes_data else []
-        edges_data = json.loads(nodemap.edges_data) if nodemap.edges_data else []
+        etag = make_etag('nodemap-index', nodemap.id, nodemap.version, node_id)
+        if is_not_modified(etag):
+            return not_modified_response(etag)
 
-        return jsonify({
-            "id": nodemap.id,
-            "name": nodemap.name,
-            "goal": nodemap.goal,
-            "description": nodemap.description,
-            "created_at": nodemap.created_at.isoformat() if nodemap.created_at else None,
-            "is_favorite": nodemap.is_favorite,
-            "nodes_data": nodes_data,
-            "edges_data": edges_data
-        }), 200 # OK
+        stale = nodemap.graph_index_version != nodemap.version
+        index = get_graph_index(nodemap)
+        if stale:
+            db.session.commit() # Maps saved before the index existed get theirs built and stored once
+
+        if node_id is not None:
+            if node_id not in index['successors']:
+                return jsonify({"error": f"Node '{node_id}' is not part of this nodemap"}), 404 # Not Found
+            return with_etag(jsonify({
+                "nodemap_id": nodemap.id,
+                "version": nodemap.version,
+                "node": node_id,
+                **{field: index[field][node_id] for field in NODE_INDEX_FIELDS},
+            }), etag), 200 # OK
+
+        return with_etag(jsonify({"nodemap_id": nodemap.id, "version": nodemap.version, **index}), etag), 200 # OK
 
     except json.JSONDecodeError:
-        print(f"JSON Decode Error for nodemap ID {nodemap_id}. Data might be corrupted.")
+        db.session.rollback()
+        logger.error(f"JSON Decode Error for nodemap ID {nodemap_id}. Data might be corrupted.")
         return jsonify({"error": "Invalid data format for this nodemap"}), 500 # Internal Server Error
     except Exception as e:
-        db.session.rollback() # Rollback in case of database error during fetch (less likely but good practice)
-        print(f"Database error during single nodemap fetch for ID {nodemap_id}: {e}")
-        return jsonify({"error": "An error occurred while fetching nodemap data"}), 500 # Internal Server Error
-# --- End New endpoint to get a single Node Map's data ---
+        db.session.rollback()
+        logger.exception(f"Database error during graph index fetch for ID {nodemap_id}: {e}")
+        return jsonify({"error": "An error occurred while fetching the nodemap index"}), 500 # Internal Server Error
+# --- End graph index endpoint ---
+
+
+# --- Endpoint to search the user's Node Maps and Agents ---
+# Largest page a client may request with ?limit=
+SEARCH_PAGE_MAX_LIMIT = 100
+SEARCH_TYPES = ('nodemap', 'agent')
+
+
+@creation_bp.route('/search', methods=['GET'])
+@jwt_required() # Protect this route
+def search():
+    """
+    Full-text search over the current user's nodemaps (name, goal, description)
+    and agents (name, system prompt). Every word of the query must match, as a
+    prefix; results are ranked with name matches first.
+    Query parameters:
+    - q:      the search text (required)
+    - type:   'nodemap' or 'agent' to search only one kind
+    - limit:  page size (1-100, default 20)
+    - offset: number of results to skip; use the 'next_offset' of the previous page
+    """
+    current_user_id = get_jwt_identity()
+
+    # --- Query Parameter Validation ---
+    query = request.args.get('q', '').strip()
+    result_type = request.args.get('type')
+    limit = request.args.get('limit', type=int)
+    offset = request.args.get('offset', type=int)
+
+    if (limit is None and 'limit' in request.args) or (offset is None and 'offset' in request.args):
+        return jsonify({"error": "'limit' and 'offset' must be integers"}), 400
+    limit = 20 if limit is None else limit
+    offset = 0 if offset is None else offset
+    if not query:
+        return jsonify({"error": "'q' is required"}), 400
+    if result_type is not None and result_type not in SEARCH_TYPES:
+        return jsonify({"error": "'type' must be 'nodemap' or 'agent'"}), 400
+    if not 1 <= limit <= SEARCH_PAGE_MAX_LIMIT:
+        return jsonify({"error": f"'limit' must be an integer between 1 and {SEARCH_PAGE_MAX_LIMIT}"}), 400
+    if offset < 0:
+        return jsonify({"error": "'offset' must be a non-negative integer"}), 400
+    # --- End Query Parameter Validation ---
+
+    try:
+        # One extra row tells whether there is a next page
+        results = search_documents(
+            int(current_user_id), query, kinds=(result_type,) if result_type else SEARCH_TYPES,
+            limit=limit + 1, offset=offset,
+        )
+        has_more = len(results) > limit
+        return jsonify({
+            "results": results[:limit],
+            "next_offset": offset + limit if has_more else None
+        }), 200 # OK
+    except Exception as e:
+        db.session.rollback()
+        logger.exception(f"Database error during search for user ID {current_user_id}: {e}")
+        return jsonify({"error": "An error occurred while searching"}), 500 # Internal Server Error
+# --- End search endpoint ---
@@ -0,0 +1,450 @@
+import logging
+from flask import Blueprint, request, jsonify, current_app, Response
+# Import jwt_required and get_jwt_identity for route protection
+from flask_jwt_extended import jwt_required, get_jwt_identity
+import time
+from sqlalchemy.orm import undefer_group
+
+from app import db
+from app.models import User, Nodemap, Agent, RunJob, RunRecord # Import the User, Nodemap, Agent, RunJob and RunRecord models
+from app.services.nodemap_executor import run_nodemap, NodemapExecutionError
+from app.services.job_queue import enqueue_run, job_to_dict, request_cancel, JobQueueFull
+from app.services.run_history import record_run, list_runs, run_record_to_dict, run_details
+from app.services.model_providers import get_provider
+from app.services.model_scheduler import get_model_scheduler, ModelSchedulerTimeout, PRIORITY_INTERACTIVE
+from app.services.response_cache import get_response_cache, response_cache_key
+from app.services.streaming import stream_sse_events
+from app.services.tokens import agent_input_fitter, agent_prompt_tokens, count_tokens, context_window, encoding_for, ContextBudgetExceeded
+
+# Create a Blueprint for routes that run nodemaps and agents
+execution_bp = Blueprint('execution', __name__)
+
+# Module logger; records go through the app's structured, queued logging (app/services/logging_setup.py)
+logger = logging.getLogger(__name__)
+
+
+# --- Define a route to run a Node Map ---
+@execution_bp.route('/runnodemap', methods=['POST'])
+@jwt_required() # Protect this route with JWT authentication
+def run_nodemap_route():
+    """
+    Executes a nodemap: every node runs its agent on the outputs of the nodes
+    connected to it, independent branches in parallel.
+    Requires a valid JWT access token.
+    Expects JSON data with 'nodemap_id' and 'input' (the text given to the entry nodes).
+    Optional 'max_concurrency' limits how many agents run at the same time.
+    Returns each node's output and timing, plus the critical path, and the
+    'run_id' under which the run was recorded in the run history.
+    """
+    current_user_id = get_jwt_identity()
+    data = request.get_json(silent=True)
+
+    # --- Data Validation ---
+    if not data:
+        return jsonify({"error": "Invalid input: No data provided or invalid JSON"}), 400
+
+    nodemap_id = data.get('nodemap_id')
+    initial_input = data.get('input', '')
+    default_concurrency = current_app.config['NODEMAP_MAX_CONCURRENCY']
+    max_concurrency = data.get('max_concurrency', default_concurrency)
+
+    if nodemap_id is None:
+        return jsonify({"error": "Nodemap ID is required"}), 400
+    if not isinstance(initial_input, str):
+        return jsonify({"error": "'input' must be a string"}), 400
+    if not isinstance(max_concurrency, int) or max_concurrency < 1:
+        return jsonify({"error": "'max_concurrency' must be a positive integer"}), 400
+    # Never allow more than the configured limit
+    max_concurrency = min(max_concurrency, default_concurrency)
+    # --- End Data Validation ---
+
+    # --- Find the Nodemap and verify ownership ---
+    # The stored graph index is read first (to reject maps that cannot run), so load it in the same query
+    nodemap = Nodemap.query.options(undefer_group('graph_index')).filter_by(id=nodemap_id, user_id=current_user_id).first()
+
+    if not nodemap:
+        logger.warning(f"Attempted to run non-existent or unauthorized nodemap ID: {nodemap_id} by user ID: {current_user_id}", extra={'user_id': current_user_id})
+        return jsonify({"error": "Nodemap not found or you do not have permission to run it"}), 404 # Not Found or Forbidden
+    # --- End Find and Verify ---
+
+    # --- Run the Nodemap ---
+    node_inputs = {}
+    try:
+        result = run_nodemap(nodemap, initial_input, max_concurrency=max_concurrency, node_inputs=node_inputs)
+    except NodemapExecutionError as e:
+        return jsonify({"error": str(e)}), 400 # Bad Request
+    except Exception as e:
+        logger.exception(f"Error while running nodemap ID {nodemap_id}: {e}")
+        return jsonify({"error": "An error occurred while running the nodemap"}), 500 # Internal Server Error
+
+    # --- Record the run ---
+    # A failure here is logged but does not fail the request: the run itself succeeded
+    if current_app.config['RUN_HISTORY_ENABLED']:
+        try:
+            result['run_id'] = record_run(nodemap, initial_input, result, node_inputs)
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            logger.exception(f"Error while recording the run of nodemap ID {nodemap_id}: {e}")
+    # --- End Record the run ---
+
+    logger.info(f"Ran nodemap ID: {nodemap.id} ({result['status']}) in {result['wall_time']:.3f}s for user ID: {current_user_id}", extra={'user_id': current_user_id})
+    return jsonify(dict(result, nodemap_id=nodemap.id)), 200 # OK
+    # --- End Run ---
+
+
+# --- Define a route to run a Node Map in the background ---
+@execution_bp.route('/enqueuerun', methods=['POST'])
+@jwt_required() # Protect this route with JWT authentication
+def enqueue_run_route():
+    """
+    Queues a run of a nodemap for the background workers ('flask run-workers')
+    and returns immediately with the job; poll /execution/getrunjob/<id> for its status.
+    Requires a valid JWT access token.
+    Expects the same JSON data as /execution/runnodemap ('nodemap_id', 'input',
+    optional 'max_concurrency').
+    """
+    current_user_id = get_jwt_identity()
+    data = request.get_json(silent=True)
+
+    # --- Data Validation ---
+    if not data:
+        return jsonify({"error": "Invalid input: No data provided or invalid JSON"}), 400
+
+    nodemap_id = data.get('nodemap_id')
+    initial_input = data.get('input', '')
+    default_concurrency = current_app.config['NODEMAP_MAX_CONCURRENCY']
+    max_concurrency = data.get('max_concurrency', default_concurrency)
+
+    if nodemap_id is None:
+        return jsonify({"error": "Nodemap ID is required"}), 400
+    if not isinstance(initial_input, str):
+        return jsonify({"error": "'input' must be a string"}), 400
+    if not isinstance(max_concurrency, int) or max_concurrency < 1:
+        return jsonify({"error": "'max_concurrency' must be a positive integer"}), 400
+    max_concurrency = min(max_concurrency, default_concurrency)
+    # --- End Data Validation ---
+
+    # --- Find the Nodemap and verify ownership ---
+    nodemap = Nodemap.query.filter_by(id=nodemap_id, user_id=current_user_id).first()
+
+    if not nodemap:
+        logger.warning(f"Attempted to queue a run of non-existent or unauthorized nodemap ID: {nodemap_id} by user ID: {current_user_id}", extra={'user_id': current_user_id})
+        return jsonify({"error": "Nodemap not found or you do not have permission to run it"}), 404 # Not Found or Forbidden
+    # --- End Find and Verify ---
+
+    try:
+        job = enqueue_run(nodemap, initial_input, max_concurrency)
+        db.session.commit()
+    except JobQueueFull as e:
+        db.session.rollback()
+        return jsonify({"error": str(e)}), 429 # Too Many Requests
+    except Exception as e:
+        db.session.rollback()
+        logger.exception(f"Error while queueing a run of nodemap ID {nodemap_id}: {e}")
+        return jsonify({"error": "An error occurred while queueing the run"}), 500 # Internal Server Error
+
+    logger.info(f"Queued job ID: {job.id} for nodemap ID: {nodemap.id} for user ID: {current_user_id}", extra={'user_id': current_user_id})
+    return jsonify(job_to_dict(job, include_result=False)), 202 # Accepted
+# --- End Enqueue Run ---
+
+
+# --- Define a route to poll a background run ---
+@execution_bp.route('/getrunjob/<int:job_id>', methods=['GET'])
+@jwt_required() # Protect this route
+def get_run_job(job_id):
+    """
+    Returns a background run's status, per-node progress and, once it has
+    finished, its result (the same result /execution/runnodemap returns).
+    Requires a valid JWT access token.
+    """
+    current_user_id = get_jwt_identity()
+    job = RunJob.query.filter_by(id=job_id, user_id=current_user_id).first()
+    if not job:
+        return jsonify({"error": "Job not found or you do not have permission to view it"}), 404 # Not Found or Forbidden
+    return jsonify(job_to_dict(job)), 200 # OK
+# --- End Get Run Job ---
+
+
+# --- Define a route to list a Node Map's background runs ---
+@execution_bp.route('/getrunjobs/<int:nodemap_id>', methods=['GET'])
+@jwt_required() # Protect this route
+def get_run_jobs(nodemap_id):
+    """
+    Returns the most recent background runs of a nodemap, newest first (without results).
+    Optional query parameter 'limit' (1-100, default 20).
+    Requires a valid JWT access token.
+    """
+    current_user_id = get_jwt_identity()
+    limit = request.args.get('limit', 20, type=int)
+    if limit is None or not 1 <= limit <= 100:
+        return jsonify({"error": "'limit' must be an integer between 1 and 100"}), 400
+
+    jobs = RunJob.query.filter_by(nodemap_id=nodemap_id, user_id=current_user_id) \
+        .order_by(RunJob.id.desc()).limit(limit).all()
+    return jsonify({"jobs": [job_to_dict(job, include_result=False) for job in jobs]}), 200 # OK
+# --- End Get Run Jobs ---
+
+
+# --- Define a route to cancel a background run ---
+@execution_bp.route('/cancelrunjob/<int:job_id>', methods=['POST'])
+@jwt_required() # Protect this route
+def cancel_run_job(job_id):
+    """
+    Cancels a background run. A queued run is cancelled at once; a running one
+    stops within JOB_HEARTBEAT_INTERVAL seconds (its status becomes 'cancelled').
+    Requires a valid JWT access token.
+    """
+    current_user_id = get_jwt_identity()
+    job = RunJob.query.filter_by(id=job_id, user_id=current_user_id).first()
+    if not job:
+        return jsonify({"error": "Job not found or you do not have permission to cancel it"}), 404 # Not Found or Forbidden
+
+    if not request_cancel(job):
+        return jsonify({"error": f"Job has already finished ({job.status})", "job": job_to_dict(job, include_result=False)}), 409 # Conflict
+
+    logger.info(f"Cancellation requested for job ID: {job.id} by user ID: {current_user_id}", extra={'user_id': current_user_id})
+    return jsonify(job_to_dict(job, include_result=False)), 200 # OK
+# --- End Cancel Run Job ---
+
+
+# --- Define a route to list a Node Map's recorded runs ---
+@execution_bp.route('/getruns/<int:nodemap_id>', methods=['GET'])
+@jwt_required() # Protect this route
+def get_runs(nodemap_id):
+    """
+    Returns the recorded runs of a nodemap, newest first (totals only).
+    Optional query parameters: 'limit' (1-200, default 50) and 'before' (a run_id;
+    pass the last run_id of a page to get the next one).
+    Requires a valid JWT access token.
+    """
+    current_user_id = get_jwt_identity()
+    limit = request.args.get('limit', 50, type=int)
+    before = request.args.get('before', type=int)
+    if limit is None or not 1 <= limit <= 200:
+        return jsonify({"error": "'limit' must be an integer between 1 and 200"}), 400
+
+    nodemap = Nodemap.query.filter_by(id=nodemap_id, user_id=current_user_id).first()
+    if not nodemap:
+        return jsonify({"error": "Nodemap not found or you do not have permission to view it"}), 404 # Not Found or Forbidden
+
+    runs = list_runs(nodemap.id, limit=limit, before=before)
+    return jsonify({
+        "runs": [run_record_to_dict(run) for run in runs],
+        "next_before": runs[-1].id if len(runs) == limit else None,
+    }), 200 # OK
+# --- End Get Runs ---
+
+
+# --- Define a route to read one recorded run ---
+@execution_bp.route('/getrun/<int:run_id>', methods=['GET'])
+@jwt_required() # Protect this route
+def get_run(run_id):
+    """
+    Returns a recorded run with its events: every node's status, timings, token
+    counts, input and output. Compacted (older) runs return a 'summary' without
+    inputs and outputs instead. '?payloads=false' leaves out inputs and outputs.
+    Requires a valid JWT access token.
+    """
+    current_user_id = get_jwt_identity()
+    record = RunRecord.query.filter_by(id=run_id, user_id=current_user_id).first()
+    if not record:
+        return jsonify({"error": "Run not found or you do not have permission to view it"}), 404 # Not Found or Forbidden
+
+    include_payloads = request.args.get('payloads', 'true').lower() != 'false'
+    return jsonify(run_details(record, include_payloads=include_payloads)), 200 # OK
+# --- End Get Run ---
+
+
+# --- Define a route to stream an Agent's output ---
+@execution_bp.route('/streamagent', methods=['POST'])
+@jwt_required() # Protect this route with JWT authentication
+def stream_agent():
+    """
+    Runs a single agent and streams its output as Server-Sent Events.
+    Requires a valid JWT access token.
+    Expects JSON data with 'agent_id' and 'input'.
+    Emits:
+    - 'token' events ({"token": "..."}) as the model produces them,
+    - a final 'done' event with the full text, token count, time to first token, total time,
+      whether the response came from the response cache and whether the input was truncated,
+    - an 'error' event if the model call fails (or the model stays at its rate limit too long).
+    Heartbeat comments are sent while the model is silent.
+    An input that does not fit the agent's context budget is truncated, or
+    rejected with 400 when CONTEXT_OVERFLOW_POLICY is 'reject'.
+    """
+    request_started = time.perf_counter()
+    current_user_id = get_jwt_identity()
+    data = request.get_json(silent=True)
+
+    # --- Data Validation ---
+    if not data:
+        return jsonify({"error": "Invalid input: No data provided or invalid JSON"}), 400
+
+    agent_id = data.get('agent_id')
+    prompt = data.get('input')
+
+    if agent_id is None:
+        return jsonify({"error": "Agent ID is required"}), 400
+    if not isinstance(prompt, str) or not prompt:
+        return jsonify({"error": "'input' must be a non-empty string"}), 400
+    # --- End Data Validation ---
+
+    # --- Find the Agent and verify ownership ---
+    agent = Agent.query.filter_by(id=agent_id, user_id=current_user_id).first()
+
+    if not agent:
+        logger.warning(f"Attempted to stream non-existent or unauthorized agent ID: {agent_id} by user ID: {current_user_id}", extra={'user_id': current_user_id})
+        return jsonify({"error": "Agent not found or you do not have permission to use it"}), 404 # Not Found or Forbidden
+    # --- End Find and Verify ---
+
+    # --- Context budget check, before the provider is called ---
+    try:
+        prompt, input_truncated = agent_input_fitter()(agent, prompt)
+    except ContextBudgetExceeded as e:
+        return jsonify({"error": str(e)}), 400 # Bad Request
+    # --- End Context budget check ---
+
+    # Copy what the stream needs, so it never touches the database session
+    model = agent.model
+    system_prompt = agent.system_prompt
+    shared = agent.cache_responses is not False # Agents that opt out of caching also opt out of sharing a call
+    provider = get_provider(model)
+
+    # A cached response is sent as a single token without calling the provider
+    cache = get_response_cache() if agent.cache_responses else None
+    cache_key = response_cache_key(model, system_prompt, prompt) if cache is not None else None
+    cached_text = cache.get(cache_key) if cache is not None else None
+    scheduler = get_model_scheduler()
+    prompt_tokens = agent_prompt_tokens(agent) + count_tokens(model, prompt) if scheduler is not None else 0
+
+    async def agent_events():
+        tokens = []
+        first_token_at = None
+        if cached_text is not None:
+            first_token_at = time.perf_counter()
+            tokens.append(cached_text)
+            yield 'token', {"token": cached_text}
+        else:
+            # Someone is waiting for this answer: rate-limited models serve it ahead of background runs
+            grant = None
+            if scheduler is not None:
+                try:
+                    grant = await scheduler.acquire(model, current_user_id, PRIORITY_INTERACTIVE, prompt_tokens)
+                except ModelSchedulerTimeout as e:
+                    yield 'error', {"error": str(e)}
+                    return
+            try:
+                async for token in provider.stream(model, system_prompt, prompt, shared=shared):
+                    if first_token_at is None:
+                        first_token_at = time.perf_counter()
+                    tokens.append(token)
+                    yield 'token', {"token": token}
+            finally:
+                if grant is not None:
+                    grant.release(count_tokens(model, ''.join(tokens)))
+            if cache is not None:
+                cache.set(cache_key, ''.join(tokens)) # Only complete responses are cached
+
+        finished_at = time.perf_counter()
+        time_to_first_token = (first_token_at - request_started) if first_token_at else None
+        logger.info(f"Streamed agent ID: {agent_id} for user ID: {current_user_id}: "
+                    f"{len(tokens)} tokens, time to first token {time_to_first_token}", extra={'user_id': current_user_id})
+        yield 'done', {
+            "agent_id": agent_id,
+            "text": ''.join(tokens),
+            "token_count": len(tokens),
+            "time_to_first_token": round(time_to_first_token, 6) if time_to_first_token is not None else None,
+            "total_time": round(finished_at - request_started, 6),
+            "cached": cached_text is not None,
+            "input_truncated": input_truncated,
+        }
+
+    events = stream_sse_events(
+        agent_events,
+        heartbeat_interval=current_app.config['SSE_HEARTBEAT_INTERVAL'],
+        max_buffered=current_app.config['SSE_MAX_BUFFERED_EVENTS'],
+        user_id=current_user_id,
+    )
+    return Response(events, mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no', # Ask proxies such as nginx not to buffer the stream
+    })
+# --- End Stream Agent ---
+
+
+# --- Define a route to count tokens ---
+@execution_bp.route('/counttokens', methods=['POST'])
+@jwt_required() # Protect this route with JWT authentication
+def count_tokens_route():
+    """
+    Counts the tokens of a text for a model, e.g. to show how much of an agent's
+    context window an input uses before running it.
+    Requires a valid JWT access token.
+    Expects JSON data with 'model' and 'text'.
+    """
+    data = request.get_json(silent=True)
+
+    # --- Data Validation ---
+    if not data:
+        return jsonify({"error": "Invalid input: No data provided or invalid JSON"}), 400
+
+    model = data.get('model')
+    text = data.get('text')
+
+    if not isinstance(model, str) or not model:
+        return jsonify({"error": "'model' must be a non-empty string"}), 400
+    if not isinstance(text, str):
+        return jsonify({"error": "'text' must be a string"}), 400
+    # --- End Data Validation ---
+
+    return jsonify({
+        "model": model,
+        "tokens": count_tokens(model, text),
+        "context_window": context_window(model),
+        "encoding": encoding_for(model).name,
+    }), 200 # OK
+# --- End Count Tokens ---
+
+
+def _is_admin(user_id):
+    # Process-wide statistics cover every user's calls, so only ADMIN_USERNAMES may read them
+    admin_usernames = current_app.config['ADMIN_USERNAMES']
+    if not admin_usernames:
+        return False
+    return db.session.query(User.username).filter_by(id=user_id).scalar() in admin_usernames
+
+
+# --- Define a route to read the response cache statistics ---
+@execution_bp.route('/cachestats', methods=['GET'])
+@jwt_required() # Protect this route
+def cache_stats():
+    """
+    Returns the agent response cache's hit/miss counters and size.
+    Requires a valid JWT access token of a user listed in ADMIN_USERNAMES.
+    """
+    if not _is_admin(get_jwt_identity()):
+        return jsonify({"error": "Only administrators can read the cache statistics"}), 403 # Forbidden
+    cache = get_response_cache()
+    if cache is None:
+        return jsonify({"enabled": False}), 200 # OK
+    return jsonify(dict(cache.stats(), enabled=True)), 200 # OK
+# --- End Cache Stats ---
+
+
+# --- Define a route to read the model scheduler statistics ---
+@execution_bp.route('/schedulerstats', methods=['GET'])
+@jwt_required() # Protect this route
+def scheduler_stats():
+    """
+    Returns the rate limits of the models and, per model and priority, the calls
+    waiting for a slot and how long recent calls waited.
+    Requires a valid JWT access token of a user listed in ADMIN_USERNAMES.
+    """
+    if not _is_admin(get_jwt_identity()):
+        return jsonify({"error": "Only administrators can read the scheduler statistics"}), 403 # Forbidden
+    scheduler = get_model_scheduler()
+    if scheduler is None:
+        return jsonify({"enabled": False}), 200 # OK
+    return jsonify(dict(scheduler.stats(), enabled=True)), 200 # OK
+# --- End Scheduler Stats ---
@@ -0,0 +1,429 @@
+# Real-time collaborative editing of Nodemaps.
+# Editors of the same map connect to the WebSocket /collab/nodemap/<id>
+# (app/routes/collab_routes.py) and exchange the patch operations of
+# app/services/nodemap_patch.py:
+# - a map open in at least one editor has a CollabRoom that holds its graph in
+#   memory; ops are validated against it and sent at once to every editor,
+#   including the sender, with a sequence number. Ops set absolute values, so
+#   editors that apply them in sequence order end up with the same map.
+# - the database is not written per op: the room remembers which nodes and edges
+#   changed, and a background thread persists them every COLLAB_PERSIST_INTERVAL
+#   seconds (and when the last editor leaves) as one patch with a single
+#   'add' or 'remove' per changed element. A burst of drag events costs one row write.
+# Rooms live in the process that serves the WebSocket, so all editors of a map
+# must reach the same process (e.g. route /collab by nodemap id). Saves made
+# elsewhere (/creation/savenodemap, another process) are noticed through the
+# nodemap's version; the room then reloads the map and re-sends it to its editors.
+import atexit
+import copy
+import json
+import logging
+import queue
+import threading
+import time
+import uuid
+
+from sqlalchemy.orm import undefer_group
+
+from app import db
+from app.models import Nodemap
+from app.services.metrics import registry
+from app.services.nodemap_patch import COLLECTIONS, patch_targets, apply_nodemap_patch
+from app.services.nodemap_graph import load_nodemap_graph, save_nodemap_graph, patch_nodemap_graph, claim_next_version
+from app.services.graph_index import refresh_graph_index
+from app.services.nodemap_history import record_revision
+
+logger = logging.getLogger(__name__)
+
+COLLAB_OPS = registry.counter(
+    'collab_ops_total', 'Patch operations received from collaborative editors.')
+COLLAB_ROWS_WRITTEN = registry.counter(
+    'collab_rows_written_total', 'Node/edge rows written when persisting collaborative edits.')
+COLLAB_PERSISTS = registry.counter(
+    'collab_persists_total', 'Collaborative editing saves, by outcome.', ('outcome',))
+
+# How often the background thread looks for rooms to persist (seconds)
+PERSIST_TICK = 0.25
+
+
+def _dumps(message):
+    return json.dumps(message, separators=(',', ':'))
+
+
+def _pointer(collection_name, element_id):
+    # JSON Pointer escaping, the inverse of nodemap_patch._parse_path
+    return f"/{collection_name}/{str(element_id).replace('~', '~0').replace('/', '~1')}"
+
+
+def _element_of(path):
+    # (collection name, element id) of a whole-element path built by _pointer()
+    collection_name, element_id = path[1:].split('/', 1)
+    return collection_name, element_id.replace('~1', '/').replace('~0', '~')
+
+
+class CollabClient:
+    """
+    One connected editor. Messages are queued and sent by run_sender() on the
+    connection's own thread, so a slow editor never holds up the others; an
+    editor whose queue fills up is disconnected.
+    """
+
+    def __init__(self, send, max_queued):
+        self.client_id = uuid.uuid4().hex[:12]
+        self._send = send
+        self._queue = queue.Queue(max_queued)
+        self.closed = threading.Event()
+
+    def post(self, message):
+        """
+        Queues a serialized message. Returns False if the editor is gone or too slow.
+        """
+        if self.closed.is_set():
+            return False
+        try:
+            self._queue.put_nowait(message)
+            return True
+        except queue.Full:
+            logger.warning(f"Collaborative editor {self.client_id} is not keeping up; disconnecting it")
+            self.closed.set()
+            return False
+
+    def run_sender(self):
+        try:
+            while not self.closed.is_set():
+                try:
+                    message = self._queue.get(timeout=1)
+                except queue.Empty:
+                    continue
+                self._send(message)
+        except Exception: # The connection is closed
+            pass
+        finally:
+            self.closed.set()
+
+
+class CollabRoom:
+    """
+    The editors of one nodemap and the in-memory copy of its graph.
+    """
+
+    def __init__(self, nodemap_id, nodes, edges, version):
+        self.nodemap_id = nodemap_id
+        self.lock = threading.Lock() # Guards the graph, the clients and the sequence
+        self.persist_lock = threading.Lock() # One save at a time
+        self.clients = {}
+        self.seq = 0
+        self._load(nodes, edges, version)
+
+    def _load(self, nodes, edges, version):
+        self.collections = {
+            'nodes': {str(node['id']): node for node in nodes if isinstance(node, dict) and 'id' in node},
+            'edges': {str(edge['id']): edge for edge in edges if isinstance(edge, dict) and 'id' in edge},
+        }
+        self.persisted = {name: set(elements) for name, elements in self.collections.items()}
+        self.dirty = {name: {} for name in COLLECTIONS} # Changed since the last save (dicts as ordered sets)
+        self.dirty_since = None
+        self.version = version
+        self.version_checked_at = time.monotonic()
+
+    def snapshot_message(self):
+        return _dumps({
+            'type': 'snapshot',
+            'nodemap_id': self.nodemap_id,
+            'nodes': list(self.collections['nodes'].values()),
+            'edges': list(self.collections['edges'].values()),
+            'version': self.version,
+            'seq': self.seq,
+            'editors': len(self.clients),
+        })
+
+    def broadcast(self, message, exclude=None):
+        for client in list(self.clients.values()):
+            if client is not exclude:
+                client.post(message)
+
+    def apply(self, client, ops, client_seq=None):
+        """
+        Validates and applies an editor's ops, then sends them to every editor.
+        Raises NodemapPatchError (nothing is applied) if the ops are invalid.
+        """
+        targets = patch_targets(ops)
+        with self.lock:
+            # Ops are applied to copies of the elements they touch, so an invalid op leaves the room unchanged
+            work = {
+                name: {element_id: copy.deepcopy(self.collections[name][element_id])
+                       for element_id in element_ids if element_id in self.collections[name]}
+                for name, element_ids in targets.items()
+            }
+            apply_nodemap_patch(work, ops)
+            for name, element_ids in targets.items():
+                for element_id in element_ids:
+                    if element_id in work[name]:
+                        self.collections[name][element_id] = work[name][element_id]
+                    else:
+                        self.collections[name].pop(element_id, None)
+                    self.dirty[name][element_id] = None
+            if self.dirty_since is None:
+                self.dirty_since = time.monotonic()
+            self.seq += 1
+            # Sent while holding the lock, so every editor receives ops in sequence order
+            self.broadcast(_dumps({'type': 'ops', 'seq': self.seq, 'client_id': client.client_id,
+                                   'client_seq': client_seq, 'ops': ops}))
+        COLLAB_OPS.inc(amount=len(ops))
+
+    def take_changes(self):
+        """
+        Returns (ops, taken, base_version): one op per element changed since the
+        last save, and the changed ids (to restore if the save fails). Call with the lock held.
+        """
+        ops = []
+        for name in COLLECTIONS:
+            for element_id in self.dirty[name]:
+                element = self.collections[name].get(element_id)
+                if element is not None:
+                    ops.append({'op': 'add', 'path': _pointer(name, element_id), 'value': element})
+                elif element_id in self.persisted[name]:
+                    ops.append({'op': 'remove', 'path': _pointer(name, element_id)})
+        taken = self.dirty
+        self.dirty = {name: {} for name in COLLECTIONS}
+        self.dirty_since = None
+        return ops, taken, self.version
+
+    def restore_changes(self, taken):
+        # A failed save: the elements are saved with the next one
+        for name in COLLECTIONS:
+            self.dirty[name] = dict(taken[name], **self.dirty[name])
+        if self.dirty_since is None:
+            self.dirty_since = time.monotonic()
+
+
+class CollabHub:
+    """
+    The rooms of this process and the thread that persists them.
+    """
+
+    def __init__(self):
+        self.rooms = {}
+        self.lock = threading.Lock()
+        self.app = None
+        self._thread = None
+        self.persist_interval = 2.0
+        self.max_editors = 20
+        self.client_queue = 256
+
+    def configure(self, app):
+        self.app = app
+        self.persist_interval = app.config['COLLAB_PERSIST_INTERVAL']
+        self.max_editors = app.config['COLLAB_MAX_EDITORS']
+        self.client_queue = app.config['COLLAB_CLIENT_QUEUE']
+
+    # --- Editors joining and leaving ---
+    def join(self, nodemap, send):
+        """
+        Adds an editor of 'nodemap' (loaded by the caller, ownership checked).
+        'send(text)' sends a message on its connection. Returns (room, client);
+        the editor is first sent a snapshot of the map.
+        Raises ValueError if the room is full.
+        """
+        with self.lock:
+            room = self.rooms.get(nodemap.id)
+            if room is None:
+                nodes, edges = load_nodemap_graph(nodemap)
+                room = self.rooms[nodemap.id] = CollabRoom(nodemap.id, nodes, edges, nodemap.version)
+            self._start_thread()
+            # Still under the hub's lock, so the last editor leaving cannot close the room meanwhile
+            with room.lock:
+                if len(room.clients) >= self.max_editors:
+                    raise ValueError(f"This nodemap already has {self.max_editors} editors")
+                client = CollabClient(send, self.client_queue)
+                room.clients[client.client_id] = client
+                client.post(room.snapshot_message())
+                room.broadcast(_dumps({'type': 'presence', 'editors': len(room.clients)}), exclude=client)
+        return room, client
+
+    def leave(self, room, client):
+        """
+        Removes an editor. The last editor to leave saves the room's changes and closes it.
+        """
+        client.closed.set()
+        with room.lock:
+            room.clients.pop(client.client_id, None)
+            room.broadcast(_dumps({'type': 'presence', 'editors': len(room.clients)}))
+            if room.clients:
+                return
+        self.persist(room)
+        with self.lock, room.lock:
+            if not room.clients and room.dirty_since is None and self.rooms.get(room.nodemap_id) is room:
+                del self.rooms[room.nodemap_id]
+    # --- End Editors joining and leaving ---
+
+    # --- Persisting ---
+    def persist(self, room):
+        """
+        Saves the room's changes (one patch, one version bump). Safe to call from any thread.
+        """
+        with room.persist_lock:
+            with room.lock:
+                ops, taken, base_version = room.take_changes()
+            if not ops:
+                return
+            with self.app.app_context():
+                try:
+                    if self._save(room, ops, base_version):
+                        COLLAB_PERSISTS.inc(('saved',))
+                    else:
+                        # Another save claimed the version first; the next attempt merges on top of it
+                        COLLAB_PERSISTS.inc(('conflict',))
+                        with room.lock:
+                            room.restore_changes(taken)
+                except Exception as e:
+                    db.session.rollback()
+                    COLLAB_PERSISTS.inc(('failed',))
+                    logger.exception(f"Error while saving collaborative edits of nodemap ID {room.nodemap_id}: {e}")
+                    with room.lock:
+                        room.restore_changes(taken)
+
+    def _save(self, room, ops, base_version):
+        nodemap = Nodemap.query.options(
+            undefer_group('legacy_graph'), undefer_group('graph_index')
+        ).filter_by(id=room.nodemap_id).first()
+        if nodemap is None:
+            self._close_room(room, "The nodemap was deleted")
+            return True
+
+        # The version is claimed first (compare-and-set), so a save made elsewhere
+        # between the read above and this write is never overwritten
+        loaded_version = nodemap.version
+        if not claim_next_version(nodemap, loaded_version):
+            db.session.rollback()
+            logger.info(f"Concurrent save of nodemap ID {room.nodemap_id}; collaborative edits are saved with the next attempt")
+            return False
+
+        changes = {} # Elements written, for the version history
+        if loaded_version == base_version:
+            # Only the rows of the changed elements are read and written
+            rows_written = patch_nodemap_graph(nodemap, ops, changes)
+            merged = None
+        else:
+            # Saved elsewhere since the room loaded it: apply the room's changes
+            # on top of the stored map, then send the result to the editors
+            nodes, edges = load_nodemap_graph(nodemap)
+            merged = {
+                'nodes': {str(node['id']): node for node in nodes},
+                'edges': {str(edge['id']): edge for edge in edges},
+            }
+            for op in ops:
+                name, element_id = _element_of(op['path'])
+                if op['op'] == 'add':
+                    merged[name][element_id] = op['value']
+                else:
+                    merged[name].pop(element_id, None)
+            rows_written = save_nodemap_graph(nodemap, list(merged['nodes'].values()), list(merged['edges'].values()), changes)
+
+        refresh_graph_index(nodemap)
+        record_revision(nodemap, changes, 'collab') # Version history
+        db.session.commit()
+        COLLAB_ROWS_WRITTEN.inc(amount=rows_written)
+        logger.info(f"Saved collaborative edits of nodemap ID {room.nodemap_id}: {len(ops)} elements, "
+                    f"{rows_written} rows written, version {nodemap.version}")
+
+        with room.lock:
+            if merged is None:
+                for op in ops:
+                    name, element_id = _element_of(op['path'])
+                    if op['op'] == 'add':
+                        room.persisted[name].add(element_id)
+                    else:
+                        room.persisted[name].discard(element_id)
+                room.version = nodemap.version
+                room.broadcast(_dumps({'type': 'saved', 'version': room.version, 'seq': room.seq}))
+            else:
+                self._reload_room(room, merged['nodes'].values(), merged['edges'].values(), nodemap.version)
+        return True
+
+    def _reload_room(self, room, nodes, edges, version):
+        # With the room's lock held: keep the changes made since the last save on top of the stored map
+        pending = {name: {element_id: room.collections[name].get(element_id) for element_id in room.dirty[name]}
+                   for name in COLLECTIONS}
+        dirty, dirty_since = room.dirty, room.dirty_since
+        room._load(list(nodes), list(edges), version)
+        for name in COLLECTIONS:
+            for element_id, element in pending[name].items():
+                if element is None:
+                    room.collections[name].pop(element_id, None)
+                else:
+                    room.collections[name][element_id] = element
+        room.dirty, room.dirty_since = dirty, dirty_since
+        room.seq += 1
+        room.broadcast(room.snapshot_message())
+
+    def _check_version(self, room):
+        # Picks up saves made outside the room while its editors are idle
+        with self.app.app_context():
+            try:
+                version = db.session.query(Nodemap.version).filter_by(id=room.nodemap_id).scalar()
+                if version is None:
+                    self._close_room(room, "The nodemap was deleted")
+                elif version != room.version:
+                    nodemap = Nodemap.query.options(undefer_group('legacy_graph')).filter_by(id=room.nodemap_id).first()
+                    nodes, edges = load_nodemap_graph(nodemap)
+                    with room.persist_lock, room.lock:
+                        self._reload_room(room, nodes, edges, nodemap.version)
+                db.session.commit()
+            except Exception as e:
+                db.session.rollback()
+                logger.exception(f"Error while checking the version of nodemap ID {room.nodemap_id}: {e}")
+
+    def _close_room(self, room, reason):
+        with self.lock, room.lock:
+            room.broadcast(_dumps({'type': 'closed', 'reason': reason}))
+            for client in room.clients.values():
+                client.closed.set()
+            room.clients.clear()
+            room.dirty = {name: {} for name in COLLECTIONS}
+            room.dirty_since = None
+            if self.rooms.get(room.nodemap_id) is room:
+                del self.rooms[room.nodemap_id]
+
+    def persist_all(self):
+        for room in list(self.rooms.values()):
+            self.persist(room)
+
+    def _start_thread(self):
+        # Started by the first editor, so CLI commands and job workers never run it
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='collab-persist', daemon=True)
+            self._thread.start()
+            atexit.register(self.persist_all) # Edits made in the last interval are not lost on shutdown
+
+    def _run(self):
+        while True:
+            time.sleep(PERSIST_TICK)
+            now = time.monotonic()
+            for room in list(self.rooms.values()):
+                try:
+                    if room.dirty_since is not None and now - room.dirty_since >= self.persist_interval:
+                        self.persist(room)
+                        room.version_checked_at = now
+                    elif room.dirty_since is None and now - room.version_checked_at >= self.persist_interval:
+                        room.version_checked_at = now
+                        self._check_version(room)
+                except Exception as e:
+                    logger.exception(f"Collaborative editing error for nodemap ID {room.nodemap_id}: {e}")
+    # --- End Persisting ---
+
+
+# One hub per process
+collab_hub = CollabHub()
+
+
+def init_collab(app):
+    """
+    Applies the collaborative editing settings of the app.
+    """
+    collab_hub.configure(app)
+    # Options of the WebSocket server (flask-sock); keepalive pings and the largest accepted message
+    app.config.setdefault('SOCK_SERVER_OPTIONS', {
+        'ping_interval': app.config['COLLAB_PING_INTERVAL'],
+        'max_message_size': app.config['COLLAB_MAX_MESSAGE_BYTES'],
+    })
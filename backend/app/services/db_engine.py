@@ -0,0 +1,109 @@
+# Database engine profiles.
+# The engine options and per-connection settings depend on the database:
+# - SQLite: WAL journaling (readers never wait for the writer, and a commit only
+#   appends to the log), synchronous=NORMAL (no fsync on every commit in WAL mode),
+#   a memory-mapped read path and a busy timeout, so concurrent autosaves wait
+#   for the write lock instead of failing with "database is locked".
+# - Server databases (PostgreSQL, MySQL, ...): a sized connection pool with
+#   pre-ping and recycling.
+# In both cases the time spent waiting for a pooled connection is recorded as
+# the db_pool_checkout_wait_seconds metric.
+# DB_ENGINE_PROFILE=none keeps Flask-SQLAlchemy's defaults.
+import time
+
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+from sqlalchemy.pool import QueuePool
+
+from app.services.metrics import registry
+
+POOL_CHECKOUT_WAIT = registry.histogram(
+    'db_pool_checkout_wait_seconds', 'Time spent waiting for a connection from the database pool.',
+    buckets=(0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 30.0))
+POOL_CHECKOUT_TIMEOUTS = registry.counter(
+    'db_pool_checkout_timeouts_total', 'Requests that gave up waiting for a pooled connection.')
+
+
+class TimedQueuePool(QueuePool):
+    """
+    QueuePool that records how long each checkout waited for a free connection.
+    """
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        except Exception:
+            POOL_CHECKOUT_TIMEOUTS.inc()
+            raise
+        finally:
+            POOL_CHECKOUT_WAIT.observe(time.perf_counter() - started)
+
+
+def _is_sqlite_memory(url):
+    return url.database in (None, '', ':memory:') or url.query.get('mode') == 'memory'
+
+
+def engine_options(config):
+    """
+    Returns SQLALCHEMY_ENGINE_OPTIONS for the configured database and profile.
+    Options already present in the config take precedence.
+    """
+    options = dict(config.get('SQLALCHEMY_ENGINE_OPTIONS') or {})
+    if config['DB_ENGINE_PROFILE'] == 'none':
+        return options
+
+    url = make_url(config['SQLALCHEMY_DATABASE_URI'])
+    if url.get_backend_name() == 'sqlite':
+        if _is_sqlite_memory(url):
+            return options # In-memory databases keep SQLAlchemy's single-connection pool
+        profile = {
+            'poolclass': TimedQueuePool,
+            'pool_size': config['DB_POOL_SIZE'],
+            'max_overflow': config['DB_MAX_OVERFLOW'],
+            'pool_timeout': config['DB_POOL_TIMEOUT'],
+        }
+    else:
+        profile = {
+            'poolclass': TimedQueuePool,
+            'pool_size': config['DB_POOL_SIZE'],
+            'max_overflow': config['DB_MAX_OVERFLOW'],
+            'pool_timeout': config['DB_POOL_TIMEOUT'],
+            'pool_recycle': config['DB_POOL_RECYCLE'],
+            'pool_pre_ping': config['DB_POOL_PRE_PING'],
+        }
+    profile.update(options)
+    return profile
+
+
+def _sqlite_pragmas(config):
+    return (
+        f"PRAGMA journal_mode={config['SQLITE_JOURNAL_MODE']}",
+        f"PRAGMA synchronous={config['SQLITE_SYNCHRONOUS']}",
+        f"PRAGMA mmap_size={int(config['SQLITE_MMAP_SIZE'])}",
+        f"PRAGMA busy_timeout={int(config['SQLITE_BUSY_TIMEOUT_MS'])}",
+    )
+
+
+def install_engine_profile(app, db):
+    """
+    Applies the per-connection settings of the profile to the app's engine
+    (call after db.init_app). Every new SQLite connection runs the PRAGMAs.
+    """
+    if app.config['DB_ENGINE_PROFILE'] == 'none':
+        return
+    with app.app_context():
+        engine = db.engine
+    if engine.url.get_backend_name() != 'sqlite' or _is_sqlite_memory(engine.url):
+        return
+
+    pragmas = _sqlite_pragmas(app.config)
+
+    @event.listens_for(engine, 'connect')
+    def _apply_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for pragma in pragmas:
+                cursor.execute(pragma)
+        finally:
+            cursor.close()
@@ -0,0 +1,229 @@
+# Compressed storage for the JSON of nodemap nodes and edges.
+# Every stored value starts with a header byte naming its encoding:
+#     0x00  raw UTF-8 JSON
+#     0x01  zlib, with the preset dictionary below
+#     0x02  zstd, with the same dictionary (needs the optional 'zstandard' package)
+# Values that start with anything else are JSON written before compression
+# existed (they start with '{' or '['), so old rows keep reading as-is.
+#
+# Elements are stored one per row and are small (a few hundred bytes), which
+# on its own compresses poorly. The preset dictionary holds the keys and values
+# React Flow repeats in every element, so even a single node compresses well.
+import threading
+import zlib
+
+import click
+from sqlalchemy.types import TypeDecorator, LargeBinary
+
+from app.services.metrics import registry
+
+try:
+    import zstandard
+except ImportError: # Optional dependency
+    zstandard = None
+
+ENCODING_RAW = 0x00
+ENCODING_ZLIB = 0x01
+ENCODING_ZSTD = 0x02
+ENCODING_NAMES = {ENCODING_RAW: 'raw', ENCODING_ZLIB: 'zlib', ENCODING_ZSTD: 'zstd'}
+
+# Version 1 of the preset dictionary. Never change it: stored rows need the exact
+# bytes to decompress. A different dictionary needs a new header byte.
+GRAPH_DICTIONARY_V1 = (
+    b'"sourceHandle":null,"targetHandle":null,"type":"smoothstep","animated":false,'
+    b'"markerEnd":{"type":"arrowclosed"},"style":{"stroke":"#'
+    b'"selected":false,"dragging":false,"deletable":true,"draggable":true,"connectable":true,'
+    b'"positionAbsolute":{"x":'
+    b'"data":{"agentId":'
+    b'"agentModel":"gpt-4o","agentName":"Agent ","agentType":"text","label":"Agent ",'
+    b'"model":"gpt-4o-mini","model":"gemini-pro","notes":"'
+    b',"height":84,"id":"dndnode_'
+    b',"position":{"x":'
+    b',"y":'
+    b'},"selected":false,"type":"aiAgent","width":200}'
+    b'},"selected":false,"type":"AIAgentNode","width":200}'
+    b'{"id":"reactflow__edge-dndnode_'
+    # Elements are serialized with sorted keys, so these sequences repeat verbatim
+    b'{"data":{"agentId":'
+    b',"agentName":"Agent '
+    b'"},"dragging":false,"height":84,"id":"dndnode_'
+    b'{"animated":false,"id":"reactflow__edge-dndnode_'
+    b'-dndnode_'
+    b'","source":"dndnode_'
+    b'","target":"dndnode_'
+    b'","type":"smoothstep"}'
+)
+
+RAW_BYTES = registry.counter(
+    'nodemap_graph_raw_bytes_total', 'Uncompressed JSON bytes of nodemap nodes/edges written.')
+STORED_BYTES = registry.counter(
+    'nodemap_graph_stored_bytes_total', 'Bytes actually stored for nodemap nodes/edges written, by encoding.',
+    ('encoding',))
+
+# --- Codec settings (set by create_app) ---
+_settings = {
+    'algorithm': 'zlib', # 'zlib', 'zstd' or 'none'
+    'level': 6,
+    'min_size': 64, # Shorter values are stored raw
+}
+# zstd compressor/decompressor objects must not be used by several threads at once
+# (requests, the collab persist thread, job workers), so each thread makes its own.
+# A new configuration bumps the generation, which replaces them on their next use.
+_zstd_local = threading.local()
+_zstd_generation = 0
+
+
+def configure_graph_codec(algorithm='zlib', level=6, min_size=64):
+    global _zstd_generation
+    if algorithm not in ('zlib', 'zstd', 'none'):
+        raise ValueError(f"Unknown graph compression {algorithm!r} (expected zlib, zstd or none)")
+    if algorithm == 'zstd' and zstandard is None:
+        raise ValueError("NODEMAP_COMPRESSION=zstd needs the 'zstandard' package")
+    _settings.update(algorithm=algorithm, level=level, min_size=min_size)
+    _zstd_generation += 1
+
+
+def _zstd_dictionary():
+    return zstandard.ZstdCompressionDict(GRAPH_DICTIONARY_V1, dict_type=zstandard.DICT_TYPE_RAWCONTENT)
+
+
+def _zstd_codecs():
+    """
+    This thread's {'compressor', 'decompressor'} (each created on first use).
+    """
+    if getattr(_zstd_local, 'generation', None) != _zstd_generation:
+        _zstd_local.generation = _zstd_generation
+        _zstd_local.codecs = {}
+    return _zstd_local.codecs
+
+
+def _zstd_compress(data):
+    codecs = _zstd_codecs()
+    if 'compressor' not in codecs:
+        codecs['compressor'] = zstandard.ZstdCompressor(level=_settings['level'], dict_data=_zstd_dictionary())
+    return codecs['compressor'].compress(data)
+
+
+def _zstd_decompress(data):
+    if zstandard is None:
+        raise ValueError("Stored nodemap data is zstd-compressed but the 'zstandard' package is not installed")
+    codecs = _zstd_codecs()
+    if 'decompressor' not in codecs:
+        codecs['decompressor'] = zstandard.ZstdDecompressor(dict_data=_zstd_dictionary())
+    return codecs['decompressor'].decompress(data)
+# --- End Codec settings ---
+
+
+def encode_graph_text(text):
+    """
+    Encodes a JSON string for storage: header byte + (compressed) UTF-8 bytes.
+    Compression is skipped when it would not make the value smaller.
+    """
+    raw = text.encode('utf-8')
+    encoded = bytes((ENCODING_RAW,)) + raw
+    algorithm = _settings['algorithm']
+    if algorithm != 'none' and len(raw) >= _settings['min_size']:
+        if algorithm == 'zstd':
+            candidate = bytes((ENCODING_ZSTD,)) + _zstd_compress(raw)
+        else:
+            compressor = zlib.compressobj(_settings['level'], zlib.DEFLATED, -15, zdict=GRAPH_DICTIONARY_V1)
+            candidate = bytes((ENCODING_ZLIB,)) + compressor.compress(raw) + compressor.flush()
+        if len(candidate) < len(encoded):
+            encoded = candidate
+
+    RAW_BYTES.inc(amount=len(raw))
+    STORED_BYTES.inc((ENCODING_NAMES[encoded[0]],), len(encoded))
+    return encoded
+
+
+def decode_graph_bytes(value):
+    """
+    Returns the JSON string of a stored value (any encoding, or legacy text).
+    """
+    if value is None or isinstance(value, str):
+        return value # Legacy rows stored as text
+    value = bytes(value) # memoryview from some drivers
+    if not value:
+        return ''
+    header = value[0]
+    if header == ENCODING_RAW:
+        return value[1:].decode('utf-8')
+    if header == ENCODING_ZLIB:
+        decompressor = zlib.decompressobj(-15, zdict=GRAPH_DICTIONARY_V1)
+        return (decompressor.decompress(value[1:]) + decompressor.flush()).decode('utf-8')
+    if header == ENCODING_ZSTD:
+        return _zstd_decompress(value[1:]).decode('utf-8')
+    return value.decode('utf-8') # Legacy JSON bytes (e.g. converted from a text column)
+
+
+def is_encoded(value):
+    """
+    True when a stored value already carries a header byte.
+    """
+    return isinstance(value, (bytes, bytearray, memoryview)) and len(value) > 0 and bytes(value[:1])[0] in ENCODING_NAMES
+
+
+class CompressedJSONText(TypeDecorator):
+    """
+    Column type for JSON strings stored compressed. Python code reads and writes
+    plain strings; the database holds header + compressed bytes.
+    """
+    impl = LargeBinary
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        return encode_graph_text(value)
+
+    def result_processor(self, dialect, coltype):
+        # Replaces LargeBinary's processor, which would reject legacy text values
+        return decode_graph_bytes
+
+
+class _StoredValue(TypeDecorator):
+    """
+    Reads a CompressedJSONText column exactly as stored (for statistics).
+    """
+    impl = LargeBinary
+    cache_ok = True
+
+    def result_processor(self, dialect, coltype):
+        return None
+
+
+# --- Storage statistics ---
+def graph_storage_stats(db):
+    """
+    Scans the stored nodes and edges and returns their stored and raw sizes,
+    the compression ratio and the number of rows per encoding.
+    """
+    from app.models import NodemapNode, NodemapEdge
+
+    stats = {}
+    for name, model in (('nodes', NodemapNode), ('edges', NodemapEdge)):
+        table_stats = {'rows': 0, 'stored_bytes': 0, 'raw_bytes': 0, 'encodings': {}}
+        query = db.select(db.type_coerce(model.__table__.c.data, _StoredValue)).execution_options(yield_per=1000)
+        for (value,) in db.session.execute(query):
+            value = value.encode('utf-8') if isinstance(value, str) else bytes(value)
+            encoding = ENCODING_NAMES[value[0]] if value and value[0] in ENCODING_NAMES else 'legacy'
+            table_stats['rows'] += 1
+            table_stats['stored_bytes'] += len(value)
+            table_stats['raw_bytes'] += len(decode_graph_bytes(value).encode('utf-8'))
+            table_stats['encodings'][encoding] = table_stats['encodings'].get(encoding, 0) + 1
+        table_stats['ratio'] = round(table_stats['raw_bytes'] / table_stats['stored_bytes'], 2) if table_stats['stored_bytes'] else None
+        stats[name] = table_stats
+    return stats
+
+
+def register_graph_codec_commands(app, db):
+    @app.cli.command('graph-storage-stats')
+    def graph_storage_stats_command():
+        """Show how much space nodemap nodes and edges take, and their compression ratio."""
+        for name, table_stats in graph_storage_stats(db).items():
+            click.echo(
+                f"{name}: {table_stats['rows']} rows, {table_stats['stored_bytes']} bytes stored, "
+                f"{table_stats['raw_bytes']} bytes raw, ratio {table_stats['ratio']}x, "
+                f"encodings {table_stats['encodings']}"
+            )
+# --- End Storage statistics ---
@@ -0,0 +1,222 @@
+# Precomputed index of a Nodemap's graph structure.
+# The index is built from the indexed columns of the nodemap_node / nodemap_edge
+# rows (node ids, edge source/target), so the element JSON is never parsed.
+# It is rebuilt when the map is saved and stored on the Nodemap together with
+# the version it was built for; an index whose version differs from the map's
+# is stale and is rebuilt on the next read.
+import json
+
+
+def build_graph_index(node_ids, edge_pairs, nodes_without_agent=()):
+    """
+    Computes the structure of a directed graph.
+    node_ids are in their saved order; edge_pairs are (source, target) tuples.
+    Edges that reference unknown nodes are ignored, duplicate edges count once.
+
+    Returns a JSON-serializable dict with:
+        'node_count', 'edge_count'
+        'successors' / 'predecessors': {node_id: [node ids]}; predecessors are in
+                                       topological order when the graph has no cycle
+        'order':      node ids in topological order (None if there is a cycle)
+        'levels':     lists of node ids that can run at the same time (None if there is a cycle)
+        'has_cycle', 'cycle_nodes': whether there is a cycle, and the nodes on or behind it
+        'entry_nodes' / 'exit_nodes': nodes without predecessors / successors
+        'components': weakly connected components, each in saved order
+        'nodes_without_agent': nodes that do not reference an agent
+        'runnable':   True when the map has nodes, no cycle, and every node has an agent
+    """
+    node_ids = [str(node_id) for node_id in node_ids]
+    known = set(node_ids)
+
+    predecessors = {node_id: [] for node_id in node_ids}
+    successors = {node_id: [] for node_id in node_ids}
+    seen_edges = set()
+    for source, target in edge_pairs:
+        source, target = str(source), str(target)
+        if source in known and target in known and (source, target) not in seen_edges:
+            seen_edges.add((source, target))
+            predecessors[target].append(source)
+            successors[source].append(target)
+
+    # --- Kahn's algorithm, level by level ---
+    in_degree = {node_id: len(predecessors[node_id]) for node_id in node_ids}
+    current_level = [node_id for node_id in node_ids if in_degree[node_id] == 0]
+    order = []
+    levels = []
+    while current_level:
+        levels.append(current_level)
+        order.extend(current_level)
+        next_level = []
+        for node_id in current_level:
+            for successor in successors[node_id]:
+                in_degree[successor] -= 1
+                if in_degree[successor] == 0:
+                    next_level.append(successor)
+        current_level = next_level
+    # --- End Kahn's algorithm ---
+
+    has_cycle = len(order) != len(node_ids)
+    cycle_nodes = sorted(node_id for node_id in node_ids if in_degree[node_id] > 0)
+    if not has_cycle:
+        position = {node_id: index for index, node_id in enumerate(order)}
+        for node_id in node_ids:
+            predecessors[node_id].sort(key=position.get)
+
+    # --- Weakly connected components (union-find) ---
+    parent = {node_id: node_id for node_id in node_ids}
+
+    def find(node_id):
+        while parent[node_id] != node_id:
+            parent[node_id] = parent[parent[node_id]]
+            node_id = parent[node_id]
+        return node_id
+
+    for source, target in seen_edges:
+        parent[find(source)] = find(target)
+    components = {}
+    for node_id in node_ids:
+        components.setdefault(find(node_id), []).append(node_id)
+    # --- End components ---
+
+    nodes_without_agent = [str(node_id) for node_id in nodes_without_agent if str(node_id) in known]
+    return {
+        'node_count': len(node_ids),
+        'edge_count': len(seen_edges),
+        'successors': successors,
+        'predecessors': predecessors,
+        'order': None if has_cycle else order,
+        'levels': None if has_cycle else levels,
+        'has_cycle': has_cycle,
+        'cycle_nodes': cycle_nodes,
+        'entry_nodes': [node_id for node_id in node_ids if not predecessors[node_id]],
+        'exit_nodes': [node_id for node_id in node_ids if not successors[node_id]],
+        'components': list(components.values()),
+        'nodes_without_agent': nodes_without_agent,
+        'runnable': bool(node_ids) and not has_cycle and not nodes_without_agent,
+    }
+
+
+def _graph_structure(nodemap):
+    """
+    Returns (node_ids, edge_pairs, nodes_without_agent) for a nodemap,
+    read from the indexed columns only.
+    """
+    # Imported here so build_graph_index() stays usable without the app (e.g. by the executor)
+    from app import db
+    from app.models import NodemapNode, NodemapEdge
+    from app.services.nodemap_graph import is_normalized, load_nodemap_graph, agent_id_of
+
+    if not is_normalized(nodemap):
+        nodes, edges = load_nodemap_graph(nodemap)
+        nodes = [node for node in nodes if isinstance(node, dict) and node.get('id') is not None]
+        return (
+            [node['id'] for node in nodes],
+            [(edge.get('source'), edge.get('target')) for edge in edges if isinstance(edge, dict)],
+            [node['id'] for node in nodes if agent_id_of(node) is None],
+        )
+
+    node_rows = db.session.execute(
+        db.select(NodemapNode.node_id, NodemapNode.agent_id).filter(NodemapNode.nodemap_id == nodemap.id)
+        .order_by(NodemapNode.sort_index, NodemapNode.id)
+    ).all()
+    edge_pairs = db.session.execute(
+        db.select(NodemapEdge.source, NodemapEdge.target).filter(NodemapEdge.nodemap_id == nodemap.id)
+        .order_by(NodemapEdge.sort_index, NodemapEdge.id)
+    ).all()
+    return (
+        [node_id for node_id, _ in node_rows],
+        [tuple(pair) for pair in edge_pairs],
+        [node_id for node_id, agent_id in node_rows if agent_id is None],
+    )
+
+
+def _store_graph_index(nodemap):
+    from app import db
+
+    db.session.flush() # The index is read from the rows, including pending ones
+    index = build_graph_index(*_graph_structure(nodemap))
+    nodemap.graph_index = json.dumps(index, separators=(',', ':'))
+    nodemap.graph_index_version = nodemap.version
+    return index
+
+
+# Row columns the index is built from; changes to anything else (the element JSON) keep it valid
+_STRUCTURE_COLUMNS = ('node_id', 'edge_id', 'agent_id', 'source', 'target', 'sort_index')
+
+
+def _structure_changes(session):
+    """
+    Ids of the nodemaps with pending graph rows that could change their index:
+    added or removed nodes/edges, or changes to the columns it is built from.
+    """
+    from sqlalchemy import inspect
+    from app.models import NodemapNode, NodemapEdge
+
+    graph_models = (NodemapNode, NodemapEdge)
+    nodemap_ids = {row.nodemap_id for row in list(session.new) + list(session.deleted) if isinstance(row, graph_models)}
+    for row in session.dirty:
+        if isinstance(row, graph_models):
+            attributes = inspect(row).attrs
+            if any(attributes[column].history.has_changes() for column in _STRUCTURE_COLUMNS if column in attributes):
+                nodemap_ids.add(row.nodemap_id)
+    return nodemap_ids
+
+
+# --- Structure changes already flushed in the current transaction ---
+# A save's own queries autoflush its rows, after which they are no longer pending;
+# what they changed is remembered here until the transaction ends.
+_FLUSHED_CHANGES_KEY = 'graph_structure_changes'
+
+
+def _remember_structure_changes(session, flush_context, instances):
+    changes = _structure_changes(session)
+    if changes:
+        session.info.setdefault(_FLUSHED_CHANGES_KEY, set()).update(changes)
+
+
+def _forget_structure_changes(session, transaction):
+    if transaction.parent is None:
+        session.info.pop(_FLUSHED_CHANGES_KEY, None)
+# --- End Structure changes already flushed ---
+
+
+def _structure_changed(session, nodemap_id):
+    return nodemap_id in session.info.get(_FLUSHED_CHANGES_KEY, ()) or nodemap_id in _structure_changes(session)
+
+
+def refresh_graph_index(nodemap):
+    """
+    Brings the nodemap's stored graph index up to its current version.
+    Call after the map's rows and version are updated (before commit).
+    If the index was current for the previous version and the save did not touch the
+    graph structure (e.g. only a node's text or position changed), it is kept as is.
+    """
+    from app import db
+
+    previous_version = (nodemap.version or 0) - 1
+    if nodemap.graph_index is not None and nodemap.graph_index_version == previous_version \
+            and not _structure_changed(db.session, nodemap.id):
+        nodemap.graph_index_version = nodemap.version
+        return
+    _store_graph_index(nodemap)
+
+
+def get_graph_index(nodemap):
+    """
+    Returns the nodemap's graph index, rebuilding it first if it is missing or
+    was built for another version. Does not commit.
+    """
+    if nodemap.graph_index is not None and nodemap.graph_index_version == nodemap.version:
+        return json.loads(nodemap.graph_index)
+    return _store_graph_index(nodemap)
+
+
+def init_graph_index(db):
+    """
+    Tracks the graph rows flushed before refresh_graph_index() runs.
+    """
+    from sqlalchemy import event
+
+    if not event.contains(db.session, 'before_flush', _remember_structure_changes):
+        event.listen(db.session, 'before_flush', _remember_structure_changes)
+        event.listen(db.session, 'after_transaction_end', _forget_structure_changes)
@@ -0,0 +1,43 @@
+# Helpers for conditional GET requests (ETag / If-None-Match).
+# Handlers compute an ETag from cheap, indexed data (a row's version counter
+# and summary columns) and can answer 304 Not Modified before doing the
+# expensive part of the request (loading and serializing the full payload).
+import hashlib
+
+from flask import request, make_response
+
+
+def make_etag(*parts):
+    """
+    Returns a strong ETag value (without quotes) for the given parts.
+    Any change to one of the parts produces a different ETag.
+    """
+    digest = hashlib.sha256('\x1f'.join(str(part) for part in parts).encode('utf-8')).hexdigest()
+    return digest[:32]
+
+
+def is_not_modified(etag):
+    """
+    True when the request's If-None-Match header already contains this ETag.
+    """
+    return request.if_none_match.contains(etag)
+
+
+def not_modified_response(etag):
+    """
+    Builds an empty 304 response that repeats the ETag. Other methods than GET and
+    HEAD (e.g. the POST form of a read) get a 412 instead, as 304 is only defined
+    for those two (RFC 9110, section 13.1.2).
+    """
+    response = make_response('', 304 if request.method in ('GET', 'HEAD') else 412)
+    return with_etag(response, etag)
+
+
+def with_etag(response, etag):
+    """
+    Adds the ETag to a response and asks clients to revalidate before reusing it.
+    Responses are private because they contain one user's data.
+    """
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
@@ -0,0 +1,560 @@
+# Model provider that calls a real model over HTTP.
+# Speaks the OpenAI-compatible chat completions API (POST <base_url>/chat/completions),
+# which OpenAI, most gateways (LiteLLM, OpenRouter, vLLM, Ollama...) and the local
+# stand-in of benchmarks/provider_server.py all understand.
+# - Connections are kept alive in a pool (ConnectionPool) and reused, so a call
+#   does not pay for a TCP (and TLS) handshake every time.
+# - Connect and read timeouts are separate; connection errors, timeouts, 429 and
+#   5xx responses are retried with exponential backoff (honouring Retry-After).
+# - Single-flight: identical requests (same model, prompts and params) that are
+#   in progress at the same time share one upstream call, whichever user or node
+#   sent them. Agents with cache_responses=False never share (see 'shared' below).
+# Only the standard library is used. The blocking HTTP calls run in the provider's
+# own thread pool; every request runs its own event loop (asyncio.run in the
+# executor and the job queue, a thread per SSE stream), so the pool and the
+# in-flight calls are shared through threads and concurrent.futures, never
+# through one event loop.
+import asyncio
+import collections
+import concurrent.futures
+import http.client
+import json
+import logging
+import random
+import socket
+import ssl
+import threading
+import time
+from urllib.parse import urlsplit
+
+from app.services.metrics import registry
+from app.services.model_providers import ModelProvider, ModelProviderError
+
+logger = logging.getLogger(__name__)
+
+PROVIDER_CALLS = registry.counter(
+    'model_provider_calls_total', 'Upstream model provider calls, by outcome.', ('provider', 'outcome'))
+PROVIDER_RETRIES = registry.counter(
+    'model_provider_retries_total', 'Upstream model provider calls that were retried.', ('provider',))
+PROVIDER_COALESCED = registry.counter(
+    'model_provider_coalesced_total', 'Requests answered by an identical call already in progress.', ('provider',))
+PROVIDER_CONNECTIONS = registry.counter(
+    'model_provider_connections_total', 'Connections used for provider calls, new or reused from the pool.', ('provider', 'kind'))
+PROVIDER_LATENCY = registry.histogram(
+    'model_provider_call_seconds', 'Upstream model provider call time, retries included.', ('provider',))
+
+# Statuses worth trying again: rate limited, or a temporary server problem
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+
+# Errors that mean a kept-alive connection was closed by the server while idle
+STALE_CONNECTION_ERRORS = (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError)
+
+
+class _RetryableError(Exception):
+    """
+    A failed attempt that may succeed when tried again.
+    """
+
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+# --- Connection pool ---
+class ConnectionPool:
+    """
+    Keeps HTTP connections to one host alive between calls.
+    acquire() returns an idle connection (the most recently used one, the most
+    likely to still be open) or opens a new one; release() puts it back if the
+    response was read completely and the server did not ask to close it.
+    At most max_size connections are open at once; idle connections are closed
+    after idle_timeout seconds, before the server's own keep-alive timeout does it.
+    """
+
+    def __init__(self, base_url, max_size=32, connect_timeout=5.0, read_timeout=120.0, idle_timeout=30.0, name='http'):
+        parts = urlsplit(base_url)
+        if parts.scheme not in ('http', 'https') or not parts.hostname:
+            raise ValueError(f"Invalid provider URL: {base_url!r}")
+        self.scheme = parts.scheme
+        self.host = parts.hostname
+        self.port = parts.port or (443 if parts.scheme == 'https' else 80)
+        self.max_size = max_size
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.idle_timeout = idle_timeout
+        self.name = name
+        self._ssl_context = ssl.create_default_context() if parts.scheme == 'https' else None
+        self._idle = collections.deque() # (connection, time it was released)
+        self._slots = threading.BoundedSemaphore(max_size)
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        if self.scheme == 'https':
+            connection = http.client.HTTPSConnection(self.host, self.port, timeout=self.connect_timeout, context=self._ssl_context)
+        else:
+            connection = http.client.HTTPConnection(self.host, self.port, timeout=self.connect_timeout)
+        connection.connect()
+        # The connect timeout only covers the handshake; waiting for the model uses the read timeout
+        connection.sock.settimeout(self.read_timeout)
+        connection.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return connection
+
+    def acquire(self):
+        """
+        Returns (connection, reused).
+        """
+        if not self._slots.acquire(timeout=self.connect_timeout):
+            raise _RetryableError(f"all {self.max_size} connections to {self.host} are busy")
+        try:
+            now = time.monotonic()
+            with self._lock:
+                # The oldest idle connections are on the left; drop the expired ones
+                while self._idle and now - self._idle[0][1] >= self.idle_timeout:
+                    self._idle.popleft()[0].close()
+                if self._idle:
+                    connection = self._idle.pop()[0]
+                    PROVIDER_CONNECTIONS.inc((self.name, 'reused'))
+                    return connection, True
+            connection = self._connect()
+            PROVIDER_CONNECTIONS.inc((self.name, 'new'))
+            return connection, False
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def release(self, connection, response):
+        """
+        Returns a connection after its response was read; it is kept only if it can be reused.
+        """
+        if response is not None and response.isclosed() and not response.will_close:
+            with self._lock:
+                self._idle.append((connection, time.monotonic()))
+        else:
+            connection.close()
+        self._slots.release()
+
+    def discard(self, connection):
+        """
+        Closes a connection that failed or whose response was abandoned.
+        """
+        connection.close()
+        self._slots.release()
+
+    def clear(self):
+        """
+        Closes all idle connections (e.g. after the server dropped one of them).
+        """
+        with self._lock:
+            while self._idle:
+                self._idle.pop()[0].close()
+
+    def idle_count(self):
+        with self._lock:
+            return len(self._idle)
+# --- End Connection pool ---
+
+
+# --- Single-flight ---
+class _SharedStream:
+    """
+    One upstream streaming call and the subscribers reading it.
+    Every subscriber has an asyncio.Queue on its own event loop; chunks are handed
+    over with call_soon_threadsafe. A subscriber that joins late first receives
+    the chunks sent so far, so everyone gets the complete response.
+    """
+
+    def __init__(self):
+        self.chunks = []
+        self.subscribers = []
+        self.finished = False
+        self.error = None
+        self.abandoned = False
+
+    def _deliver(self, subscriber, item):
+        loop, queue = subscriber
+        try:
+            loop.call_soon_threadsafe(queue.put_nowait, item)
+        except RuntimeError:
+            pass # The subscriber's loop is closed; it left without unsubscribing
+
+
+class SingleFlight:
+    """
+    Tracks the calls in progress by key, so identical requests wait for the
+    same call instead of starting their own. Keys are forgotten as soon as the
+    call finishes: this coalesces concurrent requests, it is not a cache.
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._streams = {}
+        self._lock = threading.Lock()
+
+    def call(self, key, submit):
+        """
+        Returns (future, coalesced): the future of the call in progress for key,
+        or of a new one started with submit() (which returns a concurrent.futures.Future).
+        """
+        with self._lock:
+            future = self._calls.get(key)
+            if future is not None:
+                return future, True
+            future = self._calls[key] = submit()
+        future.add_done_callback(lambda done: self._forget(self._calls, key, done))
+        return future, False
+
+    def _forget(self, calls, key, value):
+        with self._lock:
+            if calls.get(key) is value:
+                del calls[key]
+
+    def subscribe(self, key, loop, queue, start):
+        """
+        Subscribes a queue to the stream in progress for key, or to a new one
+        started with start(shared_stream). key=None never shares. Returns (stream, coalesced).
+        """
+        with self._lock:
+            stream = self._streams.get(key) if key is not None else None
+            coalesced = stream is not None
+            if stream is None:
+                stream = _SharedStream()
+                if key is not None:
+                    self._streams[key] = stream
+            subscriber = (loop, queue)
+            stream.subscribers.append(subscriber)
+            # Replay what was already received, then whatever comes next
+            for chunk in stream.chunks:
+                queue.put_nowait(chunk)
+        if not coalesced:
+            start(stream)
+        return stream, coalesced
+
+    def unsubscribe(self, key, stream, queue):
+        with self._lock:
+            stream.subscribers = [subscriber for subscriber in stream.subscribers if subscriber[1] is not queue]
+            if not stream.subscribers and not stream.finished:
+                # Nobody is listening any more: the upstream call stops at its next chunk
+                stream.abandoned = True
+                if key is not None and self._streams.get(key) is stream:
+                    del self._streams[key]
+
+    def publish(self, stream, chunk):
+        """
+        Sends a chunk to every subscriber; returns False if the stream was abandoned.
+        """
+        with self._lock:
+            if stream.abandoned:
+                return False
+            stream.chunks.append(chunk)
+            subscribers = list(stream.subscribers)
+        for subscriber in subscribers:
+            stream._deliver(subscriber, chunk)
+        return True
+
+    def finish(self, key, stream, error=None):
+        with self._lock:
+            stream.finished = True
+            stream.error = error
+            if key is not None and self._streams.get(key) is stream:
+                del self._streams[key]
+            subscribers = list(stream.subscribers)
+        for subscriber in subscribers:
+            stream._deliver(subscriber, _STREAM_END)
+
+
+# Marks the end of a stream in the subscribers' queues
+_STREAM_END = object()
+# --- End Single-flight ---
+
+
+class HTTPModelProvider(ModelProvider):
+    """
+    Calls an OpenAI-compatible chat completions endpoint.
+    'base_url' is the API root, e.g. 'https://api.openai.com/v1' or the local
+    stand-in 'http://127.0.0.1:8089/v1'. 'params' given to generate()/stream()
+    (temperature, max_tokens...) are sent with the request.
+    """
+    name = 'http'
+
+    def __init__(self, base_url, api_key=None, connect_timeout=5.0, read_timeout=120.0, max_retries=2,
+                 retry_backoff=0.5, max_retry_wait=30.0, pool_size=32, idle_timeout=30.0, single_flight=True,
+                 name='http'):
+        self.name = name
+        self.model_patterns = [] # The registry patterns it serves, set by configure_http_provider()
+        self.base_url = base_url.rstrip('/')
+        self.path = urlsplit(self.base_url).path + '/chat/completions'
+        self.api_key = api_key
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.max_retry_wait = max_retry_wait
+        self.pool = ConnectionPool(self.base_url, max_size=pool_size, connect_timeout=connect_timeout,
+                                   read_timeout=read_timeout, idle_timeout=idle_timeout, name=name)
+        self.single_flight = single_flight
+        # Streams go through it too, so there is one code path; with single_flight off nothing is shared
+        self._flights = SingleFlight()
+        # One worker per connection: a call never waits for a connection, only for a worker
+        self._workers = concurrent.futures.ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix=f'provider-{name}')
+
+    def close(self):
+        self._workers.shutdown(wait=False, cancel_futures=True)
+        self.pool.clear()
+
+    # --- Blocking HTTP calls (run in the worker threads) ---
+    def _headers(self, stream):
+        headers = {
+            'Content-Type': 'application/json',
+            'Accept': 'text/event-stream' if stream else 'application/json',
+        }
+        if self.api_key:
+            headers['Authorization'] = f'Bearer {self.api_key}'
+        return headers
+
+    def _request_body(self, model, system_prompt, prompt, params, stream):
+        messages = []
+        if system_prompt:
+            messages.append({'role': 'system', 'content': system_prompt})
+        messages.append({'role': 'user', 'content': prompt or ''})
+        body = dict(params or {})
+        body.update({'model': model, 'messages': messages, 'stream': stream})
+        return json.dumps(body).encode('utf-8')
+
+    def _send(self, body, stream):
+        """
+        One attempt: sends the request and returns (connection, response) for a
+        2xx response, whose body the caller reads and then releases.
+        A kept-alive connection the server has closed meanwhile is replaced once,
+        without counting as a retry.
+        """
+        for fresh_attempt in (False, True):
+            try:
+                connection, reused = self.pool.acquire()
+            except OSError as e: # Refused, unreachable, connect timeout, TLS handshake...
+                raise _RetryableError(f"connecting to {self.pool.host} failed: {e}")
+            try:
+                connection.request('POST', self.path, body=body, headers=self._headers(stream))
+                response = connection.getresponse()
+            except STALE_CONNECTION_ERRORS as e:
+                self.pool.discard(connection)
+                if reused and not fresh_attempt:
+                    self.pool.clear() # Its idle neighbours were most likely closed too
+                    continue
+                raise _RetryableError(f"connection to {self.pool.host} failed: {e}")
+            except (http.client.HTTPException, OSError) as e: # OSError includes timeouts
+                self.pool.discard(connection)
+                raise _RetryableError(f"connection to {self.pool.host} failed: {e}")
+            break
+
+        if 200 <= response.status < 300:
+            return connection, response
+
+        # --- Error response: read it so the connection can be reused ---
+        try:
+            error_body = response.read()
+        except (http.client.HTTPException, OSError):
+            error_body = b''
+            self.pool.discard(connection)
+        else:
+            self.pool.release(connection, response)
+        try:
+            message = json.loads(error_body)['error']['message']
+        except (ValueError, KeyError, TypeError):
+            message = error_body[:200].decode('utf-8', 'replace') or response.reason
+        error = f"{self.base_url} returned HTTP {response.status}: {message}"
+        if response.status in RETRY_STATUSES:
+            retry_after = response.getheader('Retry-After')
+            try:
+                retry_after = float(retry_after) if retry_after is not None else None
+            except ValueError:
+                retry_after = None # An HTTP date; the backoff delay is used instead
+            raise _RetryableError(error, retry_after)
+        raise ModelProviderError(error)
+        # --- End Error response ---
+
+    def _with_retries(self, attempt):
+        """
+        Runs attempt() until it succeeds, raises a non-retryable error, or the
+        retries are used up. Waits backoff * 2^n (with jitter) or Retry-After between attempts.
+        """
+        started = time.perf_counter()
+        try:
+            for attempt_number in range(self.max_retries + 1):
+                try:
+                    result = attempt()
+                    PROVIDER_CALLS.inc((self.name, 'ok'))
+                    return result
+                except _RetryableError as e:
+                    if attempt_number == self.max_retries:
+                        PROVIDER_CALLS.inc((self.name, 'error'))
+                        raise ModelProviderError(f"{e} (after {attempt_number + 1} attempts)") from None
+                    delay = e.retry_after
+                    if delay is None:
+                        delay = self.retry_backoff * (2 ** attempt_number) * random.uniform(0.5, 1.5)
+                    logger.warning(f"Model provider call failed, retrying in {delay:.2f}s: {e}")
+                    PROVIDER_RETRIES.inc((self.name,))
+                    time.sleep(min(delay, self.max_retry_wait))
+                except ModelProviderError:
+                    PROVIDER_CALLS.inc((self.name, 'error'))
+                    raise
+        finally:
+            PROVIDER_LATENCY.observe(time.perf_counter() - started, (self.name,))
+
+    def _complete(self, model, system_prompt, prompt, params):
+        body = self._request_body(model, system_prompt, prompt, params, stream=False)
+
+        def attempt():
+            connection, response = self._send(body, stream=False)
+            try:
+                data = response.read()
+            except (http.client.HTTPException, OSError) as e:
+                self.pool.discard(connection)
+                raise _RetryableError(f"reading the response from {self.pool.host} failed: {e}")
+            self.pool.release(connection, response)
+            try:
+                return json.loads(data)['choices'][0]['message']['content'] or ''
+            except (ValueError, KeyError, IndexError, TypeError):
+                raise ModelProviderError(f"{self.base_url} returned an unexpected response for model {model}")
+
+        return self._with_retries(attempt)
+
+    def _stream_into(self, key, stream, model, system_prompt, prompt, params):
+        """
+        Reads a streamed response (Server-Sent Events) and publishes its text
+        pieces to the stream's subscribers. Failures before the first piece are
+        retried; after it, the subscribers already have part of the response, so
+        the error is passed on to them.
+        """
+        body = self._request_body(model, system_prompt, prompt, params, stream=True)
+        published = False
+
+        def attempt():
+            nonlocal published
+            connection, response = self._send(body, stream=True)
+            try:
+                while True:
+                    line = response.readline()
+                    if not line:
+                        break # The server closed the stream without [DONE]
+                    line = line.strip()
+                    if not line.startswith(b'data:'):
+                        continue # Blank separators, comments and other SSE fields
+                    data = line[5:].strip()
+                    if data == b'[DONE]':
+                        break
+                    try:
+                        piece = json.loads(data)['choices'][0]['delta'].get('content')
+                    except (ValueError, KeyError, IndexError, TypeError, AttributeError):
+                        raise ModelProviderError(f"{self.base_url} sent an unexpected stream event for model {model}")
+                    if piece:
+                        published = True
+                        if not self._flights.publish(stream, piece):
+                            self.pool.discard(connection) # Abandoned: stop reading, the connection cannot be reused
+                            return
+                # Whatever follows [DONE] (the chunked terminator) must be read before the connection is reused
+                response.read()
+            except (http.client.HTTPException, OSError) as e:
+                self.pool.discard(connection)
+                if published:
+                    raise ModelProviderError(f"the stream from {self.pool.host} was interrupted: {e}")
+                raise _RetryableError(f"reading the stream from {self.pool.host} failed: {e}")
+            except BaseException:
+                self.pool.discard(connection)
+                raise
+            self.pool.release(connection, response)
+
+        error = None
+        try:
+            self._with_retries(attempt)
+        except Exception as e:
+            error = e if isinstance(e, ModelProviderError) else ModelProviderError(str(e))
+        self._flights.finish(key, stream, error)
+
+    # --- End Blocking HTTP calls ---
+
+    def _flight_key(self, model, system_prompt, prompt, params, shared):
+        # None: the call is not shared with anyone
+        if not (shared and self.single_flight):
+            return None
+        return json.dumps([model, system_prompt, prompt, params or {}], sort_keys=True, default=str)
+
+    async def generate(self, model, system_prompt, prompt, params=None, shared=True):
+        """
+        Returns the complete response text. With shared=True an identical call
+        already in progress is awaited instead of starting a new one.
+        """
+        def submit():
+            return self._workers.submit(self._complete, model, system_prompt, prompt, params)
+
+        key = self._flight_key(model, system_prompt, prompt, params, shared)
+        if key is None:
+            future = submit()
+        else:
+            future, coalesced = self._flights.call(key, submit)
+            if coalesced:
+                PROVIDER_COALESCED.inc((self.name,))
+        # shield(): a cancelled caller must not cancel a call other callers are waiting for
+        return await asyncio.shield(asyncio.wrap_future(future))
+
+    async def stream(self, model, system_prompt, prompt, params=None, shared=True):
+        """
+        Yields the response text in pieces as the model produces them.
+        With shared=True a caller that sends the same request while it is being
+        streamed joins that stream (receiving the pieces sent so far first).
+        """
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue()
+        key = self._flight_key(model, system_prompt, prompt, params, shared)
+
+        def start(shared_stream):
+            self._workers.submit(self._stream_into, key, shared_stream, model, system_prompt, prompt, params)
+
+        shared_stream, coalesced = self._flights.subscribe(key, loop, queue, start)
+        if coalesced:
+            PROVIDER_COALESCED.inc((self.name,))
+        try:
+            while True:
+                piece = await queue.get()
+                if piece is _STREAM_END:
+                    break
+                yield piece
+            if shared_stream.error is not None:
+                raise shared_stream.error
+        finally:
+            self._flights.unsubscribe(key, shared_stream, queue)
+
+
+# The provider registered by configure_http_provider(); replaced (and closed) if create_app() runs again
+_configured_provider = None
+
+
+def configure_http_provider(app):
+    """
+    Registers an HTTPModelProvider for MODEL_PROVIDER_MODELS when MODEL_PROVIDER_URL is set.
+    """
+    from app.services.model_providers import register_provider, unregister_provider
+    global _configured_provider
+
+    if _configured_provider is not None:
+        for pattern in _configured_provider.model_patterns:
+            unregister_provider(pattern)
+        _configured_provider.close()
+        _configured_provider = None
+    if not app.config['MODEL_PROVIDER_URL']:
+        return None
+    provider = HTTPModelProvider(
+        app.config['MODEL_PROVIDER_URL'],
+        api_key=app.config['MODEL_PROVIDER_API_KEY'],
+        connect_timeout=app.config['MODEL_PROVIDER_CONNECT_TIMEOUT'],
+        read_timeout=app.config['MODEL_PROVIDER_READ_TIMEOUT'],
+        max_retries=app.config['MODEL_PROVIDER_MAX_RETRIES'],
+        retry_backoff=app.config['MODEL_PROVIDER_RETRY_BACKOFF'],
+        pool_size=app.config['MODEL_PROVIDER_POOL_SIZE'],
+        idle_timeout=app.config['MODEL_PROVIDER_IDLE_TIMEOUT'],
+        single_flight=app.config['MODEL_PROVIDER_SINGLE_FLIGHT'],
+    )
+    patterns = [pattern.strip() for pattern in app.config['MODEL_PROVIDER_MODELS'].split(',') if pattern.strip()]
+    for pattern in patterns:
+        register_provider(pattern, provider)
+    provider.model_patterns = patterns
+    logger.info(f"Model provider at {provider.base_url} registered for {', '.join(patterns)}")
+    _configured_provider = provider
+    return provider
@@ -0,0 +1,473 @@
+# Durable background jobs for nodemap runs.
+# POST /execution/enqueuerun stores a RunJob row (see app/models.py) and returns
+# at once; worker processes started with 'flask run-workers' pick the jobs up
+# and run them, so a long run never blocks a web worker.
+#
+# - Claiming: a worker takes the oldest due 'queued' job with a conditional
+#   UPDATE (only one worker can win it) and holds it through a lease
+#   (lease_expires_at) that it renews every JOB_HEARTBEAT_INTERVAL seconds.
+#   Each renewal also stores the per-node progress and reads cancel_requested.
+# - Per-user limit: a job is not claimed while its user already has
+#   JOB_MAX_RUNNING_PER_USER running jobs (checked in the claiming UPDATE; on
+#   server databases concurrent claims can briefly exceed it).
+# - Retries: a run that fails, or whose worker dies, is queued again with
+#   exponential backoff until it has been attempted max_attempts times.
+#   Completed nodes are usually answered from the response cache on a retry.
+#   Runs that can never succeed (a cycle, a missing agent, a deleted map) are
+#   not retried.
+# - Crash recovery: every worker regularly re-queues 'running' jobs whose lease
+#   has expired, i.e. whose worker stopped without finishing them.
+# - Cancellation: a queued job is cancelled at once; a running job is flagged
+#   and its worker stops it at the next heartbeat.
+# - Every attempt that produced a result is recorded in the run history
+#   (app/services/run_history.py), whose maintenance the workers also run
+#   (with the nodemap version history's, app/services/nodemap_history.py).
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import random
+import signal
+import socket
+import threading
+import time
+from datetime import datetime, timedelta
+
+import click
+from flask import current_app
+from sqlalchemy import select, func, and_
+from sqlalchemy.orm import undefer_group
+
+from app import db
+from app.models import RunJob, Nodemap
+from app.services.nodemap_executor import prepare_nodemap_run, execute_nodemap_graph, NodemapExecutionError
+from app.services.tokens import agent_input_fitter
+from app.services.model_scheduler import PRIORITY_BATCH, get_model_scheduler
+from app.services.response_cache import get_response_cache
+from app.services.run_history import record_run, run_history_maintenance
+from app.services.nodemap_history import nodemap_history_maintenance
+
+logger = logging.getLogger(__name__)
+
+JOB_STATUSES = ('queued', 'running', 'completed', 'failed', 'cancelled')
+FINISHED_STATUSES = ('completed', 'failed', 'cancelled')
+
+# Number of due jobs looked at per claim attempt (others may be at their user's limit)
+CLAIM_CANDIDATES = 20
+
+
+class JobQueueFull(Exception):
+    """
+    Raised when a user already has JOB_MAX_PENDING_PER_USER queued or running jobs.
+    """
+    pass
+
+
+# --- Enqueue, status and cancellation (used by the routes) ---
+def enqueue_run(nodemap, initial_input, max_concurrency):
+    """
+    Adds a queued RunJob for the nodemap and returns it (the caller commits).
+    Raises JobQueueFull if the owner has too many unfinished jobs.
+    """
+    config = current_app.config
+    pending = db.session.execute(
+        select(func.count()).select_from(RunJob)
+        .where(RunJob.user_id == nodemap.user_id, RunJob.status.in_(('queued', 'running')))
+    ).scalar()
+    if pending >= config['JOB_MAX_PENDING_PER_USER']:
+        raise JobQueueFull(f"You already have {pending} runs queued or running")
+
+    job = RunJob(
+        user_id=nodemap.user_id,
+        nodemap_id=nodemap.id,
+        status='queued',
+        input=initial_input,
+        max_concurrency=max_concurrency,
+        max_attempts=config['JOB_MAX_ATTEMPTS'],
+        run_after=datetime.utcnow(),
+    )
+    db.session.add(job)
+    db.session.flush() # Assigns job.id
+    return job
+
+
+def job_to_dict(job, include_result=True):
+    """
+    JSON representation of a RunJob for the API.
+    """
+    data = {
+        "id": job.id,
+        "nodemap_id": job.nodemap_id,
+        "status": job.status,
+        "attempts": job.attempts,
+        "max_attempts": job.max_attempts,
+        "cancel_requested": job.cancel_requested,
+        "progress": json.loads(job.progress) if job.progress else {},
+        "error": job.error,
+        "created_at": job.created_at.isoformat() if job.created_at else None,
+        "started_at": job.started_at.isoformat() if job.started_at else None,
+        "finished_at": job.finished_at.isoformat() if job.finished_at else None,
+        # Only set while the job waits for a retry
+        "retry_at": job.run_after.isoformat() if job.status == 'queued' and job.attempts else None,
+    }
+    if include_result:
+        data["result"] = json.loads(job.result) if job.result else None
+    return data
+
+
+def request_cancel(job):
+    """
+    Cancels a queued job immediately, or asks the worker running it to stop.
+    Returns False if the job had already finished. Commits.
+    """
+    table = RunJob.__table__
+    now = datetime.utcnow()
+    # Conditional updates, so a worker claiming or finishing the job at the same time cannot be overwritten
+    cancelled = db.session.execute(
+        table.update().where(table.c.id == job.id, table.c.status == 'queued')
+        .values(status='cancelled', finished_at=now, error='Cancelled before it started')
+    ).rowcount
+    if not cancelled:
+        cancelled = db.session.execute(
+            table.update().where(table.c.id == job.id, table.c.status == 'running').values(cancel_requested=True)
+        ).rowcount
+    db.session.commit()
+    db.session.refresh(job)
+    return bool(cancelled)
+# --- End Enqueue, status and cancellation ---
+
+
+# --- Claiming and leases (used by the workers) ---
+def _lease_seconds():
+    return current_app.config['JOB_LEASE_SECONDS']
+
+
+def claim_next_job(worker_id):
+    """
+    Marks the oldest due queued job as running for this worker and returns its id,
+    or None when there is nothing to do. Commits.
+    """
+    table = RunJob.__table__
+    # Running jobs per user, as a grouped derived table: MySQL cannot read the table
+    # an UPDATE writes in a subquery (error 1093), but it materializes an aggregate first
+    running = (
+        select(table.c.user_id, func.count().label('jobs')).where(table.c.status == 'running')
+        .group_by(table.c.user_id).subquery('running_job')
+    )
+    now = datetime.utcnow()
+    max_running = current_app.config['JOB_MAX_RUNNING_PER_USER']
+    candidate_ids = db.session.execute(
+        select(table.c.id).where(table.c.status == 'queued', table.c.run_after <= now)
+        .order_by(table.c.run_after, table.c.id).limit(CLAIM_CANDIDATES)
+    ).scalars().all()
+
+    # Jobs of the user's that are already running (evaluated inside the UPDATE)
+    user_running = func.coalesce(
+        select(running.c.jobs).where(running.c.user_id == table.c.user_id).scalar_subquery(), 0
+    )
+    for job_id in candidate_ids:
+        claimed = db.session.execute(
+            table.update()
+            .where(table.c.id == job_id, table.c.status == 'queued', user_running < max_running)
+            .values(status='running', worker_id=worker_id, attempts=table.c.attempts + 1,
+                    lease_expires_at=now + timedelta(seconds=_lease_seconds()), started_at=now,
+                    finished_at=None)
+        ).rowcount
+        db.session.commit()
+        if claimed:
+            return job_id
+    return None
+
+
+def recover_orphaned_jobs():
+    """
+    Re-queues running jobs whose lease expired (their worker died), or fails them
+    when they have no attempts left. Returns the number of jobs recovered. Commits.
+    """
+    table = RunJob.__table__
+    now = datetime.utcnow()
+    expired = and_(table.c.status == 'running', table.c.lease_expires_at < now)
+    released = {'worker_id': None, 'lease_expires_at': None}
+
+    cancelled = db.session.execute(
+        table.update().where(expired, table.c.cancel_requested == True) # noqa: E712 (SQL comparison)
+        .values(status='cancelled', finished_at=now, error='Cancelled', **released)
+    ).rowcount
+    failed = db.session.execute(
+        table.update().where(expired, table.c.attempts >= table.c.max_attempts)
+        .values(status='failed', finished_at=now, error='The worker running this job stopped responding', **released)
+    ).rowcount
+    requeued = db.session.execute(
+        table.update().where(expired).values(status='queued', run_after=now, **released)
+    ).rowcount
+    db.session.commit()
+
+    if cancelled or failed or requeued:
+        logger.warning(f"Recovered orphaned jobs: {requeued} re-queued, {failed} failed, {cancelled} cancelled")
+    return cancelled + failed + requeued
+
+
+def _renew_lease(job_id, worker_id, progress):
+    """
+    Extends the job's lease and stores its progress.
+    Returns 'ok', 'cancel' (cancellation was requested) or 'lost' (the job is no longer ours). Commits.
+    """
+    table = RunJob.__table__
+    renewed = db.session.execute(
+        table.update().where(table.c.id == job_id, table.c.status == 'running', table.c.worker_id == worker_id)
+        .values(lease_expires_at=datetime.utcnow() + timedelta(seconds=_lease_seconds()),
+                progress=json.dumps(progress))
+    ).rowcount
+    cancel_requested = renewed and db.session.execute(
+        select(table.c.cancel_requested).where(table.c.id == job_id)
+    ).scalar()
+    db.session.commit()
+    if not renewed:
+        return 'lost'
+    return 'cancel' if cancel_requested else 'ok'
+
+
+def retry_delay(attempts):
+    """
+    Seconds to wait before the next attempt: JOB_RETRY_BACKOFF doubled per
+    attempt, capped at JOB_RETRY_BACKOFF_MAX, with up to 20% random jitter.
+    """
+    config = current_app.config
+    delay = min(config['JOB_RETRY_BACKOFF_MAX'], config['JOB_RETRY_BACKOFF'] * 2 ** max(0, attempts - 1))
+    return delay * random.uniform(0.8, 1.0)
+
+
+def _finish_job(job_id, worker_id, status, progress, result=None, error=None, retry=False):
+    """
+    Stores the outcome of an attempt. With retry=True (and attempts left) the job
+    is queued again after a backoff instead. Returns the job's new status. Commits,
+    together with what the caller wrote in the same transaction (the run history);
+    when the lease was lost, that is rolled back and None is returned.
+    """
+    table = RunJob.__table__
+    now = datetime.utcnow()
+    ours = and_(table.c.id == job_id, table.c.status == 'running', table.c.worker_id == worker_id)
+    job = db.session.execute(
+        select(table.c.attempts, table.c.max_attempts, table.c.cancel_requested).where(ours)
+    ).first()
+    if job is None:
+        db.session.rollback()
+        return None # Lease lost: another worker has (or had) the job
+
+    values = {'worker_id': None, 'lease_expires_at': None, 'progress': json.dumps(progress), 'error': error,
+              'result': json.dumps(result) if result is not None else None}
+    if job.cancel_requested:
+        values.update(status='cancelled', finished_at=now, error=error or 'Cancelled')
+    elif retry and job.attempts < job.max_attempts:
+        values.update(status='queued', run_after=now + timedelta(seconds=retry_delay(job.attempts)))
+    else:
+        values.update(status=status, finished_at=now)
+    if not db.session.execute(table.update().where(ours).values(**values)).rowcount:
+        db.session.rollback()
+        return None # Lost between the check and the update
+    db.session.commit()
+    return values['status']
+# --- End Claiming and leases ---
+
+
+# --- Running a job ---
+async def _run_with_heartbeat(job_id, worker_id, run, progress):
+    """
+    Runs the coroutine while renewing the job's lease. Returns (result, None), or
+    (None, 'cancel' | 'lost') if the run was stopped.
+    """
+    interval = current_app.config['JOB_HEARTBEAT_INTERVAL']
+    task = asyncio.ensure_future(run)
+    while True:
+        done, _ = await asyncio.wait({task}, timeout=interval)
+        if done:
+            return task.result(), None
+        # A short synchronous write; the agents keep running in the meantime
+        state = _renew_lease(job_id, worker_id, progress)
+        if state != 'ok':
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+            return None, state
+
+
+def run_job(job_id, worker_id):
+    """
+    Runs a claimed job to the end and records its outcome. Returns the job's new status.
+    """
+    job = db.session.get(RunJob, job_id)
+    progress = {}
+    nodemap = Nodemap.query.options(undefer_group('graph_index')) \
+        .filter_by(id=job.nodemap_id, user_id=job.user_id).first()
+    if nodemap is None:
+        return _finish_job(job_id, worker_id, 'failed', progress, error="The nodemap no longer exists")
+
+    initial_input = job.input
+    max_concurrency = min(job.max_concurrency, current_app.config['NODEMAP_MAX_CONCURRENCY'])
+    try:
+        nodes, edges, agents_by_id, plan = prepare_nodemap_run(nodemap)
+    except NodemapExecutionError as e:
+        return _finish_job(job_id, worker_id, 'failed', progress, error=str(e)) # Retrying cannot help
+    db.session.commit() # Keeps a rebuilt graph index; no transaction stays open during the run
+
+    progress.update({node_id: 'pending' for node_id in plan['order']})
+    node_inputs = {}
+    run = execute_nodemap_graph(
+        nodes, edges, agents_by_id, initial_input, max_concurrency=max_concurrency,
+        cache=get_response_cache(), plan=plan, on_node_update=progress.__setitem__, node_inputs=node_inputs,
+        fit_input=agent_input_fitter(), scheduler=get_model_scheduler(), user_id=job.user_id, priority=PRIORITY_BATCH,
+    )
+    started = time.perf_counter()
+    try:
+        result, interrupted = asyncio.run(_run_with_heartbeat(job_id, worker_id, run, progress))
+    except NodemapExecutionError as e:
+        return _finish_job(job_id, worker_id, 'failed', progress, error=str(e)) # e.g. the input does not fit an agent
+    except Exception as e:
+        logger.exception(f"Error while running job ID {job_id}: {e}")
+        return _finish_job(job_id, worker_id, 'failed', progress, error="An error occurred while running the nodemap", retry=True)
+
+    if interrupted == 'lost':
+        logger.warning(f"Lost the lease of job ID {job_id}; its result is discarded")
+        return None
+    if interrupted == 'cancel':
+        progress.update({node_id: 'cancelled' for node_id, state in progress.items() if state == 'pending'})
+        status = _finish_job(job_id, worker_id, 'cancelled', progress, error='Cancelled')
+    else:
+        if current_app.config['RUN_HISTORY_ENABLED']:
+            # Committed together with the job's outcome below, or discarded with it if the lease was lost
+            result['run_id'] = record_run(nodemap, initial_input, result, node_inputs, job_id=job_id)
+        failed_nodes = [node_id for node_id, node in result['nodes'].items() if node['status'] == 'failed']
+        error = f"Nodes failed: {', '.join(failed_nodes)}" if failed_nodes else None
+        status = _finish_job(job_id, worker_id, result['status'], progress, result=result, error=error,
+                             retry=result['status'] != 'completed')
+    logger.info(f"Job ID {job_id} (nodemap ID {nodemap.id}) -> {status} after {time.perf_counter() - started:.3f}s",
+                extra={'user_id': job.user_id})
+    return status
+# --- End Running a job ---
+
+
+# --- Workers ---
+class JobWorker:
+    """
+    Runs queued jobs one at a time until stop() is called. Use inside an app context.
+    """
+
+    def __init__(self, worker_id=None):
+        self.worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}"
+        self._stopping = threading.Event()
+
+    def stop(self):
+        self._stopping.set() # The current job is finished first
+
+    def run_once(self):
+        """
+        Runs one due job if there is one. Returns True if a job was run.
+        """
+        job_id = claim_next_job(self.worker_id)
+        if job_id is None:
+            return False
+        try:
+            run_job(job_id, self.worker_id)
+        finally:
+            db.session.remove()
+        return True
+
+    def run(self):
+        config = current_app.config
+        logger.info(f"Job worker {self.worker_id} started")
+        next_recovery = 0
+        # Spread the workers' history maintenance over the interval
+        next_maintenance = time.monotonic() + random.uniform(0, config['RUN_HISTORY_MAINTENANCE_INTERVAL'])
+        while not self._stopping.is_set():
+            try:
+                if time.monotonic() >= next_recovery:
+                    recover_orphaned_jobs()
+                    next_recovery = time.monotonic() + config['JOB_LEASE_SECONDS'] / 2
+                if time.monotonic() >= next_maintenance:
+                    if config['RUN_HISTORY_ENABLED']:
+                        run_history_maintenance()
+                    if config['NODEMAP_HISTORY_ENABLED']:
+                        nodemap_history_maintenance()
+                    next_maintenance = time.monotonic() + config['RUN_HISTORY_MAINTENANCE_INTERVAL']
+                if not self.run_once():
+                    self._stopping.wait(config['JOB_POLL_INTERVAL'])
+            except Exception as e:
+                # e.g. the database is briefly unavailable; the jobs themselves are safe in their rows
+                logger.exception(f"Job worker {self.worker_id} error: {e}")
+                db.session.remove()
+                self._stopping.wait(config['JOB_POLL_INTERVAL'])
+        logger.info(f"Job worker {self.worker_id} stopped")
+
+
+def _worker_process_main(worker_number):
+    # Entry point of a worker process: a fresh app, with its own database connections
+    from app import create_app
+
+    app = create_app()
+    with app.app_context():
+        worker = JobWorker(f"{socket.gethostname()}:{os.getpid()}:{worker_number}")
+        signal.signal(signal.SIGTERM, lambda signum, frame: worker.stop())
+        signal.signal(signal.SIGINT, signal.SIG_IGN) # The supervisor decides when to stop
+        # Stop too if the supervisor itself dies (e.g. it was killed), instead of running on unsupervised
+        supervisor = multiprocessing.parent_process()
+        threading.Thread(target=lambda: (supervisor.join(), worker.stop()), daemon=True).start()
+        worker.run()
+
+
+def run_worker_pool(processes):
+    """
+    Starts 'processes' worker processes and restarts any that exit unexpectedly,
+    until SIGINT or SIGTERM; the workers then finish their current job and exit.
+    """
+    # 'spawn' so no worker inherits the parent's database connections or threads
+    context = multiprocessing.get_context('spawn')
+    stopping = threading.Event()
+
+    def start(worker_number):
+        process = context.Process(target=_worker_process_main, args=(worker_number,), name=f'job-worker-{worker_number}')
+        process.start()
+        return process
+
+    def request_stop(signum, frame):
+        stopping.set()
+
+    signal.signal(signal.SIGTERM, request_stop)
+    signal.signal(signal.SIGINT, request_stop)
+
+    workers = {number: start(number) for number in range(processes)}
+    while not stopping.wait(1):
+        for number, process in list(workers.items()):
+            if not process.is_alive():
+                logger.warning(f"Job worker {process.name} exited with code {process.exitcode}; restarting it")
+                workers[number] = start(number)
+
+    for process in workers.values():
+        if process.is_alive():
+            process.terminate() # SIGTERM: finish the current job
+    for process in workers.values():
+        process.join()
+# --- End Workers ---
+
+
+def init_job_queue(app):
+    """
+    Checks the job settings and registers 'flask run-workers' and 'flask recover-jobs'.
+    """
+    if app.config['JOB_HEARTBEAT_INTERVAL'] >= app.config['JOB_LEASE_SECONDS']:
+        raise ValueError("JOB_HEARTBEAT_INTERVAL must be shorter than JOB_LEASE_SECONDS")
+
+    @app.cli.command('run-workers')
+    @click.option('--processes', type=int, default=None, help='Number of worker processes (default: JOB_WORKER_PROCESSES).')
+    def run_workers_command(processes):
+        """Run background nodemap jobs in a pool of worker processes."""
+        processes = processes or app.config['JOB_WORKER_PROCESSES']
+        click.echo(f"Starting {processes} job worker processes (Ctrl+C to stop)")
+        run_worker_pool(processes)
+
+    @app.cli.command('recover-jobs')
+    def recover_jobs_command():
+        """Re-queue running jobs whose worker stopped responding."""
+        click.echo(f"Recovered {recover_orphaned_jobs()} jobs")
@@ -0,0 +1,94 @@
+# Faster JSON responses.
+# - OrjsonProvider replaces Flask's JSON provider (jsonify, app.json.dumps) with
+#   orjson (optional dependency), which serializes several times faster than the
+#   json module and writes bytes directly. Output matches Flask's defaults:
+#   sorted keys, compact unless in debug mode, dates as HTTP dates, Decimal as
+#   strings. Values orjson cannot represent (e.g. integers over 64 bits) fall
+#   back to the json module. Request bodies are still parsed by the json module,
+#   because orjson silently turns very large integers into floats.
+# - spliced_json_response() builds a JSON object around members that are already
+#   serialized JSON text (e.g. stored nodemap elements), without parsing them.
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError: # Optional dependency
+    orjson = None
+
+JSON_PROVIDERS = ('auto', 'orjson', 'default')
+
+
+class OrjsonProvider(DefaultJSONProvider):
+    """
+    Flask JSON provider that serializes with orjson.
+    """
+
+    def _orjson_options(self, indent=None):
+        options = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS | orjson.OPT_NON_STR_KEYS
+        if self.sort_keys:
+            options |= orjson.OPT_SORT_KEYS
+        if indent:
+            options |= orjson.OPT_INDENT_2
+        return options
+
+    def dumps_bytes(self, obj, indent=None):
+        """
+        Serializes obj to UTF-8 JSON bytes.
+        """
+        try:
+            return orjson.dumps(obj, default=self.default, option=self._orjson_options(indent))
+        except TypeError: # orjson.JSONEncodeError; e.g. an integer that does not fit in 64 bits
+            separators = None if indent else (',', ':')
+            return super().dumps(obj, indent=indent, separators=separators, ensure_ascii=False).encode('utf-8')
+
+    def dumps(self, obj, **kwargs):
+        # Arguments orjson does not support (cls, other separators, ...) use the json module
+        indent = kwargs.get('indent')
+        if set(kwargs) - {'indent', 'separators'} or indent not in (None, 2) \
+                or kwargs.get('separators') not in (None, (',', ':')):
+            return super().dumps(obj, **kwargs)
+        return self.dumps_bytes(obj, indent=indent).decode('utf-8')
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        indent = 2 if (self.compact is None and self._app.debug) or self.compact is False else None
+        return self._app.response_class(self.dumps_bytes(obj, indent=indent) + b'\n', mimetype=self.mimetype)
+
+
+def install_json_provider(app, name='auto'):
+    """
+    Installs the JSON provider named by JSON_PROVIDER on the app.
+    'auto' uses orjson when it is installed.
+    """
+    if name not in JSON_PROVIDERS:
+        raise ValueError(f"Unknown JSON_PROVIDER {name!r} (expected one of {', '.join(JSON_PROVIDERS)})")
+    if name == 'orjson' and orjson is None:
+        raise ValueError("JSON_PROVIDER=orjson needs the 'orjson' package")
+    if name == 'default' or orjson is None:
+        return
+    app.json_provider_class = OrjsonProvider
+    app.json = OrjsonProvider(app)
+
+
+def _dumps_bytes(app, obj):
+    if isinstance(app.json, OrjsonProvider):
+        return app.json.dumps_bytes(obj)
+    return app.json.dumps(obj, separators=(',', ':')).encode('utf-8')
+
+
+def spliced_json_response(app, obj, raw_lists):
+    """
+    Returns a JSON response for obj (a dict) plus one member per raw_lists entry.
+    raw_lists maps a key to a list of strings that are each already valid JSON;
+    they are written into the body as a JSON array without being parsed.
+    """
+    body = _dumps_bytes(app, obj)
+    parts = [body[:-1]] # Drop the closing brace; the raw members are appended
+    separator = b',' if obj else b''
+    for key, items in raw_lists.items():
+        parts.append(separator + _dumps_bytes(app, key) + b':[')
+        parts.append(','.join(items).encode('utf-8'))
+        parts.append(b']')
+        separator = b','
+    parts.append(b'}\n')
+    return app.response_class(b''.join(parts), mimetype=app.json.mimetype)
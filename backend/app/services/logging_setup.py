@@ -0,0 +1,127 @@
+# Structured logging for the Flask app.
+# Log records are put on an in-memory queue by the request thread (cheap) and
+# written out by a background listener thread, so a slow stderr or log file
+# never blocks a request. Each line is a JSON object carrying the message, the
+# logger and level, any 'extra' fields, and the request it belongs to.
+import atexit
+import copy
+import json
+import logging
+import logging.handlers
+import queue
+import sys
+import uuid
+from datetime import datetime, timezone
+
+from flask import g, has_request_context, request
+
+# Attributes every LogRecord has; anything else was passed through 'extra'
+_STANDARD_RECORD_ATTRIBUTES = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+_listener = None
+
+
+class RequestContextFilter(logging.Filter):
+    """
+    Copies the current request's id, method, path and endpoint onto the record.
+    Runs in the thread that logs (where the request context exists), before the
+    record is handed to the queue.
+    """
+
+    def filter(self, record):
+        if has_request_context():
+            record.request_id = g.get('request_id')
+            record.method = request.method
+            record.path = request.path
+            record.endpoint = request.endpoint
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Formats a record as one JSON object per line.
+    """
+
+    def format(self, record):
+        entry = {
+            'timestamp': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _STANDARD_RECORD_ATTRIBUTES and not key.startswith('_'):
+                entry[key] = value
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry['exception'] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+# Renders tracebacks for queued records, in the same form as any logging.Formatter
+_traceback_formatter = logging.Formatter()
+
+
+class ExceptionKeepingQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler that keeps a record's traceback separate from its message.
+    The stdlib prepare() folds the traceback into the message and drops exc_info,
+    so JsonFormatter could never write its 'exception' field. Here the traceback
+    is rendered into exc_text (traceback objects are not kept on a queued record).
+    """
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        record.msg = record.message
+        record.args = None
+        if record.exc_info and not record.exc_text:
+            record.exc_text = _traceback_formatter.formatException(record.exc_info)
+        record.exc_info = None
+        return record
+
+
+def _assign_request_id():
+    # Reuse the caller's id (e.g. from a proxy) so logs can be correlated across services
+    g.request_id = request.headers.get('X-Request-ID') or uuid.uuid4().hex
+
+
+def _echo_request_id(response):
+    request_id = g.get('request_id')
+    if request_id:
+        response.headers['X-Request-ID'] = request_id
+    return response
+
+
+def configure_logging(app):
+    """
+    Routes the 'app' loggers through a QueueHandler and starts the listener
+    that writes them to stderr. LOG_FORMAT is 'json' (default) or 'text'.
+    """
+    global _listener
+
+    app.before_request(_assign_request_id)
+    app.after_request(_echo_request_id)
+
+    app_logger = logging.getLogger('app')
+    app_logger.setLevel(app.config['LOG_LEVEL'])
+    app_logger.propagate = False
+
+    if _listener is not None:
+        return # Already configured by an earlier create_app() in this process
+
+    output_handler = logging.StreamHandler(sys.stderr)
+    if app.config['LOG_FORMAT'] == 'json':
+        output_handler.setFormatter(JsonFormatter())
+    else:
+        output_handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(name)s: %(message)s'))
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = ExceptionKeepingQueueHandler(log_queue)
+    queue_handler.addFilter(RequestContextFilter())
+    app_logger.addHandler(queue_handler)
+
+    _listener = logging.handlers.QueueListener(log_queue, output_handler, respect_handler_level=True)
+    _listener.start()
+    atexit.register(_listener.stop) # Flush what is still queued on shutdown
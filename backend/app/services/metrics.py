@@ -0,0 +1,301 @@
+# Request-level metrics for the Flask app, exposed in the Prometheus text format.
+# Every request records its latency, status code, response size and the number
+# and total time of the SQL queries it ran, labelled by endpoint (blueprint.view),
+# so the routes that dominate tail latency can be found under load.
+# Metrics are kept in this process; with several worker processes each one
+# exposes its own values (Prometheus sums them per instance).
+import logging
+import threading
+import time
+
+from flask import g, has_request_context, request, Response, current_app
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+
+# Default histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 250)
+
+
+# --- Metric types ---
+def _escape_label_value(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labelnames, labelvalues, extra=None):
+    pairs = list(zip(labelnames, labelvalues))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape_label_value(value)}"' for name, value in pairs) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """
+    A monotonically increasing value per label combination.
+    """
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, labelvalues=(), amount=1):
+        with self._lock:
+            self._values[labelvalues] = self._values.get(labelvalues, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        for labelvalues, value in items:
+            yield self.name + _format_labels(self.labelnames, labelvalues), value
+
+
+class Gauge:
+    """
+    A value that goes up and down (e.g. a queue depth) per label combination.
+    """
+    kind = 'gauge'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def set(self, value, labelvalues=()):
+        with self._lock:
+            self._values[labelvalues] = value
+
+    def inc(self, labelvalues=(), amount=1):
+        with self._lock:
+            self._values[labelvalues] = self._values.get(labelvalues, 0) + amount
+
+    def dec(self, labelvalues=(), amount=1):
+        self.inc(labelvalues, -amount)
+
+    def samples(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        for labelvalues, value in items:
+            yield self.name + _format_labels(self.labelnames, labelvalues), value
+
+
+class Histogram:
+    """
+    Observations counted into cumulative buckets, plus their sum and count.
+    """
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+        self._values = {} # labelvalues -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, labelvalues=()):
+        with self._lock:
+            state = self._values.get(labelvalues)
+            if state is None:
+                state = self._values[labelvalues] = [0] * len(self.buckets) + [0.0, 0]
+            for index, upper_bound in enumerate(self.buckets):
+                if value <= upper_bound:
+                    state[index] += 1
+                    break
+            state[-2] += value
+            state[-1] += 1
+
+    def samples(self):
+        with self._lock:
+            items = sorted((labelvalues, list(state)) for labelvalues, state in self._values.items())
+        for labelvalues, state in items:
+            cumulative = 0
+            for index, upper_bound in enumerate(self.buckets):
+                cumulative += state[index]
+                labels = _format_labels(self.labelnames, labelvalues, ('le', _format_value(float(upper_bound))))
+                yield f'{self.name}_bucket{labels}', cumulative
+            labels = _format_labels(self.labelnames, labelvalues)
+            yield f'{self.name}_sum{labels}', state[-2]
+            yield f'{self.name}_count{labels}', state[-1]
+
+
+class MetricsRegistry:
+    """
+    Holds metrics by name. Asking twice for the same name returns the same metric,
+    so create_app() can be called more than once (e.g. by scripts) without duplicates.
+    """
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _get_or_create(self, cls, name, *args, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, *args, **kwargs)
+            return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._get_or_create(Counter, name, documentation, labelnames)
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self._get_or_create(Gauge, name, documentation, labelnames)
+
+    def histogram(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self._get_or_create(Histogram, name, documentation, labelnames, buckets=buckets)
+
+    def render(self):
+        """
+        Returns every metric in the Prometheus text exposition format (version 0.0.4).
+        """
+        with self._lock:
+            metrics = sorted(self._metrics.values(), key=lambda metric: metric.name)
+        lines = []
+        for metric in metrics:
+            lines.append(f'# HELP {metric.name} {metric.documentation}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            for sample_name, value in metric.samples():
+                lines.append(f'{sample_name} {_format_value(value)}')
+        return '\n'.join(lines) + '\n'
+# --- End Metric types ---
+
+
+# The registry used by the app and exposed at /metrics
+registry = MetricsRegistry()
+
+REQUEST_COUNT = registry.counter(
+    'http_requests_total', 'HTTP requests by endpoint, method and status code.',
+    ('endpoint', 'method', 'status'))
+REQUEST_LATENCY = registry.histogram(
+    'http_request_duration_seconds', 'Time spent handling a request (until the response is returned).',
+    ('endpoint', 'method'))
+RESPONSE_SIZE = registry.histogram(
+    'http_response_size_bytes', 'Size of non-streamed response bodies.',
+    ('endpoint',), buckets=SIZE_BUCKETS)
+REQUEST_QUERIES = registry.histogram(
+    'db_queries_per_request', 'SQL statements executed while handling a request.',
+    ('endpoint',), buckets=QUERY_COUNT_BUCKETS)
+REQUEST_QUERY_TIME = registry.histogram(
+    'db_query_duration_seconds_per_request', 'Total time of the SQL statements executed while handling a request.',
+    ('endpoint',))
+QUERY_COUNT = registry.counter(
+    'db_queries_total', 'SQL statements executed, by the endpoint that ran them.',
+    ('endpoint',))
+
+
+# --- SQL instrumentation ---
+# Listeners are attached to the Engine class, so they cover every engine the app creates.
+_sql_listeners_installed = False
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('metrics_query_start', []).append(time.perf_counter())
+
+
+def _finish_query(conn):
+    starts = conn.info.get('metrics_query_start')
+    if not starts:
+        return
+    elapsed = time.perf_counter() - starts.pop()
+    # Queries outside a request (startup, background threads) are not attributed
+    if has_request_context():
+        request_metrics = g.get('_request_metrics')
+        if request_metrics is not None:
+            request_metrics['queries'] += 1
+            request_metrics['query_time'] += elapsed
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    _finish_query(conn)
+
+
+def _handle_error(exception_context):
+    # A failed statement gets no after_cursor_execute; its start time is dropped
+    # here, or the next statement on the connection would be timed from it
+    if exception_context.execution_context is not None and exception_context.connection is not None:
+        _finish_query(exception_context.connection)
+
+
+def _install_sql_listeners():
+    global _sql_listeners_installed
+    if _sql_listeners_installed:
+        return
+    event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+    event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+    event.listen(Engine, 'handle_error', _handle_error)
+    _sql_listeners_installed = True
+# --- End SQL instrumentation ---
+
+
+def _endpoint_label():
+    # request.endpoint is 'blueprint.view'; unmatched URLs share one label
+    return request.endpoint or 'unmatched'
+
+
+def _start_request_timer():
+    g._request_metrics = {'started': time.perf_counter(), 'queries': 0, 'query_time': 0.0}
+
+
+def _record_request(response):
+    request_metrics = g.pop('_request_metrics', None)
+    if request_metrics is None:
+        return response
+
+    endpoint = _endpoint_label()
+    REQUEST_COUNT.inc((endpoint, request.method, str(response.status_code)))
+    REQUEST_LATENCY.observe(time.perf_counter() - request_metrics['started'], (endpoint, request.method))
+    if not response.is_streamed:
+        RESPONSE_SIZE.observe(response.calculate_content_length() or 0, (endpoint,))
+    REQUEST_QUERIES.observe(request_metrics['queries'], (endpoint,))
+    REQUEST_QUERY_TIME.observe(request_metrics['query_time'], (endpoint,))
+    if request_metrics['queries']:
+        QUERY_COUNT.inc((endpoint,), request_metrics['queries'])
+    return response
+
+
+def metrics_view():
+    """
+    Prometheus scrape endpoint. Requests must send 'Authorization: Bearer <METRICS_TOKEN>';
+    without a METRICS_TOKEN it is closed, unless METRICS_PUBLIC is set.
+    """
+    token = current_app.config.get('METRICS_TOKEN')
+    if not token:
+        if not current_app.config.get('METRICS_PUBLIC'):
+            return Response('Forbidden: set METRICS_TOKEN to enable /metrics\n', status=403, mimetype='text/plain')
+    elif request.headers.get('Authorization') != f'Bearer {token}':
+        return Response('Unauthorized\n', status=401, mimetype='text/plain')
+    return Response(registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+def init_metrics(app):
+    """
+    Hooks request instrumentation into the app and registers GET /metrics.
+    """
+    _install_sql_listeners()
+    app.before_request(_start_request_timer)
+    app.after_request(_record_request)
+    app.add_url_rule('/metrics', 'metrics', metrics_view, methods=['GET'])
+    if not app.config.get('METRICS_TOKEN'):
+        if app.config.get('METRICS_PUBLIC'):
+            logger.warning("METRICS_PUBLIC is set and METRICS_TOKEN is not: /metrics is readable without authentication")
+        else:
+            logger.warning("METRICS_TOKEN is not set: /metrics answers 403 until it is")
@@ -0,0 +1,119 @@
+# Model providers used to run Agents.
+# Every Agent names a model (e.g. 'gpt-4o', 'gemini-pro'); the registry below
+# maps a model name to the provider object that knows how to call it.
+# The 'local' provider is a deterministic stand-in that needs no network,
+# so nodemap execution can be tested and benchmarked offline; real models are
+# called over HTTP by app/services/http_provider.py.
+import asyncio
+import hashlib
+
+
+class ModelProviderError(Exception):
+    """
+    Raised when a provider cannot produce a response for a request.
+    """
+    pass
+
+
+class ModelProvider:
+    """
+    Base class for model providers.
+    Subclasses implement generate(), which returns the complete response text,
+    and may override stream(), an async generator yielding the response in
+    pieces as the model produces them.
+    shared=False asks for a call of its own: the response must not be shared
+    with identical requests in progress (see app/services/http_provider.py).
+    """
+    name = 'base'
+
+    async def generate(self, model, system_prompt, prompt, params=None, shared=True):
+        raise NotImplementedError
+
+    async def stream(self, model, system_prompt, prompt, params=None, shared=True):
+        # Providers without native streaming deliver the whole response as one piece
+        yield await self.generate(model, system_prompt, prompt, params, shared=shared)
+
+
+class LocalModelProvider(ModelProvider):
+    """
+    Deterministic offline stand-in for a real model.
+    The same (model, system_prompt, prompt) always produces the same response.
+    'latency' (seconds) simulates the provider's response time so throughput
+    and concurrency can be measured without a network; when streaming,
+    'token_latency' (seconds) is added between tokens.
+    """
+    name = 'local'
+
+    def __init__(self, latency=0.0, max_words=48, token_latency=0.0):
+        self.latency = latency
+        self.max_words = max_words
+        self.token_latency = token_latency
+
+    def _response_text(self, model, system_prompt, prompt):
+        # A short digest identifies the exact request, followed by an echo of the prompt
+        digest = hashlib.sha256(f"{model}\0{system_prompt}\0{prompt}".encode('utf-8')).hexdigest()[:12]
+        words = (prompt or '').split()[:self.max_words]
+        return ' '.join([f"[{model}:{digest}]"] + words)
+
+    async def generate(self, model, system_prompt, prompt, params=None, shared=True):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return self._response_text(model, system_prompt, prompt)
+
+    async def stream(self, model, system_prompt, prompt, params=None, shared=True):
+        if self.latency:
+            await asyncio.sleep(self.latency) # Time to first token
+        words = self._response_text(model, system_prompt, prompt).split(' ')
+        for index, word in enumerate(words):
+            if index and self.token_latency:
+                await asyncio.sleep(self.token_latency)
+            # Each token carries its leading space, so joining the tokens gives the full text
+            yield word if index == 0 else ' ' + word
+
+
+# --- Provider registry ---
+# Maps a model name (exact match) or a prefix ending with '*' to a provider.
+_providers = {}
+_default_provider = LocalModelProvider()
+
+
+def register_provider(model_pattern, provider):
+    """
+    Registers a provider for a model name, e.g. register_provider('gpt-*', provider).
+    """
+    _providers[model_pattern] = provider
+
+
+def unregister_provider(model_pattern):
+    """
+    Removes the provider registered for a model name or pattern, if any.
+    """
+    _providers.pop(model_pattern, None)
+
+
+def set_default_provider(provider):
+    """
+    Sets the provider used for models that have no registered provider.
+    """
+    global _default_provider
+    _default_provider = provider
+
+
+def get_provider(model):
+    """
+    Returns the provider for a model name: exact match first, then the longest
+    matching prefix pattern, then the default provider.
+    """
+    if model in _providers:
+        return _providers[model]
+
+    best_match = None
+    for pattern in _providers:
+        if pattern.endswith('*') and model.startswith(pattern[:-1]):
+            if best_match is None or len(pattern) > len(best_match):
+                best_match = pattern
+    if best_match is not None:
+        return _providers[best_match]
+
+    return _default_provider
+# --- End Provider registry ---
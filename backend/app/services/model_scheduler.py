@@ -0,0 +1,414 @@
+# Rate-limited priority scheduler for agent calls.
+# Providers limit every model to so many requests and tokens per minute; when
+# many nodemaps run at once they all hit the same few models, and calls beyond
+# the limit come back as 429s and turn into retry storms. Instead, every call
+# to a rate-limited model first asks the scheduler for a slot:
+# - each model has two token buckets, requests per minute and tokens per minute
+#   (MODEL_RATE_LIMITS). A call takes one request and its estimated tokens
+#   (prompt + expected output); the difference to the real output is settled
+#   when the call finishes.
+# - calls that cannot run yet wait in a queue per priority class: 'interactive'
+#   (streamagent and runnodemap, someone is waiting for the answer) always goes
+#   before 'batch' (background jobs). Batch calls also leave a share of every
+#   bucket (MODEL_SCHEDULER_INTERACTIVE_RESERVE) untouched, so an interactive
+#   call does not have to wait for the budget to refill after a batch burst.
+# - within a class, users take turns (round robin), so one user's large batch
+#   does not hold back everyone else's.
+# - queue depth, wait times and outcomes are exposed as metrics and through
+#   /execution/schedulerstats.
+# The limits are enforced per process; with several worker processes, divide
+# the provider's limits between them.
+import asyncio
+import collections
+import concurrent.futures
+import logging
+import threading
+import time
+
+from app.services.metrics import registry
+from app.services.model_providers import ModelProviderError
+
+logger = logging.getLogger(__name__)
+
+PRIORITY_INTERACTIVE = 'interactive'
+PRIORITY_BATCH = 'batch'
+PRIORITIES = (PRIORITY_INTERACTIVE, PRIORITY_BATCH) # Highest first
+
+SCHEDULER_QUEUE_DEPTH = registry.gauge(
+    'model_scheduler_queue_depth', 'Agent calls waiting for a rate-limited model.', ('model', 'priority'))
+SCHEDULER_WAIT = registry.histogram(
+    'model_scheduler_wait_seconds', 'Time agent calls waited for a rate-limited model.', ('model', 'priority'))
+SCHEDULER_CALLS = registry.counter(
+    'model_scheduler_calls_total', 'Agent calls to rate-limited models, by outcome.', ('model', 'priority', 'outcome'))
+
+# Waits kept per model and priority for the percentiles of stats()
+RECENT_WAITS = 1000
+
+
+class ModelSchedulerTimeout(ModelProviderError):
+    """
+    Raised when a call waited longer than its priority class allows for a rate-limited model.
+    """
+    pass
+
+
+def parse_rate_limits(text):
+    """
+    Parses MODEL_RATE_LIMITS: 'pattern=requests/tokens' entries separated by commas,
+    limits per minute, e.g. 'gpt-4o=500/150000,gemini-*=300/'. An empty or 0 limit
+    means unlimited. Returns {pattern: (requests_per_minute, tokens_per_minute)}.
+    """
+    limits = {}
+    for entry in (text or '').split(','):
+        entry = entry.strip()
+        if not entry:
+            continue
+        try:
+            pattern, values = entry.split('=', 1)
+            requests, _, tokens = values.partition('/')
+            limits[pattern.strip()] = (int(requests or 0) or None, int(tokens or 0) or None)
+        except ValueError:
+            raise ValueError(f"Invalid MODEL_RATE_LIMITS entry {entry!r}, expected 'model=requests/tokens'")
+    return limits
+
+
+class TokenBucket:
+    """
+    Holds up to 'per_minute' units and refills at per_minute / 60 units per second.
+    The level may go below zero when a call used more than it was charged for;
+    that debt is paid back by the refill.
+    """
+
+    def __init__(self, per_minute, now):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.level = self.capacity
+        self.updated = now
+
+    def refill(self, now):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount, floor):
+        """
+        Seconds until 'amount' can be taken while leaving at least 'floor' in the bucket.
+        """
+        missing = amount + floor - self.level
+        return max(0.0, missing / self.rate)
+
+    def give_back(self, amount):
+        self.level = min(self.capacity, self.level + amount)
+
+
+class _Ticket:
+    __slots__ = ('user_id', 'priority', 'tokens', 'future', 'enqueued_at')
+
+    def __init__(self, user_id, priority, tokens, now):
+        self.user_id = user_id
+        self.priority = priority
+        self.tokens = tokens
+        self.future = concurrent.futures.Future()
+        self.enqueued_at = now
+
+
+class _ModelLimiter:
+    """
+    The buckets and wait queues of one model.
+    queues[priority] maps user_id -> deque of tickets; the first user in the
+    OrderedDict is served next and then moves to the end (round robin).
+    """
+
+    def __init__(self, model, requests_per_minute, tokens_per_minute, now):
+        self.model = model
+        self.requests = TokenBucket(requests_per_minute, now) if requests_per_minute else None
+        self.tokens = TokenBucket(tokens_per_minute, now) if tokens_per_minute else None
+        self.queues = {priority: collections.OrderedDict() for priority in PRIORITIES}
+        self.depth = dict.fromkeys(PRIORITIES, 0)
+        self.waits = {priority: collections.deque(maxlen=RECENT_WAITS) for priority in PRIORITIES}
+        self.outcomes = collections.Counter()
+
+    def enqueue(self, ticket):
+        self.queues[ticket.priority].setdefault(ticket.user_id, collections.deque()).append(ticket)
+        self.depth[ticket.priority] += 1
+        SCHEDULER_QUEUE_DEPTH.set(self.depth[ticket.priority], (self.model, ticket.priority))
+
+    def remove(self, ticket):
+        user_queue = self.queues[ticket.priority].get(ticket.user_id)
+        if user_queue is None or ticket not in user_queue:
+            return False
+        user_queue.remove(ticket)
+        if not user_queue:
+            del self.queues[ticket.priority][ticket.user_id]
+        self.depth[ticket.priority] -= 1
+        SCHEDULER_QUEUE_DEPTH.set(self.depth[ticket.priority], (self.model, ticket.priority))
+        return True
+
+    def _pop_next(self, priority):
+        queue = self.queues[priority]
+        user_id, user_queue = next(iter(queue.items()))
+        ticket = user_queue.popleft()
+        if user_queue:
+            queue.move_to_end(user_id) # The user's next call waits for everyone else's turn
+        else:
+            del queue[user_id]
+        self.depth[priority] -= 1
+        SCHEDULER_QUEUE_DEPTH.set(self.depth[priority], (self.model, priority))
+        return ticket
+
+    def _charges(self, ticket, reserve):
+        # (bucket, amount, floor) for every limited bucket; a call larger than what
+        # the bucket may ever hold is charged that maximum, so it can still run
+        for bucket, amount in ((self.requests, 1), (self.tokens, ticket.tokens)):
+            if bucket is not None:
+                floor = bucket.capacity * reserve
+                yield bucket, min(amount, bucket.capacity - floor), floor
+
+    def dispatch(self, now, interactive_reserve):
+        """
+        Grants every call that can run now, highest priority first.
+        Returns the seconds until the next queued call can run (None if nothing waits).
+        """
+        for bucket in (self.requests, self.tokens):
+            if bucket is not None:
+                bucket.refill(now)
+        for priority in PRIORITIES:
+            reserve = interactive_reserve if priority == PRIORITY_BATCH else 0.0
+            queue = self.queues[priority]
+            while queue:
+                ticket = next(iter(queue.values()))[0]
+                charges = list(self._charges(ticket, reserve))
+                wait = max((bucket.wait_time(amount, floor) for bucket, amount, floor in charges), default=0.0)
+                if wait > 0:
+                    # Lower classes wait too: they must not take the budget this call is waiting for
+                    return wait
+                self._pop_next(priority)
+                if not ticket.future.set_running_or_notify_cancel():
+                    continue # The caller gave up meanwhile
+                for bucket, amount, _ in charges:
+                    bucket.level -= amount
+                    if bucket is self.tokens:
+                        ticket.tokens = amount # What release() settles against
+                waited = now - ticket.enqueued_at
+                self.waits[priority].append(waited)
+                self.outcomes[(priority, 'granted')] += 1
+                SCHEDULER_WAIT.observe(waited, (self.model, priority))
+                SCHEDULER_CALLS.inc((self.model, priority, 'granted'))
+                ticket.future.set_result(ticket)
+        return None
+
+
+class SchedulerGrant:
+    """
+    Permission to make one call. release() settles the tokens the call was
+    charged for with the tokens it really used, and must be called when it ends.
+    """
+
+    def __init__(self, scheduler, limiter, ticket, prompt_tokens):
+        self._scheduler = scheduler
+        self._limiter = limiter
+        self._ticket = ticket
+        self._prompt_tokens = prompt_tokens
+        self._released = False
+
+    def release(self, output_tokens=0):
+        if self._released:
+            return
+        self._released = True
+        if self._limiter.tokens is not None:
+            self._scheduler._settle(self._limiter, self._ticket.tokens - (self._prompt_tokens + output_tokens))
+
+
+class ModelScheduler:
+    """
+    Hands out call slots for rate-limited models; see the top of this module.
+    'limits' is {model name or prefix pattern ending with '*': (requests/min, tokens/min)}.
+    'max_wait' is {priority: seconds} after which a waiting call fails with ModelSchedulerTimeout.
+    """
+
+    def __init__(self, limits, interactive_reserve=0.2, output_tokens=256, max_wait=None):
+        self.limits = dict(limits)
+        self.interactive_reserve = interactive_reserve
+        self.output_tokens = output_tokens
+        self.max_wait = dict({PRIORITY_INTERACTIVE: 30.0, PRIORITY_BATCH: 600.0}, **(max_wait or {}))
+        self._limiters = {}
+        self._condition = threading.Condition()
+        self._thread = None
+
+    def limits_for(self, model):
+        """
+        (requests/min, tokens/min) for a model: exact match first, then the longest prefix pattern.
+        None if the model is not rate limited.
+        """
+        if model in self.limits:
+            return self.limits[model]
+        best_match = None
+        for pattern in self.limits:
+            if pattern.endswith('*') and (model or '').startswith(pattern[:-1]):
+                if best_match is None or len(pattern) > len(best_match):
+                    best_match = pattern
+        return self.limits[best_match] if best_match is not None else None
+
+    def _limiter(self, model):
+        # Called with the condition's lock held
+        limiter = self._limiters.get(model)
+        if limiter is None:
+            limits = self.limits_for(model)
+            if limits is None or limits == (None, None):
+                return None
+            limiter = self._limiters[model] = _ModelLimiter(model, *limits, time.monotonic())
+        return limiter
+
+    async def acquire(self, model, user_id, priority, prompt_tokens, output_tokens=None):
+        """
+        Waits until a call to 'model' may be made and returns a SchedulerGrant,
+        or None if the model is not rate limited. Raises ModelSchedulerTimeout
+        after the priority's max_wait.
+        """
+        if priority not in PRIORITIES:
+            raise ValueError(f"Unknown priority {priority!r}")
+        user_id = None if user_id is None else int(user_id) # JWT identities are strings, job rows hold ints
+        expected_output = self.output_tokens if output_tokens is None else output_tokens
+        with self._condition:
+            limiter = self._limiter(model)
+            if limiter is None:
+                return None
+            ticket = _Ticket(user_id, priority, prompt_tokens + expected_output, time.monotonic())
+            limiter.enqueue(ticket)
+            limiter.dispatch(time.monotonic(), self.interactive_reserve)
+            if not ticket.future.done():
+                self._start_dispatcher()
+                self._condition.notify()
+        grant = SchedulerGrant(self, limiter, ticket, prompt_tokens)
+        if ticket.future.done():
+            return grant # No wait at all, the common case below the limits
+
+        try:
+            await asyncio.wait_for(asyncio.wrap_future(ticket.future), self.max_wait[priority])
+            return grant
+        except BaseException as e: # Timed out, or the run was cancelled
+            with self._condition:
+                limiter.remove(ticket)
+                # The dispatcher only grants with this lock held, so the ticket is now either cancelled or granted
+                if ticket.future.cancel() or ticket.future.cancelled():
+                    outcome = 'timeout' if isinstance(e, asyncio.TimeoutError) else 'cancelled'
+                    limiter.outcomes[(priority, outcome)] += 1
+                    SCHEDULER_CALLS.inc((model, priority, outcome))
+            if not ticket.future.cancelled():
+                # Granted just as the caller gave up: give the whole charge back
+                self._settle(limiter, ticket.tokens, requests=1)
+            if isinstance(e, asyncio.TimeoutError):
+                raise ModelSchedulerTimeout(
+                    f"Model '{model}' is at its rate limit: no slot within {self.max_wait[priority]:g}s") from None
+            raise
+
+    def _settle(self, limiter, tokens, requests=0):
+        """
+        Gives unused tokens (and requests) back to a model's buckets; negative amounts are taken.
+        """
+        with self._condition:
+            if limiter.tokens is not None:
+                limiter.tokens.refill(time.monotonic())
+                limiter.tokens.give_back(tokens)
+            if requests and limiter.requests is not None:
+                limiter.requests.give_back(requests)
+            if tokens > 0 or requests:
+                self._condition.notify() # Waiting calls may fit now
+
+    # --- Dispatcher thread ---
+    def _start_dispatcher(self):
+        # Called with the condition's lock held
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run_dispatcher, name='model-scheduler', daemon=True)
+            self._thread.start()
+
+    def _run_dispatcher(self):
+        """
+        Grants queued calls as the buckets refill. Sleeps until the earliest
+        queued call can run, or until a new call or returned budget wakes it.
+        """
+        with self._condition:
+            while True:
+                now = time.monotonic()
+                waits = [limiter.dispatch(now, self.interactive_reserve) for limiter in self._limiters.values()]
+                waits = [wait for wait in waits if wait is not None]
+                # An idle dispatcher still wakes now and then; it costs nothing measurable
+                self._condition.wait(timeout=min(waits) if waits else 60.0)
+    # --- End Dispatcher thread ---
+
+    def stats(self):
+        """
+        Per model: limits, what is left in the buckets, queued calls and recent waits per priority.
+        """
+        def percentile(values, fraction):
+            if not values:
+                return None
+            values = sorted(values)
+            return round(values[min(len(values) - 1, int(fraction * len(values)))], 6)
+
+        with self._condition:
+            now = time.monotonic()
+            models = {}
+            for model, limiter in self._limiters.items():
+                for bucket in (limiter.requests, limiter.tokens):
+                    if bucket is not None:
+                        bucket.refill(now)
+                models[model] = {
+                    'requests_per_minute': int(limiter.requests.capacity) if limiter.requests else None,
+                    'tokens_per_minute': int(limiter.tokens.capacity) if limiter.tokens else None,
+                    'requests_available': int(limiter.requests.level) if limiter.requests else None,
+                    'tokens_available': int(limiter.tokens.level) if limiter.tokens else None,
+                    'priorities': {
+                        priority: {
+                            'queued': limiter.depth[priority],
+                            'waiting_users': len(limiter.queues[priority]),
+                            'granted': limiter.outcomes[(priority, 'granted')],
+                            'timeouts': limiter.outcomes[(priority, 'timeout')],
+                            'wait_p50': percentile(limiter.waits[priority], 0.50),
+                            'wait_p95': percentile(limiter.waits[priority], 0.95),
+                        }
+                        for priority in PRIORITIES
+                    },
+                }
+        return {
+            'limits': {pattern: {'requests_per_minute': requests, 'tokens_per_minute': tokens}
+                       for pattern, (requests, tokens) in self.limits.items()},
+            'interactive_reserve': self.interactive_reserve,
+            'models': models,
+        }
+
+
+# --- Shared scheduler instance ---
+# Configured by create_app(); None means no model is rate limited.
+_model_scheduler = None
+
+
+def configure_model_scheduler(scheduler):
+    global _model_scheduler
+    _model_scheduler = scheduler
+
+
+def get_model_scheduler():
+    return _model_scheduler
+# --- End Shared scheduler instance ---
+
+
+def init_model_scheduler(app):
+    """
+    Creates the scheduler from MODEL_RATE_LIMITS (no limits, no scheduler).
+    """
+    limits = parse_rate_limits(app.config['MODEL_RATE_LIMITS'])
+    if not limits:
+        configure_model_scheduler(None)
+        return None
+    scheduler = ModelScheduler(
+        limits,
+        interactive_reserve=app.config['MODEL_SCHEDULER_INTERACTIVE_RESERVE'],
+        output_tokens=app.config['MODEL_SCHEDULER_OUTPUT_TOKENS'],
+        max_wait={
+            PRIORITY_INTERACTIVE: app.config['MODEL_SCHEDULER_MAX_WAIT_INTERACTIVE'],
+            PRIORITY_BATCH: app.config['MODEL_SCHEDULER_MAX_WAIT_BATCH'],
+        },
+    )
+    configure_model_scheduler(scheduler)
+    logger.info(f"Model rate limits: {app.config['MODEL_RATE_LIMITS']}")
+    return scheduler
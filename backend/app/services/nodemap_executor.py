@@ -0,0 +1,349 @@
+# Execution engine for Nodemaps.
+# A nodemap is a directed graph of AIAgentNodes: each node runs its Agent
+# (model + system_prompt) on the outputs of the nodes that point to it.
+# Nodes whose inputs are ready run concurrently (bounded by max_concurrency),
+# and every node's timing is recorded so the critical path can be reported.
+# Inputs are fitted to each agent's context budget before a provider is called,
+# and calls to rate-limited models wait for the model scheduler (app/services/model_scheduler.py).
+import asyncio
+import time
+
+from app.services.graph_index import build_graph_index
+from app.services.model_providers import get_provider
+from app.services.response_cache import get_response_cache, response_cache_key
+from app.services.model_scheduler import ModelSchedulerTimeout, PRIORITY_BATCH, PRIORITY_INTERACTIVE, get_model_scheduler
+from app.services.tokens import ContextBudgetExceeded, agent_input_fitter, agent_prompt_tokens, count_tokens, encoding_for
+
+
+class NodemapExecutionError(Exception):
+    """
+    Raised when a nodemap cannot be executed at all
+    (e.g. it contains a cycle or a node without a resolvable agent).
+    """
+    pass
+
+
+# --- Planning ---
+def build_execution_plan(nodes, edges):
+    """
+    Computes a topological schedule for the graph.
+
+    Returns a dict with:
+        'order':        node ids in topological order
+        'predecessors': {node_id: [node ids feeding into it, in topological order]}
+        'successors':   {node_id: [node ids it feeds]}
+        'levels':       lists of node ids that can run at the same time
+    Edges that reference unknown nodes are ignored.
+    Raises NodemapExecutionError if the graph has a cycle.
+    """
+    node_ids = [node['id'] for node in nodes if isinstance(node, dict) and node.get('id') is not None]
+    edge_pairs = [(edge.get('source'), edge.get('target')) for edge in edges if isinstance(edge, dict)]
+    return execution_plan_from_index(build_graph_index(node_ids, edge_pairs))
+
+
+def execution_plan_from_index(index):
+    """
+    Returns the execution plan contained in a graph index (see app/services/graph_index.py).
+    Raises NodemapExecutionError if the graph has a cycle.
+    """
+    if index['has_cycle']:
+        raise NodemapExecutionError(f"Nodemap contains a cycle involving nodes: {', '.join(index['cycle_nodes'])}")
+    return {
+        'order': index['order'],
+        'predecessors': index['predecessors'],
+        'successors': index['successors'],
+        'levels': index['levels'],
+    }
+
+
+def resolve_node_agents(nodes, agents_by_id):
+    """
+    Maps each node id to the agent referenced by node.data.agentId.
+    'agents_by_id' maps agent ids to objects/dicts with 'model' and 'system_prompt'.
+    Raises NodemapExecutionError listing every node whose agent cannot be found.
+    """
+    resolved = {}
+    missing = []
+    for node in nodes:
+        if not isinstance(node, dict) or node.get('id') is None:
+            continue
+        node_id = str(node['id'])
+        node_data = node.get('data') if isinstance(node.get('data'), dict) else {}
+        try:
+            agent = agents_by_id.get(int(node_data.get('agentId')))
+        except (TypeError, ValueError):
+            agent = None
+        if agent is None:
+            missing.append(node_id)
+        else:
+            resolved[node_id] = agent
+    if missing:
+        raise NodemapExecutionError(f"No agent found for nodes: {', '.join(missing)}")
+    return resolved
+# --- End Planning ---
+
+
+def _agent_field(agent, field):
+    # Agents can be passed as model instances or as plain dicts
+    return agent.get(field) if isinstance(agent, dict) else getattr(agent, field)
+
+
+def _compose_input(node_id, plan, outputs, initial_input):
+    """
+    Entry nodes receive the run's input; every other node receives the
+    outputs of its predecessors, joined in topological order.
+    """
+    predecessors = plan['predecessors'][node_id]
+    if not predecessors:
+        return initial_input
+    return '\n\n'.join(outputs[predecessor] for predecessor in predecessors)
+
+
+def _critical_path(plan, timings):
+    """
+    Walks back from the node that finished last, always following the
+    predecessor that finished last, to find the chain that bounded the run.
+    """
+    finished = [node_id for node_id in plan['order'] if node_id in timings]
+    if not finished:
+        return []
+    node_id = max(finished, key=lambda n: timings[n]['finished_at'])
+    path = [node_id]
+    while True:
+        done_predecessors = [p for p in plan['predecessors'][node_id] if p in timings]
+        if not done_predecessors:
+            break
+        node_id = max(done_predecessors, key=lambda n: timings[n]['finished_at'])
+        path.append(node_id)
+    path.reverse()
+    return path
+
+
+def agent_uses_cache(agent):
+    """
+    Agents opt out of response caching with cache_responses=False (e.g. nondeterministic agents).
+    """
+    return _agent_field(agent, 'cache_responses') is not False
+
+
+async def execute_nodemap_graph(nodes, edges, agents_by_id, initial_input, max_concurrency=8,
+                                provider_for=get_provider, params=None, cache=None, plan=None,
+                                on_node_update=None, node_inputs=None, fit_input=None,
+                                scheduler=None, user_id=None, priority=PRIORITY_BATCH):
+    """
+    Runs every node of the graph and returns a JSON-serializable result:
+        {
+          'status': 'completed' | 'failed',
+          'outputs': {node_id: text},
+          'nodes': {node_id: {'status', 'agent_id', 'model', 'cached', 'input_truncated',
+                              'started_at', 'finished_at', 'wall_time', 'error'}},
+          'critical_path': [node ids], 'critical_path_time': seconds,
+          'wall_time': seconds, 'max_concurrency': n
+        }
+    Times are seconds relative to the start of the run.
+    If a ResponseCache is given, cached responses are used instead of calling the
+    provider (for agents that allow it) and new responses are stored in it.
+    A node that fails causes every node downstream of it to be 'skipped'.
+    A precomputed plan (see execution_plan_from_index) can be passed in.
+    on_node_update(node_id, status), if given, is called when a node starts
+    ('running') and when it ends (its final status).
+    If a node_inputs dict is given, the input each node ran on is stored in it (for the run history).
+    fit_input(agent, text) -> (text, truncated), if given, fits every node's input to
+    its agent's context budget (see app/services/tokens.py) before the cache or the
+    provider sees it; a node whose input is rejected fails without calling the provider.
+    The run's own input is checked for the entry nodes before anything runs:
+    NodemapExecutionError is raised if it is rejected.
+    If a ModelScheduler is given, every provider call first waits for a slot of its
+    model, queued as 'user_id' in the 'priority' class; a node that waits too long fails.
+    """
+    if plan is None:
+        plan = build_execution_plan(nodes, edges)
+    node_agents = resolve_node_agents(nodes, agents_by_id)
+
+    # --- Budget check of the run's input, before any node runs ---
+    entry_inputs = {} # node_id -> (fitted input, truncated)
+    if fit_input is not None:
+        for node_id in plan['order']:
+            if plan['predecessors'][node_id]:
+                continue
+            try:
+                entry_inputs[node_id] = fit_input(node_agents[node_id], initial_input)
+            except ContextBudgetExceeded as e:
+                raise NodemapExecutionError(f"Input does not fit node {node_id}: {e}")
+    # --- End Budget check ---
+
+    semaphore = asyncio.Semaphore(max(1, int(max_concurrency)))
+    run_started = time.perf_counter()
+    outputs = {}
+    timings = {}
+    node_results = {}
+    done_events = {node_id: asyncio.Event() for node_id in plan['order']}
+
+    async def run_node(node_id):
+        # Wait until every predecessor has finished (successfully or not)
+        for predecessor in plan['predecessors'][node_id]:
+            await done_events[predecessor].wait()
+
+        agent = node_agents[node_id]
+        result = {
+            'status': 'skipped',
+            'agent_id': _agent_field(agent, 'id'),
+            'model': _agent_field(agent, 'model'),
+            'cached': False,
+            'input_truncated': False,
+            'started_at': None,
+            'finished_at': None,
+            'wall_time': None,
+            'error': None,
+        }
+        node_results[node_id] = result
+        try:
+            if any(predecessor not in outputs for predecessor in plan['predecessors'][node_id]):
+                return # An upstream node failed or was skipped
+
+            if on_node_update is not None:
+                on_node_update(node_id, 'running')
+            prompt = _compose_input(node_id, plan, outputs, initial_input)
+            if fit_input is not None:
+                try:
+                    prompt, result['input_truncated'] = entry_inputs.get(node_id) or fit_input(agent, prompt)
+                except ContextBudgetExceeded as e:
+                    # The upstream outputs are too long for this agent
+                    result['status'] = 'failed'
+                    result['error'] = str(e)
+                    return
+            if node_inputs is not None:
+                node_inputs[node_id] = prompt
+            model = _agent_field(agent, 'model')
+            system_prompt = _agent_field(agent, 'system_prompt')
+
+            # --- Cache lookup: a hit never reaches the provider ---
+            cache_key = None
+            if cache is not None and agent_uses_cache(agent):
+                cache_key = response_cache_key(model, system_prompt, prompt, params)
+                started = time.perf_counter()
+                cached_output = cache.get(cache_key)
+                if cached_output is not None:
+                    outputs[node_id] = cached_output
+                    result['status'] = 'completed'
+                    result['cached'] = True
+                    finished = time.perf_counter()
+            # --- End Cache lookup ---
+
+            if not result['cached']:
+                grant = None
+                try:
+                    if scheduler is not None:
+                        # Waits, without taking one of the run's concurrency slots, while the model is at its rate limit
+                        prompt_tokens = agent_prompt_tokens(agent) + count_tokens(model, prompt)
+                        grant = await scheduler.acquire(model, user_id, priority, prompt_tokens,
+                                                        output_tokens=(params or {}).get('max_tokens'))
+                except ModelSchedulerTimeout as e:
+                    started = finished = time.perf_counter()
+                    result['status'] = 'failed'
+                    result['error'] = str(e)
+                else:
+                    try:
+                        async with semaphore:
+                            started = time.perf_counter()
+                            try:
+                                # Agents that opt out of caching also opt out of sharing a call with identical requests
+                                outputs[node_id] = await provider_for(model).generate(
+                                    model, system_prompt, prompt, params, shared=agent_uses_cache(agent))
+                                result['status'] = 'completed'
+                                if cache_key is not None:
+                                    cache.set(cache_key, outputs[node_id])
+                            except Exception as e:
+                                result['status'] = 'failed'
+                                result['error'] = str(e)
+                            finished = time.perf_counter()
+                    finally:
+                        # Also when the run is cancelled while waiting for a concurrency slot
+                        if grant is not None:
+                            grant.release(count_tokens(model, outputs.get(node_id)))
+
+            timings[node_id] = {'started_at': started - run_started, 'finished_at': finished - run_started}
+            result['started_at'] = round(started - run_started, 6)
+            result['finished_at'] = round(finished - run_started, 6)
+            result['wall_time'] = round(finished - started, 6)
+        except asyncio.CancelledError:
+            result['status'] = 'cancelled' # The whole run was cancelled (e.g. a background job)
+            raise
+        finally:
+            done_events[node_id].set()
+            if on_node_update is not None:
+                on_node_update(node_id, result['status'])
+
+    await asyncio.gather(*(run_node(node_id) for node_id in plan['order']))
+    wall_time = time.perf_counter() - run_started
+
+    critical_path = _critical_path(plan, timings)
+    critical_path_time = sum(
+        timings[node_id]['finished_at'] - timings[node_id]['started_at'] for node_id in critical_path
+    )
+
+    return {
+        'status': 'completed' if all(r['status'] == 'completed' for r in node_results.values()) else 'failed',
+        'outputs': {node_id: outputs[node_id] for node_id in plan['order'] if node_id in outputs},
+        'nodes': {node_id: node_results[node_id] for node_id in plan['order']},
+        'critical_path': critical_path,
+        'critical_path_time': round(critical_path_time, 6),
+        'wall_time': round(wall_time, 6),
+        'max_concurrency': max(1, int(max_concurrency)),
+    }
+
+
+def prepare_nodemap_run(nodemap):
+    """
+    Loads what running a Nodemap needs: returns (nodes, edges, agents_by_id, plan).
+    Agents are plain dicts, so they stay usable after the session is committed or closed;
+    they carry their system prompt's token count for the context budget check.
+    Raises NodemapExecutionError if the map cannot run.
+    """
+    # Imported here so the engine itself stays usable without an app context
+    from app.models import Agent
+    from app.services.nodemap_graph import load_nodemap_graph
+    from app.services.graph_index import get_graph_index
+
+    # The stored graph index tells whether the map can run before its nodes are loaded
+    index = get_graph_index(nodemap)
+    plan = execution_plan_from_index(index)
+    if index['nodes_without_agent']:
+        raise NodemapExecutionError(f"No agent found for nodes: {', '.join(index['nodes_without_agent'])}")
+
+    nodes, edges = load_nodemap_graph(nodemap)
+
+    # Only load the agents the nodes actually reference (and only the owner's)
+    agent_ids = set()
+    for node in nodes:
+        node_data = node.get('data') if isinstance(node, dict) and isinstance(node.get('data'), dict) else {}
+        try:
+            agent_ids.add(int(node_data.get('agentId')))
+        except (TypeError, ValueError):
+            pass
+    agents_by_id = {}
+    if agent_ids:
+        query = Agent.query.filter(Agent.user_id == nodemap.user_id, Agent.id.in_(agent_ids))
+        agents_by_id = {
+            agent.id: {'id': agent.id, 'model': agent.model, 'system_prompt': agent.system_prompt,
+                       'cache_responses': agent.cache_responses,
+                       'system_prompt_tokens': agent_prompt_tokens(agent),
+                       'system_prompt_token_encoding': encoding_for(agent.model).name}
+            for agent in query
+        }
+    return nodes, edges, agents_by_id, plan
+
+
+def run_nodemap(nodemap, initial_input, max_concurrency=8, params=None, node_inputs=None):
+    """
+    Loads a Nodemap's graph and its owner's agents and executes it.
+    Synchronous wrapper around execute_nodemap_graph() for use from Flask routes.
+    Inputs are fitted to the agents' context budgets; the caller is waiting, so
+    rate-limited models are called with interactive priority.
+    """
+    nodes, edges, agents_by_id, plan = prepare_nodemap_run(nodemap)
+    return asyncio.run(execute_nodemap_graph(
+        nodes, edges, agents_by_id, initial_input, max_concurrency=max_concurrency, params=params,
+        cache=get_response_cache(), plan=plan, node_inputs=node_inputs, fit_input=agent_input_fitter(),
+        scheduler=get_model_scheduler(), user_id=nodemap.user_id, priority=PRIORITY_INTERACTIVE,
+    ))
@@ -0,0 +1,358 @@
+# Storage helpers for a Nodemap's graph (React Flow nodes and edges).
+# Nodes and edges are stored one row per element in the nodemap_node /
+# nodemap_edge tables, so saves only write the elements that changed and
+# single nodes can be read or queried without loading the whole map.
+import json
+
+from sqlalchemy import func, update
+from sqlalchemy.orm.attributes import set_committed_value
+
+from app import db
+from app.models import Nodemap, NodemapNode, NodemapEdge
+from app.services.nodemap_patch import apply_nodemap_patch, patch_targets
+
+
+class NodemapGraphError(ValueError):
+    """
+    Raised when nodes or edges sent by the client cannot be stored
+    (e.g. an element that is not an object, or two elements with the same id).
+    """
+    pass
+
+
+# --- Version counter ---
+def claim_next_version(nodemap, expected_version):
+    """
+    Compare-and-set of Nodemap.version, the first write of every save:
+        UPDATE nodemap SET version = version + 1 WHERE id = :id AND version = :expected
+    Returns True when this transaction now owns the next version (nodemap.version
+    is updated to it), False when another save got there first; the caller must
+    then roll back and answer 409. The UPDATE takes the row lock (SQLite: the
+    write lock), so a concurrent save waits for this one to commit and then
+    finds the version changed, instead of both saving on top of the same version.
+    """
+    result = db.session.execute(
+        update(Nodemap)
+        .where(Nodemap.id == nodemap.id, Nodemap.version == expected_version)
+        .values(version=Nodemap.version + 1)
+        .execution_options(synchronize_session=False)
+    )
+    if result.rowcount != 1:
+        return False
+    # Already written by the UPDATE above, so the ORM must not write it again
+    set_committed_value(nodemap, 'version', expected_version + 1)
+    return True
+# --- End Version counter ---
+
+
+# --- Serialization helpers ---
+def serialize_element(element):
+    """
+    Serializes a node or edge to the JSON string stored in the 'data' column.
+    Keys are sorted so that an unchanged element always produces the same string,
+    which is what lets a full save skip rows that did not change.
+    """
+    return json.dumps(element, sort_keys=True, separators=(',', ':'))
+
+
+def agent_id_of(node):
+    """
+    Returns the agent referenced by an AIAgentNode (node.data.agentId) as an int, or None.
+    """
+    node_data = node.get('data')
+    if not isinstance(node_data, dict):
+        return None
+    try:
+        return int(node_data.get('agentId'))
+    except (TypeError, ValueError):
+        return None
+
+
+def _endpoint(edge, key):
+    value = edge.get(key)
+    return str(value) if value is not None else None
+
+
+def with_element_ids(elements):
+    """
+    Returns the list with an id given to every element that has none: 'legacy_<index>'
+    (its position in the list), like the backfill of the normalized tables did, plus
+    '~<index>' if another element already uses that id. The ids are deterministic,
+    so saving the same id-less list again addresses the same rows.
+    """
+    taken = {str(element['id']) for element in elements if isinstance(element, dict) and element.get('id') is not None}
+    result = []
+    for index, element in enumerate(elements):
+        if isinstance(element, dict) and element.get('id') is None:
+            element_id = f'legacy_{index}'
+            if element_id in taken:
+                element_id = f'{element_id}~{index}'
+            taken.add(element_id)
+            element = dict(element, id=element_id)
+        result.append(element)
+    return result
+
+
+def _index_elements(elements, kind):
+    """
+    Turns a list of nodes or edges into an ordered {element_id: element} dict.
+    Elements without an id get one (see with_element_ids).
+    """
+    indexed = {}
+    for element in with_element_ids(elements):
+        if not isinstance(element, dict):
+            raise NodemapGraphError(f"Every {kind} must be an object")
+        element_id = str(element['id'])
+        if element_id in indexed:
+            raise NodemapGraphError(f"Duplicate {kind} id: {element_id!r}")
+        indexed[element_id] = element
+    return indexed
+# --- End Serialization helpers ---
+
+
+# --- Row helpers ---
+# (model, element id column) for each collection
+_COLLECTION_MODELS = {
+    'nodes': (NodemapNode, 'node_id'),
+    'edges': (NodemapEdge, 'edge_id'),
+}
+
+
+def _fill_row(row, collection_name, element, serialized):
+    """
+    Copies an element into its row, including the indexed columns derived from it.
+    """
+    row.data = serialized
+    if collection_name == 'nodes':
+        row.agent_id = agent_id_of(element)
+    else:
+        row.source = _endpoint(element, 'source')
+        row.target = _endpoint(element, 'target')
+
+
+def _new_row(nodemap_id, collection_name, element_id, element, serialized, sort_index):
+    model, id_column = _COLLECTION_MODELS[collection_name]
+    row = model(nodemap_id=nodemap_id, sort_index=sort_index, **{id_column: element_id})
+    _fill_row(row, collection_name, element, serialized)
+    return row
+
+
+def _next_sort_index(collection_name, nodemap_id):
+    model, _ = _COLLECTION_MODELS[collection_name]
+    current_max = db.session.query(func.max(model.sort_index)).filter(model.nodemap_id == nodemap_id).scalar()
+    return 0 if current_max is None else current_max + 1
+# --- End Row helpers ---
+
+
+def is_normalized(nodemap):
+    """
+    True when the map's graph lives in the nodemap_node / nodemap_edge tables.
+    Maps created before the normalized tables keep their JSON in the legacy
+    columns until they are backfilled or saved for the first time.
+    """
+    return nodemap.nodes_data is None and nodemap.edges_data is None
+
+
+def load_nodemap_graph(nodemap):
+    """
+    Returns (nodes, edges) for a nodemap as lists of dicts, in their saved order.
+    """
+    if not is_normalized(nodemap):
+        # Ids are filled in as the first save will store them, so ops can address every element
+        nodes = json.loads(nodemap.nodes_data) if nodemap.nodes_data else []
+        edges = json.loads(nodemap.edges_data) if nodemap.edges_data else []
+        return with_element_ids(nodes), with_element_ids(edges)
+
+    node_rows = db.session.query(NodemapNode.data).filter(
+        NodemapNode.nodemap_id == nodemap.id
+    ).order_by(NodemapNode.sort_index, NodemapNode.id)
+    edge_rows = db.session.query(NodemapEdge.data).filter(
+        NodemapEdge.nodemap_id == nodemap.id
+    ).order_by(NodemapEdge.sort_index, NodemapEdge.id)
+
+    nodes = [json.loads(data) for (data,) in node_rows]
+    edges = [json.loads(data) for (data,) in edge_rows]
+    return nodes, edges
+
+
+def load_nodemap_graph_json(nodemap):
+    """
+    Like load_nodemap_graph(), but returns each node and edge as its stored JSON
+    string, without parsing it, so responses can include the elements as-is.
+    """
+    if not is_normalized(nodemap):
+        nodes, edges = load_nodemap_graph(nodemap)
+        return [json.dumps(node) for node in nodes], [json.dumps(edge) for edge in edges]
+
+    nodes = db.session.scalars(
+        db.select(NodemapNode.data).filter(NodemapNode.nodemap_id == nodemap.id)
+        .order_by(NodemapNode.sort_index, NodemapNode.id)
+    ).all()
+    edges = db.session.scalars(
+        db.select(NodemapEdge.data).filter(NodemapEdge.nodemap_id == nodemap.id)
+        .order_by(NodemapEdge.sort_index, NodemapEdge.id)
+    ).all()
+    return nodes, edges
+
+
+def _record_change(changes, collection_name, element_id, serialized=None, sort_index=None):
+    # Collects what a save wrote, for the version history (app/services/nodemap_history.py):
+    # {(collection, element id): (serialized element, sort_index), or None when removed}
+    if changes is not None:
+        changes[(collection_name, element_id)] = (serialized, sort_index) if serialized is not None else None
+
+
+def save_nodemap_graph(nodemap, nodes, edges, changes=None):
+    """
+    Stores the complete nodes and edges lists for a nodemap.
+    Existing rows are diffed against the new elements by id, so only inserted,
+    changed, reordered or removed elements are written. Rows keep their sort_index
+    while they stay in order (indexes only need to increase along the list), so
+    removing an element does not rewrite every element after it.
+    The written elements are added to the 'changes' dict when one is given.
+    Does not commit; returns the number of rows written.
+    """
+    incoming = {
+        'nodes': _index_elements(nodes, 'node'),
+        'edges': _index_elements(edges, 'edge'),
+    }
+    # Any legacy JSON is superseded by the rows written below
+    nodemap.nodes_data = None
+    nodemap.edges_data = None
+
+    written = 0
+    for collection_name, elements in incoming.items():
+        model, id_column = _COLLECTION_MODELS[collection_name]
+        existing = {getattr(row, id_column): row for row in model.query.filter_by(nodemap_id=nodemap.id)}
+
+        previous_index = -1
+        for element_id, element in elements.items():
+            serialized = serialize_element(element)
+            row = existing.pop(element_id, None)
+            if row is not None and row.sort_index > previous_index:
+                sort_index = row.sort_index # Still in order
+            else:
+                sort_index = previous_index + 1
+            previous_index = sort_index
+            if row is None:
+                db.session.add(_new_row(nodemap.id, collection_name, element_id, element, serialized, sort_index))
+                _record_change(changes, collection_name, element_id, serialized, sort_index)
+                written += 1
+            elif row.data != serialized or row.sort_index != sort_index:
+                _fill_row(row, collection_name, element, serialized)
+                row.sort_index = sort_index
+                _record_change(changes, collection_name, element_id, serialized, sort_index)
+                written += 1
+
+        # Whatever is left was removed on the client
+        for element_id, row in existing.items():
+            db.session.delete(row)
+            _record_change(changes, collection_name, element_id)
+            written += 1
+
+    return written
+
+
+def patch_nodemap_graph(nodemap, ops, changes=None):
+    """
+    Applies JSON-Patch-style ops (see app/services/nodemap_patch.py) to a nodemap.
+    Only the rows targeted by the ops are loaded and written.
+    The written elements are added to the 'changes' dict when one is given.
+    Does not commit; returns the number of rows written.
+    Raises NodemapPatchError if the patch is invalid.
+    """
+    targets = patch_targets(ops)
+
+    if not is_normalized(nodemap):
+        # Convert the legacy JSON once, then patch the rows like any other map
+        nodes, edges = load_nodemap_graph(nodemap)
+        save_nodemap_graph(nodemap, nodes, edges, changes)
+        db.session.flush()
+
+    # --- Load only the targeted elements ---
+    rows = {}
+    collections = {}
+    for collection_name, element_ids in targets.items():
+        model, id_column = _COLLECTION_MODELS[collection_name]
+        rows[collection_name] = {}
+        if element_ids:
+            id_attr = getattr(model, id_column)
+            query = model.query.filter(model.nodemap_id == nodemap.id, id_attr.in_(element_ids))
+            rows[collection_name] = {getattr(row, id_column): row for row in query}
+        collections[collection_name] = {
+            element_id: json.loads(row.data) for element_id, row in rows[collection_name].items()
+        }
+    # --- End Load ---
+
+    apply_nodemap_patch(collections, ops)
+
+    # --- Write back the targeted elements ---
+    written = 0
+    for collection_name, element_ids in targets.items():
+        next_index = None
+        # New elements are appended in the order the ops introduced them
+        for element_id in element_ids:
+            row = rows[collection_name].get(element_id)
+            element = collections[collection_name].get(element_id)
+            if element is None:
+                if row is not None:
+                    db.session.delete(row)
+                    _record_change(changes, collection_name, element_id)
+                    written += 1
+                continue
+
+            serialized = serialize_element(element)
+            if row is None:
+                if next_index is None:
+                    next_index = _next_sort_index(collection_name, nodemap.id)
+                db.session.add(_new_row(nodemap.id, collection_name, element_id, element, serialized, next_index))
+                _record_change(changes, collection_name, element_id, serialized, next_index)
+                next_index += 1
+                written += 1
+            elif row.data != serialized:
+                _fill_row(row, collection_name, element, serialized)
+                _record_change(changes, collection_name, element_id, serialized, row.sort_index)
+                written += 1
+    # --- End Write back ---
+
+    return written
+
+
+def write_nodemap_elements(nodemap, updates, changes=None):
+    """
+    Writes given elements of a nodemap as-is: updates maps each collection name
+    ('nodes'/'edges') to {element_id: (serialized element, sort_index), or None to
+    remove it}. Only the rows of those elements are loaded and written.
+    Used to restore an earlier version (app/services/nodemap_history.py).
+    Does not commit; returns the number of rows written.
+    """
+    written = 0
+    for collection_name, elements in updates.items():
+        if not elements:
+            continue
+        model, id_column = _COLLECTION_MODELS[collection_name]
+        id_attr = getattr(model, id_column)
+        element_ids = list(elements)
+        rows = {}
+        for start in range(0, len(element_ids), 500): # Keeps the IN lists short
+            query = model.query.filter(model.nodemap_id == nodemap.id, id_attr.in_(element_ids[start:start + 500]))
+            rows.update((getattr(row, id_column), row) for row in query)
+
+        for element_id, value in elements.items():
+            row = rows.get(element_id)
+            if value is None:
+                if row is not None:
+                    db.session.delete(row)
+                    _record_change(changes, collection_name, element_id)
+                    written += 1
+                continue
+            serialized, sort_index = value
+            element = json.loads(serialized)
+            if row is None:
+                db.session.add(_new_row(nodemap.id, collection_name, element_id, element, serialized, sort_index))
+            else:
+                _fill_row(row, collection_name, element, serialized)
+                row.sort_index = sort_index
+            _record_change(changes, collection_name, element_id, serialized, sort_index)
+            written += 1
+    return written
@@ -0,0 +1,426 @@
+# Version history of nodemap graphs, for undo beyond the browser session.
+# Every save of a map's nodes/edges (full save, patch, collaborative edits,
+# import, restore) records a NodemapRevision for the map's new version.
+# Versions are not stored as copies of the map:
+# - each node/edge JSON is stored once in NodemapBlob, keyed by the SHA-256 of
+#   its serialized form (serialize_element sorts keys, so the same element always
+#   has the same hash); every version and map containing it shares the blob,
+# - NodemapHistoryElement rows record which blob an element had, and at which
+#   position, from one version (included) to another (excluded; NULL while
+#   current). A save closes the rows of the elements it changed or removed and
+#   opens rows for their new content, so it writes O(changed elements) rows.
+# The graph at version v is the set of element rows with from_version <= v < to_version.
+# Restoring or comparing versions only reads the element rows written between
+# them, and only the elements that differ are loaded and written; a restore is
+# itself a new version.
+#
+# Only the last NODEMAP_HISTORY_MAX_VERSIONS versions of each map are kept (older
+# ones are pruned as new ones are recorded). Blobs that no element row references
+# any more are deleted by 'flask nodemap-history-maintenance', also run by the job workers.
+import hashlib
+import json
+import logging
+from datetime import datetime, timedelta
+
+import click
+from flask import current_app
+from sqlalchemy import select, exists, or_
+
+from app import db
+from app.models import NodemapNode, NodemapEdge, NodemapRevision, NodemapHistoryElement, NodemapBlob
+from app.services.nodemap_graph import write_nodemap_elements
+from app.services.run_history import insert_ignoring_duplicates, in_chunks
+
+logger = logging.getLogger(__name__)
+
+COLLECTIONS = ('nodes', 'edges')
+
+# Blobs younger than this are never garbage-collected, so a save that is being
+# recorded while maintenance runs cannot lose a blob it is about to reference
+BLOB_GC_GRACE = timedelta(hours=1)
+BLOB_REFRESH_AFTER = BLOB_GC_GRACE / 2 # Blobs newer than this are not collectable before a save commits
+
+
+class NodemapHistoryError(ValueError):
+    """
+    Raised when a version is not (or no longer) in a nodemap's history.
+    """
+    pass
+
+
+# --- Blobs ---
+def element_hash(serialized):
+    return hashlib.sha256(serialized.encode('utf-8')).hexdigest()
+
+
+def store_blobs(connection, texts):
+    """
+    Stores each distinct serialized element once and returns {text: hash}.
+    """
+    hashes = {text: element_hash(text) for text in set(texts)}
+    if not hashes:
+        return hashes
+    table = NodemapBlob.__table__
+    now = datetime.utcnow()
+    existing = set()
+    for chunk in in_chunks(hashes.values()):
+        # Reused blobs get a fresh created_at, so delete_unreferenced_blobs leaves them alone
+        # until this save's element rows reference them. Refreshed first: a blob the GC
+        # deletes before this UPDATE is missing from the SELECT below and inserted again.
+        connection.execute(
+            table.update()
+            .where(table.c.hash.in_(chunk), table.c.created_at < now - BLOB_REFRESH_AFTER)
+            .values(created_at=now)
+        )
+        existing.update(connection.execute(select(table.c.hash).where(table.c.hash.in_(chunk))).scalars())
+    rows = [{'hash': digest, 'data': text, 'created_at': now}
+            for text, digest in hashes.items() if digest not in existing]
+    if rows:
+        connection.execute(insert_ignoring_duplicates(connection.dialect.name, table), rows)
+    return hashes
+
+
+def load_blobs(hashes):
+    """
+    Returns {hash: serialized element} for the given blob hashes.
+    """
+    table = NodemapBlob.__table__
+    blobs = {}
+    for chunk in in_chunks(set(hashes)):
+        blobs.update(db.session.execute(select(table.c.hash, table.c.data).where(table.c.hash.in_(chunk))).all())
+    return blobs
+# --- End Blobs ---
+
+
+# --- Recording versions ---
+def _current_elements(nodemap_id):
+    # {(collection, element id): (serialized element, sort_index)} from the map's rows
+    db.session.flush() # The rows written by this save are part of the graph
+    elements = {}
+    for collection, model, id_column in (('nodes', NodemapNode, NodemapNode.node_id),
+                                         ('edges', NodemapEdge, NodemapEdge.edge_id)):
+        rows = db.session.execute(select(id_column, model.sort_index, model.data).where(model.nodemap_id == nodemap_id))
+        for element_id, sort_index, data in rows:
+            elements[(collection, element_id)] = (data, sort_index)
+    return elements
+
+
+def _latest_version(connection, nodemap_id):
+    table = NodemapRevision.__table__
+    return connection.execute(
+        select(table.c.version, table.c.node_count, table.c.edge_count)
+        .where(table.c.nodemap_id == nodemap_id).order_by(table.c.version.desc()).limit(1)
+    ).first()
+
+
+def record_revision(nodemap, changes, source, restored_from=None):
+    """
+    Records the nodemap's current version in its history. 'changes' is the dict
+    filled by the save (see save_nodemap_graph). Call after the version was
+    incremented and the graph index refreshed; the caller commits.
+    Returns the version, or None when the history is disabled.
+    """
+    config = current_app.config
+    if not config['NODEMAP_HISTORY_ENABLED']:
+        return None
+    connection = db.session.connection()
+    revision_table = NodemapRevision.__table__
+    element_table = NodemapHistoryElement.__table__
+    version = nodemap.version
+
+    previous = _latest_version(connection, nodemap.id)
+    if previous is not None and previous.version == version - 1:
+        counts = {'nodes': previous.node_count, 'edges': previous.edge_count}
+    else:
+        # The map's first version in the history (or it was saved while the history
+        # was disabled): its whole current graph is recorded
+        connection.execute(element_table.update().where(
+            element_table.c.nodemap_id == nodemap.id, element_table.c.to_version.is_(None)
+        ).values(to_version=version))
+        changes = _current_elements(nodemap.id)
+        counts = {'nodes': 0, 'edges': 0}
+
+    opened = {key: value for key, value in changes.items() if value is not None}
+    hashes = store_blobs(connection, [serialized for serialized, _ in opened.values()])
+
+    # Close the rows of every element the save wrote...
+    for collection in COLLECTIONS:
+        element_ids = [element_id for name, element_id in changes if name == collection]
+        for chunk in in_chunks(element_ids):
+            counts[collection] -= connection.execute(element_table.update().where(
+                element_table.c.nodemap_id == nodemap.id,
+                element_table.c.collection == collection,
+                element_table.c.element_id.in_(chunk),
+                element_table.c.to_version.is_(None),
+            ).values(to_version=version)).rowcount
+    # ...and open rows for their new content
+    rows = []
+    for (collection, element_id), (serialized, sort_index) in opened.items():
+        counts[collection] += 1
+        rows.append({'nodemap_id': nodemap.id, 'collection': collection, 'element_id': element_id,
+                     'sort_index': sort_index, 'hash': hashes[serialized],
+                     'from_version': version, 'to_version': None})
+    if rows:
+        connection.execute(element_table.insert(), rows)
+
+    connection.execute(revision_table.insert().values(
+        nodemap_id=nodemap.id,
+        version=version,
+        source=source,
+        restored_from=restored_from,
+        node_count=counts['nodes'],
+        edge_count=counts['edges'],
+        changed_count=len(changes),
+        created_at=datetime.utcnow(),
+    ))
+    _prune(connection, nodemap.id, version, config['NODEMAP_HISTORY_MAX_VERSIONS'])
+    return version
+
+
+def _prune(connection, nodemap_id, version, max_versions):
+    # Drops the versions older than the last max_versions, and the element rows
+    # that only those versions used
+    oldest_kept = version - max_versions + 1
+    if oldest_kept <= 1:
+        return
+    revision_table = NodemapRevision.__table__
+    element_table = NodemapHistoryElement.__table__
+    connection.execute(revision_table.delete().where(
+        revision_table.c.nodemap_id == nodemap_id, revision_table.c.version < oldest_kept))
+    connection.execute(element_table.delete().where(
+        element_table.c.nodemap_id == nodemap_id,
+        element_table.c.to_version.isnot(None),
+        element_table.c.to_version <= oldest_kept,
+    ))
+# --- End Recording versions ---
+
+
+# --- Reading versions ---
+def revision_to_dict(revision):
+    return {
+        "version": revision.version,
+        "source": revision.source,
+        "restored_from": revision.restored_from,
+        "node_count": revision.node_count,
+        "edge_count": revision.edge_count,
+        "changed_count": revision.changed_count,
+        "created_at": revision.created_at.isoformat() if revision.created_at else None,
+    }
+
+
+def list_revisions(nodemap_id, limit=50, before=None):
+    """
+    The nodemap's most recent versions (newest first), optionally only those below 'before'.
+    One range scan of the (nodemap_id, version) unique index.
+    """
+    query = NodemapRevision.query.filter(NodemapRevision.nodemap_id == nodemap_id)
+    if before is not None:
+        query = query.filter(NodemapRevision.version < before)
+    return query.order_by(NodemapRevision.version.desc()).limit(limit).all()
+
+
+def get_revision(nodemap_id, version):
+    """
+    The NodemapRevision of a version. Raises NodemapHistoryError if it is not in the history.
+    """
+    revision = NodemapRevision.query.filter_by(nodemap_id=nodemap_id, version=version).first()
+    if revision is None:
+        raise NodemapHistoryError(f"Version {version} is not in the history of this nodemap")
+    return revision
+
+
+_ELEMENT_COLUMNS = ('collection', 'element_id', 'hash', 'sort_index')
+
+
+def _collect(query):
+    # {collection: {element id: (hash, sort_index)}} from a query on the element rows
+    elements = {collection: {} for collection in COLLECTIONS}
+    for collection, element_id, digest, sort_index in db.session.execute(query):
+        elements[collection][element_id] = (digest, sort_index)
+    return elements
+
+
+def _elements_at(nodemap_id, version=None):
+    # Every element of the map at a version (None: the current elements)
+    table = NodemapHistoryElement.__table__
+    query = select(*(table.c[name] for name in _ELEMENT_COLUMNS)).where(table.c.nodemap_id == nodemap_id)
+    if version is None:
+        query = query.where(table.c.to_version.is_(None))
+    else:
+        query = query.where(table.c.from_version <= version,
+                            or_(table.c.to_version.is_(None), table.c.to_version > version))
+    return _collect(query)
+
+
+def _changed_between(nodemap_id, older, newer):
+    """
+    (before, after) for the elements whose content or position differs between two
+    versions (older < newer), each side as at its version (an element missing from a
+    side did not exist then). Only the rows written between the two versions are read,
+    so the cost depends on how much changed, not on the size of the map.
+    """
+    table = NodemapHistoryElement.__table__
+    columns = [table.c[name] for name in _ELEMENT_COLUMNS]
+    # Rows of 'older' closed by a later save up to 'newer' (ix_nodemap_history_element_to)...
+    before = _collect(select(*columns).where(
+        table.c.nodemap_id == nodemap_id, table.c.to_version > older, table.c.to_version <= newer,
+        table.c.from_version <= older))
+    # ...and the rows opened by those saves that 'newer' still has (ix_nodemap_history_element_from)
+    after = _collect(select(*columns).where(
+        table.c.nodemap_id == nodemap_id, table.c.from_version > older, table.c.from_version <= newer,
+        or_(table.c.to_version.is_(None), table.c.to_version > newer)))
+    # An element changed and then changed back has the same content on both sides
+    for collection in COLLECTIONS:
+        for element_id in [element_id for element_id, value in after[collection].items()
+                           if before[collection].get(element_id) == value]:
+            del before[collection][element_id]
+            del after[collection][element_id]
+    return before, after
+
+
+def _load_elements(hashes):
+    blobs = load_blobs(hashes)
+    missing = set(hashes) - set(blobs)
+    if missing:
+        raise NodemapHistoryError(f"{len(missing)} stored elements of this version are missing")
+    return blobs
+
+
+def revision_graph_json(nodemap_id, version):
+    """
+    (nodes, edges) of a version as lists of JSON strings, in their saved order.
+    """
+    get_revision(nodemap_id, version)
+    elements = _elements_at(nodemap_id, version)
+    blobs = _load_elements({digest for collection in COLLECTIONS for digest, _ in elements[collection].values()})
+    graph = []
+    for collection in COLLECTIONS:
+        ordered = sorted(elements[collection].items(), key=lambda item: (item[1][1], item[0]))
+        graph.append([blobs[digest] for _, (digest, _) in ordered])
+    return graph[0], graph[1]
+
+
+def diff_revisions(nodemap_id, from_version, to_version):
+    """
+    What changed from one version to another, per collection: the elements
+    'added' and 'removed', the 'changed' ones (with their content before and
+    after) and the ids of the 'moved' ones (same content, other position).
+    """
+    get_revision(nodemap_id, from_version)
+    get_revision(nodemap_id, to_version)
+    if from_version <= to_version:
+        old, new = _changed_between(nodemap_id, from_version, to_version)
+    else: # Comparing backwards
+        new, old = _changed_between(nodemap_id, to_version, from_version)
+
+    diff = {'from_version': from_version, 'to_version': to_version}
+    needed = {digest for side in (old, new) for collection in COLLECTIONS for digest, _ in side[collection].values()}
+    blobs = _load_elements(needed)
+    for collection in COLLECTIONS:
+        before, after = old[collection], new[collection]
+        ordered_after = sorted(after, key=lambda element_id: (after[element_id][1], element_id))
+        diff[collection] = {
+            'added': [json.loads(blobs[after[element_id][0]]) for element_id in ordered_after if element_id not in before],
+            'removed': [json.loads(blobs[before[element_id][0]])
+                        for element_id in sorted(before, key=lambda element_id: (before[element_id][1], element_id))
+                        if element_id not in after],
+            'changed': [{'id': element_id, 'before': json.loads(blobs[before[element_id][0]]),
+                         'after': json.loads(blobs[after[element_id][0]])}
+                        for element_id in ordered_after
+                        if element_id in before and before[element_id][0] != after[element_id][0]],
+            'moved': [element_id for element_id in ordered_after
+                      if element_id in before and before[element_id][0] == after[element_id][0]],
+        }
+    return diff
+# --- End Reading versions ---
+
+
+# --- Restoring versions ---
+def _restore_differences(nodemap, version, current_version):
+    # {collection: {element id: (hash, sort_index) to write, or None to remove}}
+    latest = _latest_version(db.session.connection(), nodemap.id)
+    if latest is not None and latest.version == current_version:
+        # The history is up to date: only what changed since 'version' differs
+        target, current = _changed_between(nodemap.id, version, current_version)
+    else:
+        # Saved while the history was disabled: compare with the rows themselves
+        target = _elements_at(nodemap.id, version)
+        current = {collection: {} for collection in COLLECTIONS}
+        for (collection, element_id), (serialized, sort_index) in _current_elements(nodemap.id).items():
+            current[collection][element_id] = (element_hash(serialized), sort_index)
+
+    differences = {collection: {} for collection in COLLECTIONS}
+    for collection in COLLECTIONS:
+        for element_id, value in target[collection].items():
+            if current[collection].get(element_id) != value:
+                differences[collection][element_id] = value
+        for element_id in current[collection]:
+            if element_id not in target[collection]:
+                differences[collection][element_id] = None
+    return differences
+
+
+def restore_revision(nodemap, version, changes, current_version=None):
+    """
+    Writes the graph of an earlier version back to the nodemap's rows. Only the
+    elements that differ from the current graph are loaded and written, and
+    recorded in 'changes'. Does not change the version or commit; returns the
+    number of rows written. Raises NodemapHistoryError for an unknown version.
+    'current_version' is the version the rows hold now (default nodemap.version;
+    pass the version from before claim_next_version()).
+    """
+    get_revision(nodemap.id, version)
+    if current_version is None:
+        current_version = nodemap.version
+    differences = _restore_differences(nodemap, version, current_version)
+    blobs = _load_elements({value[0] for collection in COLLECTIONS
+                            for value in differences[collection].values() if value is not None})
+    updates = {
+        collection: {element_id: (blobs[value[0]], value[1]) if value is not None else None
+                     for element_id, value in differences[collection].items()}
+        for collection in COLLECTIONS
+    }
+    return write_nodemap_elements(nodemap, updates, changes)
+# --- End Restoring versions ---
+
+
+# --- Maintenance ---
+def delete_unreferenced_blobs():
+    """
+    Deletes blobs that no element row references (older than BLOB_GC_GRACE). Returns the number deleted.
+    """
+    blob_table = NodemapBlob.__table__
+    element_table = NodemapHistoryElement.__table__
+    deleted = db.session.execute(
+        blob_table.delete().where(
+            blob_table.c.created_at < datetime.utcnow() - BLOB_GC_GRACE,
+            ~exists().where(element_table.c.hash == blob_table.c.hash),
+        )
+    ).rowcount
+    db.session.commit()
+    return deleted
+
+
+def nodemap_history_maintenance():
+    """
+    Deletes the blobs pruned versions no longer need. Returns {'blobs_deleted'}.
+    """
+    stats = {'blobs_deleted': delete_unreferenced_blobs()}
+    if any(stats.values()):
+        logger.info(f"Nodemap history maintenance: {stats}")
+    return stats
+# --- End Maintenance ---
+
+
+def init_nodemap_history(app):
+    """
+    Checks the nodemap history settings and registers 'flask nodemap-history-maintenance'.
+    """
+    if app.config['NODEMAP_HISTORY_MAX_VERSIONS'] < 1:
+        raise ValueError("NODEMAP_HISTORY_MAX_VERSIONS must be at least 1")
+
+    @app.cli.command('nodemap-history-maintenance')
+    def nodemap_history_maintenance_command():
+        """Delete nodemap history blobs no kept version uses."""
+        stats = nodemap_history_maintenance()
+        click.echo(f"Deleted {stats['blobs_deleted']} blobs")
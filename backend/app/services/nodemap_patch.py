@@ -0,0 +1,146 @@
+# Helpers for applying JSON-Patch-style operations to a Nodemap's nodes and edges.
+# The NodeMapView autosave can send only the elements that changed since the
+# version it last loaded, instead of re-sending the whole graph every second.
+
+# Supported operation names (a subset of RFC 6902 that makes sense for a graph)
+SUPPORTED_OPS = ('add', 'replace', 'remove')
+
+# Top-level collections that can be patched, mapped to the key used in the
+# response / save payloads
+COLLECTIONS = ('nodes', 'edges')
+
+
+class NodemapPatchError(ValueError):
+    """
+    Raised when a patch operation is malformed or cannot be applied
+    (e.g. it targets an element that does not exist).
+    """
+    pass
+
+
+def _parse_path(path):
+    """
+    Splits a patch path like '/nodes/dndnode_0/position' into
+    ('nodes', 'dndnode_0', ['position']).
+    Elements are addressed by their 'id' rather than by list index so that
+    concurrent reordering on the client cannot shift the target of an op.
+    """
+    if not isinstance(path, str) or not path.startswith('/'):
+        raise NodemapPatchError(f"Invalid patch path: {path!r}")
+
+    # JSON Pointer escaping: '~1' -> '/', '~0' -> '~'
+    parts = [part.replace('~1', '/').replace('~0', '~') for part in path[1:].split('/')]
+
+    if len(parts) < 2 or parts[0] not in COLLECTIONS or parts[1] == '':
+        raise NodemapPatchError(f"Patch path must start with /nodes/<id> or /edges/<id>: {path!r}")
+
+    return parts[0], parts[1], parts[2:]
+
+
+def _apply_to_element(element, field_path, op, value, path):
+    """
+    Applies an operation to a nested field inside a single node or edge.
+    Only dictionaries are traversed; React Flow elements do not nest lists
+    in the fields we edit (position, data, style, ...).
+    Only 'add' creates missing fields; 'replace' and 'remove' need the field
+    to exist (RFC 6902).
+    """
+    target = element
+    for key in field_path[:-1]:
+        if not isinstance(target, dict):
+            raise NodemapPatchError(f"Cannot traverse into non-object at {path!r}")
+        if key not in target:
+            if op != 'add':
+                raise NodemapPatchError(f"Path does not exist: {path!r}")
+            target[key] = {} # Create intermediate objects for add
+        target = target[key]
+
+    if not isinstance(target, dict):
+        raise NodemapPatchError(f"Cannot patch non-object at {path!r}")
+
+    last_key = field_path[-1]
+    if op != 'add' and last_key not in target:
+        raise NodemapPatchError(f"Path does not exist: {path!r}")
+    if op == 'remove':
+        del target[last_key]
+    else:
+        target[last_key] = value
+
+
+def patch_targets(ops):
+    """
+    Validates the shape of a list of patch operations and returns the ids they touch,
+    in the order they first appear:
+        {'nodes': ['dndnode_0', ...], 'edges': [...]}
+    Lets the storage layer load only the affected elements before applying the patch.
+    """
+    if not isinstance(ops, list):
+        raise NodemapPatchError("'ops' must be a list")
+
+    targets = {name: {} for name in COLLECTIONS} # dicts used as ordered sets
+    for op_data in ops:
+        if not isinstance(op_data, dict):
+            raise NodemapPatchError("Each patch operation must be an object")
+        collection_name, element_id, _ = _parse_path(op_data.get('path'))
+        targets[collection_name].setdefault(element_id, None)
+    return {name: list(element_ids) for name, element_ids in targets.items()}
+
+
+def apply_nodemap_patch(collections, ops):
+    """
+    Applies a list of patch operations to the given collections of elements.
+
+    'collections' maps 'nodes' / 'edges' to dicts of {element_id: element}. It only
+    needs to contain the elements returned by patch_targets(ops) (when they exist);
+    it is modified in place.
+
+    Each op is a dict like:
+        {"op": "add",     "path": "/nodes/<id>",          "value": {...full node...}}
+        {"op": "replace", "path": "/nodes/<id>/position", "value": {"x": 1, "y": 2}}
+        {"op": "remove",  "path": "/edges/<id>"}
+
+    Raises NodemapPatchError if any operation is invalid; in that case the
+    caller should discard the result and keep the stored data unchanged.
+    """
+    if not isinstance(ops, list):
+        raise NodemapPatchError("'ops' must be a list")
+
+    for op_data in ops:
+        if not isinstance(op_data, dict):
+            raise NodemapPatchError("Each patch operation must be an object")
+
+        op = op_data.get('op')
+        path = op_data.get('path')
+        if op not in SUPPORTED_OPS:
+            raise NodemapPatchError(f"Unsupported patch op: {op!r}")
+        if op != 'remove' and 'value' not in op_data:
+            raise NodemapPatchError(f"Patch op '{op}' requires a 'value' ({path!r})")
+
+        collection_name, element_id, field_path = _parse_path(path)
+        collection = collections[collection_name]
+        value = op_data.get('value')
+
+        # --- Whole-element operations ---
+        if not field_path:
+            if op == 'remove':
+                if element_id not in collection:
+                    raise NodemapPatchError(f"Element does not exist: {path!r}")
+                del collection[element_id]
+            else:
+                if not isinstance(value, dict):
+                    raise NodemapPatchError(f"Value for {path!r} must be an object")
+                if op == 'replace' and element_id not in collection:
+                    raise NodemapPatchError(f"Element does not exist: {path!r}")
+                # Keep the stored id consistent with the path
+                value = dict(value, id=element_id)
+                collection[element_id] = value
+            continue
+        # --- End Whole-element operations ---
+
+        # --- Field-level operations inside an existing element ---
+        if element_id not in collection:
+            raise NodemapPatchError(f"Element does not exist: {path!r}")
+        if field_path == ['id']:
+            raise NodemapPatchError(f"The element id cannot be patched: {path!r}")
+        _apply_to_element(collection[element_id], field_path, op, value, path)
+        # --- End Field-level operations ---
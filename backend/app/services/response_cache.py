@@ -0,0 +1,195 @@
+# Content-addressed cache for agent responses.
+# A response is identified by a hash of everything that determines it
+# (model, system prompt, input and generation params), so re-running the same
+# nodemap on the same input is answered without calling the model provider.
+#
+# Two tiers:
+# - an in-memory LRU, bounded by entry count and total size,
+# - an optional SQLite file that survives restarts (also bounded by size).
+# Both tiers drop entries older than the configured TTL.
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+def response_cache_key(model, system_prompt, prompt, params=None):
+    """
+    Returns the content address (hex SHA-256) of an agent invocation.
+    """
+    payload = json.dumps(
+        [model, system_prompt, prompt, params or {}],
+        sort_keys=True, separators=(',', ':'), ensure_ascii=False,
+    )
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class ResponseCache:
+    """
+    Two-tier LRU/TTL cache of response texts keyed by response_cache_key().
+    Safe to use from several threads.
+    """
+
+    def __init__(self, max_entries=10000, max_bytes=64 * 1024 * 1024, ttl=24 * 3600,
+                 disk_path=None, max_disk_bytes=512 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl # Seconds; 0 or None disables expiry
+        self.max_disk_bytes = max_disk_bytes
+
+        self._lock = threading.Lock()
+        self._entries = OrderedDict() # key -> (value, expires_at), least recently used first
+        self._bytes = 0
+        self._stats = {
+            'memory_hits': 0,
+            'disk_hits': 0,
+            'misses': 0,
+            'stores': 0,
+            'evictions': 0,
+            'expirations': 0,
+        }
+
+        # --- Optional on-disk tier ---
+        self._disk = None
+        self._disk_writes = 0
+        if disk_path:
+            self._disk = sqlite3.connect(disk_path, check_same_thread=False, isolation_level=None)
+            self._disk.execute('PRAGMA journal_mode=WAL')
+            self._disk.execute(
+                'CREATE TABLE IF NOT EXISTS response_cache ('
+                ' key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL,'
+                ' expires_at REAL, last_access REAL NOT NULL)'
+            )
+            self._disk.execute('CREATE INDEX IF NOT EXISTS ix_response_cache_last_access ON response_cache (last_access)')
+        # --- End on-disk tier ---
+
+    # --- Memory tier helpers (call with the lock held) ---
+    def _expires_at(self, now):
+        return now + self.ttl if self.ttl else None
+
+    def _memory_remove(self, key):
+        value, _ = self._entries.pop(key)
+        self._bytes -= len(value)
+
+    def _memory_store(self, key, value, expires_at):
+        if key in self._entries:
+            self._memory_remove(key)
+        if len(value) > self.max_bytes:
+            return # Larger than the whole memory tier
+        self._entries[key] = (value, expires_at)
+        self._bytes += len(value)
+        while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+            oldest_key = next(iter(self._entries))
+            self._memory_remove(oldest_key)
+            self._stats['evictions'] += 1
+    # --- End Memory tier helpers ---
+
+    def get(self, key):
+        """
+        Returns the cached response text for a key, or None.
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, expires_at = entry
+                if expires_at is None or expires_at > now:
+                    self._entries.move_to_end(key)
+                    self._stats['memory_hits'] += 1
+                    return value
+                self._memory_remove(key)
+                self._stats['expirations'] += 1
+
+            if self._disk is not None:
+                row = self._disk.execute(
+                    'SELECT value, expires_at FROM response_cache WHERE key = ?', (key,)
+                ).fetchone()
+                if row is not None:
+                    value, expires_at = row
+                    if expires_at is None or expires_at > now:
+                        self._disk.execute('UPDATE response_cache SET last_access = ? WHERE key = ?', (now, key))
+                        self._memory_store(key, value, expires_at) # Promote to the memory tier
+                        self._stats['disk_hits'] += 1
+                        return value
+                    self._disk.execute('DELETE FROM response_cache WHERE key = ?', (key,))
+                    self._stats['expirations'] += 1
+
+            self._stats['misses'] += 1
+            return None
+
+    def set(self, key, value):
+        """
+        Stores a response text under a key in every tier.
+        """
+        now = time.time()
+        expires_at = self._expires_at(now)
+        with self._lock:
+            self._memory_store(key, value, expires_at)
+            self._stats['stores'] += 1
+
+            if self._disk is not None:
+                self._disk.execute(
+                    'INSERT OR REPLACE INTO response_cache (key, value, size, expires_at, last_access)'
+                    ' VALUES (?, ?, ?, ?, ?)',
+                    (key, value, len(value), expires_at, now),
+                )
+                self._disk_writes += 1
+                if self._disk_writes % 100 == 0:
+                    self._evict_disk(now)
+
+    def _evict_disk(self, now):
+        """
+        Drops expired rows, then least recently used rows until the file tier fits max_disk_bytes.
+        """
+        expired = self._disk.execute(
+            'DELETE FROM response_cache WHERE expires_at IS NOT NULL AND expires_at <= ?', (now,)
+        ).rowcount
+        self._stats['expirations'] += max(expired, 0)
+
+        total = self._disk.execute('SELECT COALESCE(SUM(size), 0) FROM response_cache').fetchone()[0]
+        while total > self.max_disk_bytes:
+            rows = self._disk.execute(
+                'SELECT key, size FROM response_cache ORDER BY last_access LIMIT 100'
+            ).fetchall()
+            if not rows:
+                break
+            self._disk.executemany('DELETE FROM response_cache WHERE key = ?', [(key,) for key, _ in rows])
+            total -= sum(size for _, size in rows)
+            self._stats['evictions'] += len(rows)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+            if self._disk is not None:
+                self._disk.execute('DELETE FROM response_cache')
+
+    def stats(self):
+        """
+        Returns hit/miss counters and the current size of the memory tier.
+        """
+        with self._lock:
+            stats = dict(self._stats)
+            stats['entries'] = len(self._entries)
+            stats['bytes'] = self._bytes
+            stats['disk_enabled'] = self._disk is not None
+        lookups = stats['memory_hits'] + stats['disk_hits'] + stats['misses']
+        stats['hit_ratio'] = round((stats['memory_hits'] + stats['disk_hits']) / lookups, 4) if lookups else 0.0
+        return stats
+
+
+# --- Shared cache instance ---
+# Configured by create_app(); None means caching is disabled.
+_response_cache = None
+
+
+def configure_response_cache(cache):
+    global _response_cache
+    _response_cache = cache
+
+
+def get_response_cache():
+    return _response_cache
+# --- End Shared cache instance ---
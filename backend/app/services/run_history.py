@@ -0,0 +1,371 @@
+# History of nodemap runs, for audit and debugging.
+# Each run gets a RunRecord (its totals) and an append-only list of RunEvents:
+#     0      run_started   the run's input
+#     1..n   node          one per node: status, timings, token counts, input and output
+#     n+1    run_finished  status, wall time, critical path
+# Inputs and outputs are not stored in the events but in RunPayload, keyed by the
+# SHA-256 of their text: the same prompt or output (e.g. a cached response, or
+# the same input run every day) is stored once, compressed with zlib.
+#
+# Maintenance ('flask run-history-maintenance', also run by the job workers):
+# - compaction: runs older than RUN_HISTORY_COMPACT_AFTER_DAYS keep a JSON summary
+#   of their nodes (no inputs/outputs) on the RunRecord and lose their events,
+# - retention: runs older than RUN_HISTORY_RETENTION_DAYS are deleted,
+# - payloads no event references any more are deleted.
+import hashlib
+import json
+import logging
+import zlib
+from datetime import datetime, timedelta
+
+import click
+from flask import current_app
+from sqlalchemy import select, exists
+
+from app import db
+from app.models import RunRecord, RunEvent, RunPayload
+from app.services.tokens import count_tokens
+
+logger = logging.getLogger(__name__)
+
+# Payload encodings (first byte of RunPayload.data)
+PAYLOAD_RAW = 0x00
+PAYLOAD_ZLIB = 0x01
+PAYLOAD_COMPRESS_MIN_SIZE = 128 # Shorter payloads are stored raw
+
+# Payloads younger than this are never garbage-collected, so a run that is being
+# recorded while maintenance runs cannot lose a payload it is about to reference
+PAYLOAD_GC_GRACE = timedelta(hours=1)
+PAYLOAD_REFRESH_AFTER = PAYLOAD_GC_GRACE / 2 # Payloads newer than this are not collectable before a run commits
+
+# Longest IN (...) list per statement (SQLite limits the number of parameters)
+_IN_CHUNK_SIZE = 500
+
+# Fields of a node event kept in a compacted run's summary
+_SUMMARY_FIELDS = ('status', 'agent_id', 'model', 'cached', 'started_at', 'finished_at', 'wall_time',
+                   'input_tokens', 'output_tokens', 'error')
+
+
+# --- Payloads ---
+def payload_hash(text):
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def _encode_payload(raw):
+    if len(raw) >= PAYLOAD_COMPRESS_MIN_SIZE:
+        compressed = zlib.compress(raw, 6)
+        if len(compressed) < len(raw):
+            return bytes((PAYLOAD_ZLIB,)) + compressed
+    return bytes((PAYLOAD_RAW,)) + raw
+
+
+def _decode_payload(value):
+    value = bytes(value)
+    if value[0] == PAYLOAD_ZLIB:
+        return zlib.decompress(value[1:]).decode('utf-8')
+    return value[1:].decode('utf-8')
+
+
+def store_payloads(connection, texts):
+    """
+    Stores each distinct text once and returns {text: hash}.
+    """
+    hashes = {text: payload_hash(text) for text in set(texts)}
+    if not hashes:
+        return hashes
+    table = RunPayload.__table__
+    now = datetime.utcnow()
+    # Reused payloads get a fresh created_at, so delete_unreferenced_payloads leaves them
+    # alone until this run's events reference them. Refreshed first: a payload the GC
+    # deletes before this UPDATE is missing from the SELECT below and inserted again.
+    existing = set()
+    for chunk in in_chunks(hashes.values()):
+        connection.execute(
+            table.update()
+            .where(table.c.hash.in_(chunk), table.c.created_at < now - PAYLOAD_REFRESH_AFTER)
+            .values(created_at=now)
+        )
+        existing.update(connection.execute(select(table.c.hash).where(table.c.hash.in_(chunk))).scalars())
+    rows = []
+    for text, digest in hashes.items():
+        if digest not in existing:
+            raw = text.encode('utf-8')
+            rows.append({'hash': digest, 'size': len(raw), 'data': _encode_payload(raw), 'created_at': now})
+    if rows:
+        connection.execute(insert_ignoring_duplicates(connection.dialect.name, table), rows)
+    return hashes
+
+
+def in_chunks(values):
+    """
+    Splits values into lists short enough for one IN (...) clause.
+    """
+    values = list(values)
+    for start in range(0, len(values), _IN_CHUNK_SIZE):
+        yield values[start:start + _IN_CHUNK_SIZE]
+
+
+def insert_ignoring_duplicates(dialect_name, table):
+    # Another run may store the same payload at the same time
+    if dialect_name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    elif dialect_name == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    else:
+        return table.insert()
+    return dialect_insert(table).on_conflict_do_nothing()
+
+
+def load_payloads(hashes):
+    """
+    Returns {hash: text} for the given payload hashes.
+    """
+    hashes = [digest for digest in set(hashes) if digest]
+    if not hashes:
+        return {}
+    table = RunPayload.__table__
+    payloads = {}
+    for chunk in in_chunks(hashes):
+        rows = db.session.execute(select(table.c.hash, table.c.data).where(table.c.hash.in_(chunk)))
+        payloads.update((digest, _decode_payload(data)) for digest, data in rows)
+    return payloads
+# --- End Payloads ---
+
+
+# --- Recording runs ---
+def record_run(nodemap, initial_input, result, node_inputs, job_id=None):
+    """
+    Appends a finished run (the result of execute_nodemap_graph) to the history.
+    node_inputs maps node ids to the input each node ran on. Returns the run id.
+    The caller commits.
+    """
+    connection = db.session.connection()
+    outputs = result['outputs']
+    texts = [initial_input] + list(node_inputs.values()) + list(outputs.values())
+    hashes = store_payloads(connection, texts)
+
+    node_events = []
+    input_tokens = output_tokens = 0
+    for node_id, node in result['nodes'].items():
+        node_input = node_inputs.get(node_id)
+        output = outputs.get(node_id)
+        event = {
+            'kind': 'node', 'node_id': node_id, 'status': node['status'], 'agent_id': node['agent_id'],
+            'model': node['model'], 'cached': node['cached'], 'started_at': node['started_at'],
+            'finished_at': node['finished_at'], 'wall_time': node['wall_time'], 'error': node['error'],
+            'input_tokens': count_tokens(node['model'], node_input) if node_input is not None else None,
+            'output_tokens': count_tokens(node['model'], output) if output is not None else None,
+            'input_hash': hashes.get(node_input) if node_input is not None else None,
+            'output_hash': hashes.get(output) if output is not None else None,
+            # Inputs cut to fit the agent's context window (see app/services/tokens.py)
+            'details': json.dumps({'input_truncated': True}) if node.get('input_truncated') else None,
+        }
+        if not node['cached']: # Cached responses did not cost tokens
+            input_tokens += event['input_tokens'] or 0
+            output_tokens += event['output_tokens'] or 0
+        node_events.append(event)
+    # Nodes in the order they started (nodes that never started last)
+    node_events.sort(key=lambda event: (event['started_at'] is None, event['started_at'] or 0))
+
+    events = (
+        [{'kind': 'run_started', 'input_hash': hashes[initial_input],
+          'input_tokens': count_tokens(None, initial_input)}]
+        + node_events
+        + [{'kind': 'run_finished', 'status': result['status'], 'wall_time': result['wall_time'],
+            'details': json.dumps({'critical_path': result['critical_path'],
+                                   'critical_path_time': result['critical_path_time'],
+                                   'max_concurrency': result['max_concurrency']})}]
+    )
+
+    record_table = RunRecord.__table__
+    run_id = connection.execute(record_table.insert().values(
+        nodemap_id=nodemap.id,
+        user_id=nodemap.user_id,
+        job_id=job_id,
+        status=result['status'],
+        created_at=datetime.utcnow(),
+        wall_time=result['wall_time'],
+        node_count=len(node_events),
+        failed_count=sum(1 for event in node_events if event['status'] == 'failed'),
+        input_tokens=input_tokens,
+        output_tokens=output_tokens,
+        event_count=len(events),
+        compacted=False,
+    )).inserted_primary_key[0]
+
+    columns = [column.name for column in RunEvent.__table__.columns if column.name != 'id']
+    connection.execute(RunEvent.__table__.insert(), [
+        dict({column: None for column in columns}, **event, nodemap_id=nodemap.id, run_id=run_id, sequence=sequence)
+        for sequence, event in enumerate(events)
+    ])
+    return run_id
+# --- End Recording runs ---
+
+
+# --- Reading runs ---
+def run_record_to_dict(record):
+    return {
+        "run_id": record.id,
+        "nodemap_id": record.nodemap_id,
+        "job_id": record.job_id,
+        "status": record.status,
+        "created_at": record.created_at.isoformat() if record.created_at else None,
+        "wall_time": record.wall_time,
+        "node_count": record.node_count,
+        "failed_count": record.failed_count,
+        "input_tokens": record.input_tokens,
+        "output_tokens": record.output_tokens,
+        "compacted": record.compacted,
+    }
+
+
+def list_runs(nodemap_id, limit=50, before=None):
+    """
+    The nodemap's most recent runs (newest first), optionally only those with an id below 'before'.
+    One range scan of ix_run_record_nodemap_id.
+    """
+    query = RunRecord.query.filter(RunRecord.nodemap_id == nodemap_id)
+    if before is not None:
+        query = query.filter(RunRecord.id < before)
+    return query.order_by(RunRecord.id.desc()).limit(limit).all()
+
+
+def run_details(record, include_payloads=True):
+    """
+    A run with its events (or, for a compacted run, its summary).
+    Inputs and outputs are included as text when include_payloads is true.
+    """
+    data = run_record_to_dict(record)
+    if record.compacted:
+        data['summary'] = json.loads(record.summary) if record.summary else None
+        data['events'] = []
+        return data
+
+    events = RunEvent.query.filter(RunEvent.run_id == record.id).order_by(RunEvent.sequence).all()
+    payloads = load_payloads(
+        [event.input_hash for event in events] + [event.output_hash for event in events]
+    ) if include_payloads else {}
+
+    data['events'] = []
+    for event in events:
+        item = {
+            "sequence": event.sequence, "kind": event.kind, "node_id": event.node_id, "status": event.status,
+            "agent_id": event.agent_id, "model": event.model, "cached": event.cached,
+            "started_at": event.started_at, "finished_at": event.finished_at, "wall_time": event.wall_time,
+            "input_tokens": event.input_tokens, "output_tokens": event.output_tokens, "error": event.error,
+            "details": json.loads(event.details) if event.details else None,
+        }
+        if include_payloads:
+            item["input"] = payloads.get(event.input_hash)
+            item["output"] = payloads.get(event.output_hash)
+        data['events'].append(item)
+    return data
+# --- End Reading runs ---
+
+
+# --- Maintenance ---
+def compact_runs(older_than, batch_size=500):
+    """
+    Replaces the events of runs created before 'older_than' with a summary on
+    their RunRecord. Each batch is committed on its own. Returns the number of runs compacted.
+    """
+    record_table = RunRecord.__table__
+    event_table = RunEvent.__table__
+    compacted = 0
+    while True:
+        run_ids = db.session.execute(
+            select(record_table.c.id)
+            .where(record_table.c.created_at < older_than, record_table.c.compacted == False) # noqa: E712
+            .order_by(record_table.c.created_at).limit(batch_size)
+        ).scalars().all()
+        if not run_ids:
+            break
+
+        summaries = {run_id: {'nodes': {}} for run_id in run_ids}
+        events = db.session.execute(
+            select(event_table).where(event_table.c.run_id.in_(run_ids)).order_by(event_table.c.run_id, event_table.c.sequence)
+        ).mappings()
+        for event in events:
+            summary = summaries[event['run_id']]
+            if event['kind'] == 'node':
+                summary['nodes'][event['node_id']] = {field: event[field] for field in _SUMMARY_FIELDS}
+            elif event['kind'] == 'run_finished' and event['details']:
+                summary.update(json.loads(event['details']))
+
+        for run_id, summary in summaries.items():
+            db.session.execute(record_table.update().where(record_table.c.id == run_id)
+                               .values(compacted=True, summary=json.dumps(summary)))
+        db.session.execute(event_table.delete().where(event_table.c.run_id.in_(run_ids)))
+        db.session.commit()
+        compacted += len(run_ids)
+    return compacted
+
+
+def delete_old_runs(older_than, batch_size=500):
+    """
+    Deletes runs created before 'older_than' with their events. Returns the number of runs deleted.
+    """
+    record_table = RunRecord.__table__
+    event_table = RunEvent.__table__
+    deleted = 0
+    while True:
+        run_ids = db.session.execute(
+            select(record_table.c.id).where(record_table.c.created_at < older_than)
+            .order_by(record_table.c.created_at).limit(batch_size)
+        ).scalars().all()
+        if not run_ids:
+            break
+        db.session.execute(event_table.delete().where(event_table.c.run_id.in_(run_ids)))
+        db.session.execute(record_table.delete().where(record_table.c.id.in_(run_ids)))
+        db.session.commit()
+        deleted += len(run_ids)
+    return deleted
+
+
+def delete_unreferenced_payloads():
+    """
+    Deletes payloads that no event references (older than PAYLOAD_GC_GRACE). Returns the number deleted.
+    """
+    payload_table = RunPayload.__table__
+    event_table = RunEvent.__table__
+    deleted = db.session.execute(
+        payload_table.delete().where(
+            payload_table.c.created_at < datetime.utcnow() - PAYLOAD_GC_GRACE,
+            ~exists().where(event_table.c.input_hash == payload_table.c.hash),
+            ~exists().where(event_table.c.output_hash == payload_table.c.hash),
+        )
+    ).rowcount
+    db.session.commit()
+    return deleted
+
+
+def run_history_maintenance():
+    """
+    Compacts and expires old runs and deletes orphaned payloads.
+    Returns {'compacted', 'deleted', 'payloads_deleted'}.
+    """
+    config = current_app.config
+    now = datetime.utcnow()
+    stats = {} # Expired runs are deleted first, so they are not compacted for nothing
+    stats['deleted'] = delete_old_runs(now - timedelta(days=config['RUN_HISTORY_RETENTION_DAYS']))
+    stats['compacted'] = compact_runs(now - timedelta(days=config['RUN_HISTORY_COMPACT_AFTER_DAYS']))
+    stats['payloads_deleted'] = delete_unreferenced_payloads()
+    if any(stats.values()):
+        logger.info(f"Run history maintenance: {stats}")
+    return stats
+# --- End Maintenance ---
+
+
+def init_run_history(app):
+    """
+    Checks the run history settings and registers 'flask run-history-maintenance'.
+    """
+    if app.config['RUN_HISTORY_RETENTION_DAYS'] < app.config['RUN_HISTORY_COMPACT_AFTER_DAYS']:
+        raise ValueError("RUN_HISTORY_RETENTION_DAYS must not be shorter than RUN_HISTORY_COMPACT_AFTER_DAYS")
+
+    @app.cli.command('run-history-maintenance')
+    def run_history_maintenance_command():
+        """Compact old runs, delete expired runs and unreferenced payloads."""
+        stats = run_history_maintenance()
+        click.echo(f"Compacted {stats['compacted']} runs, deleted {stats['deleted']} runs "
+                   f"and {stats['payloads_deleted']} payloads")
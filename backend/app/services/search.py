@@ -0,0 +1,360 @@
+# Full-text search over a user's nodemaps (name, goal, description) and agents
+# (name, system_prompt).
+# Two interchangeable backends keep an inverted index of those fields:
+#     'fts5'   an SQLite FTS5 virtual table (search_fts), ranked with bm25
+#     'table'  the portable search_term table (see app/models.py), one row per
+#              (user, term, document), ranked by summed term weights
+# SEARCH_BACKEND=auto picks FTS5 when the database is SQLite and supports it.
+# Both backends match every word of the query as a prefix ("plan rev" finds
+# "Planning review") and only ever look at the searching user's documents.
+# The index is updated by a flush listener whenever nodemaps or agents are
+# created, changed or deleted; code that writes them with bulk statements calls
+# index_documents() itself. 'flask search-reindex' rebuilds it from scratch
+# (e.g. after switching backends).
+import re
+import sqlite3
+import unicodedata
+from collections import Counter
+
+import click
+from flask import current_app, has_app_context
+from sqlalchemy import event, text, bindparam, select, func, union_all, literal, distinct, desc
+
+from app import db
+from app.models import Nodemap, Agent, SearchTerm
+
+SEARCH_BACKENDS = ('auto', 'fts5', 'table')
+
+# Relative weight of a match in the document's name vs. the rest of its text
+TITLE_WEIGHT = 10
+BODY_WEIGHT = 1
+
+MAX_TERM_LENGTH = 64 # Matches SearchTerm.term
+MAX_QUERY_TERMS = 8
+
+# Each document is one FTS5 row whose rowid encodes the owner, the id and the kind:
+#     (user_id << 32) | (doc_id << 1) | kind code
+# so a user's documents form one rowid range, which FTS5 can search on its own
+_KIND_CODES = {'nodemap': 0, 'agent': 1}
+_KINDS_BY_CODE = {code: kind for kind, code in _KIND_CODES.items()}
+
+# FTS5 ranks at most this many matches of a query (the user's most recently created
+# documents); only very broad prefixes (e.g. a single letter) match more than this
+MAX_RANKED_CANDIDATES = 5000
+
+# Fields of each model that are indexed
+_INDEXED_FIELDS = {
+    Nodemap: ('name', 'goal', 'description', 'user_id'),
+    Agent: ('name', 'system_prompt', 'user_id'),
+}
+
+_FTS5_DDL = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS search_fts USING fts5("
+    "title, body, "
+    "tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')"
+)
+
+_fts5_supported = None
+
+
+def sqlite_supports_fts5():
+    """
+    True when the SQLite library used by Python was built with FTS5.
+    """
+    global _fts5_supported
+    if _fts5_supported is None:
+        connection = sqlite3.connect(':memory:')
+        try:
+            connection.execute("CREATE VIRTUAL TABLE fts5_probe USING fts5(content)")
+            _fts5_supported = True
+        except sqlite3.OperationalError:
+            _fts5_supported = False
+        finally:
+            connection.close()
+    return _fts5_supported
+
+
+@event.listens_for(db.metadata, 'after_create')
+def _create_fts_table(target, connection, **kwargs):
+    # db.create_all() cannot create virtual tables from models, so add it here
+    if connection.dialect.name == 'sqlite' and sqlite_supports_fts5():
+        connection.exec_driver_sql(_FTS5_DDL)
+
+
+# --- Documents and tokens ---
+_TOKEN_PATTERN = re.compile(r'[^\W_]+')
+
+
+def tokenize(value):
+    """
+    Splits text into lowercase words without diacritics, like FTS5's unicode61 tokenizer.
+    """
+    value = unicodedata.normalize('NFKD', (value or '').casefold())
+    value = ''.join(char for char in value if not unicodedata.combining(char))
+    return [token[:MAX_TERM_LENGTH] for token in _TOKEN_PATTERN.findall(value)]
+
+
+def nodemap_document(nodemap_id, user_id, name, goal, description):
+    return {'kind': 'nodemap', 'doc_id': nodemap_id, 'user_id': user_id,
+            'title': name or '', 'body': '\n'.join(part for part in (goal, description) if part)}
+
+
+def agent_document(agent_id, user_id, name, system_prompt):
+    return {'kind': 'agent', 'doc_id': agent_id, 'user_id': user_id,
+            'title': name or '', 'body': system_prompt or ''}
+
+
+def _document_for(obj):
+    if isinstance(obj, Nodemap):
+        return nodemap_document(obj.id, obj.user_id, obj.name, obj.goal, obj.description)
+    return agent_document(obj.id, obj.user_id, obj.name, obj.system_prompt)
+
+
+def _kind_of(obj):
+    return 'nodemap' if isinstance(obj, Nodemap) else 'agent'
+
+
+def _fts_rowid(user_id, kind, doc_id):
+    return (int(user_id) << 32) | (int(doc_id) << 1) | _KIND_CODES[kind]
+# --- End Documents and tokens ---
+
+
+# --- Index writes ---
+def remove_documents(connection, backend, keys):
+    """
+    Removes documents, given as (user_id, kind, doc_id) tuples, from the index.
+    """
+    if not keys:
+        return
+    if backend == 'fts5':
+        connection.execute(
+            text("DELETE FROM search_fts WHERE rowid IN :rowids").bindparams(bindparam('rowids', expanding=True)),
+            {'rowids': [_fts_rowid(*key) for key in keys]},
+        )
+        return
+    table = SearchTerm.__table__
+    for kind in _KIND_CODES:
+        doc_ids = [doc_id for _, key_kind, doc_id in keys if key_kind == kind]
+        if doc_ids:
+            connection.execute(table.delete().where(table.c.kind == kind, table.c.doc_id.in_(doc_ids)))
+
+
+def index_documents(connection, backend, documents):
+    """
+    Adds documents (see nodemap_document / agent_document) to the index,
+    replacing any earlier version of them.
+    """
+    if not documents:
+        return
+    remove_documents(connection, backend, [
+        (document['user_id'], document['kind'], document['doc_id']) for document in documents
+    ])
+
+    if backend == 'fts5':
+        connection.execute(
+            text("INSERT INTO search_fts (rowid, title, body) VALUES (:rowid, :title, :body)"),
+            [{'rowid': _fts_rowid(document['user_id'], document['kind'], document['doc_id']),
+              'title': document['title'], 'body': document['body']} for document in documents],
+        )
+        return
+
+    rows = []
+    for document in documents:
+        weights = Counter()
+        for term in tokenize(document['title']):
+            weights[term] += TITLE_WEIGHT
+        for term in tokenize(document['body']):
+            weights[term] += BODY_WEIGHT
+        rows.extend(
+            {'user_id': document['user_id'], 'term': term, 'kind': document['kind'],
+             'doc_id': document['doc_id'], 'weight': weight}
+            for term, weight in weights.items()
+        )
+    if rows:
+        connection.execute(SearchTerm.__table__.insert(), rows)
+
+
+def rebuild_search_index(connection, backend, batch_size=1000):
+    """
+    Clears the index and re-adds every nodemap and agent. Returns the number of documents.
+    """
+    if backend == 'fts5':
+        connection.execute(text("DELETE FROM search_fts"))
+    else:
+        connection.execute(SearchTerm.__table__.delete())
+
+    count = 0
+    sources = (
+        (Nodemap.__table__, ('name', 'goal', 'description'), nodemap_document),
+        (Agent.__table__, ('name', 'system_prompt'), agent_document),
+    )
+    for table, fields, make_document in sources:
+        last_id = 0
+        while True:
+            batch = connection.execute(
+                select(table.c.id, table.c.user_id, *(table.c[field] for field in fields))
+                .where(table.c.id > last_id).order_by(table.c.id).limit(batch_size)
+            ).all()
+            if not batch:
+                break
+            index_documents(connection, backend, [make_document(*row) for row in batch])
+            last_id = batch[-1][0]
+            count += len(batch)
+
+    if backend == 'fts5':
+        connection.execute(text("INSERT INTO search_fts (search_fts) VALUES ('optimize')")) # Merge index segments
+    return count
+# --- End Index writes ---
+
+
+# --- Keep the index in sync ---
+def active_search_backend():
+    """
+    The current app's search backend, or None outside an app (or before init_search).
+    """
+    return current_app.extensions.get('search') if has_app_context() else None
+
+
+@event.listens_for(db.session, 'after_flush')
+def _sync_search_index(session, flush_context):
+    """
+    After every flush, re-indexes the nodemaps and agents that were created or
+    whose indexed fields changed, and removes the deleted ones.
+    """
+    backend = active_search_backend()
+    if backend is None:
+        return
+
+    changed = []
+    removed = []
+    for obj in session.new:
+        if isinstance(obj, (Nodemap, Agent)):
+            changed.append(obj)
+    for obj in session.dirty:
+        if isinstance(obj, (Nodemap, Agent)):
+            state = db.inspect(obj)
+            if any(state.attrs[name].history.has_changes() for name in _INDEXED_FIELDS[type(obj)]):
+                changed.append(obj)
+                # A document moved to another user is stored under a different key
+                removed.extend((old_user_id, _kind_of(obj), obj.id) for old_user_id in state.attrs.user_id.history.deleted)
+    removed.extend(
+        (obj.user_id, _kind_of(obj), obj.id) for obj in session.deleted if isinstance(obj, (Nodemap, Agent))
+    )
+
+    if changed or removed:
+        # Core statements on the flush's connection, in the same transaction
+        connection = session.connection()
+        remove_documents(connection, backend, removed)
+        index_documents(connection, backend, [_document_for(obj) for obj in changed])
+# --- End Keep the index in sync ---
+
+
+# --- Queries ---
+def _prefix_end(term):
+    # Smallest string greater than every string starting with 'term'
+    return term[:-1] + chr(ord(term[-1]) + 1)
+
+
+def _ranked_fts5(connection, user_id, terms, kinds, limit, offset):
+    parameters = {
+        'match': ' AND '.join(f'"{term}"*' for term in terms),
+        'low': int(user_id) << 32, # The user's rowid range
+        'high': ((int(user_id) + 1) << 32) - 1,
+        'kind_codes': [_KIND_CODES[kind] for kind in kinds],
+        'cap': MAX_RANKED_CANDIDATES,
+    }
+    matching = "search_fts MATCH :match AND rowid BETWEEN :low AND :high AND (rowid & 1) IN :kind_codes"
+
+    # Walking the matches in rowid order is cheap; scoring them is not. When a query
+    # matches more than MAX_RANKED_CANDIDATES documents, only the newest ones are ranked.
+    floor = connection.execute(
+        text(f"SELECT rowid FROM search_fts WHERE {matching} ORDER BY rowid DESC LIMIT 1 OFFSET :cap")
+        .bindparams(bindparam('kind_codes', expanding=True)),
+        parameters,
+    ).scalar()
+    if floor is not None:
+        parameters['low'] = floor + 1
+
+    rows = connection.execute(
+        text(f"SELECT rowid, -bm25(search_fts, :title_weight, :body_weight) AS score FROM search_fts "
+             f"WHERE {matching} ORDER BY score DESC, rowid DESC LIMIT :limit OFFSET :offset")
+        .bindparams(bindparam('kind_codes', expanding=True)),
+        dict(parameters, title_weight=float(TITLE_WEIGHT), body_weight=float(BODY_WEIGHT), limit=limit, offset=offset),
+    ).all()
+    return [(_KINDS_BY_CODE[rowid & 1], (rowid & 0xFFFFFFFF) >> 1, score) for rowid, score in rows]
+
+
+def _ranked_table(connection, user_id, terms, kinds, limit, offset):
+    table = SearchTerm.__table__
+    per_term = [
+        select(table.c.kind, table.c.doc_id, table.c.weight, literal(position).label('term_position'))
+        .where(table.c.user_id == user_id, table.c.term >= term, table.c.term < _prefix_end(term),
+               table.c.kind.in_(kinds))
+        for position, term in enumerate(terms)
+    ]
+    matches = (per_term[0] if len(per_term) == 1 else union_all(*per_term)).subquery()
+    score = func.sum(matches.c.weight).label('score')
+    statement = (
+        select(matches.c.kind, matches.c.doc_id, score)
+        .group_by(matches.c.kind, matches.c.doc_id)
+        .having(func.count(distinct(matches.c.term_position)) == len(terms)) # Every word must match
+        .order_by(desc('score'), matches.c.doc_id.desc())
+        .limit(limit).offset(offset)
+    )
+    return connection.execute(statement).all()
+
+
+def search_documents(user_id, query, kinds=('nodemap', 'agent'), limit=20, offset=0):
+    """
+    Returns one page of the user's nodemaps and agents matching every word of
+    'query' (as prefixes), best match first: [{'type', 'id', 'name', 'score'}].
+    """
+    terms = list(dict.fromkeys(tokenize(query)))[:MAX_QUERY_TERMS]
+    if not terms:
+        return []
+
+    connection = db.session.connection()
+    if active_search_backend() == 'fts5':
+        ranked = _ranked_fts5(connection, user_id, terms, kinds, limit, offset)
+    else:
+        ranked = _ranked_table(connection, user_id, terms, kinds, limit, offset)
+
+    # Names come from the tables themselves, which also re-checks ownership
+    # (looked up by primary key; filtering on user_id in SQL makes SQLite scan the user's rows)
+    names = {}
+    for kind, model in (('nodemap', Nodemap), ('agent', Agent)):
+        doc_ids = [doc_id for row_kind, doc_id, _ in ranked if row_kind == kind]
+        if doc_ids:
+            table = model.__table__
+            rows = connection.execute(
+                select(table.c.id, table.c.user_id, table.c.name).where(table.c.id.in_(doc_ids))
+            )
+            names.update({(kind, row_id): name for row_id, owner_id, name in rows if owner_id == user_id})
+
+    return [
+        {'type': kind, 'id': doc_id, 'name': names[(kind, doc_id)], 'score': round(float(score), 4)}
+        for kind, doc_id, score in ranked if (kind, doc_id) in names
+    ]
+# --- End Queries ---
+
+
+def init_search(app, db):
+    """
+    Picks the search backend for the app's database and registers 'flask search-reindex'.
+    """
+    configured = app.config['SEARCH_BACKEND']
+    if configured not in SEARCH_BACKENDS:
+        raise ValueError(f"Unknown SEARCH_BACKEND {configured!r} (expected one of {', '.join(SEARCH_BACKENDS)})")
+    with app.app_context():
+        fts5 = db.engine.url.get_backend_name() == 'sqlite' and sqlite_supports_fts5()
+    if configured == 'fts5' and not fts5:
+        raise ValueError("SEARCH_BACKEND=fts5 needs an SQLite database with FTS5 support")
+    app.extensions['search'] = 'fts5' if fts5 and configured != 'table' else 'table'
+
+    @app.cli.command('search-reindex')
+    def search_reindex_command():
+        """Rebuild the full-text search index of nodemaps and agents."""
+        backend = app.extensions['search']
+        with db.engine.begin() as connection:
+            count = rebuild_search_index(connection, backend)
+        click.echo(f"Indexed {count} documents ({backend} backend)")
@@ -0,0 +1,163 @@
+# Helpers that keep application startup fast.
+# - Schema handling at boot is configurable (SCHEMA_STARTUP_MODE):
+#     'create_all'  create missing tables with db.create_all() (development default)
+#     'check'       compare the database's Alembic revision with the migration
+#                   head (one small query, once per process) and refuse to start
+#                   when the database is behind
+#     'skip'        no schema work at all; migrations are run separately
+# - Flask-Migrate (and with it Alembic) is only imported when a 'flask db ...'
+#   command is actually run.
+# - StartupTimer records how long each step of create_app() took.
+import os
+import re
+import time
+
+import click
+
+SCHEMA_STARTUP_MODES = ('create_all', 'check', 'skip')
+
+# Schema checks already done in this process, by database URI
+_checked_databases = set()
+
+
+class StartupTimer:
+    """
+    Collects named durations (milliseconds) for the startup report.
+    """
+
+    def __init__(self, started=None):
+        self.started = time.perf_counter() if started is None else started
+        self._last = self.started
+        self.timings = {}
+
+    def record(self, name, since=None):
+        now = time.perf_counter()
+        self.timings[name] = round((now - (self._last if since is None else since)) * 1000, 2)
+        self._last = now
+
+    def finish(self):
+        self.timings['total'] = round((time.perf_counter() - self.started) * 1000, 2)
+        return self.timings
+
+
+# --- Migration head check ---
+_REVISION_PATTERN = re.compile(r"^revision\s*=\s*['\"]([^'\"]+)['\"]", re.MULTILINE)
+_DOWN_REVISION_PATTERN = re.compile(r"^down_revision\s*=\s*(.+)$", re.MULTILINE)
+
+
+def read_migration_heads(versions_directory):
+    """
+    Returns the set of head revisions of the migration scripts in a directory.
+    Reads the 'revision' / 'down_revision' lines directly instead of loading Alembic,
+    which would add a few hundred milliseconds to every start.
+    """
+    revisions = set()
+    parents = set()
+    for file_name in os.listdir(versions_directory):
+        if not file_name.endswith('.py'):
+            continue
+        with open(os.path.join(versions_directory, file_name), encoding='utf-8') as script:
+            source = script.read()
+        revision = _REVISION_PATTERN.search(source)
+        if not revision:
+            continue
+        revisions.add(revision.group(1))
+        down_revision = _DOWN_REVISION_PATTERN.search(source)
+        if down_revision:
+            # A single id, None, or a tuple of ids for merge revisions
+            parents.update(re.findall(r"['\"]([^'\"]+)['\"]", down_revision.group(1)))
+    return revisions - parents
+
+
+def check_schema_head(app, db):
+    """
+    Raises RuntimeError unless the database is at the migration head.
+    Runs once per process and database.
+    """
+    database_uri = app.config['SQLALCHEMY_DATABASE_URI']
+    if database_uri in _checked_databases:
+        return
+
+    heads = read_migration_heads(os.path.join(app.config['MIGRATIONS_DIRECTORY'], 'versions'))
+    with app.app_context():
+        try:
+            current = {row[0] for row in db.session.execute(db.text('SELECT version_num FROM alembic_version'))}
+        except Exception:
+            db.session.rollback()
+            current = set()
+        finally:
+            db.session.remove()
+
+    if current != heads:
+        raise RuntimeError(
+            f"Database schema is at revision {sorted(current) or 'none'}, expected {sorted(heads)}; "
+            f"run 'flask db upgrade' before starting the app (SCHEMA_STARTUP_MODE=check)"
+        )
+    _checked_databases.add(database_uri)
+
+
+def prepare_schema(app, db):
+    """
+    Applies the configured SCHEMA_STARTUP_MODE.
+    """
+    mode = app.config['SCHEMA_STARTUP_MODE']
+    if mode not in SCHEMA_STARTUP_MODES:
+        raise RuntimeError(f"Unknown SCHEMA_STARTUP_MODE {mode!r} (expected one of {', '.join(SCHEMA_STARTUP_MODES)})")
+    if mode == 'create_all':
+        with app.app_context():
+            db.create_all() # Create database tables for our models if they don't exist
+    elif mode == 'check':
+        check_schema_head(app, db)
+# --- End Migration head check ---
+
+
+# --- Lazy 'flask db' commands ---
+class LazyMigrateGroup(click.Group):
+    """
+    Stands in for Flask-Migrate's 'db' command group. Flask-Migrate is set up
+    on the app the first time a 'flask db ...' command is looked up, so plain
+    app starts (web workers) never import it.
+    """
+
+    def __init__(self, db, directory, **kwargs):
+        from flask.cli import with_appcontext
+
+        # Same group options as flask_migrate.cli.db
+        params = [
+            click.Option(['-d', '--directory'], default=None,
+                         help='Migration script directory (default is "migrations")'),
+            click.Option(['-x', '--x-arg'], multiple=True,
+                         help='Additional arguments consumed by custom env.py scripts'),
+        ]
+        super().__init__(params=params, callback=with_appcontext(self._store_options), **kwargs)
+        self._db = db
+        self._directory = directory
+
+    @staticmethod
+    def _store_options(directory, x_arg):
+        from flask import g
+        g.directory = directory
+        g.x_arg = x_arg # Picked up by Migrate.get_config(), as in flask_migrate.cli.db
+
+    def _real_group(self, ctx):
+        from flask.cli import ScriptInfo
+        from flask_migrate import Migrate
+        from flask_migrate.cli import db as db_cli_group
+
+        app = ctx.ensure_object(ScriptInfo).load_app()
+        if 'migrate' not in app.extensions:
+            Migrate(app, self._db, directory=self._directory)
+        return db_cli_group
+
+    def list_commands(self, ctx):
+        return self._real_group(ctx).list_commands(ctx)
+
+    def get_command(self, ctx, name):
+        return self._real_group(ctx).get_command(ctx, name)
+
+
+def register_lazy_migrate_commands(app, db):
+    app.cli.add_command(LazyMigrateGroup(
+        db, app.config['MIGRATIONS_DIRECTORY'], name='db', help='Perform database migrations.',
+    ))
+# --- End Lazy 'flask db' commands ---
@@ -0,0 +1,117 @@
+# Helpers for streaming responses as Server-Sent Events (SSE).
+# Model providers stream tokens through async generators, while Flask serves
+# responses from plain (synchronous) generators. stream_sse_events() runs the
+# async side on its own event loop in a background thread and hands events
+# over through a bounded queue.
+import asyncio
+import json
+import logging
+import queue
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+def sse_event(event, data, event_id=None):
+    """
+    Formats one Server-Sent Event. 'data' is serialized as JSON on a single line.
+    """
+    lines = []
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    lines.append(f"event: {event}")
+    lines.append(f"data: {json.dumps(data, separators=(',', ':'))}")
+    return '\n'.join(lines) + '\n\n'
+
+
+# A comment line; ignored by EventSource clients but keeps proxies from timing out
+SSE_HEARTBEAT = ': heartbeat\n\n'
+
+# Markers passed through the queue alongside the events themselves
+_FINISHED = object()
+
+
+def stream_sse_events(make_async_events, heartbeat_interval=15.0, max_buffered=64, user_id=None):
+    """
+    Turns an async generator of (event, data) tuples into a synchronous generator
+    of SSE-formatted strings suitable for a Flask Response.
+
+    - 'make_async_events' is a callable returning the async generator; it is called
+      on the background thread's event loop.
+    - At most 'max_buffered' events are held in memory: when the client reads slower
+      than the model produces, the producer waits instead of buffering without bound.
+    - A heartbeat comment is sent whenever no event was produced for 'heartbeat_interval' seconds.
+    - When the client disconnects, the WSGI server closes this generator; the producer
+      is then cancelled so the model call stops as well.
+    - An exception raised by the generator is logged (with 'user_id') and the client
+      gets a generic 'error' event; messages meant for the client are yielded as events.
+    """
+    events = queue.Queue(maxsize=max_buffered)
+    cancelled = threading.Event()
+
+    def put(item):
+        # Blocks while the queue is full (backpressure), but gives up once cancelled
+        while not cancelled.is_set():
+            try:
+                events.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    async def put_async(item):
+        try:
+            events.put_nowait(item)
+            return True
+        except queue.Full:
+            # The client is behind: wait on a worker thread, so the event loop keeps running
+            return await asyncio.get_running_loop().run_in_executor(None, put, item)
+
+    async def pump():
+        agen = make_async_events()
+        try:
+            async for item in agen:
+                if not await put_async(item):
+                    break # The client went away
+        except Exception:
+            logger.exception("Error while producing streamed events", extra={'user_id': user_id})
+            await put_async(('error', {"error": "An error occurred while generating the response"}))
+        finally:
+            await agen.aclose()
+            await put_async(_FINISHED)
+
+    # The producer gets its own event loop so it can be cancelled from this thread
+    loop = asyncio.new_event_loop()
+    task = loop.create_task(pump())
+
+    def run_producer():
+        try:
+            loop.run_until_complete(task)
+        except asyncio.CancelledError:
+            pass
+        finally:
+            loop.run_until_complete(loop.shutdown_default_executor()) # Worker threads of put_async()
+            loop.close()
+
+    threading.Thread(target=run_producer, daemon=True).start()
+
+    try:
+        event_id = 0
+        while True:
+            try:
+                item = events.get(timeout=heartbeat_interval)
+            except queue.Empty:
+                yield SSE_HEARTBEAT
+                continue
+            if item is _FINISHED:
+                break
+            event, data = item
+            yield sse_event(event, data, event_id=event_id)
+            event_id += 1
+    finally:
+        # Runs on normal completion and when the client disconnects (GeneratorExit)
+        cancelled.set()
+        try:
+            loop.call_soon_threadsafe(task.cancel) # Interrupt a model call that is still waiting
+        except RuntimeError:
+            pass # The loop already finished and was closed
@@ -0,0 +1,277 @@
+# Token counting and context budgets for agents.
+# - Tokenizers are pluggable: TOKENIZER='auto' uses tiktoken (optional dependency)
+#   when it is installed and otherwise a local heuristic tokenizer; other
+#   tokenizers can be added with register_tokenizer(). Each model maps to an
+#   encoding, whose name is stored next to counts so they can be recomputed if
+#   the tokenizer changes.
+# - count_tokens() is memoized per (encoding, hash of the text), so the same
+#   system prompt is only counted once per process. Agents store their system
+#   prompt's count when they are created (Agent.system_prompt_tokens).
+# - Budgets: a call may use the model's context window minus MODEL_OUTPUT_RESERVE
+#   tokens for the answer. An input that does not fit next to the system prompt
+#   is truncated (its beginning and end are kept) or rejected, according to
+#   CONTEXT_OVERFLOW_POLICY, before the provider is called.
+import hashlib
+import re
+import threading
+from collections import OrderedDict
+
+from sqlalchemy import event, inspect
+
+try:
+    import tiktoken
+except ImportError: # Optional dependency
+    tiktoken = None
+
+# Context window (tokens) of the models the app knows; others use DEFAULT_CONTEXT_WINDOW.
+# Extend or override with MODEL_CONTEXT_WINDOWS='{"model": tokens, ...}'.
+MODEL_CONTEXT_WINDOWS = {
+    'gpt-4o': 128000,
+    'gpt-4o-mini': 128000,
+    'gemini-pro': 32760,
+    'claude-3-haiku': 200000,
+    'llama-3-70b': 8192,
+}
+DEFAULT_CONTEXT_WINDOW = 8192
+
+OVERFLOW_POLICIES = ('truncate', 'reject')
+TRUNCATION_MARKER = '\n[...]\n'
+
+
+class ContextBudgetExceeded(ValueError):
+    """
+    Raised when an input (or a system prompt) does not fit in a model's context window.
+    """
+    pass
+
+
+# --- Tokenizers ---
+class HeuristicEncoding:
+    """
+    Local approximation of a BPE tokenizer, used when no real tokenizer is
+    installed: ASCII words cost one token per five letters, digits one token
+    per three, every other character one token.
+    """
+    name = 'heuristic-v1'
+    _pattern = re.compile(r'[A-Za-z]+|\d{1,3}|\S')
+
+    def count(self, text):
+        tokens = 0
+        for piece in self._pattern.findall(text):
+            tokens += (len(piece) + 4) // 5 if piece[0].isalpha() and piece.isascii() else 1
+        return tokens
+
+
+class TiktokenEncoding:
+    """
+    A tiktoken encoding (exact counts for OpenAI models, a close estimate for others).
+    """
+
+    def __init__(self, encoding):
+        self._encoding = encoding
+        self.name = f'tiktoken:{encoding.name}'
+
+    def count(self, text):
+        return len(self._encoding.encode(text, disallowed_special=()))
+
+
+def _tiktoken_for_model(model):
+    try:
+        return TiktokenEncoding(tiktoken.encoding_for_model(model))
+    except KeyError: # Not an OpenAI model
+        return TiktokenEncoding(tiktoken.get_encoding('cl100k_base'))
+
+
+_HEURISTIC = HeuristicEncoding()
+
+# name -> function(model) returning an encoding object with .name and .count(text)
+_TOKENIZERS = {
+    'heuristic': lambda model: _HEURISTIC,
+}
+if tiktoken is not None:
+    _TOKENIZERS['tiktoken'] = _tiktoken_for_model
+
+
+def register_tokenizer(name, encoding_for_model):
+    """
+    Adds a tokenizer: encoding_for_model(model) returns an object with a unique
+    'name' and a 'count(text)' method.
+    """
+    _TOKENIZERS[name] = encoding_for_model
+# --- End Tokenizers ---
+
+
+# --- Settings (set by init_tokens) ---
+_settings = {
+    'tokenizer': 'heuristic',
+    'context_windows': dict(MODEL_CONTEXT_WINDOWS),
+    'default_context_window': DEFAULT_CONTEXT_WINDOW,
+    'output_reserve': 1024,
+    'overflow_policy': 'truncate',
+}
+_encodings = {} # model -> encoding, for the configured tokenizer
+_counts = OrderedDict() # (encoding name, text key) -> token count (LRU)
+_counts_lock = threading.Lock()
+_counts_max = 10000
+# --- End Settings ---
+
+
+def encoding_for(model):
+    """
+    The encoding the configured tokenizer uses for a model (None = the default model).
+    """
+    encoding = _encodings.get(model)
+    if encoding is None:
+        encoding = _encodings[model] = _TOKENIZERS[_settings['tokenizer']](model or '')
+    return encoding
+
+
+def count_tokens(model, text):
+    """
+    Number of tokens of 'text' for 'model'. Memoized.
+    """
+    if not text:
+        return 0
+    encoding = encoding_for(model)
+    # Long texts are keyed by their hash so the cache does not keep them alive
+    text_key = text if len(text) <= 64 else hashlib.blake2b(text.encode('utf-8'), digest_size=16).digest()
+    key = (encoding.name, text_key)
+    with _counts_lock:
+        count = _counts.get(key)
+        if count is not None:
+            _counts.move_to_end(key)
+            return count
+    count = encoding.count(text)
+    with _counts_lock:
+        _counts[key] = count
+        if len(_counts) > _counts_max:
+            _counts.popitem(last=False)
+    return count
+
+
+def context_window(model):
+    return _settings['context_windows'].get(model, _settings['default_context_window'])
+
+
+def input_budget(model, system_prompt_tokens):
+    """
+    Tokens left for a call's input next to the system prompt and the reserved output.
+    """
+    return context_window(model) - _settings['output_reserve'] - system_prompt_tokens
+
+
+def check_system_prompt(model, system_prompt):
+    """
+    Returns the system prompt's token count, or raises ContextBudgetExceeded
+    if it leaves no room for an input.
+    """
+    tokens = count_tokens(model, system_prompt)
+    if input_budget(model, tokens) <= 0:
+        raise ContextBudgetExceeded(
+            f"The system prompt is {tokens} tokens; model '{model}' accepts at most "
+            f"{context_window(model) - _settings['output_reserve'] - 1} (its context window minus the reserved output)")
+    return tokens
+
+
+def agent_prompt_tokens(agent):
+    """
+    An agent's (model instance or dict) system prompt token count: the stored one
+    when it was counted with the current encoding, otherwise counted now.
+    """
+    get = agent.get if isinstance(agent, dict) else lambda field: getattr(agent, field, None)
+    if get('system_prompt_tokens') is not None and get('system_prompt_token_encoding') == encoding_for(get('model')).name:
+        return get('system_prompt_tokens')
+    return count_tokens(get('model'), get('system_prompt'))
+
+
+def truncate_to_tokens(model, text, max_tokens):
+    """
+    Shortens text to at most max_tokens, keeping its beginning and its end.
+    """
+    if max_tokens <= 0:
+        return ''
+    if count_tokens(model, text) <= max_tokens:
+        return text
+    # Binary search on the number of characters kept from each end
+    low, high = 0, len(text) // 2
+    while low < high:
+        keep = (low + high + 1) // 2
+        if count_tokens(model, text[:keep] + TRUNCATION_MARKER + text[-keep:]) <= max_tokens:
+            low = keep
+        else:
+            high = keep - 1
+    return text[:low] + TRUNCATION_MARKER + text[-low:] if low else ''
+
+
+def fit_input(model, system_prompt_tokens, text):
+    """
+    Returns (text, truncated) where text fits the model's input budget.
+    Raises ContextBudgetExceeded when it does not fit and the policy is 'reject'.
+    """
+    budget = input_budget(model, system_prompt_tokens)
+    tokens = count_tokens(model, text)
+    if tokens <= budget:
+        return text, False
+    if _settings['overflow_policy'] == 'reject' or budget <= 0:
+        raise ContextBudgetExceeded(
+            f"Input is {tokens} tokens but model '{model}' has room for {max(budget, 0)} "
+            f"(context window {context_window(model)}, system prompt {system_prompt_tokens})")
+    return truncate_to_tokens(model, text, budget), True
+
+
+def agent_input_fitter():
+    """
+    fit_input for agents, as used by the nodemap executor: fit(agent, text) -> (text, truncated).
+    """
+    def fit(agent, text):
+        model = agent.get('model') if isinstance(agent, dict) else agent.model
+        return fit_input(model, agent_prompt_tokens(agent), text)
+    return fit
+
+
+# --- Keep Agent.system_prompt_tokens up to date ---
+def _count_agent_prompts(session, flush_context, instances):
+    # Agents created or changed through the ORM; bulk inserts set the count themselves
+    from app.models import Agent
+
+    for obj in list(session.new) + list(session.dirty):
+        if not isinstance(obj, Agent) or not obj.system_prompt or not obj.model:
+            continue
+        encoding_name = encoding_for(obj.model).name
+        attrs = inspect(obj).attrs
+        changed = attrs.system_prompt.history.has_changes() or attrs.model.history.has_changes()
+        if changed or obj.system_prompt_tokens is None or obj.system_prompt_token_encoding != encoding_name:
+            obj.system_prompt_tokens = count_tokens(obj.model, obj.system_prompt)
+            obj.system_prompt_token_encoding = encoding_name
+# --- End Keep Agent.system_prompt_tokens up to date ---
+
+
+def init_tokens(app, db):
+    """
+    Applies the tokenizer and budget settings of the app.
+    """
+    config = app.config
+    tokenizer = config['TOKENIZER']
+    if tokenizer == 'auto':
+        tokenizer = 'tiktoken' if 'tiktoken' in _TOKENIZERS else 'heuristic'
+    if tokenizer not in _TOKENIZERS:
+        raise ValueError(f"Unknown TOKENIZER {tokenizer!r} (available: auto, {', '.join(_TOKENIZERS)})")
+    if config['CONTEXT_OVERFLOW_POLICY'] not in OVERFLOW_POLICIES:
+        raise ValueError(f"Unknown CONTEXT_OVERFLOW_POLICY {config['CONTEXT_OVERFLOW_POLICY']!r} "
+                         f"(expected one of {', '.join(OVERFLOW_POLICIES)})")
+
+    global _counts_max
+    _settings.update(
+        tokenizer=tokenizer,
+        context_windows=dict(MODEL_CONTEXT_WINDOWS, **config['MODEL_CONTEXT_WINDOWS']),
+        default_context_window=config['DEFAULT_CONTEXT_WINDOW'],
+        output_reserve=config['MODEL_OUTPUT_RESERVE'],
+        overflow_policy=config['CONTEXT_OVERFLOW_POLICY'],
+    )
+    _encodings.clear()
+    with _counts_lock:
+        _counts.clear()
+    _counts_max = config['TOKEN_COUNT_CACHE_SIZE']
+
+    if not event.contains(db.session, 'before_flush', _count_agent_prompts):
+        event.listen(db.session, 'before_flush', _count_agent_prompts)
@@ -0,0 +1,395 @@
+# Export and import of a user's workspace (agents and nodemaps) as NDJSON:
+# one JSON object per line, in this order:
+#     {"type": "header", "format": "ai-orchestrator-workspace", "version": 1, "exported_at": "...", ...}
+#     {"type": "agent", "id": 3, "name": "...", "agent_type": "...", "model": "...", "system_prompt": "...", ...}
+#     {"type": "nodemap", "id": 7, "name": "...", "goal": "...", "description": "...", ...}
+#     {"type": "node", "nodemap_id": 7, "data": {...the React Flow node...}}   (after their nodemap)
+#     {"type": "edge", "nodemap_id": 7, "data": {...the React Flow edge...}}
+#     {"type": "end", "agents": 1, "nodemaps": 1, "nodes": 10, "edges": 9}
+# - Export reads agents and nodemaps in keyset-paginated batches and nodes/edges
+#   through a streaming cursor, and writes the stored element JSON as-is, so its
+#   memory use does not depend on the size of the workspace.
+# - Import reads the file line by line and commits every IMPORT_BATCH_SIZE lines.
+#   Agents and nodemaps get new ids (names are made unique), and nodes that
+#   reference an exported agent (data.agentId) are pointed at its copy.
+import json
+import zlib
+from datetime import datetime
+
+from sqlalchemy import select, insert, func
+
+from app import db
+from app.models import Agent, Nodemap, NodemapNode, NodemapEdge
+from app.services.nodemap_graph import load_nodemap_graph, serialize_element, agent_id_of
+from app.services.graph_index import refresh_graph_index
+from app.services.nodemap_history import record_revision
+
+FORMAT_NAME = 'ai-orchestrator-workspace'
+FORMAT_VERSION = 1
+
+# Longest agent/nodemap name (both columns are String(100))
+MAX_NAME_LENGTH = 100
+
+
+class WorkspaceImportError(ValueError):
+    """
+    Raised when an import file is malformed or cannot be imported.
+    """
+    pass
+
+
+def _line(record):
+    return json.dumps(record, separators=(',', ':')) + '\n'
+
+
+def _isoformat(value):
+    return value.isoformat() if value else None
+
+
+def _parse_datetime(value):
+    # Exported creation times are kept; anything unreadable becomes "now"
+    try:
+        return datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        return datetime.utcnow()
+
+
+# --- Export ---
+def _keyset_batches(query, id_column, batch_size):
+    # Rows of 'query' in id order, batch_size at a time, without an OFFSET scan
+    last_id = 0
+    while True:
+        rows = db.session.execute(query.where(id_column > last_id).order_by(id_column).limit(batch_size)).all()
+        if not rows:
+            return
+        yield rows
+        last_id = rows[-1].id
+
+
+def _element_lines(nodemap_id, model, kind, batch_size):
+    # The stored JSON strings are spliced in without being parsed
+    query = select(model.data).where(model.nodemap_id == nodemap_id) \
+        .order_by(model.sort_index, model.id).execution_options(yield_per=batch_size)
+    for (data,) in db.session.execute(query):
+        yield f'{{"type":"{kind}","nodemap_id":{nodemap_id},"data":{data}}}\n'
+
+
+def export_workspace(user_id, batch_size=1000):
+    """
+    Generates the user's workspace as NDJSON lines (see the top of this module).
+    Runs in one read transaction, so the export is a consistent snapshot on SQLite.
+    """
+    counts = {'agents': 0, 'nodemaps': 0, 'nodes': 0, 'edges': 0}
+    yield _line({'type': 'header', 'format': FORMAT_NAME, 'version': FORMAT_VERSION,
+                 'exported_at': datetime.utcnow().isoformat(), 'user_id': user_id})
+
+    agents = select(Agent.id, Agent.name, Agent.type, Agent.model, Agent.system_prompt,
+                    Agent.cache_responses, Agent.created_at).where(Agent.user_id == user_id)
+    for rows in _keyset_batches(agents, Agent.id, batch_size):
+        for agent in rows:
+            counts['agents'] += 1
+            yield _line({'type': 'agent', 'id': agent.id, 'name': agent.name, 'agent_type': agent.type,
+                         'model': agent.model, 'system_prompt': agent.system_prompt,
+                         'cache_responses': agent.cache_responses, 'created_at': _isoformat(agent.created_at)})
+
+    # Maps that still keep their graph in the legacy JSON columns are read through the model
+    legacy = (Nodemap.nodes_data.isnot(None) | Nodemap.edges_data.isnot(None)).label('legacy')
+    nodemaps = select(Nodemap.id, Nodemap.name, Nodemap.goal, Nodemap.description, Nodemap.is_favorite,
+                      Nodemap.created_at, legacy).where(Nodemap.user_id == user_id)
+    for rows in _keyset_batches(nodemaps, Nodemap.id, batch_size):
+        for nodemap in rows:
+            counts['nodemaps'] += 1
+            yield _line({'type': 'nodemap', 'id': nodemap.id, 'name': nodemap.name, 'goal': nodemap.goal,
+                         'description': nodemap.description, 'is_favorite': nodemap.is_favorite,
+                         'created_at': _isoformat(nodemap.created_at)})
+            if nodemap.legacy:
+                instance = db.session.get(Nodemap, nodemap.id)
+                nodes, edges = load_nodemap_graph(instance)
+                db.session.expunge(instance)
+                for kind, elements in (('node', nodes), ('edge', edges)):
+                    for element in elements:
+                        counts[kind + 's'] += 1
+                        yield _line({'type': kind, 'nodemap_id': nodemap.id, 'data': element})
+                continue
+            for kind, model in (('node', NodemapNode), ('edge', NodemapEdge)):
+                for line in _element_lines(nodemap.id, model, kind, batch_size):
+                    counts[kind + 's'] += 1
+                    yield line
+
+    yield _line(dict({'type': 'end'}, **counts))
+
+
+def gzip_lines(lines, level=6):
+    """
+    Compresses a stream of text lines into gzip chunks (for ?compress=gzip).
+    """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31) # wbits=31: gzip container
+    for line in lines:
+        chunk = compressor.compress(line.encode('utf-8'))
+        if chunk:
+            yield chunk
+    yield compressor.flush()
+# --- End Export ---
+
+
+# --- Import ---
+def read_lines(stream, max_line_bytes):
+    """
+    Yields (line number, raw line) from a binary stream, refusing lines longer than max_line_bytes.
+    """
+    line_number = 0
+    while True:
+        raw = stream.readline(max_line_bytes + 1)
+        if not raw:
+            return
+        line_number += 1
+        if len(raw) > max_line_bytes and not raw.endswith(b'\n'):
+            raise WorkspaceImportError(f"Line {line_number} is longer than {max_line_bytes} bytes")
+        yield line_number, raw
+
+
+def parse_header(raw):
+    """
+    Checks the first line of an import file. Raises WorkspaceImportError if it is not a header.
+    """
+    try:
+        header = json.loads(raw)
+    except ValueError:
+        header = None
+    if not isinstance(header, dict) or header.get('type') != 'header' or header.get('format') != FORMAT_NAME:
+        raise WorkspaceImportError(f"The first line must be a '{FORMAT_NAME}' header")
+    if not isinstance(header.get('version'), int) or header['version'] > FORMAT_VERSION:
+        raise WorkspaceImportError(f"Unsupported workspace format version: {header.get('version')!r}")
+    return header
+
+
+class WorkspaceImporter:
+    """
+    Imports the records of a workspace file, one at a time (feed()), for one user.
+    'validate_agent' and 'validate_nodemap' are the creation routes' field
+    validators, returning (fields, None) or (None, error message).
+    """
+
+    def __init__(self, user_id, validate_agent, validate_nodemap, batch_size=1000):
+        self.user_id = user_id
+        self.validate_agent = validate_agent
+        self.validate_nodemap = validate_nodemap
+        self.batch_size = batch_size
+        self.counts = {'agents': 0, 'nodemaps': 0, 'nodes': 0, 'edges': 0, 'unresolved_agent_refs': 0, 'renamed': 0}
+        self.agent_ids = {} # exported id -> new id
+        self.nodemap_ids = {}
+        self.finished = False
+        self._new_agents = [] # (exported id, Agent) not flushed yet
+        self._uncommitted = {'agents': [], 'nodemaps': [], 'nodes': 0, 'edges': 0} # Undone by abort()
+        self._owned_agents = {} # agent id -> whether it already belongs to the user
+        self._current = None # The nodemap whose nodes/edges are being imported
+        self._rows = {'nodes': [], 'edges': []} # Graph rows waiting for a bulk insert
+        self._since_commit = 0
+        self._names = {
+            'agent': set(db.session.scalars(select(Agent.name).where(Agent.user_id == user_id))),
+            'nodemap': set(db.session.scalars(select(Nodemap.name).where(Nodemap.user_id == user_id))),
+        }
+
+    def _unique_name(self, kind, name):
+        if name not in self._names[kind]:
+            self._names[kind].add(name)
+            return name
+        self.counts['renamed'] += 1
+        number = 2
+        while True:
+            suffix = f" ({number})"
+            candidate = name[:MAX_NAME_LENGTH - len(suffix)] + suffix
+            if candidate not in self._names[kind]:
+                self._names[kind].add(candidate)
+                return candidate
+            number += 1
+
+    # --- Records ---
+    def feed(self, record):
+        """
+        Imports one record. Returns True when a batch was committed.
+        Raises WorkspaceImportError if the record is invalid.
+        """
+        if self.finished:
+            raise WorkspaceImportError("Nothing may follow the 'end' line")
+        if not isinstance(record, dict):
+            raise WorkspaceImportError("Every line must be a JSON object")
+        record_type = record.get('type')
+        if record_type == 'agent':
+            self._add_agent(record)
+        elif record_type == 'nodemap':
+            self._add_nodemap(record)
+        elif record_type in ('node', 'edge'):
+            self._add_element(record_type, record)
+        elif record_type == 'end':
+            self.finish()
+            return True
+        else:
+            raise WorkspaceImportError(f"Unknown record type: {record_type!r}")
+
+        self._since_commit += 1
+        if self._since_commit >= self.batch_size:
+            self.commit()
+            return True
+        return False
+
+    def _add_agent(self, record):
+        fields, error = self.validate_agent(dict(record, type=record.get('agent_type')))
+        if error:
+            raise WorkspaceImportError(f"Invalid agent: {error}")
+        fields['name'] = self._unique_name('agent', fields['name'])
+        agent = Agent(user_id=self.user_id, created_at=_parse_datetime(record.get('created_at')), **fields)
+        db.session.add(agent)
+        self._new_agents.append((record.get('id'), agent))
+        self._uncommitted['agents'].append(record.get('id'))
+        self.counts['agents'] += 1
+
+    def _add_nodemap(self, record):
+        self._finish_nodemap()
+        fields, error = self.validate_nodemap(record)
+        if error:
+            raise WorkspaceImportError(f"Invalid nodemap: {error}")
+        nodemap = Nodemap(
+            name=self._unique_name('nodemap', fields['name']),
+            goal=fields['goal'],
+            description=fields['description'],
+            is_favorite=record.get('is_favorite') is True,
+            created_at=_parse_datetime(record.get('created_at')),
+            user_id=self.user_id,
+        )
+        db.session.add(nodemap)
+        db.session.flush() # The id is needed by the node/edge rows
+        self.nodemap_ids[record.get('id')] = nodemap.id
+        self._current = {'exported_id': record.get('id'), 'nodemap': nodemap,
+                         'ids': {'nodes': set(), 'edges': set()}, 'next_index': {'nodes': 0, 'edges': 0}}
+        self._uncommitted['nodemaps'].append(record.get('id'))
+        self.counts['nodemaps'] += 1
+
+    def _agent_id(self, exported_id):
+        # The copy of an exported agent, an agent the user already owns, or None
+        if self._new_agents:
+            self._flush_agents()
+        if exported_id in self.agent_ids:
+            return self.agent_ids[exported_id]
+        if exported_id not in self._owned_agents:
+            self._owned_agents[exported_id] = db.session.scalar(
+                select(func.count()).where(Agent.id == exported_id, Agent.user_id == self.user_id)) > 0
+        return exported_id if self._owned_agents[exported_id] else None
+
+    def _add_element(self, kind, record):
+        collection = kind + 's'
+        current = self._current
+        if current is None or record.get('nodemap_id') != current['exported_id']:
+            raise WorkspaceImportError(f"A {kind} must follow its nodemap (nodemap_id {record.get('nodemap_id')!r})")
+        element = record.get('data')
+        if not isinstance(element, dict):
+            raise WorkspaceImportError(f"Every {kind} must be an object")
+        if element.get('id') is None:
+            # The id a save gives it (nodemap_graph.with_element_ids), from its position in the map
+            index = current['next_index'][collection]
+            element_id = f'legacy_{index}'
+            element = dict(element, id=element_id if element_id not in current['ids'][collection] else f'{element_id}~{index}')
+        element_id = str(element['id'])
+        if element_id in current['ids'][collection]:
+            raise WorkspaceImportError(f"Duplicate {kind} id: {element_id!r}")
+        current['ids'][collection].add(element_id)
+
+        row = {'nodemap_id': current['nodemap'].id, 'sort_index': current['next_index'][collection]}
+        current['next_index'][collection] += 1
+        if kind == 'node':
+            exported_agent_id = agent_id_of(element)
+            agent_id = self._agent_id(exported_agent_id) if exported_agent_id is not None else None
+            if exported_agent_id is not None and agent_id != exported_agent_id:
+                element = dict(element, data=dict(element['data'], agentId=agent_id))
+                if agent_id is None:
+                    self.counts['unresolved_agent_refs'] += 1
+            row.update(node_id=element_id, agent_id=agent_id)
+        else:
+            row.update(edge_id=element_id,
+                       source=str(element['source']) if element.get('source') is not None else None,
+                       target=str(element['target']) if element.get('target') is not None else None)
+        row['data'] = serialize_element(element)
+        self._rows[collection].append(row)
+        self._uncommitted[collection] += 1
+        self.counts[collection] += 1
+        if len(self._rows[collection]) >= self.batch_size:
+            self._flush_rows()
+    # --- End Records ---
+
+    # --- Writing ---
+    def _flush_agents(self):
+        db.session.flush()
+        for exported_id, agent in self._new_agents:
+            self.agent_ids[exported_id] = agent.id
+        self._new_agents = []
+
+    def _flush_rows(self):
+        # One executemany per table
+        for collection, model in (('nodes', NodemapNode), ('edges', NodemapEdge)):
+            if self._rows[collection]:
+                db.session.execute(insert(model), self._rows[collection])
+                self._rows[collection] = []
+
+    def _finish_nodemap(self):
+        if self._current is None:
+            return
+        self._flush_rows()
+        nodemap = self._current['nodemap']
+        nodemap.version = 1
+        refresh_graph_index(nodemap)
+        # The map's first version: the history records all of its rows
+        record_revision(nodemap, {}, 'import')
+        self._current = None
+
+    def commit(self):
+        if self._new_agents:
+            self._flush_agents()
+        self._flush_rows()
+        db.session.commit()
+        self._since_commit = 0
+        self._uncommitted = {'agents': [], 'nodemaps': [], 'nodes': 0, 'edges': 0}
+
+    def finish(self):
+        self._finish_nodemap()
+        self.commit()
+        self.finished = True
+
+    def abort(self):
+        """
+        Rolls back the current batch. A nodemap whose nodes/edges were only partly
+        imported is deleted, so no half-imported map is left behind.
+        """
+        current = self._current
+        nodemap_id = current['nodemap'].id if current is not None else None
+        db.session.rollback()
+        self._new_agents = []
+        self._rows = {'nodes': [], 'edges': []}
+        self._current = None
+
+        # The counts and ids only keep what was committed
+        uncommitted = self._uncommitted
+        for kind, ids in (('agents', self.agent_ids), ('nodemaps', self.nodemap_ids)):
+            for exported_id in uncommitted[kind]:
+                ids.pop(exported_id, None)
+            self.counts[kind] -= len(uncommitted[kind])
+        for collection in ('nodes', 'edges'):
+            self.counts[collection] -= uncommitted[collection]
+        self._uncommitted = {'agents': [], 'nodemaps': [], 'nodes': 0, 'edges': 0}
+
+        if current is not None and current['exported_id'] in self.nodemap_ids:
+            # Explicit deletes: SQLite does not enforce ON DELETE CASCADE unless told to
+            for model in (NodemapNode, NodemapEdge):
+                db.session.execute(model.__table__.delete().where(model.nodemap_id == nodemap_id))
+            nodemap = db.session.get(Nodemap, nodemap_id)
+            if nodemap is not None:
+                db.session.delete(nodemap) # Through the session, so the search index and data_version follow
+            db.session.commit()
+            self.nodemap_ids.pop(current['exported_id'], None)
+            self.counts['nodemaps'] -= 1
+            for collection in ('nodes', 'edges'):
+                self.counts[collection] -= current['next_index'][collection] - uncommitted[collection]
+
+    def summary(self):
+        return dict(self.counts, agent_ids=self.agent_ids, nodemap_ids=self.nodemap_ids)
+    # --- End Writing ---
+# --- End Import ---
@@ -0,0 +1,18 @@
+# Benchmark and load-test suite for the backend routes.
+# Runs entirely on a laptop: a temporary SQLite database is seeded with users,
+# agents and nodemaps of realistic graph sizes, then every route is driven
+#   - through the Flask test client (micro-benchmarks, one request at a time), and
+#   - through a local multi-threaded HTTP server and load generator (no network
+#     beyond 127.0.0.1),
+# and the results (p50/p95/p99 latency, requests/sec, memory) are written as a
+# JSON report that can be diffed between commits.
+#
+# Usage (from backend/):
+#   python -m benchmarks run --output before.json
+#   python -m benchmarks run --users 20 --nodemaps 50 --nodes 80 --threads 8 --output after.json
+#   python -m benchmarks compare before.json after.json
+#
+# The HTTP model provider client is benchmarked against a local stand-in server
+# (benchmarks/provider_server.py), which can also be run on its own:
+#   python -m benchmarks provider --calls 400 --concurrency 32 --latency 0.05
+#   python -m benchmarks provider-server --port 8089
@@ -0,0 +1,153 @@
+# Command line entry point: python -m benchmarks {run,compare,provider,provider-server} ...
+import argparse
+import json
+import os
+import sys
+import tempfile
+
+from benchmarks.scenarios import SCENARIOS
+
+
+def _parse_args(argv):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks', description='Backend route benchmarks')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run = commands.add_parser('run', help='seed a temporary SQLite database and benchmark the routes')
+    run.add_argument('--users', type=int, default=5)
+    run.add_argument('--agents', type=int, default=20, help='agents per user')
+    run.add_argument('--nodemaps', type=int, default=20, help='nodemaps per user')
+    run.add_argument('--nodes', type=int, default=40, help='average nodes per nodemap')
+    run.add_argument('--iterations', type=int, default=200, help='micro-benchmark requests per scenario')
+    run.add_argument('--threads', type=int, default=4, help='load generator threads')
+    run.add_argument('--requests', type=int, default=100, help='load requests per thread per scenario')
+    run.add_argument('--scenarios', default=','.join(SCENARIOS), help='comma separated, default: all')
+    run.add_argument('--skip-micro', action='store_true')
+    run.add_argument('--skip-load', action='store_true')
+    run.add_argument('--seed', type=int, default=1234)
+    run.add_argument('--database', help='SQLite file to use (default: a temporary file)')
+    run.add_argument('--output', help='where to write the JSON report')
+
+    compare = commands.add_parser('compare', help='compare two JSON reports')
+    compare.add_argument('base')
+    compare.add_argument('new')
+
+    provider = commands.add_parser('provider', help='benchmark the HTTP model provider client against the local stand-in')
+    provider.add_argument('--calls', type=int, default=400)
+    provider.add_argument('--concurrency', type=int, default=32)
+    provider.add_argument('--latency', type=float, default=0.05, help='simulated response time (seconds)')
+    provider.add_argument('--token-latency', type=float, default=0.0, help='delay between streamed tokens (seconds)')
+    provider.add_argument('--stream', action='store_true', help='stream the responses')
+    provider.add_argument('--duplicates', type=float, default=0.3, help='fraction of calls that repeat a popular prompt')
+    provider.add_argument('--error-rate', type=float, default=0.0, help='fraction of upstream requests failing with 503')
+    provider.add_argument('--seed', type=int, default=1234)
+    provider.add_argument('--output', help='where to write the JSON results')
+
+    server = commands.add_parser('provider-server', help='run the local model provider stand-in')
+    server.add_argument('--host', default='127.0.0.1')
+    server.add_argument('--port', type=int, default=8089)
+    server.add_argument('--latency', type=float, default=0.5, help='simulated response time (seconds)')
+    server.add_argument('--token-latency', type=float, default=0.02, help='delay between streamed tokens (seconds)')
+    server.add_argument('--error-rate', type=float, default=0.0, help='fraction of requests failing with 503')
+    return parser.parse_args(argv)
+
+
+def _run(args):
+    unknown = [name for name in args.scenarios.split(',') if name not in SCENARIOS]
+    if unknown:
+        sys.exit(f"Unknown scenarios: {', '.join(unknown)} (available: {', '.join(SCENARIOS)})")
+    scenarios = [SCENARIOS[name] for name in args.scenarios.split(',')]
+
+    # --- Isolated app and database ---
+    temp_dir = None
+    database = args.database
+    if not database:
+        temp_dir = tempfile.TemporaryDirectory(prefix='ai_orchestrator_bench_')
+        database = os.path.join(temp_dir.name, 'benchmark.db')
+    os.environ['DATABASE_URL'] = f'sqlite:///{os.path.abspath(database)}'
+    os.environ.setdefault('LOG_LEVEL', 'WARNING') # Per-request logs would dominate the measurement
+    os.environ.setdefault('JWT_SECRET_KEY', 'benchmark-jwt-secret-key-with-32-bytes!')
+
+    from app import create_app, db
+    from app.models import User
+    from benchmarks.seed import seed_database
+    from benchmarks.runner import run_micro, run_load
+    from benchmarks.report import build_report, write_report, print_summary
+
+    app = create_app()
+    # --- End Isolated app and database ---
+
+    with app.app_context():
+        if User.query.count():
+            sys.exit(f"{database} already contains users; benchmarks need an empty database")
+        print(f"Seeding {args.users} users x ({args.agents} agents, {args.nodemaps} nodemaps of ~{args.nodes} nodes)...")
+        seed_info = seed_database(
+            users=args.users, agents_per_user=args.agents, nodemaps_per_user=args.nodemaps,
+            nodes_per_map=args.nodes, seed=args.seed,
+        )
+    print(f"Seeded {seed_info['counts']} in {seed_info['seconds']}s")
+
+    micro = {} if args.skip_micro else run_micro(app, seed_info['users'], scenarios, iterations=args.iterations, seed=args.seed)
+    load = {} if args.skip_load else run_load(
+        app, seed_info['users'], scenarios, threads=args.threads, requests_per_thread=args.requests, seed=args.seed,
+    )
+
+    config = {key: getattr(args, key) for key in (
+        'users', 'agents', 'nodemaps', 'nodes', 'iterations', 'threads', 'requests', 'seed',
+    )}
+    config['scenarios'] = [scenario.name for scenario in scenarios]
+    report = build_report(config, seed_info, micro, load)
+    print_summary(report)
+    if args.output:
+        write_report(report, args.output)
+        print(f"\nReport written to {args.output}")
+
+    with app.app_context():
+        db.engine.dispose()
+    if temp_dir is not None:
+        temp_dir.cleanup()
+
+
+def _provider(args):
+    import logging
+    logging.getLogger('app.services.http_provider').setLevel(logging.ERROR) # Retry warnings would flood the output
+    from benchmarks.provider_bench import run_provider_benchmark, print_provider_summary
+    results = run_provider_benchmark(
+        calls=args.calls, concurrency=args.concurrency, latency=args.latency, token_latency=args.token_latency,
+        stream=args.stream, duplicate_fraction=args.duplicates, error_rate=args.error_rate, seed=args.seed,
+    )
+    print_provider_summary(results)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as output_file:
+            json.dump({'config': vars(args), 'results': results}, output_file, indent=2)
+        print(f"\nResults written to {args.output}")
+
+
+def _provider_server(args):
+    from benchmarks.provider_server import ProviderStandInServer
+    server = ProviderStandInServer((args.host, args.port), latency=args.latency,
+                                   token_latency=args.token_latency, error_rate=args.error_rate)
+    print(f"Model provider stand-in listening on {server.base_url} (Ctrl+C to stop)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+def main(argv=None):
+    args = _parse_args(sys.argv[1:] if argv is None else argv)
+    if args.command == 'compare':
+        from benchmarks.report import compare_reports
+        with open(args.base, encoding='utf-8') as base_file, open(args.new, encoding='utf-8') as new_file:
+            compare_reports(json.load(base_file), json.load(new_file))
+    elif args.command == 'provider':
+        _provider(args)
+    elif args.command == 'provider-server':
+        _provider_server(args)
+    else:
+        _run(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+# Throughput of HTTPModelProvider against the local stand-in server.
+# The same calls are run three times:
+#   - 'no_keepalive':  a new connection per call (idle_timeout=0), no single-flight,
+#   - 'keepalive':     pooled keep-alive connections, no single-flight,
+#   - 'single_flight': pooled connections, identical concurrent calls coalesced,
+# and each run reports latency percentiles, calls/sec, and the upstream requests
+# and connections the stand-in actually saw.
+import asyncio
+import random
+import time
+
+from app.services.http_provider import HTTPModelProvider
+from benchmarks.provider_server import start_provider_server
+from benchmarks.report import summarize
+
+CONFIGURATIONS = {
+    'no_keepalive': {'idle_timeout': 0, 'single_flight': False},
+    'keepalive': {'single_flight': False},
+    'single_flight': {'single_flight': True},
+}
+
+
+def _prompts(calls, duplicate_fraction, popular_prompts, seed):
+    """
+    duplicate_fraction of the calls ask one of a few popular prompts (the same
+    question sent by many users or nodes); the rest are unique.
+    """
+    rng = random.Random(seed)
+    return [
+        f"popular question {rng.randrange(popular_prompts)}" if rng.random() < duplicate_fraction
+        else f"unique question {index}"
+        for index in range(calls)
+    ]
+
+
+async def _drive(provider, prompts, concurrency, stream):
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    errors = 0
+
+    async def one_call(prompt):
+        nonlocal errors
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                if stream:
+                    async for _ in provider.stream('gpt-4o', 'You are a benchmark.', prompt):
+                        pass
+                else:
+                    await provider.generate('gpt-4o', 'You are a benchmark.', prompt)
+                latencies.append(time.perf_counter() - started)
+            except Exception:
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one_call(prompt) for prompt in prompts))
+    return latencies, errors, time.perf_counter() - started
+
+
+def run_provider_benchmark(calls=400, concurrency=32, latency=0.05, token_latency=0.0, stream=False,
+                           duplicate_fraction=0.3, popular_prompts=5, error_rate=0.0, seed=1234):
+    """
+    Returns {configuration name: summary}.
+    """
+    prompts = _prompts(calls, duplicate_fraction, popular_prompts, seed)
+    results = {}
+    for name, options in CONFIGURATIONS.items():
+        server = start_provider_server(latency=latency, token_latency=token_latency, error_rate=error_rate, seed=seed)
+        provider = HTTPModelProvider(server.base_url, pool_size=concurrency, retry_backoff=0.05, name=f'bench_{name}', **options)
+        try:
+            latencies, errors, total_time = asyncio.run(_drive(provider, prompts, concurrency, stream))
+        finally:
+            provider.close()
+            server.shutdown()
+            server.server_close()
+        results[name] = summarize(latencies, errors, total_time, extra={
+            'upstream_requests': server.stats['requests'],
+            'upstream_connections': server.stats['connections'],
+        })
+    return results
+
+
+def print_provider_summary(results):
+    print(f"\n{'configuration':<16}{'calls/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'errors':>8}{'upstream':>10}{'conns':>8}")
+    for name, summary in results.items():
+        print(f"{name:<16}{summary['requests_per_second'] or 0:>10}{summary['p50_ms'] or 0:>10}{summary['p95_ms'] or 0:>10}"
+              f"{summary['errors']:>8}{summary['upstream_requests']:>10}{summary['upstream_connections']:>8}")
@@ -0,0 +1,139 @@
+# Local stand-in for a model provider's HTTP API.
+# Answers POST /v1/chat/completions like an OpenAI-compatible server, with the
+# deterministic responses of the offline 'local' provider, so HTTPModelProvider
+# (app/services/http_provider.py) can be run and benchmarked without a network:
+#   - 'latency' seconds pass before the response (or the first streamed token),
+#   - streamed tokens are sent as Server-Sent Events, 'token_latency' seconds apart,
+#   - 'error_rate' of the requests fail with 503, to exercise the retries.
+# Connections are kept alive (HTTP/1.1) and GET /stats reports how many requests
+# and connections the server has seen, so connection reuse and single-flight
+# coalescing can be checked from the outside.
+#
+# Usage (from backend/):
+#   python -m benchmarks provider-server --port 8089 --latency 0.5 --token-latency 0.02
+#   MODEL_PROVIDER_URL=http://127.0.0.1:8089/v1 flask run
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from app.services.model_providers import LocalModelProvider
+
+
+class ProviderStandInServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, latency=0.0, token_latency=0.0, error_rate=0.0, max_words=48, seed=None):
+        super().__init__(address, _ProviderRequestHandler)
+        self.latency = latency
+        self.token_latency = token_latency
+        self.error_rate = error_rate
+        self.responses = LocalModelProvider(max_words=max_words)
+        self.random = random.Random(seed)
+        self.stats = {'requests': 0, 'streams': 0, 'errors': 0, 'connections': 0}
+        self.stats_lock = threading.Lock()
+
+    def count(self, name):
+        with self.stats_lock:
+            self.stats[name] += 1
+
+    def should_fail(self):
+        with self.stats_lock:
+            return self.error_rate > 0 and self.random.random() < self.error_rate
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}/v1'
+
+
+class _ProviderRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1' # Keep-alive
+    disable_nagle_algorithm = True # Streamed tokens are small writes
+    timeout = 60 # Idle keep-alive connections are closed after this many seconds
+
+    def setup(self):
+        super().setup()
+        self.server.count('connections')
+
+    def log_message(self, format, *args):
+        pass # Per-request logs would dominate the measurement
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _write_chunk(self, data):
+        self.wfile.write(f'{len(data):x}\r\n'.encode('ascii') + data + b'\r\n')
+
+    def do_GET(self):
+        if self.path == '/stats':
+            with self.server.stats_lock:
+                stats = dict(self.server.stats)
+            return self._send_json(200, stats)
+        self._send_json(404, {'error': {'message': 'Not found'}})
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        raw = self.rfile.read(length)
+        if self.path.rstrip('/') != '/v1/chat/completions':
+            return self._send_json(404, {'error': {'message': 'Not found'}})
+        try:
+            request = json.loads(raw)
+            model = request['model']
+            messages = request['messages']
+        except (ValueError, KeyError, TypeError):
+            return self._send_json(400, {'error': {'message': "Expected JSON with 'model' and 'messages'"}})
+
+        self.server.count('requests')
+        if self.server.should_fail():
+            self.server.count('errors')
+            return self._send_json(503, {'error': {'message': 'Simulated overload'}})
+
+        system_prompt = ''.join(m.get('content', '') for m in messages if m.get('role') == 'system')
+        prompt = ''.join(m.get('content', '') for m in messages if m.get('role') == 'user')
+        text = self.server.responses._response_text(model, system_prompt, prompt)
+        if self.server.latency:
+            time.sleep(self.server.latency) # Time to the response, or to the first token
+
+        if not request.get('stream'):
+            return self._send_json(200, {
+                'object': 'chat.completion',
+                'model': model,
+                'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': text}, 'finish_reason': 'stop'}],
+            })
+
+        # --- Streamed response: one SSE event per token, chunked transfer encoding ---
+        self.server.count('streams')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        try:
+            for index, word in enumerate(text.split(' ')):
+                if index and self.server.token_latency:
+                    time.sleep(self.server.token_latency)
+                token = word if index == 0 else ' ' + word
+                event = {'object': 'chat.completion.chunk', 'choices': [{'index': 0, 'delta': {'content': token}}]}
+                self._write_chunk(b'data: ' + json.dumps(event).encode('utf-8') + b'\n\n')
+            self._write_chunk(b'data: [DONE]\n\n')
+            self.wfile.write(b'0\r\n\r\n')
+        except (BrokenPipeError, ConnectionResetError):
+            self.close_connection = True # The client stopped reading (an abandoned stream)
+        # --- End Streamed response ---
+
+
+def start_provider_server(host='127.0.0.1', port=0, **options):
+    """
+    Starts the stand-in in a background thread; port=0 picks a free port.
+    Returns the server (server.base_url is the URL for HTTPModelProvider; call server.shutdown() to stop it).
+    """
+    server = ProviderStandInServer((host, port), **options)
+    thread = threading.Thread(target=server.serve_forever, name='provider-standin', daemon=True)
+    thread.start()
+    return server
@@ -0,0 +1,130 @@
+# Statistics and JSON reports for the benchmark suite.
+import json
+import math
+import platform
+import subprocess
+import sys
+from datetime import datetime, timezone
+
+
+def percentile(sorted_values, fraction):
+    """
+    Nearest-rank percentile of an already sorted list (fraction in 0..1).
+    """
+    if not sorted_values:
+        return None
+    rank = math.ceil(round(fraction * len(sorted_values), 9))
+    return sorted_values[min(max(rank, 1), len(sorted_values)) - 1]
+
+
+def summarize(latencies, errors, total_time, extra=None):
+    """
+    Turns a list of request latencies (seconds) into the report entry of a scenario.
+    Latencies are reported in milliseconds.
+    """
+    values = sorted(latencies)
+
+    def ms(value):
+        return round(value * 1000, 3) if value is not None else None
+
+    summary = {
+        'requests': len(values),
+        'errors': errors,
+        'p50_ms': ms(percentile(values, 0.50)),
+        'p95_ms': ms(percentile(values, 0.95)),
+        'p99_ms': ms(percentile(values, 0.99)),
+        'mean_ms': ms(sum(values) / len(values)) if values else None,
+        'max_ms': ms(values[-1]) if values else None,
+        'requests_per_second': round(len(values) / total_time, 2) if total_time > 0 else None,
+    }
+    summary.update(extra or {})
+    return summary
+
+
+def peak_rss_bytes():
+    """
+    Peak resident memory of this process, or None where the resource module is unavailable.
+    """
+    try:
+        import resource
+    except ImportError: # Windows
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024 # macOS reports bytes, Linux kilobytes
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def build_report(config, seed_info, micro, load):
+    from importlib.metadata import version
+    return {
+        'meta': {
+            'created_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'git_commit': git_commit(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'flask': version('flask'),
+            'sqlalchemy': version('sqlalchemy'),
+        },
+        'config': config,
+        'seed': {'counts': seed_info['counts'], 'seconds': seed_info['seconds']},
+        'micro': micro,
+        'load': load,
+        'process': {'peak_rss_bytes': peak_rss_bytes()},
+    }
+
+
+def write_report(report, path):
+    with open(path, 'w', encoding='utf-8') as report_file:
+        json.dump(report, report_file, indent=2, sort_keys=True)
+        report_file.write('\n')
+
+
+def print_summary(report, out=sys.stdout):
+    for section in ('micro', 'load'):
+        results = report.get(section) or {}
+        if not results:
+            continue
+        out.write(f"\n{section}:\n")
+        out.write(f"  {'scenario':<24}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'req/s':>11}{'errors':>8}\n")
+        for name, result in results.items():
+            out.write(f"  {name:<24}{_cell(result['p50_ms'])}{_cell(result['p95_ms'])}"
+                      f"{_cell(result['p99_ms'])}{_cell(result['requests_per_second'], 11)}{result['errors']:>8}\n")
+
+
+def _cell(value, width=10):
+    return f"{'-' if value is None else value:>{width}}"
+
+
+def compare_reports(base, new, out=sys.stdout):
+    """
+    Prints the relative change of every scenario's latency percentiles and throughput.
+    Negative latency changes and positive throughput changes are improvements.
+    """
+    metrics = ('p50_ms', 'p95_ms', 'p99_ms', 'requests_per_second')
+    out.write(f"base {base['meta'].get('git_commit')}  ->  new {new['meta'].get('git_commit')}\n")
+    for section in ('micro', 'load'):
+        base_results = base.get(section) or {}
+        new_results = new.get(section) or {}
+        names = [name for name in new_results if name in base_results]
+        if not names:
+            continue
+        out.write(f"\n{section}:\n")
+        out.write(f"  {'scenario':<24}" + ''.join(f"{metric:>32}" for metric in metrics) + '\n')
+        for name in names:
+            cells = []
+            for metric in metrics:
+                before, after = base_results[name].get(metric), new_results[name].get(metric)
+                if before is None or after is None:
+                    cells.append(f"{'-':>32}")
+                    continue
+                change = f"{(after - before) / before * 100:+.1f}%" if before else 'n/a'
+                cells.append(f"{f'{before} -> {after} ({change})':>32}")
+            out.write(f"  {name:<24}" + ''.join(cells) + '\n')
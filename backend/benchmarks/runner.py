@@ -0,0 +1,144 @@
+# Drives the scenarios and measures them.
+# - run_micro():  one client, requests sent back to back through the test client.
+# - run_load():   several threads, each with its own HTTP connection, against a
+#                 local threaded werkzeug server.
+import random
+import threading
+import time
+import tracemalloc
+
+from werkzeug.serving import make_server, WSGIRequestHandler
+
+from benchmarks.report import summarize
+from benchmarks.scenarios import BenchmarkSession, HttpTransport, TestClientTransport
+
+
+def _timed_request(session, scenario):
+    """
+    Runs one scenario request; returns (seconds, ok).
+    """
+    if scenario.prepare:
+        scenario.prepare(session)
+    method, path, body, headers = scenario.build(session)
+    started = time.perf_counter()
+    status, response_headers, response_body = session.transport.request(method, path, body, headers)
+    elapsed = time.perf_counter() - started
+    if scenario.after:
+        scenario.after(session, status, response_headers, response_body)
+    return elapsed, status in scenario.ok_statuses
+
+
+def _sessions_for_threads(transport_factory, users, thread_count, seed):
+    """
+    One session per thread. Threads are spread over the users; threads that share
+    a user edit disjoint nodemaps, so patch saves do not conflict with each other.
+    """
+    slots_per_user = -(-thread_count // len(users)) # Ceiling division
+    sessions = []
+    for thread_index in range(thread_count):
+        user = users[thread_index % len(users)]
+        slot = thread_index // len(users)
+        nodemap_ids = user['nodemap_ids'][slot::slots_per_user] or user['nodemap_ids']
+        session = BenchmarkSession(transport_factory(), user, nodemap_ids, random.Random(seed + thread_index))
+        session.login()
+        sessions.append(session)
+    return sessions
+
+
+def run_micro(app, users, scenarios, iterations=200, warmup=20, memory_iterations=20, seed=1234):
+    """
+    Sends each scenario's requests one at a time through the test client.
+    Latencies are measured without tracemalloc; a separate short pass measures the
+    peak Python memory allocated while serving the scenario's requests.
+    """
+    results = {}
+    session = _sessions_for_threads(lambda: TestClientTransport(app), users, 1, seed)[0]
+    for scenario in scenarios:
+        for _ in range(min(warmup, scenario.max_requests or warmup)):
+            _timed_request(session, scenario)
+
+        latencies = []
+        errors = 0
+        started = time.perf_counter()
+        for _ in range(min(iterations, scenario.max_requests or iterations)):
+            elapsed, ok = _timed_request(session, scenario)
+            latencies.append(elapsed)
+            errors += not ok
+        total_time = time.perf_counter() - started
+
+        # --- Memory pass ---
+        tracemalloc.start()
+        tracemalloc.reset_peak()
+        baseline = tracemalloc.get_traced_memory()[0]
+        for _ in range(min(memory_iterations, scenario.max_requests or memory_iterations)):
+            _timed_request(session, scenario)
+        peak = tracemalloc.get_traced_memory()[1] - baseline
+        tracemalloc.stop()
+        # --- End Memory pass ---
+
+        results[scenario.name] = summarize(latencies, errors, total_time, extra={'peak_alloc_bytes': max(peak, 0)})
+    return results
+
+
+class _KeepAliveRequestHandler(WSGIRequestHandler):
+    # HTTP/1.1 so the load generator's connections are reused between requests
+    protocol_version = 'HTTP/1.1'
+
+    def log_request(self, *args, **kwargs):
+        pass # Access logs would dominate the measurement
+
+
+def start_http_server(app, host='127.0.0.1', port=0):
+    """
+    Starts a threaded werkzeug server in a background thread.
+    Returns (server, port); call server.shutdown() to stop it.
+    """
+    server = make_server(host, port, app, threaded=True, request_handler=_KeepAliveRequestHandler)
+    thread = threading.Thread(target=server.serve_forever, name='benchmark-http-server', daemon=True)
+    thread.start()
+    return server, server.server_port
+
+
+def run_load(app, users, scenarios, threads=4, requests_per_thread=100, seed=1234):
+    """
+    For each scenario, 'threads' clients send requests_per_thread requests each,
+    concurrently, over HTTP. Reports latency percentiles and overall requests/sec.
+    """
+    server, port = start_http_server(app)
+    results = {}
+    try:
+        sessions = _sessions_for_threads(lambda: HttpTransport('127.0.0.1', port), users, threads, seed)
+        for scenario in scenarios:
+            latencies = [[] for _ in sessions]
+            errors = [0] * len(sessions)
+            start_barrier = threading.Barrier(len(sessions) + 1)
+            request_count = min(requests_per_thread, scenario.max_requests or requests_per_thread)
+
+            def worker(index):
+                session = sessions[index]
+                start_barrier.wait()
+                for _ in range(request_count):
+                    try:
+                        elapsed, ok = _timed_request(session, scenario)
+                    except Exception:
+                        errors[index] += 1
+                        continue
+                    latencies[index].append(elapsed)
+                    errors[index] += not ok
+
+            workers = [threading.Thread(target=worker, args=(index,)) for index in range(len(sessions))]
+            for thread in workers:
+                thread.start()
+            start_barrier.wait()
+            started = time.perf_counter()
+            for thread in workers:
+                thread.join()
+            total_time = time.perf_counter() - started
+
+            all_latencies = [latency for thread_latencies in latencies for latency in thread_latencies]
+            results[scenario.name] = summarize(all_latencies, sum(errors), total_time, extra={'threads': len(sessions)})
+        for session in sessions:
+            session.transport.close()
+    finally:
+        server.shutdown()
+    return results
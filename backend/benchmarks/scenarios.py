@@ -0,0 +1,228 @@
+# The requests the benchmark drives, one scenario per route (or route variant).
+# A scenario builds a request from a BenchmarkSession (one simulated client),
+# and may update the session from the response (e.g. the new nodemap version).
+# Only the request itself is timed; fetching state a scenario needs happens in
+# its prepare step.
+import http.client
+import json
+from urllib.parse import quote
+
+from benchmarks.seed import BENCHMARK_PASSWORD, WORDS
+
+
+# --- Transports ---
+class TestClientTransport:
+    """
+    Sends requests through Flask's test client (no sockets). Not thread-safe.
+    request() returns (status, headers with lower-case names, body bytes).
+    """
+    name = 'test_client'
+
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def request(self, method, path, body=None, headers=None):
+        response = self.client.open(path, method=method, json=body, headers=headers or {})
+        return response.status_code, {key.lower(): value for key, value in response.headers.items()}, response.get_data()
+
+
+class HttpTransport:
+    """
+    Sends requests over a keep-alive HTTP/1.1 connection. One per thread.
+    """
+    name = 'http'
+
+    def __init__(self, host, port, timeout=30):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.connection = None
+
+    def request(self, method, path, body=None, headers=None):
+        headers = dict(headers or {})
+        payload = None
+        if body is not None:
+            payload = json.dumps(body).encode('utf-8')
+            headers['Content-Type'] = 'application/json'
+        for attempt in (1, 2):
+            if self.connection is None:
+                self.connection = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+            try:
+                self.connection.request(method, path, body=payload, headers=headers)
+                response = self.connection.getresponse()
+                body = response.read()
+                return response.status, {key.lower(): value for key, value in response.getheaders()}, body
+            except (http.client.HTTPException, ConnectionError):
+                # The server closed the keep-alive connection; reconnect once
+                self.close()
+                if attempt == 2:
+                    raise
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+# --- End Transports ---
+
+
+class BenchmarkSession:
+    """
+    State of one simulated client: its user, token and the nodemaps it edits.
+    """
+
+    def __init__(self, transport, user, nodemap_ids, rng):
+        self.transport = transport
+        self.user = user
+        self.nodemap_ids = nodemap_ids
+        self.rng = rng
+        self.token = None
+        self.user_data_etag = None
+        self.graphs = {} # nodemap_id -> {'nodes', 'edges', 'version'}
+
+    def auth_headers(self):
+        return {'Authorization': f'Bearer {self.token}'}
+
+    def login(self):
+        status, _, body = self.transport.request('POST', '/auth/login', {
+            'emailOrUsername': self.user['username'], 'password': BENCHMARK_PASSWORD,
+        })
+        if status != 200:
+            raise RuntimeError(f"Benchmark login failed for {self.user['username']}: {status} {body[:200]!r}")
+        self.token = json.loads(body)['access_token']
+
+    def load_graph(self, nodemap_id):
+        status, _, body = self.transport.request('GET', f'/creation/getnodemapdata/{nodemap_id}', headers=self.auth_headers())
+        if status != 200:
+            raise RuntimeError(f"Could not load nodemap {nodemap_id}: {status}")
+        data = json.loads(body)
+        self.graphs[nodemap_id] = {'nodes': data['nodes_data'], 'edges': data['edges_data'], 'version': data['version']}
+        return self.graphs[nodemap_id]
+
+    def pick_graph(self):
+        nodemap_id = self.rng.choice(self.nodemap_ids)
+        graph = self.graphs.get(nodemap_id) or self.load_graph(nodemap_id)
+        return nodemap_id, graph
+
+
+class Scenario:
+    """
+    build(session) -> (method, path, body, headers) for the timed request.
+    after(session, status, headers, body) updates the session from the response.
+    prepare(session) runs untimed before build.
+    max_requests caps the requests per run for deliberately slow routes.
+    """
+
+    def __init__(self, name, build, ok_statuses=(200,), prepare=None, after=None, max_requests=None):
+        self.name = name
+        self.max_requests = max_requests
+        self.build = build
+        self.ok_statuses = set(ok_statuses)
+        self.prepare = prepare
+        self.after = after
+
+
+# --- Scenario definitions ---
+def _build_login(session):
+    return 'POST', '/auth/login', {'emailOrUsername': session.user['username'], 'password': BENCHMARK_PASSWORD}, None
+
+
+def _build_user_data(session):
+    return 'GET', '/auth/user_data', None, session.auth_headers()
+
+
+def _build_user_data_conditional(session):
+    # After the first response the client revalidates with its ETag (304 path)
+    headers = session.auth_headers()
+    if session.user_data_etag:
+        headers['If-None-Match'] = session.user_data_etag
+    return 'GET', '/auth/user_data', None, headers
+
+
+def _after_user_data_conditional(session, status, headers, body):
+    if status == 200:
+        session.user_data_etag = headers.get('etag')
+
+
+def _build_getnodemaps(session):
+    return 'GET', '/creation/getnodemaps', None, session.auth_headers()
+
+
+def _build_getnodemaps_page(session):
+    return 'GET', '/creation/getnodemaps?limit=20&fields=id,name,is_favorite,created_at', None, session.auth_headers()
+
+
+def _build_getnodemapdata(session):
+    nodemap_id = session.rng.choice(session.nodemap_ids)
+    return 'GET', f'/creation/getnodemapdata/{nodemap_id}', None, session.auth_headers()
+
+
+def _prepare_save(session):
+    session.current_nodemap_id, session.current_graph = session.pick_graph()
+
+
+def _move_random_node(session, graph):
+    if not graph['nodes']:
+        return None
+    node = session.rng.choice(graph['nodes'])
+    position = node.setdefault('position', {'x': 0, 'y': 0})
+    position['x'] = position.get('x', 0) + session.rng.randint(-15, 15)
+    position['y'] = position.get('y', 0) + session.rng.randint(-15, 15)
+    return node
+
+
+def _build_save_full(session):
+    graph = session.current_graph
+    _move_random_node(session, graph)
+    return 'POST', '/creation/savenodemap', {
+        'nodemap_id': session.current_nodemap_id, 'nodes': graph['nodes'], 'edges': graph['edges'],
+    }, session.auth_headers()
+
+
+def _build_save_patch(session):
+    graph = session.current_graph
+    node = _move_random_node(session, graph)
+    ops = []
+    if node is not None:
+        escaped_id = str(node['id']).replace('~', '~0').replace('/', '~1')
+        ops.append({'op': 'replace', 'path': f'/nodes/{escaped_id}/position', 'value': node['position']})
+    return 'POST', '/creation/savenodemap', {
+        'nodemap_id': session.current_nodemap_id, 'base_version': graph['version'], 'ops': ops,
+    }, session.auth_headers()
+
+
+def _after_save(session, status, headers, body):
+    if status == 200:
+        session.current_graph['version'] = json.loads(body)['version']
+    else:
+        # Out of date (e.g. another client saved it): reload before the next save
+        session.graphs.pop(session.current_nodemap_id, None)
+
+
+def _build_toggle_favorite(session):
+    nodemap_id = session.rng.choice(session.nodemap_ids)
+    return 'POST', '/creation/togglenodemapfavorite', {'id': nodemap_id}, session.auth_headers()
+
+
+def _build_search(session):
+    # Two words from the seed vocabulary, the second one partly typed
+    query = f"{session.rng.choice(WORDS)} {session.rng.choice(WORDS)[:3]}"
+    return 'GET', f'/creation/search?q={quote(query)}&limit=20', None, session.auth_headers()
+
+
+SCENARIOS = {
+    scenario.name: scenario for scenario in (
+        # Password hashing makes login deliberately slow (~100ms+), so it gets fewer requests
+        Scenario('login', _build_login, max_requests=20),
+        Scenario('user_data', _build_user_data),
+        Scenario('user_data_conditional', _build_user_data_conditional, ok_statuses=(200, 304),
+                 after=_after_user_data_conditional),
+        Scenario('getnodemaps', _build_getnodemaps),
+        Scenario('getnodemaps_page', _build_getnodemaps_page),
+        Scenario('getnodemapdata', _build_getnodemapdata),
+        Scenario('savenodemap_full', _build_save_full, prepare=_prepare_save, after=_after_save),
+        Scenario('savenodemap_patch', _build_save_patch, prepare=_prepare_save, after=_after_save),
+        Scenario('togglenodemapfavorite', _build_toggle_favorite),
+        Scenario('search', _build_search),
+    )
+}
+# --- End Scenario definitions ---
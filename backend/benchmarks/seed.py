@@ -0,0 +1,154 @@
+# Seeds a database with benchmark data.
+# Rows are written with bulk INSERT statements (not through the routes), so even
+# large datasets are created in seconds; graphs are stored in the same format
+# the app writes (see app/services/nodemap_graph.py).
+import random
+import time
+
+from sqlalchemy import insert
+from werkzeug.security import generate_password_hash
+
+from app import db
+from app.models import User, Agent, Nodemap, NodemapNode, NodemapEdge
+from app.services.nodemap_graph import serialize_element
+from app.services.search import active_search_backend, rebuild_search_index
+
+# Every seeded user has this password
+BENCHMARK_PASSWORD = 'benchmark-password'
+
+MODELS = ('gpt-4o', 'gpt-4o-mini', 'gemini-pro', 'claude-3-haiku', 'llama-3-70b')
+AGENT_TYPES = ('text', 'chat', 'image')
+WORDS = (
+    'analyze summarize extract classify translate review plan draft refine verify '
+    'research compare rank critique expand outline rewrite score merge route'
+).split()
+
+
+def _sentence(rng, length):
+    return ' '.join(rng.choice(WORDS) for _ in range(length))
+
+
+def generate_graph(rng, node_count, agents):
+    """
+    Builds a React Flow graph shaped like the ones NodeMapView saves:
+    AIAgentNodes laid out left to right, each fed by one or two earlier nodes.
+    'agents' is a list of (agent_id, name, model) the nodes may reference.
+    """
+    nodes = []
+    edges = []
+    for index in range(node_count):
+        agent_id, agent_name, model = rng.choice(agents)
+        nodes.append({
+            'id': f'dndnode_{index}',
+            'type': 'AIAgentNode',
+            'position': {'x': 220 * (index // 4) + rng.randint(-20, 20), 'y': 120 * (index % 4) + rng.randint(-20, 20)},
+            'data': {
+                'label': agent_name,
+                'agentId': agent_id,
+                'agentName': agent_name,
+                'model': model,
+                'notes': _sentence(rng, rng.randint(5, 25)),
+            },
+            'width': 200,
+            'height': 84,
+            'selected': False,
+            'dragging': False,
+        })
+        if index:
+            for source in {rng.randrange(max(0, index - 6), index) for _ in range(rng.choice((1, 1, 2)))}:
+                edges.append({
+                    'id': f'reactflow__edge-dndnode_{source}-dndnode_{index}',
+                    'source': f'dndnode_{source}',
+                    'target': f'dndnode_{index}',
+                    'type': 'smoothstep',
+                    'animated': False,
+                })
+    return nodes, edges
+
+
+def seed_database(users=5, agents_per_user=20, nodemaps_per_user=20, nodes_per_map=40, seed=1234):
+    """
+    Creates the benchmark dataset in the current app's database (call inside an
+    app context, on an empty database). Graph sizes vary around nodes_per_map
+    (from half to one and a half times it).
+    Returns a description of what was created:
+        {'users': [{'id', 'username', 'nodemap_ids', 'agent_ids'}], 'counts': {...}, 'seconds': ...}
+    """
+    rng = random.Random(seed)
+    started = time.perf_counter()
+    password_hash = generate_password_hash(BENCHMARK_PASSWORD) # Hashing once keeps seeding fast
+
+    db.session.execute(insert(User), [
+        {'username': f'bench_user_{index}', 'email': f'bench_user_{index}@example.com', 'password': password_hash}
+        for index in range(users)
+    ])
+    user_rows = db.session.query(User.id, User.username).order_by(User.id).all()
+
+    seeded_users = []
+    counts = {'users': len(user_rows), 'agents': 0, 'nodemaps': 0, 'nodes': 0, 'edges': 0}
+    for user_id, username in user_rows:
+        # --- Agents ---
+        db.session.execute(insert(Agent), [
+            {
+                'name': f'Agent {index}',
+                'type': rng.choice(AGENT_TYPES),
+                'model': rng.choice(MODELS),
+                'system_prompt': _sentence(rng, rng.randint(40, 400)),
+                'user_id': user_id,
+            }
+            for index in range(agents_per_user)
+        ])
+        agents = db.session.query(Agent.id, Agent.name, Agent.model).filter(Agent.user_id == user_id).order_by(Agent.id).all()
+
+        # --- Nodemaps ---
+        db.session.execute(insert(Nodemap), [
+            {
+                'name': f'Nodemap {index}',
+                'goal': _sentence(rng, 12),
+                'description': _sentence(rng, rng.randint(10, 60)),
+                'is_favorite': rng.random() < 0.2,
+                'user_id': user_id,
+            }
+            for index in range(nodemaps_per_user)
+        ])
+        nodemap_ids = [row_id for (row_id,) in db.session.query(Nodemap.id).filter(Nodemap.user_id == user_id).order_by(Nodemap.id)]
+
+        # --- Graph rows ---
+        node_rows = []
+        edge_rows = []
+        for nodemap_id in nodemap_ids:
+            node_count = rng.randint(max(1, nodes_per_map // 2), max(1, nodes_per_map * 3 // 2)) if agents else 0
+            nodes, edges = generate_graph(rng, node_count, agents) if node_count else ([], [])
+            node_rows.extend(
+                {'nodemap_id': nodemap_id, 'node_id': node['id'], 'agent_id': node['data']['agentId'],
+                 'sort_index': sort_index, 'data': serialize_element(node)}
+                for sort_index, node in enumerate(nodes)
+            )
+            edge_rows.extend(
+                {'nodemap_id': nodemap_id, 'edge_id': edge['id'], 'source': edge['source'], 'target': edge['target'],
+                 'sort_index': sort_index, 'data': serialize_element(edge)}
+                for sort_index, edge in enumerate(edges)
+            )
+        if node_rows:
+            db.session.execute(insert(NodemapNode), node_rows)
+        if edge_rows:
+            db.session.execute(insert(NodemapEdge), edge_rows)
+
+        counts['agents'] += len(agents)
+        counts['nodemaps'] += len(nodemap_ids)
+        counts['nodes'] += len(node_rows)
+        counts['edges'] += len(edge_rows)
+        seeded_users.append({
+            'id': user_id,
+            'username': username,
+            'agent_ids': [agent_id for agent_id, _, _ in agents],
+            'nodemap_ids': nodemap_ids,
+        })
+
+    # Bulk inserts skip the flush listener that keeps the search index up to date
+    backend = active_search_backend()
+    if backend is not None:
+        rebuild_search_index(db.session.connection(), backend)
+
+    db.session.commit()
+    return {'users': seeded_users, 'counts': counts, 'seconds': round(time.perf_counter() - started, 3)}
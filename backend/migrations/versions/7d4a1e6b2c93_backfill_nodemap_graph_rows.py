@@ -0,0 +1,190 @@
+"""Backfill nodemap_node and nodemap_edge from the JSON columns
+
+Revision ID: 7d4a1e6b2c93
+Revises: 5c2e8a9d4f10
+Create Date: 2026-10-18 10:05:00.000000
+
+Moves each Nodemap's nodes_data / edges_data JSON into one row per node and
+edge, then sets the JSON columns to NULL. Maps are read in batches and committed
+one by one, and a map's JSON is only cleared once its rows are written, so
+if the upgrade is interrupted it can simply be run again: maps that still
+have JSON are (re)processed, everything else is skipped. The application reads both forms,
+so it can serve traffic while the backfill is running.
+
+"""
+import json
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7d4a1e6b2c93'
+down_revision = '5c2e8a9d4f10'
+branch_labels = None
+depends_on = None
+
+# Number of nodemaps converted per committed batch
+BATCH_SIZE = 200
+
+# Lightweight table definitions so the migration does not depend on the current models
+nodemap = sa.table('nodemap',
+    sa.column('id', sa.Integer),
+    sa.column('nodes_data', sa.Text),
+    sa.column('edges_data', sa.Text),
+)
+nodemap_node = sa.table('nodemap_node',
+    sa.column('nodemap_id', sa.Integer),
+    sa.column('node_id', sa.String),
+    sa.column('agent_id', sa.Integer),
+    sa.column('sort_index', sa.Integer),
+    sa.column('data', sa.Text),
+)
+nodemap_edge = sa.table('nodemap_edge',
+    sa.column('nodemap_id', sa.Integer),
+    sa.column('edge_id', sa.String),
+    sa.column('source', sa.String),
+    sa.column('target', sa.String),
+    sa.column('sort_index', sa.Integer),
+    sa.column('data', sa.Text),
+)
+
+
+def _serialize(element):
+    # Must match app/services/nodemap_graph.py:serialize_element
+    return json.dumps(element, sort_keys=True, separators=(',', ':'))
+
+
+def _element_rows(nodemap_id, elements, id_column):
+    """
+    Yields (row dict, element) pairs for a legacy list of nodes or edges.
+    Elements without an id or with a duplicate id get a synthetic one so no data is lost.
+    """
+    seen = set()
+    for index, element in enumerate(elements):
+        if not isinstance(element, dict):
+            continue
+        element_id = str(element['id']) if element.get('id') is not None else f'legacy_{index}'
+        if element_id in seen:
+            element_id = f'{element_id}~{index}'
+        seen.add(element_id)
+        yield {
+            'nodemap_id': nodemap_id,
+            id_column: element_id,
+            'sort_index': index,
+            'data': _serialize(element),
+        }, element
+
+
+def _node_rows(nodemap_id, nodes):
+    rows = []
+    for row, node in _element_rows(nodemap_id, nodes, 'node_id'):
+        node_data = node.get('data')
+        try:
+            row['agent_id'] = int(node_data.get('agentId')) if isinstance(node_data, dict) else None
+        except (TypeError, ValueError):
+            row['agent_id'] = None
+        rows.append(row)
+    return rows
+
+
+def _edge_rows(nodemap_id, edges):
+    rows = []
+    for row, edge in _element_rows(nodemap_id, edges, 'edge_id'):
+        row['source'] = str(edge['source']) if edge.get('source') is not None else None
+        row['target'] = str(edge['target']) if edge.get('target') is not None else None
+        rows.append(row)
+    return rows
+
+
+def upgrade():
+    if op.get_context().as_sql:
+        print("Skipping nodemap graph backfill in offline (--sql) mode; run it online.")
+        return
+
+    bind = op.get_bind()
+    last_id = 0
+    converted = 0
+
+    # Run outside the migration transaction so an interrupted run keeps its progress
+    with op.get_context().autocommit_block():
+        while True:
+            batch = bind.execute(
+                sa.select(nodemap.c.id, nodemap.c.nodes_data, nodemap.c.edges_data)
+                .where(nodemap.c.id > last_id)
+                .where(sa.or_(nodemap.c.nodes_data.isnot(None), nodemap.c.edges_data.isnot(None)))
+                .order_by(nodemap.c.id)
+                .limit(BATCH_SIZE)
+            ).fetchall()
+            if not batch:
+                break
+
+            for nodemap_id, nodes_data, edges_data in batch:
+                last_id = nodemap_id
+                try:
+                    nodes = json.loads(nodes_data) if nodes_data else []
+                    edges = json.loads(edges_data) if edges_data else []
+                except json.JSONDecodeError:
+                    # Leave the JSON in place; the map keeps failing to load exactly as before
+                    print(f"Skipping nodemap {nodemap_id}: nodes_data/edges_data is not valid JSON")
+                    continue
+
+                # Remove rows left behind by an interrupted earlier run
+                bind.execute(nodemap_node.delete().where(nodemap_node.c.nodemap_id == nodemap_id))
+                bind.execute(nodemap_edge.delete().where(nodemap_edge.c.nodemap_id == nodemap_id))
+
+                node_rows = _node_rows(nodemap_id, nodes if isinstance(nodes, list) else [])
+                edge_rows = _edge_rows(nodemap_id, edges if isinstance(edges, list) else [])
+                if node_rows:
+                    bind.execute(nodemap_node.insert(), node_rows)
+                if edge_rows:
+                    bind.execute(nodemap_edge.insert(), edge_rows)
+
+                bind.execute(
+                    nodemap.update().where(nodemap.c.id == nodemap_id)
+                    .values(nodes_data=None, edges_data=None)
+                )
+                converted += 1
+
+            print(f"Backfilled nodemap graphs up to ID {last_id} ({converted} converted so far)")
+
+
+def downgrade():
+    if op.get_context().as_sql:
+        print("Skipping nodemap graph restore in offline (--sql) mode; run it online.")
+        return
+
+    bind = op.get_bind()
+    last_id = 0
+
+    with op.get_context().autocommit_block():
+        while True:
+            batch = bind.execute(
+                sa.select(nodemap.c.id)
+                .where(nodemap.c.id > last_id)
+                .where(nodemap.c.nodes_data.is_(None))
+                .where(nodemap.c.edges_data.is_(None))
+                .order_by(nodemap.c.id)
+                .limit(BATCH_SIZE)
+            ).scalars().all()
+            if not batch:
+                break
+
+            for nodemap_id in batch:
+                last_id = nodemap_id
+                node_data = bind.execute(
+                    sa.select(nodemap_node.c.data).where(nodemap_node.c.nodemap_id == nodemap_id)
+                    .order_by(nodemap_node.c.sort_index)
+                ).scalars().all()
+                edge_data = bind.execute(
+                    sa.select(nodemap_edge.c.data).where(nodemap_edge.c.nodemap_id == nodemap_id)
+                    .order_by(nodemap_edge.c.sort_index)
+                ).scalars().all()
+                bind.execute(
+                    nodemap.update().where(nodemap.c.id == nodemap_id).values(
+                        nodes_data='[' + ','.join(node_data) + ']',
+                        edges_data='[' + ','.join(edge_data) + ']',
+                    )
+                )
+                bind.execute(nodemap_node.delete().where(nodemap_node.c.nodemap_id == nodemap_id))
+                bind.execute(nodemap_edge.delete().where(nodemap_edge.c.nodemap_id == nodemap_id))
@@ -0,0 +1,209 @@
+"""Store nodemap_node / nodemap_edge data compressed
+
+Revision ID: d8f3b6a1c274
+Revises: c5d2a7f4e816
+Create Date: 2026-10-18 14:00:00.000000
+
+Changes the 'data' column of nodemap_node and nodemap_edge from text to binary
+and recompresses the existing rows (the format of app/services/graph_codec.py). Rows are
+read in id order in batches and each batch is committed on its own, so an
+interrupted upgrade can simply be run again: rows that already carry a header
+byte are skipped. The application reads both the old and the new form, so it
+can serve traffic while the rows are being recompressed.
+
+"""
+import zlib
+
+from alembic import op
+import sqlalchemy as sa
+
+try:
+    import zstandard
+except ImportError: # Only needed to downgrade rows the app later stored as zstd
+    zstandard = None
+
+
+# revision identifiers, used by Alembic.
+revision = 'd8f3b6a1c274'
+down_revision = 'c5d2a7f4e816'
+branch_labels = None
+depends_on = None
+
+# Number of rows recompressed per committed batch
+BATCH_SIZE = 1000
+
+GRAPH_TABLES = ('nodemap_node', 'nodemap_edge')
+
+# --- Frozen codec ---
+# A copy of the storage format of app/services/graph_codec.py as of this revision,
+# so later changes to the app (or its NODEMAP_COMPRESSION settings) cannot change
+# what this migration writes. Rows are always written as zlib (level 6, values of
+# 64 bytes and more) or raw.
+ENCODING_RAW = 0x00
+ENCODING_ZLIB = 0x01
+ENCODING_ZSTD = 0x02
+ZLIB_LEVEL = 6
+MIN_COMPRESS_SIZE = 64
+
+GRAPH_DICTIONARY_V1 = (
+    b'"sourceHandle":null,"targetHandle":null,"type":"smoothstep","animated":false,'
+    b'"markerEnd":{"type":"arrowclosed"},"style":{"stroke":"#'
+    b'"selected":false,"dragging":false,"deletable":true,"draggable":true,"connectable":true,'
+    b'"positionAbsolute":{"x":'
+    b'"data":{"agentId":'
+    b'"agentModel":"gpt-4o","agentName":"Agent ","agentType":"text","label":"Agent ",'
+    b'"model":"gpt-4o-mini","model":"gemini-pro","notes":"'
+    b',"height":84,"id":"dndnode_'
+    b',"position":{"x":'
+    b',"y":'
+    b'},"selected":false,"type":"aiAgent","width":200}'
+    b'},"selected":false,"type":"AIAgentNode","width":200}'
+    b'{"id":"reactflow__edge-dndnode_'
+    # Elements are serialized with sorted keys, so these sequences repeat verbatim
+    b'{"data":{"agentId":'
+    b',"agentName":"Agent '
+    b'"},"dragging":false,"height":84,"id":"dndnode_'
+    b'{"animated":false,"id":"reactflow__edge-dndnode_'
+    b'-dndnode_'
+    b'","source":"dndnode_'
+    b'","target":"dndnode_'
+    b'","type":"smoothstep"}'
+)
+
+
+def encode_graph_text(text):
+    raw = text.encode('utf-8')
+    encoded = bytes((ENCODING_RAW,)) + raw
+    if len(raw) >= MIN_COMPRESS_SIZE:
+        compressor = zlib.compressobj(ZLIB_LEVEL, zlib.DEFLATED, -15, zdict=GRAPH_DICTIONARY_V1)
+        candidate = bytes((ENCODING_ZLIB,)) + compressor.compress(raw) + compressor.flush()
+        if len(candidate) < len(encoded):
+            encoded = candidate
+    return encoded
+
+
+def decode_graph_bytes(value):
+    if isinstance(value, str):
+        return value
+    value = bytes(value)
+    if not value:
+        return ''
+    header = value[0]
+    if header == ENCODING_RAW:
+        return value[1:].decode('utf-8')
+    if header == ENCODING_ZLIB:
+        decompressor = zlib.decompressobj(-15, zdict=GRAPH_DICTIONARY_V1)
+        return (decompressor.decompress(value[1:]) + decompressor.flush()).decode('utf-8')
+    if header == ENCODING_ZSTD:
+        if zstandard is None:
+            raise RuntimeError("Some rows are zstd-compressed; install the 'zstandard' package to downgrade")
+        dictionary = zstandard.ZstdCompressionDict(GRAPH_DICTIONARY_V1, dict_type=zstandard.DICT_TYPE_RAWCONTENT)
+        return zstandard.ZstdDecompressor(dict_data=dictionary).decompress(value[1:]).decode('utf-8')
+    return value.decode('utf-8') # JSON converted from the old text column
+
+
+def is_encoded(value):
+    return isinstance(value, (bytes, bytearray, memoryview)) and len(value) > 0 \
+        and bytes(value[:1])[0] in (ENCODING_RAW, ENCODING_ZLIB, ENCODING_ZSTD)
+# --- End Frozen codec ---
+
+
+def _graph_table(name):
+    # Lightweight table definition so the migration does not depend on the current models
+    return sa.table(name,
+        sa.column('id', sa.Integer),
+        sa.column('data', sa.LargeBinary),
+    )
+
+
+def _rewrite_rows(table_name, convert, needs_conversion):
+    """
+    Rewrites 'data' of every row for which needs_conversion(value) is true.
+    Returns (rows rewritten, bytes before, bytes after).
+    """
+    bind = op.get_bind()
+    table = _graph_table(table_name)
+    last_id = 0
+    rewritten = bytes_before = bytes_after = 0
+
+    # Run outside the migration transaction so an interrupted run keeps its progress
+    with op.get_context().autocommit_block():
+        while True:
+            batch = bind.execute(
+                sa.select(table.c.id, table.c.data)
+                .where(table.c.id > last_id)
+                .order_by(table.c.id)
+                .limit(BATCH_SIZE)
+            ).fetchall()
+            if not batch:
+                break
+
+            updates = []
+            for row_id, value in batch:
+                last_id = row_id
+                if not needs_conversion(value):
+                    continue
+                new_value = convert(value)
+                updates.append({'row_id': row_id, 'new_data': new_value})
+                bytes_before += len(value)
+                bytes_after += len(new_value)
+            if updates:
+                bind.execute(
+                    table.update().where(table.c.id == sa.bindparam('row_id'))
+                    .values(data=sa.bindparam('new_data')),
+                    updates,
+                )
+                rewritten += len(updates)
+
+            print(f"{table_name}: rewrote rows up to ID {last_id} ({rewritten} so far)")
+    return rewritten, bytes_before, bytes_after
+
+
+def upgrade():
+    # ### commands auto generated by Alembic - please adjust! ###
+    for table_name in GRAPH_TABLES:
+        with op.batch_alter_table(table_name, schema=None) as batch_op:
+            batch_op.alter_column('data',
+                                  existing_type=sa.Text(),
+                                  type_=sa.LargeBinary(),
+                                  existing_nullable=False,
+                                  postgresql_using="convert_to(data, 'UTF8')")
+
+    # ### end Alembic commands ###
+
+    if op.get_context().as_sql:
+        print("Skipping nodemap graph recompression in offline (--sql) mode; run it online.")
+        return
+
+    for table_name in GRAPH_TABLES:
+        rewritten, bytes_before, bytes_after = _rewrite_rows(
+            table_name,
+            convert=lambda value: encode_graph_text(decode_graph_bytes(value)),
+            needs_conversion=lambda value: not is_encoded(value),
+        )
+        ratio = round(bytes_before / bytes_after, 2) if bytes_after else None
+        print(f"{table_name}: compressed {rewritten} rows, {bytes_before} -> {bytes_after} bytes (ratio {ratio}x)")
+
+
+def downgrade():
+    if op.get_context().as_sql:
+        print("Skipping nodemap graph decompression in offline (--sql) mode; run it online.")
+    else:
+        for table_name in GRAPH_TABLES:
+            rewritten, _, _ = _rewrite_rows(
+                table_name,
+                convert=lambda value: decode_graph_bytes(value).encode('utf-8'),
+                needs_conversion=is_encoded,
+            )
+            print(f"{table_name}: decompressed {rewritten} rows")
+
+    # ### commands auto generated by Alembic - please adjust! ###
+    for table_name in GRAPH_TABLES:
+        with op.batch_alter_table(table_name, schema=None) as batch_op:
+            batch_op.alter_column('data',
+                                  existing_type=sa.LargeBinary(),
+                                  type_=sa.Text(),
+                                  existing_nullable=False,
+                                  postgresql_using="convert_from(data, 'UTF8')")
+
+    # ### end Alembic commands ###
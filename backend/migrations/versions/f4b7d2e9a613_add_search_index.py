@@ -0,0 +1,164 @@
+"""Add the full-text search index (search_term table and search_fts)
+
+Revision ID: f4b7d2e9a613
+Revises: e2a9c4d7b150
+Create Date: 2026-10-18 16:00:00.000000
+
+Creates the portable search_term table and, on SQLite builds with FTS5, the
+search_fts virtual table (see app/services/search.py), then indexes the
+existing nodemaps and agents for the app's search backend. The backfill runs
+outside the migration transaction; if it is interrupted, run
+'flask search-reindex' to rebuild the index.
+
+"""
+import re
+import sqlite3
+import unicodedata
+from collections import Counter
+
+from alembic import op
+import sqlalchemy as sa
+from flask import current_app
+
+
+# revision identifiers, used by Alembic.
+revision = 'f4b7d2e9a613'
+down_revision = 'e2a9c4d7b150'
+branch_labels = None
+depends_on = None
+
+# Frozen copies of the index format of app/services/search.py as of this revision,
+# so later changes to the app cannot change what this migration does
+
+FTS5_DDL = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS search_fts USING fts5("
+    "title, body, "
+    "tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')"
+)
+
+TITLE_WEIGHT = 10
+BODY_WEIGHT = 1
+MAX_TERM_LENGTH = 64
+KIND_CODES = {'nodemap': 0, 'agent': 1}
+BATCH_SIZE = 1000
+TOKEN_PATTERN = re.compile(r'[^\W_]+')
+
+nodemap_table = sa.table('nodemap', sa.column('id'), sa.column('user_id'),
+                         sa.column('name'), sa.column('goal'), sa.column('description'))
+agent_table = sa.table('agent', sa.column('id'), sa.column('user_id'), sa.column('name'), sa.column('system_prompt'))
+search_term_table = sa.table('search_term', sa.column('user_id'), sa.column('term'), sa.column('kind'),
+                             sa.column('doc_id'), sa.column('weight'))
+
+
+def _sqlite_supports_fts5():
+    connection = sqlite3.connect(':memory:')
+    try:
+        connection.execute("CREATE VIRTUAL TABLE fts5_probe USING fts5(content)")
+        return True
+    except sqlite3.OperationalError:
+        return False
+    finally:
+        connection.close()
+
+
+def _uses_fts5():
+    return op.get_context().dialect.name == 'sqlite' and _sqlite_supports_fts5()
+
+
+def _tokenize(value):
+    value = unicodedata.normalize('NFKD', (value or '').casefold())
+    value = ''.join(char for char in value if not unicodedata.combining(char))
+    return [token[:MAX_TERM_LENGTH] for token in TOKEN_PATTERN.findall(value)]
+
+
+def _documents(connection):
+    # (kind, doc_id, user_id, title, body) of every nodemap and agent, in batches
+    sources = (
+        ('nodemap', nodemap_table, lambda row: '\n'.join(part for part in (row.goal, row.description) if part)),
+        ('agent', agent_table, lambda row: row.system_prompt or ''),
+    )
+    for kind, table, body in sources:
+        last_id = 0
+        while True:
+            batch = connection.execute(
+                sa.select(table).where(table.c.id > last_id).order_by(table.c.id).limit(BATCH_SIZE)
+            ).all()
+            if not batch:
+                break
+            yield [(kind, row.id, row.user_id, row.name or '', body(row)) for row in batch]
+            last_id = batch[-1].id
+
+
+def _backfill(connection, backend):
+    count = 0
+    for batch in _documents(connection):
+        if backend == 'fts5':
+            connection.execute(
+                sa.text("INSERT INTO search_fts (rowid, title, body) VALUES (:rowid, :title, :body)"),
+                [{'rowid': (int(user_id) << 32) | (int(doc_id) << 1) | KIND_CODES[kind], 'title': title, 'body': body}
+                 for kind, doc_id, user_id, title, body in batch],
+            )
+        else:
+            rows = []
+            for kind, doc_id, user_id, title, body in batch:
+                weights = Counter()
+                for term in _tokenize(title):
+                    weights[term] += TITLE_WEIGHT
+                for term in _tokenize(body):
+                    weights[term] += BODY_WEIGHT
+                rows.extend({'user_id': user_id, 'term': term, 'kind': kind, 'doc_id': doc_id, 'weight': weight}
+                            for term, weight in weights.items())
+            if rows:
+                connection.execute(search_term_table.insert(), rows)
+        count += len(batch)
+    if backend == 'fts5':
+        connection.execute(sa.text("INSERT INTO search_fts (search_fts) VALUES ('optimize')")) # Merge index segments
+    return count
+
+
+def upgrade():
+    # create_app() may already have created the table from the models on boot
+    existing_tables = [] if op.get_context().as_sql else sa.inspect(op.get_bind()).get_table_names()
+
+    # ### commands auto generated by Alembic - please adjust! ###
+    if 'search_term' not in existing_tables:
+        op.create_table('search_term',
+        sa.Column('user_id', sa.Integer(), autoincrement=False, nullable=False),
+        sa.Column('term', sa.String(length=64), nullable=False),
+        sa.Column('kind', sa.String(length=16), nullable=False),
+        sa.Column('doc_id', sa.Integer(), autoincrement=False, nullable=False),
+        sa.Column('weight', sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint('user_id', 'term', 'kind', 'doc_id')
+        )
+        with op.batch_alter_table('search_term', schema=None) as batch_op:
+            batch_op.create_index('ix_search_term_document', ['kind', 'doc_id'], unique=False)
+
+    # ### end Alembic commands ###
+
+    if _uses_fts5():
+        op.execute(FTS5_DDL)
+
+    if op.get_context().as_sql:
+        print("Skipping the search index backfill in offline (--sql) mode; run 'flask search-reindex'.")
+        return
+
+    # The backend the app will search with (SEARCH_BACKEND), or the default for this database
+    backend = current_app.extensions.get('search') or ('fts5' if _uses_fts5() else 'table')
+    with op.get_context().autocommit_block():
+        connection = op.get_bind()
+        # create_app() may already have indexed documents into the tables it created
+        connection.execute(sa.text("DELETE FROM search_fts") if backend == 'fts5' else search_term_table.delete())
+        count = _backfill(connection, backend)
+    print(f"search index: indexed {count} documents ({backend} backend)")
+
+
+def downgrade():
+    if _uses_fts5():
+        op.execute("DROP TABLE IF EXISTS search_fts")
+
+    # ### commands auto generated by Alembic - please adjust! ###
+    with op.batch_alter_table('search_term', schema=None) as batch_op:
+        batch_op.drop_index('ix_search_term_document')
+
+    op.drop_table('search_term')
+    # ### end Alembic commands ###
@@ -0,0 +1,65 @@
+# Shared fixtures: every test gets its own app on a fresh SQLite file
+# (a file, not :memory:, so concurrent requests really share one database).
+import pytest
+
+
+@pytest.fixture
+def app(tmp_path, monkeypatch):
+    monkeypatch.setenv('DATABASE_URL', f"sqlite:///{tmp_path / 'test.db'}")
+    monkeypatch.setenv('JWT_SECRET_KEY', 'test-jwt-secret-key-with-at-least-32-bytes')
+    monkeypatch.setenv('SECRET_KEY', 'test-secret-key')
+    monkeypatch.setenv('SCHEMA_STARTUP_MODE', 'create_all')
+    monkeypatch.setenv('LOG_LEVEL', 'WARNING')
+    monkeypatch.setenv('RESPONSE_CACHE_ENABLED', 'false')
+    from app import create_app, db
+    app = create_app()
+    app.config['TESTING'] = True
+    yield app
+    with app.app_context():
+        db.session.remove()
+        db.engine.dispose()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def login(client):
+    """
+    login('alice') registers the user (once) and returns Authorization headers.
+    """
+    def login(username='alice'):
+        client.post('/auth/register', json={'username': username, 'password': 'password1', 'email': f'{username}@example.com'})
+        response = client.post('/auth/login', json={'emailOrUsername': username, 'password': 'password1'})
+        return {'Authorization': 'Bearer ' + response.get_json()['access_token']}
+    return login
+
+
+@pytest.fixture
+def create_nodemap(client):
+    """
+    create_nodemap(headers, nodes, edges) creates a map, saves the graph and returns (nodemap_id, version).
+    """
+    def create_nodemap(headers, nodes=(), edges=(), name='map'):
+        nodemap_id = client.post('/creation/createmap', json={'name': name, 'goal': 'g', 'description': 'd'},
+                                 headers=headers).get_json()['nodemap_id']
+        response = client.post('/creation/savenodemap', json={'nodemap_id': nodemap_id, 'nodes': list(nodes), 'edges': list(edges)},
+                               headers=headers)
+        assert response.status_code == 200, response.get_json()
+        return nodemap_id, response.get_json()['version']
+    return create_nodemap
+
+
+@pytest.fixture
+def create_agent(client):
+    """
+    create_agent(headers, name) creates a text agent on the offline 'local' provider's model and returns its id.
+    """
+    def create_agent(headers, name='agent', **fields):
+        response = client.post('/creation/createagent', json={'name': name, 'type': 'text', 'model': 'gpt-4o', 'system_prompt': 'sp', **fields},
+                               headers=headers)
+        assert response.status_code == 201, response.get_json()
+        return response.get_json()['agent_id']
+    return create_agent
@@ -0,0 +1,24 @@
+# Benchmark suite (benchmarks/): every scenario runs without errors against a
+# seeded database, and the report statistics are computed as documented.
+from app import db
+from benchmarks.report import percentile, summarize
+from benchmarks.runner import run_micro
+from benchmarks.scenarios import SCENARIOS
+from benchmarks.seed import seed_database
+
+
+def test_percentile_is_nearest_rank():
+    values = list(range(1, 101))
+    assert (percentile(values, 0.5), percentile(values, 0.99), percentile(values, 1.0)) == (50, 99, 100)
+    assert percentile([7], 0.5) == 7 and percentile([], 0.5) is None
+    summary = summarize([0.002, 0.001, 0.003], errors=1, total_time=0.5)
+    assert (summary['requests'], summary['errors'], summary['p50_ms'], summary['max_ms']) == (3, 1, 2.0, 3.0)
+
+
+def test_every_scenario_runs_without_errors(app):
+    with app.app_context():
+        seed_info = seed_database(users=2, agents_per_user=3, nodemaps_per_user=3, nodes_per_map=6, seed=7)
+        db.session.remove()
+    results = run_micro(app, seed_info['users'], list(SCENARIOS.values()), iterations=3, warmup=1, memory_iterations=1)
+    assert set(results) == set(SCENARIOS)
+    assert {name: result['errors'] for name, result in results.items() if result['errors']} == {}
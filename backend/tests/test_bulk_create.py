@@ -0,0 +1,49 @@
+# Bulk creation (/creation/bulkcreate): items are validated one by one, names
+# are checked against the user's rows and each other, and the valid items are
+# inserted in one transaction.
+AGENT = {'type': 'text', 'model': 'gpt-4o', 'system_prompt': 'sp'}
+NODEMAP = {'goal': 'g', 'description': 'd'}
+
+
+def test_everything_is_created(client, login):
+    headers = login()
+    response = client.post('/creation/bulkcreate', json={
+        'agents': [dict(AGENT, name='a1'), dict(AGENT, name='a2')],
+        'nodemaps': [dict(NODEMAP, name='m1')],
+    }, headers=headers)
+    assert response.status_code == 201
+    body = response.get_json()
+    assert [item['name'] for item in body['agents']['created']] == ['a1', 'a2']
+    assert all(item['agent_id'] for item in body['agents']['created'])
+
+    user_data = client.get('/auth/user_data', headers=headers).get_json()
+    assert {agent['name'] for agent in user_data['agents']} == {'a1', 'a2'}
+    assert [nodemap['name'] for nodemap in user_data['nodemaps']] == ['m1']
+
+
+def test_invalid_items_are_reported_by_index(client, login, create_agent):
+    headers = login()
+    create_agent(headers, 'taken')
+    response = client.post('/creation/bulkcreate', json={
+        'agents': [dict(AGENT, name='taken'), dict(AGENT, name='new'), dict(AGENT, name='new'), {'name': 'no fields'}],
+    }, headers=headers)
+    assert response.status_code == 207
+    body = response.get_json()
+    assert [item['index'] for item in body['agents']['created']] == [1]
+    assert [error['index'] for error in body['agents']['errors']] == [0, 2, 3]
+
+
+def test_all_or_nothing_creates_nothing_on_an_error(client, login):
+    headers = login()
+    response = client.post('/creation/bulkcreate', json={
+        'agents': [dict(AGENT, name='ok')], 'nodemaps': [{'name': 'missing fields'}], 'all_or_nothing': True,
+    }, headers=headers)
+    assert response.status_code == 400
+    assert response.get_json()['created_count'] == 0
+    assert client.get('/auth/user_data', headers=headers).get_json()['agents'] == []
+
+
+def test_batch_size_is_capped(app, client, login):
+    app.config['BULK_CREATE_MAX_ITEMS'] = 2
+    response = client.post('/creation/bulkcreate', json={'agents': [dict(AGENT, name=f'a{i}') for i in range(3)]}, headers=login())
+    assert response.status_code == 413
@@ -0,0 +1,108 @@
+# Collaborative editing (app/services/collab.py): a room's edits are saved on
+# top of the version they were based on, and never over a concurrent save.
+import json
+
+from sqlalchemy import update
+
+from app import db
+from app.models import Nodemap, NodemapRevision
+from app.routes import collab_routes
+from app.services import collab
+from app.services.collab import CollabHub, CollabRoom, CollabClient
+from app.services.nodemap_graph import load_nodemap_graph
+
+NODES = [{'id': 'a', 'data': {'label': 'A'}}, {'id': 'b', 'data': {'label': 'B'}}]
+
+
+def _room(app, nodemap_id):
+    hub = CollabHub()
+    hub.configure(app)
+    with app.app_context():
+        nodemap = db.session.get(Nodemap, nodemap_id)
+        nodes, edges = load_nodemap_graph(nodemap)
+        room = CollabRoom(nodemap_id, nodes, edges, nodemap.version)
+    client = CollabClient(lambda message: None, 100)
+    room.clients[client.client_id] = client
+    return hub, room, client
+
+
+def _graph(app, nodemap_id):
+    with app.app_context():
+        nodes, _ = load_nodemap_graph(db.session.get(Nodemap, nodemap_id))
+        return {node['id']: node['data']['label'] for node in nodes}, db.session.get(Nodemap, nodemap_id).version
+
+
+def _label(node_id, label):
+    return [{'op': 'add', 'path': f'/nodes/{node_id}', 'value': {'id': node_id, 'data': {'label': label}}}]
+
+
+def test_edits_are_saved_as_one_version(app, login, create_nodemap):
+    nodemap_id, version = create_nodemap(login(), NODES)
+    hub, room, client = _room(app, nodemap_id)
+    room.apply(client, _label('a', 'A2'))
+    room.apply(client, _label('a', 'A3'))
+    hub.persist(room)
+
+    labels, saved_version = _graph(app, nodemap_id)
+    assert labels == {'a': 'A3', 'b': 'B'}
+    assert saved_version == room.version == version + 1
+
+
+def test_edits_are_merged_over_a_save_made_elsewhere(app, client, login, create_nodemap):
+    headers = login()
+    nodemap_id, version = create_nodemap(headers, NODES)
+    hub, room, editor = _room(app, nodemap_id)
+    room.apply(editor, _label('a', 'from room'))
+    response = client.post('/creation/savenodemap', json={'nodemap_id': nodemap_id, 'base_version': version, 'ops': _label('b', 'from http')}, headers=headers)
+    assert response.status_code == 200
+
+    hub.persist(room)
+    labels, saved_version = _graph(app, nodemap_id)
+    assert labels == {'a': 'from room', 'b': 'from http'}
+    assert saved_version == room.version == version + 2
+
+
+def test_save_racing_a_concurrent_save_is_retried_not_overwritten(app, login, create_nodemap, monkeypatch):
+    nodemap_id, version = create_nodemap(login(), NODES)
+    hub, room, editor = _room(app, nodemap_id)
+    room.apply(editor, _label('a', 'from room'))
+
+    # Another process saves between the room's read of the map and its write
+    original_claim = collab.claim_next_version
+
+    def claim_after_concurrent_save(nodemap, expected_version):
+        with db.engine.begin() as connection:
+            connection.execute(update(Nodemap).where(Nodemap.id == nodemap_id).values(version=Nodemap.version + 1))
+        return original_claim(nodemap, expected_version)
+
+    monkeypatch.setattr(collab, 'claim_next_version', claim_after_concurrent_save)
+    hub.persist(room)
+    assert room.dirty['nodes'] # Kept for the next attempt
+    with app.app_context():
+        assert db.session.get(Nodemap, nodemap_id).version == version + 1
+        assert db.session.query(NodemapRevision).filter_by(nodemap_id=nodemap_id, source='collab').count() == 0
+
+    monkeypatch.setattr(collab, 'claim_next_version', original_claim)
+    hub.persist(room)
+    labels, saved_version = _graph(app, nodemap_id)
+    assert labels['a'] == 'from room'
+    assert saved_version == version + 2
+
+
+class _FakeSocket:
+    def __init__(self, *messages):
+        self.messages = list(messages)
+
+    def receive(self, timeout=None):
+        return self.messages.pop(0) if self.messages else None
+
+
+def test_socket_is_authenticated_by_its_first_message(app, client, login):
+    login()
+    token = client.post('/auth/login', json={'emailOrUsername': 'alice', 'password': 'password1'}).get_json()['access_token']
+    with app.app_context():
+        user_id = collab_routes._authenticate(_FakeSocket(json.dumps({'type': 'auth', 'token': token})))
+        assert user_id is not None
+        assert collab_routes._authenticate(_FakeSocket()) is None # Nothing sent in time
+        assert collab_routes._authenticate(_FakeSocket(json.dumps({'type': 'ops', 'ops': []}))) is None
+        assert collab_routes._authenticate(_FakeSocket(json.dumps({'type': 'auth', 'token': 'not-a-token'}))) is None
@@ -0,0 +1,34 @@
+# Database engine profiles (app/services/db_engine.py): file-based SQLite runs in
+# WAL mode with a busy timeout, server databases get a sized pool, and explicit
+# engine options win.
+from sqlalchemy import text
+
+from app import db
+from app.services.db_engine import engine_options, TimedQueuePool
+
+
+def _config(uri, profile='auto', **options):
+    return {
+        'SQLALCHEMY_DATABASE_URI': uri, 'SQLALCHEMY_ENGINE_OPTIONS': options, 'DB_ENGINE_PROFILE': profile,
+        'DB_POOL_SIZE': 10, 'DB_MAX_OVERFLOW': 20, 'DB_POOL_TIMEOUT': 30, 'DB_POOL_RECYCLE': 1800, 'DB_POOL_PRE_PING': True,
+    }
+
+
+def test_sqlite_connections_use_wal_and_a_busy_timeout(app):
+    with app.app_context():
+        connection = db.session.connection()
+        assert connection.execute(text('PRAGMA journal_mode')).scalar() == 'wal'
+        assert connection.execute(text('PRAGMA busy_timeout')).scalar() == app.config['SQLITE_BUSY_TIMEOUT_MS']
+        assert isinstance(db.engine.pool, TimedQueuePool)
+
+
+def test_server_databases_get_a_sized_pool():
+    options = engine_options(_config('postgresql://user@localhost/app'))
+    assert options['poolclass'] is TimedQueuePool
+    assert (options['pool_size'], options['max_overflow'], options['pool_pre_ping']) == (10, 20, True)
+
+
+def test_explicit_options_win_and_none_keeps_the_defaults():
+    assert engine_options(_config('postgresql://user@localhost/app', pool_size=3))['pool_size'] == 3
+    assert engine_options(_config('postgresql://user@localhost/app', profile='none')) == {}
+    assert engine_options(_config('sqlite://')) == {} # In-memory databases keep a single connection
@@ -0,0 +1,73 @@
+# Compressed storage of nodemap nodes/edges (app/services/graph_codec.py), and the
+# frozen copy of the format in the migration that recompressed the existing rows.
+import importlib.util
+import json
+from pathlib import Path
+
+import pytest
+
+from app.services import graph_codec
+from app.services.graph_codec import encode_graph_text, decode_graph_bytes, is_encoded, configure_graph_codec
+
+MIGRATION = Path(__file__).resolve().parent.parent / 'migrations' / 'versions' / 'd8f3b6a1c274_compress_nodemap_graph_rows.py'
+
+NODE = json.dumps({'data': {'agentId': 3, 'agentName': 'Agent 3', 'label': 'Agent 3'}, 'dragging': False, 'height': 84,
+                   'id': 'dndnode_3', 'position': {'x': 10, 'y': 20}, 'selected': False, 'type': 'aiAgent', 'width': 200},
+                  sort_keys=True, separators=(',', ':'))
+
+
+@pytest.fixture
+def migration():
+    spec = importlib.util.spec_from_file_location('graph_codec_migration', MIGRATION)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+@pytest.fixture(autouse=True)
+def default_codec():
+    yield
+    configure_graph_codec() # Tests may change the process-wide settings
+
+
+@pytest.mark.parametrize('text', [NODE, '{}', '{"label":"Café ☕"}'])
+def test_values_round_trip(text):
+    encoded = encode_graph_text(text)
+    assert is_encoded(encoded)
+    assert decode_graph_bytes(encoded) == text
+
+
+def test_elements_compress_with_the_preset_dictionary():
+    encoded = encode_graph_text(NODE)
+    assert encoded[0] == graph_codec.ENCODING_ZLIB
+    assert len(encoded) < len(NODE) / 2
+
+
+def test_legacy_text_and_json_bytes_are_read_as_is():
+    assert decode_graph_bytes(NODE) == NODE
+    assert decode_graph_bytes(NODE.encode('utf-8')) == NODE
+    assert not is_encoded(NODE.encode('utf-8'))
+
+
+def test_migration_writes_what_the_app_reads(migration):
+    assert migration.GRAPH_DICTIONARY_V1 == graph_codec.GRAPH_DICTIONARY_V1
+    configure_graph_codec('none') # The app's settings do not affect the migration
+    encoded = migration.encode_graph_text(NODE)
+    assert encoded[0] == graph_codec.ENCODING_ZLIB
+    assert decode_graph_bytes(encoded) == NODE
+    assert migration.decode_graph_bytes(encode_graph_text(NODE)) == NODE
+
+
+def test_zstd_is_safe_to_use_from_several_threads():
+    pytest.importorskip('zstandard')
+    from concurrent.futures import ThreadPoolExecutor
+
+    configure_graph_codec('zstd', level=3, min_size=1)
+    texts = [NODE.replace('dndnode_3', f'dndnode_{i}') * (1 + i % 7) for i in range(400)]
+
+    def round_trip(text):
+        encoded = encode_graph_text(text)
+        return encoded[0] == graph_codec.ENCODING_ZSTD and decode_graph_bytes(encoded) == text
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        assert all(pool.map(round_trip, texts))
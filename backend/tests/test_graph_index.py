@@ -0,0 +1,90 @@
+# Graph index (app/services/graph_index.py): the structure of a map is computed
+# on save, served by /getnodemapindex, and kept in step with the map's version.
+from app import db
+from app.models import Nodemap
+from app.services.graph_index import build_graph_index
+
+
+def test_index_of_a_dag():
+    index = build_graph_index(['a', 'b', 'c', 'd'], [('a', 'b'), ('a', 'c'), ('b', 'c'), ('a', 'b'), ('x', 'a')],
+                              nodes_without_agent=['d'])
+    position = {node_id: i for i, node_id in enumerate(index['order'])}
+    assert sorted(position) == ['a', 'b', 'c', 'd']
+    assert position['a'] < position['b'] < position['c']
+    assert index['levels'] == [['a', 'd'], ['b'], ['c']]
+    assert index['predecessors']['c'] == ['a', 'b']
+    assert index['edge_count'] == 3 # The duplicate and the dangling edge are ignored
+    assert index['entry_nodes'] == ['a', 'd'] and index['exit_nodes'] == ['c', 'd']
+    assert index['components'] == [['a', 'b', 'c'], ['d']]
+    assert index['has_cycle'] is False and index['runnable'] is False
+
+
+def test_cycle_is_detected():
+    index = build_graph_index(['a', 'b', 'c'], [('a', 'b'), ('b', 'a'), ('b', 'c')])
+    assert index['has_cycle'] is True
+    assert index['order'] is None
+    assert set(index['cycle_nodes']) >= {'a', 'b'}
+
+
+def test_index_follows_saves(app, client, login, create_nodemap):
+    headers = login()
+    nodes = [{'id': 'a', 'data': {}}, {'id': 'b', 'data': {}}]
+    nodemap_id, version = create_nodemap(headers, nodes, [{'id': 'e', 'source': 'a', 'target': 'b'}])
+    response = client.get(f'/creation/getnodemapindex/{nodemap_id}', headers=headers)
+    assert response.status_code == 200
+    assert response.get_json()['order'] == ['a', 'b']
+    assert client.get(f'/creation/getnodemapindex/{nodemap_id}?node=b', headers=headers).get_json()['predecessors'] == ['a']
+    assert client.get(f'/creation/getnodemapindex/{nodemap_id}?node=z', headers=headers).status_code == 404
+
+    ops = [{'op': 'add', 'path': '/edges/f', 'value': {'id': 'f', 'source': 'b', 'target': 'a'}}]
+    client.post('/creation/savenodemap', json={'nodemap_id': nodemap_id, 'base_version': version, 'ops': ops}, headers=headers)
+    with app.app_context():
+        nodemap = db.session.get(Nodemap, nodemap_id)
+        assert nodemap.graph_index_version == nodemap.version == version + 1
+    assert client.get(f'/creation/getnodemapindex/{nodemap_id}', headers=headers).get_json()['has_cycle'] is True
+
+
+def _full_save(client, headers, nodemap_id, node_ids, edge_pairs):
+    nodes = [{'id': node_id, 'data': {}} for node_id in node_ids]
+    edges = [{'id': f'{source}-{target}', 'source': source, 'target': target} for source, target in edge_pairs]
+    response = client.post('/creation/savenodemap', json={'nodemap_id': nodemap_id, 'nodes': nodes, 'edges': edges}, headers=headers)
+    assert response.status_code == 200
+
+
+def test_full_save_removing_a_node_with_unchanged_edges_rebuilds_the_index(client, login, create_nodemap):
+    headers = login()
+    nodemap_id, _ = create_nodemap(headers)
+    _full_save(client, headers, nodemap_id, 'abc', [('a', 'b'), ('a', 'c')])
+    _full_save(client, headers, nodemap_id, 'abc', [('a', 'b')])
+    _full_save(client, headers, nodemap_id, 'ab', [('a', 'b')]) # Only a node goes away
+
+    index = client.get(f'/creation/getnodemapindex/{nodemap_id}', headers=headers).get_json()
+    assert index['node_count'] == 2
+    assert sorted(index['order']) == ['a', 'b']
+
+
+def test_full_save_adding_an_unconnected_node_rebuilds_the_index(client, login, create_nodemap):
+    headers = login()
+    nodemap_id, _ = create_nodemap(headers)
+    _full_save(client, headers, nodemap_id, 'ab', [('a', 'b')])
+    _full_save(client, headers, nodemap_id, 'abc', [('a', 'b')])
+
+    index = client.get(f'/creation/getnodemapindex/{nodemap_id}', headers=headers).get_json()
+    assert index['node_count'] == 3
+    assert ['c'] in index['components']
+
+
+def test_text_only_save_keeps_the_index(client, login, create_nodemap, monkeypatch):
+    from app.services import graph_index
+
+    headers = login()
+    nodemap_id, version = create_nodemap(headers, [{'id': 'a', 'data': {'label': 'A'}}])
+    rebuilds = []
+    store = graph_index._store_graph_index
+    monkeypatch.setattr(graph_index, '_store_graph_index', lambda nodemap: rebuilds.append(nodemap.id) or store(nodemap))
+
+    ops = [{'op': 'replace', 'path': '/nodes/a/data/label', 'value': 'A2'}]
+    response = client.post('/creation/savenodemap', json={'nodemap_id': nodemap_id, 'base_version': version, 'ops': ops}, headers=headers)
+    assert response.status_code == 200
+    _full_save(client, headers, nodemap_id, 'a', []) # Label back to none, same structure
+    assert rebuilds == []
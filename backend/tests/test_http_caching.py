@@ -0,0 +1,31 @@
+# Conditional reads (app/services/http_caching.py): a matching If-None-Match is a
+# 304 on GET, and a 412 on the POST form, for which 304 is not defined.
+NODES = [{'id': 'a', 'data': {'label': 'A'}}]
+
+
+def test_get_revalidates_with_304(client, login, create_nodemap):
+    headers = login()
+    nodemap_id, _ = create_nodemap(headers, NODES)
+    response = client.get(f'/creation/getnodemapdata/{nodemap_id}', headers=headers)
+    assert response.status_code == 200
+    etag = response.headers['ETag']
+
+    cached = client.get(f'/creation/getnodemapdata/{nodemap_id}', headers={**headers, 'If-None-Match': etag})
+    assert cached.status_code == 304
+    assert cached.headers['ETag'] == etag and not cached.data
+
+
+def test_post_with_matching_validator_is_412(client, login, create_nodemap):
+    headers = login()
+    nodemap_id, version = create_nodemap(headers, NODES)
+    response = client.post('/creation/getnodemapdata', json={'id': nodemap_id}, headers=headers)
+    assert response.status_code == 200
+    etag = response.headers['ETag']
+
+    conditional = {**headers, 'If-None-Match': etag}
+    assert client.post('/creation/getnodemapdata', json={'id': nodemap_id}, headers=conditional).status_code == 412
+
+    # Once the map changes the validator no longer matches and the data is sent
+    patch = [{'op': 'add', 'path': '/nodes/a', 'value': {'id': 'a', 'data': {'label': 'A2'}}}]
+    client.post('/creation/savenodemap', json={'nodemap_id': nodemap_id, 'base_version': version, 'ops': patch}, headers=headers)
+    assert client.post('/creation/getnodemapdata', json={'id': nodemap_id}, headers=conditional).status_code == 200
@@ -0,0 +1,82 @@
+# HTTP model provider (app/services/http_provider.py), against the local stand-in
+# server of the benchmarks: connections are kept alive, identical concurrent calls
+# share one upstream request, and failures are retried.
+import asyncio
+
+import pytest
+
+from app.services.http_provider import HTTPModelProvider
+from app.services.model_providers import LocalModelProvider, ModelProviderError
+from benchmarks.provider_server import start_provider_server
+
+
+@pytest.fixture
+def provider_server():
+    servers = []
+
+    def start(**options):
+        server = start_provider_server(**options)
+        servers.append(server)
+        return server
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+@pytest.fixture
+def provider():
+    providers = []
+
+    def create(server, **options):
+        providers.append(HTTPModelProvider(server.base_url, retry_backoff=0, **options))
+        return providers[-1]
+
+    yield create
+    for http_provider in providers:
+        http_provider.close()
+
+
+def test_calls_reuse_one_connection(provider_server, provider):
+    server = provider_server()
+    http_provider = provider(server)
+
+    async def calls():
+        return [await http_provider.generate('gpt-4o', 'sp', f'prompt {i}') for i in range(5)]
+
+    texts = asyncio.run(calls())
+    assert texts[0] == LocalModelProvider()._response_text('gpt-4o', 'sp', 'prompt 0')
+    assert server.stats['requests'] == 5
+    assert server.stats['connections'] == 1
+
+
+@pytest.mark.parametrize('shared, upstream_requests', [(True, 1), (False, 4)])
+def test_identical_concurrent_calls_share_one_request(provider_server, provider, shared, upstream_requests):
+    server = provider_server(latency=0.2)
+    http_provider = provider(server)
+
+    async def calls():
+        return await asyncio.gather(*(http_provider.generate('gpt-4o', 'sp', 'same', shared=shared) for _ in range(4)))
+
+    assert len(set(asyncio.run(calls()))) == 1
+    assert server.stats['requests'] == upstream_requests
+
+
+def test_streamed_tokens_make_the_full_text(provider_server, provider):
+    http_provider = provider(provider_server())
+
+    async def collect():
+        return [token async for token in http_provider.stream('gpt-4o', 'sp', 'hello')]
+
+    tokens = asyncio.run(collect())
+    assert len(tokens) > 1
+    assert ''.join(tokens) == LocalModelProvider()._response_text('gpt-4o', 'sp', 'hello')
+
+
+def test_failures_are_retried_then_reported(provider_server, provider):
+    server = provider_server(error_rate=1.0)
+    http_provider = provider(server, max_retries=2)
+    with pytest.raises(ModelProviderError):
+        asyncio.run(http_provider.generate('gpt-4o', 'sp', 'hello'))
+    assert server.stats['requests'] == 3
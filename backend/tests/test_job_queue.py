@@ -0,0 +1,76 @@
+# Background runs (app/services/job_queue.py): claims respect the per-user limit,
+# and a run's history is kept only when the worker still held the job's lease.
+from sqlalchemy import update
+
+from app import db
+from app.models import RunJob, RunRecord
+from app.services import job_queue
+from app.services.job_queue import claim_next_job, run_job
+
+
+def _enqueue(client, headers, nodemap_id):
+    response = client.post('/execution/enqueuerun', json={'nodemap_id': nodemap_id, 'input': 'hello'}, headers=headers)
+    assert response.status_code == 202, response.get_json()
+    return response.get_json()['id']
+
+
+def _nodemap(create_agent, create_nodemap, headers):
+    nodes = [{'id': 'a', 'data': {'agentId': create_agent(headers)}}]
+    return create_nodemap(headers, nodes)[0]
+
+
+def test_claim_respects_the_running_limit_per_user(app, client, login, create_agent, create_nodemap):
+    app.config['JOB_MAX_RUNNING_PER_USER'] = 1
+    alice, bob = login('alice'), login('bob')
+    alice_map, bob_map = _nodemap(create_agent, create_nodemap, alice), _nodemap(create_agent, create_nodemap, bob)
+    first, second = _enqueue(client, alice, alice_map), _enqueue(client, alice, alice_map)
+    other = _enqueue(client, bob, bob_map)
+
+    with app.app_context():
+        assert claim_next_job('w1') == first
+        assert claim_next_job('w2') == other # alice's second job waits for her first
+        assert claim_next_job('w3') is None
+        assert db.session.get(RunJob, second).status == 'queued'
+
+
+def test_finished_job_records_its_run(app, client, login, create_agent, create_nodemap):
+    headers = login()
+    job_id = _enqueue(client, headers, _nodemap(create_agent, create_nodemap, headers))
+    with app.app_context():
+        assert claim_next_job('w1') == job_id
+        assert run_job(job_id, 'w1') == 'completed'
+        assert db.session.query(RunRecord).filter_by(job_id=job_id).count() == 1
+
+
+def test_run_is_not_recorded_when_the_lease_was_lost(app, client, login, create_agent, create_nodemap, monkeypatch):
+    headers = login()
+    job_id = _enqueue(client, headers, _nodemap(create_agent, create_nodemap, headers))
+    original_record_run = job_queue.record_run
+
+    def record_run_after_lease_lost(*args, **kwargs):
+        # Recovery hands the job to another worker while this one finishes
+        with db.engine.begin() as connection:
+            connection.execute(update(RunJob).where(RunJob.id == job_id).values(worker_id='w2'))
+        return original_record_run(*args, **kwargs)
+
+    monkeypatch.setattr(job_queue, 'record_run', record_run_after_lease_lost)
+    with app.app_context():
+        assert claim_next_job('w1') == job_id
+        assert run_job(job_id, 'w1') is None
+        assert db.session.query(RunRecord).filter_by(job_id=job_id).count() == 0
+        assert db.session.get(RunJob, job_id).status == 'running' # Left to its new worker
+
+
+def test_unexpected_error_is_not_shown_to_the_client(app, client, login, create_agent, create_nodemap, monkeypatch):
+    headers = login()
+    job_id = _enqueue(client, headers, _nodemap(create_agent, create_nodemap, headers))
+
+    async def broken_run(*args, **kwargs):
+        raise RuntimeError('secret connection string')
+
+    monkeypatch.setattr(job_queue, 'execute_nodemap_graph', broken_run)
+    with app.app_context():
+        assert claim_next_job('w1') == job_id
+        run_job(job_id, 'w1')
+    error = client.get(f'/execution/getrunjob/{job_id}', headers=headers).get_json()['error']
+    assert error == 'An error occurred while running the nodemap'
@@ -0,0 +1,38 @@
+# JSON responses (app/services/json_provider.py): the orjson provider writes what
+# Flask's default provider would, and stored graph JSON is spliced into the
+# /getnodemapdata body unchanged.
+import json
+from datetime import datetime
+from decimal import Decimal
+
+import pytest
+from flask.json.provider import DefaultJSONProvider
+
+from app.services.json_provider import OrjsonProvider, orjson, spliced_json_response
+
+VALUES = {'b': [1, 2.5, None, True], 'a': 'é', 'when': datetime(2024, 1, 2, 3, 4, 5), 'price': Decimal('1.10'), 'big': 2 ** 70}
+
+
+@pytest.mark.skipif(orjson is None, reason='orjson is not installed')
+def test_orjson_output_matches_the_default_provider(app):
+    assert isinstance(app.json, OrjsonProvider)
+    expected = DefaultJSONProvider(app).dumps(VALUES, separators=(',', ':'), ensure_ascii=False)
+    assert app.json.dumps(VALUES) == expected
+    with app.test_request_context():
+        assert json.loads(app.json.response(VALUES).get_data()) == json.loads(expected)
+
+
+def test_spliced_members_are_written_as_they_are(app):
+    with app.app_context():
+        response = spliced_json_response(app, {'id': 1}, {'nodes_data': ['{"id":"a","x":1.50}', '{"id":"b"}'], 'edges_data': []})
+    assert response.get_data() == b'{"id":1,"nodes_data":[{"id":"a","x":1.50},{"id":"b"}],"edges_data":[]}\n'
+
+
+def test_nodemap_data_round_trips(client, login, create_nodemap):
+    headers = login()
+    nodes = [{'id': 'a', 'data': {'label': 'Ä', 'weight': 0.25}}, {'id': 'b', 'data': {}}]
+    edges = [{'id': 'e', 'source': 'a', 'target': 'b'}]
+    nodemap_id, _ = create_nodemap(headers, nodes, edges)
+    body = client.post('/creation/getnodemapdata', json={'id': nodemap_id}, headers=headers).get_json()
+    assert body['nodes_data'] == nodes
+    assert body['edges_data'] == edges
@@ -0,0 +1,28 @@
+# Structured logging (app/services/logging_setup.py): records keep their traceback
+# in a separate 'exception' field after going through the log queue.
+import json
+import logging
+import sys
+
+from app.services.logging_setup import ExceptionKeepingQueueHandler, JsonFormatter
+
+
+def _queued_record(app):
+    # The record as the listener thread receives it from the app's queue handler
+    [queue_handler] = [handler for handler in logging.getLogger('app').handlers if isinstance(handler, ExceptionKeepingQueueHandler)]
+    try:
+        raise RuntimeError('broken')
+    except RuntimeError:
+        record = logging.getLogger('app.tests').makeRecord('app.tests', logging.ERROR, __file__, 1, 'boom %s', (1,), sys.exc_info())
+    return queue_handler.prepare(record)
+
+
+def test_exception_is_a_separate_field(app):
+    entry = json.loads(JsonFormatter().format(_queued_record(app)))
+    assert entry['message'] == 'boom 1'
+    assert entry['exception'].startswith('Traceback') and 'RuntimeError: broken' in entry['exception']
+
+
+def test_text_format_still_shows_the_traceback(app):
+    line = logging.Formatter('%(levelname)s %(name)s: %(message)s').format(_queued_record(app))
+    assert line.startswith('ERROR app.tests: boom 1\nTraceback')
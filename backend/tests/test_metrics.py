@@ -0,0 +1,33 @@
+# Request metrics (app/services/metrics.py): the /metrics endpoint is closed
+# unless configured, and SQL timing survives failed statements.
+import pytest
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+
+from app import db
+
+
+def test_metrics_are_closed_without_a_token(client):
+    assert client.get('/metrics').status_code == 403
+
+
+def test_metrics_require_the_token(app, client):
+    app.config['METRICS_TOKEN'] = 'scrape-token'
+    assert client.get('/metrics').status_code == 401
+    response = client.get('/metrics', headers={'Authorization': 'Bearer scrape-token'})
+    assert response.status_code == 200
+    assert 'http_requests_total' in response.get_data(as_text=True)
+
+
+def test_metrics_can_be_made_public(app, client):
+    app.config['METRICS_PUBLIC'] = True
+    assert client.get('/metrics').status_code == 200
+
+
+def test_failed_statement_leaves_no_query_start_behind(app):
+    with app.app_context():
+        connection = db.session.connection()
+        with pytest.raises(OperationalError):
+            connection.execute(text('SELECT * FROM no_such_table'))
+        assert not connection.info.get('metrics_query_start')
+        db.session.rollback()
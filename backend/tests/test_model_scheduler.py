@@ -0,0 +1,58 @@
+# Model scheduler (app/services/model_scheduler.py): grants are always released,
+# users are queued by one id type, and the statistics are for administrators only.
+import asyncio
+
+from app.services import model_scheduler
+from app.services.model_providers import LocalModelProvider
+from app.services.model_scheduler import ModelScheduler, PRIORITY_BATCH
+from app.services.nodemap_executor import execute_nodemap_graph
+
+AGENTS = {1: {'id': 1, 'model': 'gpt-4o', 'system_prompt': 'sp', 'type': 'text'}}
+
+
+def test_user_ids_are_normalized():
+    scheduler = ModelScheduler({'gpt-4o': (600, None)})
+
+    async def acquire(user_id):
+        return await scheduler.acquire('gpt-4o', user_id, PRIORITY_BATCH, 1)
+
+    assert asyncio.run(acquire('7'))._ticket.user_id == asyncio.run(acquire(7))._ticket.user_id == 7
+
+
+def test_grant_is_released_when_cancelled_waiting_for_a_concurrency_slot(monkeypatch):
+    released = []
+    original_release = model_scheduler.SchedulerGrant.release
+
+    def release(grant, output_tokens=0):
+        released.append(grant)
+        original_release(grant, output_tokens)
+
+    monkeypatch.setattr(model_scheduler.SchedulerGrant, 'release', release)
+    scheduler = ModelScheduler({'gpt-4o': (600, 100000)})
+    slow = LocalModelProvider(latency=30)
+    nodes = [{'id': 'a', 'data': {'agentId': 1}}, {'id': 'b', 'data': {'agentId': 1}}]
+
+    async def run_and_cancel():
+        # One slot: one node calls the (slow) provider, the other holds a grant and waits for the slot
+        run = asyncio.create_task(execute_nodemap_graph(nodes, [], AGENTS, 'hi', max_concurrency=1,
+                                                        provider_for=lambda model: slow,
+                                                        scheduler=scheduler, user_id=1))
+        await asyncio.sleep(0.2)
+        run.cancel()
+        try:
+            await run
+        except asyncio.CancelledError:
+            pass
+
+    asyncio.run(run_and_cancel())
+    assert len(released) == 2
+
+
+def test_statistics_are_for_administrators(app, client, login):
+    headers = login('alice')
+    assert client.get('/execution/schedulerstats', headers=headers).status_code == 403
+    assert client.get('/execution/cachestats', headers=headers).status_code == 403
+
+    app.config['ADMIN_USERNAMES'] = frozenset({'alice'})
+    assert client.get('/execution/schedulerstats', headers=headers).status_code == 200
+    assert client.get('/execution/cachestats', headers=headers).status_code == 200
@@ -0,0 +1,79 @@
+# Parallel execution of nodemaps (app/services/nodemap_executor.py): nodes run as
+# soon as their inputs are ready, up to max_concurrency at a time, and a failed
+# node skips everything downstream of it.
+import asyncio
+
+import pytest
+
+from app.services.nodemap_executor import execute_nodemap_graph, build_execution_plan, NodemapExecutionError
+
+AGENTS = {1: {'id': 1, 'model': 'm', 'system_prompt': 'sp'}}
+
+
+def _nodes(*node_ids):
+    return [{'id': node_id, 'data': {'agentId': 1}} for node_id in node_ids]
+
+
+def _edges(*pairs):
+    return [{'id': f'{source}-{target}', 'source': source, 'target': target} for source, target in pairs]
+
+
+class _Provider:
+    """Echoes its input after a delay, and records how many calls overlapped."""
+
+    def __init__(self, delay=0.05, fail=()):
+        self.delay, self.fail = delay, set(fail)
+        self.running = self.peak = 0
+
+    async def generate(self, model, system_prompt, prompt, params=None, shared=True):
+        self.running += 1
+        self.peak = max(self.peak, self.running)
+        try:
+            await asyncio.sleep(self.delay)
+            if prompt in self.fail:
+                raise RuntimeError(f'failed on {prompt}')
+            return f'<{prompt}>'
+        finally:
+            self.running -= 1
+
+
+def _run(nodes, edges, provider, initial_input='in', **options):
+    return asyncio.run(execute_nodemap_graph(nodes, edges, AGENTS, initial_input, provider_for=lambda model: provider, **options))
+
+
+def test_independent_nodes_run_concurrently_within_the_limit():
+    provider = _Provider()
+    result = _run(_nodes('a', 'b', 'c', 'd'), [], provider, max_concurrency=2)
+    assert result['status'] == 'completed'
+    assert provider.peak == 2
+    assert result['outputs'] == {node_id: '<in>' for node_id in 'abcd'}
+
+
+def test_nodes_receive_their_predecessors_outputs_in_order():
+    result = _run(_nodes('a', 'b', 'c'), _edges(('a', 'c'), ('b', 'c')), _Provider(delay=0))
+    assert result['outputs']['c'] == '<<in>\n\n<in>>'
+    assert result['critical_path'][-1] == 'c'
+
+
+def test_failed_node_skips_its_descendants_only():
+    provider = _Provider(delay=0, fail={'bad'})
+    result = _run(_nodes('a', 'b', 'c'), _edges(('a', 'b')), provider, initial_input='bad')
+    assert result['status'] == 'failed'
+    assert {node_id: node['status'] for node_id, node in result['nodes'].items()} == {'a': 'failed', 'b': 'skipped', 'c': 'failed'}
+
+
+def test_cycle_is_rejected_before_running():
+    with pytest.raises(NodemapExecutionError, match='cycle'):
+        build_execution_plan(_nodes('a', 'b'), _edges(('a', 'b'), ('b', 'a')))
+
+
+def test_run_route_returns_every_node_output(client, login, create_agent, create_nodemap):
+    headers = login()
+    agent_id = create_agent(headers)
+    nodes = [{'id': node_id, 'data': {'agentId': agent_id}} for node_id in ('a', 'b')]
+    nodemap_id, _ = create_nodemap(headers, nodes, _edges(('a', 'b')))
+    response = client.post('/execution/runnodemap', json={'nodemap_id': nodemap_id, 'input': 'hello'}, headers=headers)
+    assert response.status_code == 200
+    body = response.get_json()
+    assert body['status'] == 'completed'
+    assert set(body['outputs']) == {'a', 'b'}
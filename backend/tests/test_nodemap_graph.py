@@ -0,0 +1,50 @@
+# Row storage of nodemap graphs (app/services/nodemap_graph.py): elements sent
+# without an id get deterministic ids instead of being rejected or merged.
+from app import db
+from app.models import Nodemap
+from app.services.nodemap_graph import with_element_ids, load_nodemap_graph
+
+
+def _graph(client, headers, nodemap_id):
+    data = client.post('/creation/getnodemapdata', json={'id': nodemap_id}, headers=headers).get_json()
+    return data['nodes_data'], data['edges_data']
+
+
+def test_missing_ids_are_filled_in_deterministically():
+    elements = [{'data': 1}, {'id': 'legacy_2'}, {'data': 3}, {'id': 'x'}]
+    assert [element['id'] for element in with_element_ids(elements)] == ['legacy_0', 'legacy_2', 'legacy_2~2', 'x']
+    assert with_element_ids(elements) == with_element_ids(elements)
+    assert 'id' not in elements[0] # The input is not modified
+
+
+def test_nodes_without_ids_are_saved_as_separate_elements(client, login, create_nodemap):
+    headers = login()
+    nodes = [{'data': {'label': 'A'}}, {'data': {'label': 'B'}}, {'id': 'c', 'data': {'label': 'C'}}]
+    nodemap_id, version = create_nodemap(headers, nodes)
+    saved, _ = _graph(client, headers, nodemap_id)
+    assert [(node['id'], node['data']['label']) for node in saved] == [('legacy_0', 'A'), ('legacy_1', 'B'), ('c', 'C')]
+
+    # The generated ids can be patched like any other
+    ops = [{'op': 'replace', 'path': '/nodes/legacy_1/data', 'value': {'label': 'B2'}}]
+    response = client.post('/creation/savenodemap', json={'nodemap_id': nodemap_id, 'base_version': version, 'ops': ops}, headers=headers)
+    assert response.status_code == 200
+    saved, _ = _graph(client, headers, nodemap_id)
+    assert [node['data']['label'] for node in saved] == ['A', 'B2', 'C']
+
+
+def test_legacy_json_without_ids_is_patched_without_losing_elements(app, client, login):
+    headers = login()
+    nodemap_id = client.post('/creation/createmap', json={'name': 'm', 'goal': 'g', 'description': 'd'}, headers=headers).get_json()['nodemap_id']
+    with app.app_context():
+        nodemap = db.session.get(Nodemap, nodemap_id)
+        nodemap.nodes_data = '[{"data": {"label": "A"}}, {"data": {"label": "B"}}]'
+        nodemap.edges_data = '[]'
+        db.session.commit()
+        version = nodemap.version
+        assert [node['id'] for node in load_nodemap_graph(nodemap)[0]] == ['legacy_0', 'legacy_1']
+
+    ops = [{'op': 'add', 'path': '/nodes/n', 'value': {'id': 'n', 'data': {'label': 'N'}}}]
+    response = client.post('/creation/savenodemap', json={'nodemap_id': nodemap_id, 'base_version': version, 'ops': ops}, headers=headers)
+    assert response.status_code == 200
+    saved, _ = _graph(client, headers, nodemap_id)
+    assert [(node['id'], node['data']['label']) for node in saved] == [('legacy_0', 'A'), ('legacy_1', 'B'), ('n', 'N')]
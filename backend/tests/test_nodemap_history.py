@@ -0,0 +1,65 @@
+# Version history of nodemaps (app/services/nodemap_history.py): one revision per
+# save, element contents stored once, and saves that collide on a version rejected.
+from datetime import datetime, timedelta
+
+from sqlalchemy import select
+
+from app import db
+from app.models import Nodemap, NodemapBlob, NodemapRevision
+from app.services.nodemap_history import store_blobs, delete_unreferenced_blobs, element_hash, BLOB_GC_GRACE
+
+NODES = [{'id': 'a', 'data': {'label': 'A'}}, {'id': 'b', 'data': {'label': 'B'}}]
+
+
+def _patch(label):
+    return [{'op': 'add', 'path': '/nodes/a', 'value': {'id': 'a', 'data': {'label': label}}}]
+
+
+def test_each_save_is_a_revision_and_unchanged_elements_are_stored_once(app, client, login, create_nodemap):
+    headers = login()
+    nodemap_id, version = create_nodemap(headers, NODES)
+    with app.app_context():
+        blobs_before = db.session.query(NodemapBlob).count()
+    response = client.post('/creation/savenodemap', json={'nodemap_id': nodemap_id, 'base_version': version, 'ops': _patch('A2')}, headers=headers)
+    assert response.status_code == 200
+
+    history = client.get(f'/creation/getnodemaphistory/{nodemap_id}', headers=headers).get_json()
+    assert [item['version'] for item in history['versions']] == [version + 1, version]
+    with app.app_context():
+        assert db.session.query(NodemapBlob).count() == blobs_before + 1 # Only the changed node
+
+    old = client.get(f'/creation/getnodemapversion/{nodemap_id}/{version}', headers=headers)
+    assert old.status_code == 200
+
+
+def test_save_colliding_with_a_recorded_version_is_a_conflict(app, client, login, create_nodemap):
+    headers = login()
+    nodemap_id, version = create_nodemap(headers, NODES)
+    with app.app_context():
+        # As if another save had recorded the next version without bumping the map
+        db.session.add(NodemapRevision(nodemap_id=nodemap_id, version=version + 1, source='save'))
+        db.session.commit()
+
+    response = client.post('/creation/savenodemap', json={'nodemap_id': nodemap_id, 'base_version': version, 'ops': _patch('A2')}, headers=headers)
+    assert response.status_code == 409
+    assert response.get_json()['full_save_required'] is True
+    with app.app_context():
+        assert db.session.get(Nodemap, nodemap_id).version == version # Nothing of the failed save was kept
+
+
+def test_reused_blob_is_not_collected_while_a_save_references_it(app):
+    text = '{"id": "x"}'
+    digest = element_hash(text)
+    with app.app_context():
+        old = datetime.utcnow() - 2 * BLOB_GC_GRACE
+        db.session.add(NodemapBlob(hash=digest, data=text, created_at=old))
+        db.session.commit()
+
+        # A save reuses the blob; its element rows are not committed yet
+        assert store_blobs(db.session.connection(), [text]) == {text: digest}
+        db.session.commit()
+
+        created_at = db.session.execute(select(NodemapBlob.created_at).where(NodemapBlob.hash == digest)).scalar_one()
+        assert created_at > datetime.utcnow() - timedelta(minutes=1)
+        assert delete_unreferenced_blobs() == 0
+        assert db.session.get(NodemapBlob, digest) is not None
@@ -0,0 +1,49 @@
+# Keyset pagination of /creation/getnodemaps on (created_at, id).
+import base64
+import json
+from datetime import datetime
+
+from app import db
+from app.models import Nodemap
+
+
+def _create(client, headers, count):
+    return [client.post('/creation/createmap', json={'name': f'map {index}', 'goal': 'g', 'description': 'd'},
+                        headers=headers).get_json()['nodemap_id'] for index in range(count)]
+
+
+def _all_pages(client, headers, **params):
+    ids, cursor = [], None
+    while True:
+        query = dict(params, limit=2, fields='id', **({'cursor': cursor} if cursor else {}))
+        page = client.get('/creation/getnodemaps', query_string=query, headers=headers).get_json()
+        ids.extend(item['id'] for item in page['nodemaps'])
+        cursor = page['next_cursor']
+        if not cursor:
+            return ids
+
+
+def test_pages_cover_every_map_once_in_order(client, login):
+    headers = login()
+    created = _create(client, headers, 5)
+    assert _all_pages(client, headers) == created
+    assert _all_pages(client, headers, order='desc') == created[::-1]
+
+
+def test_maps_created_on_the_same_instant_are_ordered_by_id(app, client, login):
+    headers = login()
+    created = _create(client, headers, 5)
+    with app.app_context():
+        db.session.query(Nodemap).update({Nodemap.created_at: datetime(2026, 1, 1)})
+        db.session.commit()
+    assert _all_pages(client, headers) == created
+
+
+def test_cursor_without_a_creation_time_is_accepted(client, login):
+    # Issued before created_at was NOT NULL
+    headers = login()
+    created = _create(client, headers, 3)
+    cursor = base64.urlsafe_b64encode(json.dumps([None, 0]).encode('utf-8')).decode('ascii')
+    page = client.get('/creation/getnodemaps', query_string={'limit': 10, 'fields': 'id', 'cursor': cursor}, headers=headers)
+    assert page.status_code == 200
+    assert [item['id'] for item in page.get_json()['nodemaps']] == created
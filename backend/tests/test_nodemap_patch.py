@@ -0,0 +1,39 @@
+# Patch operations on nodemap elements (app/services/nodemap_patch.py): 'add'
+# creates missing fields, while 'replace' and 'remove' need them to exist.
+import pytest
+
+from app import db
+from app.models import Nodemap
+from app.services.nodemap_patch import apply_nodemap_patch, NodemapPatchError
+
+
+def _collections():
+    return {'nodes': {'a': {'id': 'a', 'position': {'x': 1, 'y': 2}, 'data': {'label': 'A'}}}, 'edges': {}}
+
+
+def test_replace_and_add_of_fields():
+    collections = _collections()
+    apply_nodemap_patch(collections, [
+        {'op': 'replace', 'path': '/nodes/a/position/x', 'value': 5},
+        {'op': 'add', 'path': '/nodes/a/style/width', 'value': 120}, # Creates 'style'
+        {'op': 'remove', 'path': '/nodes/a/data/label'},
+    ])
+    assert collections['nodes']['a'] == {'id': 'a', 'position': {'x': 5, 'y': 2}, 'data': {}, 'style': {'width': 120}}
+
+
+@pytest.mark.parametrize('path', ['/nodes/a/data/notes', '/nodes/a/style/width', '/nodes/a/position/x/value'])
+def test_replace_of_a_missing_field_is_rejected(path):
+    collections = _collections()
+    with pytest.raises(NodemapPatchError):
+        apply_nodemap_patch(collections, [{'op': 'replace', 'path': path, 'value': 1}])
+    assert 'style' not in collections['nodes']['a'] and 'notes' not in collections['nodes']['a']['data']
+
+
+def test_rejected_replace_saves_nothing(app, client, login, create_nodemap):
+    headers = login()
+    nodemap_id, version = create_nodemap(headers, [{'id': 'a', 'data': {'label': 'A'}}])
+    ops = [{'op': 'replace', 'path': '/nodes/a/data/notes', 'value': 'n'}]
+    response = client.post('/creation/savenodemap', json={'nodemap_id': nodemap_id, 'base_version': version, 'ops': ops}, headers=headers)
+    assert response.status_code == 400
+    with app.app_context():
+        assert db.session.get(Nodemap, nodemap_id).version == version
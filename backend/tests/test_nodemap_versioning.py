@@ -0,0 +1,89 @@
+# Optimistic concurrency of /creation/savenodemap: a save is only accepted on top
+# of the version it was based on, and two concurrent saves never both succeed.
+import threading
+
+from app import db
+from app.models import Nodemap, NodemapRevision
+from app.routes import creation_routes
+from app.services.nodemap_graph import claim_next_version
+
+NODES = [{'id': 'a', 'data': {'label': 'A'}}, {'id': 'b', 'data': {'label': 'B'}}]
+
+
+def _patch(label):
+    return [{'op': 'add', 'path': '/nodes/a', 'value': {'id': 'a', 'data': {'label': label}}}]
+
+
+def test_patch_on_current_version_is_saved(client, login, create_nodemap):
+    headers = login()
+    nodemap_id, version = create_nodemap(headers, NODES)
+    response = client.post('/creation/savenodemap', json={'nodemap_id': nodemap_id, 'base_version': version, 'ops': _patch('A2')}, headers=headers)
+    assert response.status_code == 200
+    assert response.get_json()['version'] == version + 1
+    assert response.get_json()['save_mode'] == 'patch'
+
+
+def test_patch_on_stale_version_is_rejected(client, login, create_nodemap):
+    headers = login()
+    nodemap_id, version = create_nodemap(headers, NODES)
+    assert client.post('/creation/savenodemap', json={'nodemap_id': nodemap_id, 'base_version': version, 'ops': _patch('A2')}, headers=headers).status_code == 200
+
+    response = client.post('/creation/savenodemap', json={'nodemap_id': nodemap_id, 'base_version': version, 'ops': _patch('A3')}, headers=headers)
+    assert response.status_code == 409
+    assert response.get_json()['full_save_required'] is True
+    assert response.get_json()['version'] == version + 1
+
+
+def test_claim_next_version_is_a_compare_and_set(app, login, create_nodemap):
+    headers = login()
+    nodemap_id, version = create_nodemap(headers, NODES)
+    with app.app_context():
+        nodemap = db.session.get(Nodemap, nodemap_id)
+        assert not claim_next_version(nodemap, version - 1)
+        assert claim_next_version(nodemap, version)
+        assert nodemap.version == version + 1
+        db.session.commit()
+        assert db.session.query(Nodemap.version).filter_by(id=nodemap_id).scalar() == version + 1
+
+
+def test_concurrent_patches_on_the_same_base_version(app, login, create_nodemap, monkeypatch):
+    headers = login()
+    nodemap_id, version = create_nodemap(headers, NODES)
+
+    # The first request stops inside its save (after claiming the version) until
+    # the second one has been sent, so both are based on the same version
+    first_inside = threading.Event()
+    second_sent = threading.Event()
+    original_patch = creation_routes.patch_nodemap_graph
+
+    def slow_patch(*args, **kwargs):
+        if not first_inside.is_set():
+            first_inside.set()
+            second_sent.wait(5)
+        return original_patch(*args, **kwargs)
+
+    monkeypatch.setattr(creation_routes, 'patch_nodemap_graph', slow_patch)
+    results = {}
+
+    def save(name, label):
+        response = app.test_client().post('/creation/savenodemap', headers=headers, json={
+            'nodemap_id': nodemap_id, 'base_version': version, 'ops': _patch(label)})
+        results[name] = (response.status_code, response.get_json())
+
+    first = threading.Thread(target=save, args=('first', 'from first'))
+    first.start()
+    assert first_inside.wait(5)
+    second = threading.Thread(target=save, args=('second', 'from second'))
+    second.start()
+    second.join(0.5) # The second request is now waiting for the first one's transaction
+    second_sent.set()
+    first.join(10)
+    second.join(10)
+
+    assert results['first'][0] == 200
+    assert results['second'][0] == 409, results['second']
+    with app.app_context():
+        assert db.session.query(Nodemap.version).filter_by(id=nodemap_id).scalar() == version + 1
+        assert NodemapRevision.query.filter_by(nodemap_id=nodemap_id, version=version + 1).count() == 1
+    graph = app.test_client().get(f'/creation/getnodemapdata/{nodemap_id}', headers=headers).get_json()
+    assert {node['id']: node['data']['label'] for node in graph['nodes_data']}['a'] == 'from first'
@@ -0,0 +1,59 @@
+# Response cache (app/services/response_cache.py): entries are addressed by their
+# content, evicted least recently used first, expire after the TTL, and the file
+# tier survives a restart.
+from app.services import response_cache
+from app.services.response_cache import ResponseCache, response_cache_key
+
+
+def test_key_depends_on_everything_that_determines_the_response():
+    key = response_cache_key('m', 'sp', 'hello', {'temperature': 0})
+    assert key == response_cache_key('m', 'sp', 'hello', {'temperature': 0})
+    assert key != response_cache_key('m', 'sp', 'hello', {'temperature': 1})
+    assert key != response_cache_key('other', 'sp', 'hello', {'temperature': 0})
+    assert response_cache_key('m', 'sp', 'hello') == response_cache_key('m', 'sp', 'hello', {})
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = ResponseCache(max_entries=2)
+    cache.set('a', 'A')
+    cache.set('b', 'B')
+    assert cache.get('a') == 'A' # 'b' is now the least recently used
+    cache.set('c', 'C')
+    assert cache.get('b') is None
+    assert cache.get('a') == 'A' and cache.get('c') == 'C'
+    assert cache.stats()['evictions'] == 1
+
+
+def test_entries_expire_after_the_ttl(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(response_cache.time, 'time', lambda: now[0])
+    cache = ResponseCache(ttl=60)
+    cache.set('a', 'A')
+    now[0] += 59
+    assert cache.get('a') == 'A'
+    now[0] += 2
+    assert cache.get('a') is None
+    assert cache.stats()['expirations'] == 1
+
+
+def test_file_tier_survives_a_restart(tmp_path):
+    path = str(tmp_path / 'responses.db')
+    ResponseCache(disk_path=path).set('a', 'A')
+    cache = ResponseCache(disk_path=path)
+    assert cache.get('a') == 'A'
+    assert cache.stats()['disk_hits'] == 1
+    assert cache.get('a') == 'A' and cache.stats()['memory_hits'] == 1 # Promoted
+
+
+def test_repeated_run_is_answered_from_the_cache(app, client, login, create_agent, create_nodemap):
+    response_cache.configure_response_cache(ResponseCache())
+    try:
+        headers = login()
+        nodemap_id, _ = create_nodemap(headers, [{'id': 'a', 'data': {'agentId': create_agent(headers)}}])
+        runs = [client.post('/execution/runnodemap', json={'nodemap_id': nodemap_id, 'input': 'hello'}, headers=headers).get_json()
+                for _ in range(2)]
+        assert runs[0]['nodes']['a']['cached'] is False
+        assert runs[1]['nodes']['a']['cached'] is True
+        assert runs[1]['outputs'] == runs[0]['outputs']
+    finally:
+        response_cache.configure_response_cache(None)
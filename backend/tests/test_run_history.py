@@ -0,0 +1,87 @@
+# Run history (app/services/run_history.py): each run is recorded with its node
+# events, and payloads are stored once and survive garbage collection while reused.
+from datetime import datetime, timedelta
+
+from sqlalchemy import select, event
+
+from app import db
+from app.models import RunPayload
+from app.services import run_history
+from app.services.run_history import store_payloads, load_payloads, delete_unreferenced_payloads, payload_hash, PAYLOAD_GC_GRACE
+
+
+def _chain(create_agent, headers):
+    first, second = create_agent(headers, 'first'), create_agent(headers, 'second')
+    nodes = [{'id': 'a', 'data': {'agentId': first}}, {'id': 'b', 'data': {'agentId': second}}]
+    return nodes, [{'id': 'e', 'source': 'a', 'target': 'b'}]
+
+
+def test_runs_are_recorded_with_their_events(client, login, create_agent, create_nodemap):
+    headers = login()
+    nodemap_id, _ = create_nodemap(headers, *_chain(create_agent, headers))
+    run_ids = []
+    for _ in range(2):
+        response = client.post('/execution/runnodemap', json={'nodemap_id': nodemap_id, 'input': 'hello'}, headers=headers)
+        assert response.status_code == 200
+        run_ids.append(response.get_json()['run_id'])
+
+    runs = client.get(f'/execution/getruns/{nodemap_id}', headers=headers).get_json()['runs']
+    assert [run['run_id'] for run in runs] == run_ids[::-1]
+    run = client.get(f'/execution/getrun/{run_ids[0]}', headers=headers).get_json()
+    node_events = [event for event in run['events'] if event['node_id']]
+    assert {event['node_id'] for event in node_events} == {'a', 'b'}
+    assert all(event['output'] for event in node_events)
+
+
+def test_identical_inputs_share_payloads(app, client, login, create_agent, create_nodemap):
+    headers = login()
+    nodemap_id, _ = create_nodemap(headers, *_chain(create_agent, headers))
+    client.post('/execution/runnodemap', json={'nodemap_id': nodemap_id, 'input': 'hello'}, headers=headers)
+    with app.app_context():
+        payloads = db.session.query(RunPayload).count()
+    client.post('/execution/runnodemap', json={'nodemap_id': nodemap_id, 'input': 'hello'}, headers=headers)
+    with app.app_context():
+        assert db.session.query(RunPayload).count() == payloads # Same input, same (deterministic) outputs
+
+
+def test_reused_payload_is_not_collected_while_a_run_references_it(app):
+    text = 'a payload'
+    digest = payload_hash(text)
+    with app.app_context():
+        db.session.execute(RunPayload.__table__.insert().values(
+            hash=digest, size=len(text), data=b'\x00' + text.encode('utf-8'),
+            created_at=datetime.utcnow() - 2 * PAYLOAD_GC_GRACE,
+        ))
+        db.session.commit()
+
+        # A run reuses the payload; its events are not committed yet
+        assert store_payloads(db.session.connection(), [text]) == {text: digest}
+        db.session.commit()
+
+        created_at = db.session.execute(select(RunPayload.created_at).where(RunPayload.hash == digest)).scalar_one()
+        assert created_at > datetime.utcnow() - timedelta(minutes=1)
+        assert delete_unreferenced_payloads() == 0
+
+
+def test_many_payloads_are_stored_and_loaded_in_chunks(app, monkeypatch):
+    monkeypatch.setattr(run_history, '_IN_CHUNK_SIZE', 4)
+    texts = [f'payload {i}' for i in range(10)]
+    with app.app_context():
+        store_payloads(db.session.connection(), texts[:3]) # Some already exist
+        db.session.commit()
+
+        parameter_counts = []
+
+        def count(conn, cursor, statement, parameters, context, executemany):
+            if ' IN (' in statement and not executemany:
+                parameter_counts.append(len(parameters))
+
+        event.listen(db.engine, 'before_cursor_execute', count)
+        try:
+            hashes = store_payloads(db.session.connection(), texts)
+            db.session.commit()
+            assert load_payloads(hashes.values()) == {digest: text for text, digest in hashes.items()}
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', count)
+        assert parameter_counts and max(parameter_counts) <= 4 + 2 # The chunk, plus the refresh time and cutoff
+        assert db.session.query(RunPayload).count() == 10
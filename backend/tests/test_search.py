@@ -0,0 +1,54 @@
+# Full-text search (app/services/search.py) on both backends, and the search
+# index migration, which builds the same index as the app from a frozen copy.
+import importlib.util
+from pathlib import Path
+
+import pytest
+from sqlalchemy import select
+
+from app import db
+from app.models import SearchTerm
+from app.services.search import rebuild_search_index
+
+MIGRATION = Path(__file__).resolve().parent.parent / 'migrations' / 'versions' / 'f4b7d2e9a613_add_search_index.py'
+
+
+@pytest.fixture(params=['auto', 'table'])
+def search_backend(request, monkeypatch):
+    # Requested before 'app', so the app is created with this backend
+    monkeypatch.setenv('SEARCH_BACKEND', request.param)
+    return request.param
+
+
+def _search(client, headers, query):
+    response = client.get('/creation/search', query_string={'q': query}, headers=headers)
+    assert response.status_code == 200
+    return [(result['type'], result['name']) for result in response.get_json()['results']]
+
+
+def test_search_matches_word_prefixes_without_diacritics(search_backend, client, login, create_agent):
+    headers = login()
+    client.post('/creation/createmap', json={'name': 'Planning review', 'goal': 'Café goals', 'description': 'd'}, headers=headers)
+    create_agent(headers, 'Writer', system_prompt='You write résumés')
+
+    assert _search(client, headers, 'plan rev') == [('nodemap', 'Planning review')]
+    assert _search(client, headers, 'cafe') == [('nodemap', 'Planning review')]
+    assert _search(client, headers, 'resume') == [('agent', 'Writer')]
+
+
+def test_migration_backfill_matches_the_app_index(app, client, login, create_agent):
+    headers = login()
+    client.post('/creation/createmap', json={'name': 'Planning review', 'goal': 'Café goals', 'description': 'Long description'}, headers=headers)
+    create_agent(headers, 'Writer', system_prompt='You write résumés')
+
+    spec = importlib.util.spec_from_file_location('search_index_migration', MIGRATION)
+    migration = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(migration)
+
+    table = SearchTerm.__table__
+    with app.app_context(), db.engine.begin() as connection:
+        rebuild_search_index(connection, 'table')
+        expected = sorted(connection.execute(select(table)).all())
+        connection.execute(table.delete())
+        assert migration._backfill(connection, 'table') == 2
+        assert sorted(connection.execute(select(table)).all()) == expected
@@ -0,0 +1,55 @@
+# Application startup (app/services/startup.py): SCHEMA_STARTUP_MODE decides what
+# create_app() does about the schema, and 'check' refuses a database that is behind.
+import os
+import sqlite3
+
+import pytest
+from sqlalchemy import inspect
+
+from app import create_app, db
+from app.services.startup import read_migration_heads
+
+VERSIONS = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'migrations', 'versions')
+
+
+def _create_app(monkeypatch, tmp_path, mode):
+    monkeypatch.setenv('DATABASE_URL', f"sqlite:///{tmp_path / 'startup.db'}")
+    monkeypatch.setenv('JWT_SECRET_KEY', 'test-jwt-secret-key-with-at-least-32-bytes')
+    monkeypatch.setenv('LOG_LEVEL', 'WARNING')
+    monkeypatch.setenv('SCHEMA_STARTUP_MODE', mode)
+    return create_app()
+
+
+def _stamp(tmp_path, revision):
+    with sqlite3.connect(tmp_path / 'startup.db') as connection:
+        connection.execute('CREATE TABLE alembic_version (version_num VARCHAR(32) NOT NULL)')
+        connection.execute('INSERT INTO alembic_version VALUES (?)', (revision,))
+
+
+def test_migration_scripts_have_a_single_head():
+    assert len(read_migration_heads(VERSIONS)) == 1
+
+
+def test_check_refuses_a_database_behind_the_head(monkeypatch, tmp_path):
+    _stamp(tmp_path, 'not-the-head')
+    with pytest.raises(RuntimeError, match='flask db upgrade'):
+        _create_app(monkeypatch, tmp_path, 'check')
+
+
+def test_check_accepts_a_database_at_the_head(monkeypatch, tmp_path):
+    [head] = read_migration_heads(VERSIONS)
+    _stamp(tmp_path, head)
+    app = _create_app(monkeypatch, tmp_path, 'check')
+    assert 'total' in app.test_client().get('/api/status').get_json()['startup_ms']
+
+
+def test_skip_does_no_schema_work(monkeypatch, tmp_path):
+    app = _create_app(monkeypatch, tmp_path, 'skip')
+    with app.app_context():
+        assert inspect(db.engine).get_table_names() == []
+        db.engine.dispose()
+
+
+def test_unknown_mode_is_rejected(monkeypatch, tmp_path):
+    with pytest.raises(RuntimeError, match='SCHEMA_STARTUP_MODE'):
+        _create_app(monkeypatch, tmp_path, 'migrate')
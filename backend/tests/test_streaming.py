@@ -0,0 +1,55 @@
+# Server-Sent Events (app/services/streaming.py): backpressure does not block the
+# producer's event loop, and errors reach the client only as a generic message.
+import asyncio
+import logging
+import time
+
+from app.services.streaming import stream_sse_events
+
+
+def test_events_are_streamed_in_order():
+    async def events():
+        for index in range(5):
+            yield 'token', {'token': index}
+
+    chunks = list(stream_sse_events(events, heartbeat_interval=5))
+    assert len(chunks) == 5
+    assert chunks[0] == 'id: 0\nevent: token\ndata: {"token":0}\n\n'
+
+
+def test_event_loop_keeps_running_while_the_client_is_behind():
+    ticks = []
+
+    async def events():
+        async def ticker():
+            while True:
+                ticks.append(time.monotonic())
+                await asyncio.sleep(0.01)
+        ticking = asyncio.create_task(ticker())
+        try:
+            for index in range(3):
+                yield 'token', {'token': index} # The queue holds one event, so the second waits for the reader
+        finally:
+            ticking.cancel()
+
+    stream = stream_sse_events(events, heartbeat_interval=5, max_buffered=1)
+    first = next(stream)
+    time.sleep(0.3) # A slow client
+    ticks_while_blocked = len(ticks)
+    rest = list(stream)
+    assert first.startswith('id: 0')
+    assert len(rest) == 2
+    assert ticks_while_blocked >= 10 # Other coroutines ran while the producer waited
+
+
+def test_errors_are_logged_and_sent_as_a_generic_message(caplog):
+    async def events():
+        yield 'token', {'token': 'a'}
+        raise RuntimeError('secret connection string')
+
+    with caplog.at_level(logging.ERROR, logger='app.services.streaming'):
+        chunks = list(stream_sse_events(events, heartbeat_interval=5, user_id=7))
+    assert 'event: error' in chunks[-1]
+    assert 'secret' not in chunks[-1]
+    assert caplog.records[0].user_id == 7
+    assert 'secret connection string' in caplog.text
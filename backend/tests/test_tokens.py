@@ -0,0 +1,48 @@
+# Token counting and context budgets (app/services/tokens.py): agents store their
+# prompt's count, and inputs that do not fit are truncated or rejected before a
+# provider is called.
+import pytest
+
+from app.services.tokens import count_tokens, truncate_to_tokens, TRUNCATION_MARKER
+
+LONG_INPUT = ' '.join(f'word{i}' for i in range(400))
+
+
+@pytest.fixture(params=['truncate', 'reject'])
+def overflow_policy(request, monkeypatch):
+    # Requested before 'app': a small window for the agents' model, counted with the local tokenizer
+    monkeypatch.setenv('TOKENIZER', 'heuristic')
+    monkeypatch.setenv('MODEL_CONTEXT_WINDOWS', '{"gpt-4o": 300}')
+    monkeypatch.setenv('MODEL_OUTPUT_RESERVE', '100')
+    monkeypatch.setenv('CONTEXT_OVERFLOW_POLICY', request.param)
+    return request.param
+
+
+def test_truncation_keeps_both_ends(overflow_policy, app):
+    text = truncate_to_tokens('gpt-4o', LONG_INPUT, 50)
+    assert count_tokens('gpt-4o', text) <= 50
+    assert text.startswith('word0 ') and text.endswith(' word399') and TRUNCATION_MARKER in text
+
+
+def test_agent_stores_its_prompt_count_and_oversized_prompts_are_rejected(overflow_policy, client, login):
+    headers = login()
+    response = client.post('/creation/createagent', json={'name': 'a', 'type': 'text', 'model': 'gpt-4o', 'system_prompt': 'Be brief.'},
+                           headers=headers)
+    assert response.status_code == 201
+    assert response.get_json()['system_prompt_tokens'] == count_tokens('gpt-4o', 'Be brief.')
+
+    response = client.post('/creation/createagent', json={'name': 'b', 'type': 'text', 'model': 'gpt-4o', 'system_prompt': LONG_INPUT},
+                           headers=headers)
+    assert response.status_code == 400
+
+
+def test_oversized_run_input_follows_the_policy(overflow_policy, client, login, create_agent, create_nodemap):
+    headers = login()
+    nodemap_id, _ = create_nodemap(headers, [{'id': 'a', 'data': {'agentId': create_agent(headers)}}])
+    response = client.post('/execution/runnodemap', json={'nodemap_id': nodemap_id, 'input': LONG_INPUT}, headers=headers)
+    if overflow_policy == 'truncate':
+        assert response.status_code == 200
+        assert response.get_json()['nodes']['a']['input_truncated'] is True
+    else:
+        assert response.status_code == 400
+        assert 'does not fit' in response.get_json()['error']
@@ -0,0 +1,56 @@
+# Summary loading in /auth/login and /auth/user_data (app/routes/auth_routes.py):
+# lists carry summary columns only, in a number of queries that does not grow
+# with what the user owns.
+from contextlib import contextmanager
+
+from sqlalchemy import event
+
+from app import db
+from app.routes.auth_routes import SYSTEM_PROMPT_PREVIEW_LENGTH
+
+
+@contextmanager
+def _count_queries(app):
+    statements = []
+    with app.app_context():
+        engine = db.engine
+
+    def count(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(engine, 'before_cursor_execute', count)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, 'before_cursor_execute', count)
+
+
+def test_lists_carry_summaries_only(client, login, create_agent, create_nodemap):
+    headers = login()
+    create_agent(headers, system_prompt='x' * (SYSTEM_PROMPT_PREVIEW_LENGTH + 50))
+    create_nodemap(headers, [{'id': 'a', 'data': {'label': 'A'}}])
+
+    body = client.get('/auth/user_data', headers=headers).get_json()
+    [agent] = body['agents']
+    assert agent['system_prompt_preview'] == 'x' * SYSTEM_PROMPT_PREVIEW_LENGTH
+    assert 'system_prompt' not in agent
+    [nodemap] = body['nodemaps']
+    assert 'nodes_data' not in nodemap and 'edges_data' not in nodemap
+
+
+def test_query_count_does_not_grow_with_the_lists(app, client, login, create_agent, create_nodemap):
+    headers = login()
+    counts = []
+    for index in range(2):
+        create_agent(headers, f'agent {index}')
+        create_nodemap(headers, [{'id': 'a', 'data': {'label': 'A'}}], name=f'map {index}')
+        create_nodemap(headers, name=f'empty map {index}')
+        with _count_queries(app) as statements:
+            response = client.get('/auth/user_data', headers=headers)
+        assert response.status_code == 200
+        counts.append(len(statements))
+    assert counts[0] == counts[1]
+
+    with _count_queries(app) as statements:
+        login()
+    assert not any('nodemap_node' in statement for statement in statements)
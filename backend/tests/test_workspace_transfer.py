@@ -0,0 +1,65 @@
+# Workspace export and import (app/services/workspace_transfer.py): an exported
+# workspace imports into another account with new ids, nodes pointing at the
+# copied agents, and names made unique.
+import gzip
+import json
+
+
+def _lines(body):
+    return [json.loads(line) for line in body.splitlines() if line.strip()]
+
+
+def _export(client, headers, **query):
+    response = client.get('/creation/exportworkspace', query_string=query, headers=headers)
+    assert response.status_code == 200
+    return response.get_data()
+
+
+def _import(client, headers, body, **request_headers):
+    response = client.post('/creation/importworkspace', data=body, headers={**headers, **request_headers})
+    assert response.status_code == 200
+    return _lines(response.get_data())[-1]
+
+
+def _workspace(client, login, create_agent, create_nodemap):
+    headers = login('alice')
+    agent_id = create_agent(headers, 'writer')
+    nodes = [{'id': 'a', 'data': {'agentId': agent_id}}, {'id': 'b', 'data': {'label': 'B'}}]
+    nodemap_id, _ = create_nodemap(headers, nodes, [{'id': 'e', 'source': 'a', 'target': 'b'}], name='plan')
+    return headers, agent_id, nodemap_id
+
+
+def test_export_lists_every_record(client, login, create_agent, create_nodemap):
+    headers, _, _ = _workspace(client, login, create_agent, create_nodemap)
+    records = _lines(_export(client, headers))
+    assert [record['type'] for record in records] == ['header', 'agent', 'nodemap', 'node', 'node', 'edge', 'end']
+    assert records[-1]['nodes'] == 2
+
+
+def test_import_into_another_account_remaps_agents(client, login, create_agent, create_nodemap):
+    alice, agent_id, nodemap_id = _workspace(client, login, create_agent, create_nodemap)
+    bob = login('bob')
+    create_agent(bob, 'writer') # Taken: the copy is renamed
+
+    done = _import(client, bob, gzip.compress(_export(client, alice)), **{'Content-Encoding': 'gzip'})
+    assert done['type'] == 'done'
+    assert (done['agents'], done['nodemaps'], done['nodes'], done['edges']) == (1, 1, 2, 1)
+    new_agent_id = done['agent_ids'][str(agent_id)]
+    new_nodemap_id = done['nodemap_ids'][str(nodemap_id)]
+
+    user_data = client.get('/auth/user_data', headers=bob).get_json()
+    assert {agent['name'] for agent in user_data['agents']} == {'writer', 'writer (2)'}
+    data = client.post('/creation/getnodemapdata', json={'id': new_nodemap_id}, headers=bob).get_json()
+    assert data['nodes_data'][0]['data']['agentId'] == new_agent_id
+    assert data['edges_data'] == [{'id': 'e', 'source': 'a', 'target': 'b'}]
+
+
+def test_bad_files_are_rejected(client, login, create_agent, create_nodemap):
+    headers, _, _ = _workspace(client, login, create_agent, create_nodemap)
+    response = client.post('/creation/importworkspace', data=b'{"type": "agent"}\n', headers=headers)
+    assert response.status_code == 400
+
+    truncated = b''.join(_export(client, headers).splitlines(keepends=True)[:-1]) # Without its 'end' line
+    error = _import(client, login('bob'), truncated)
+    assert error['type'] == 'error'
+    assert 'truncated' in error['error']